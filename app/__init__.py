@@ -33,6 +33,8 @@ def create_app(config_class=None):
     
     app = Flask(__name__)
     app.config.from_object(config_class)
+    # Путь импорта конфигурации - для процессов-обработчиков, создающих собственное приложение
+    app.config['CONFIG_CLASS_PATH'] = f'{config_class.__module__}.{config_class.__qualname__}'
     
     # Отключить кэширование статических файлов в development
     if app.config.get('DEBUG'):
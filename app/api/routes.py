@@ -18,6 +18,7 @@ from app.api.serializers import (
     ProductSerializer, AttributeSerializer, VerificationSerializer
 )
 from app.services.verification_service import VerificationService
+from app.utils.pagination import CursorError, paginate, request_args
 from app.models.version import ProductVersion as PV
 from sqlalchemy import func
 from datetime import datetime, timedelta
@@ -372,6 +373,30 @@ def delete_subcategory(subcategory_id):
         current_app.logger.error(f"Ошибка при удалении подкатегории {subcategory_id}: {str(e)}")
         return jsonify({'error': 'Ошибка при удалении подкатегории'}), 500
 
+@bp.route('/subcategories/<int:subcategory_id>/scores', methods=['GET'])
+@login_required
+def get_subcategory_scores(subcategory_id):
+    """Рассчитать оценки полноты и качества всех товаров подкатегории (колоночный расчет)"""
+    from app.services.scoring_service import ScoringService
+    
+    Subcategory.query.get_or_404(subcategory_id)
+    scores = ScoringService.score_subcategory(subcategory_id)
+    
+    return jsonify({
+        'subcategory_id': subcategory_id,
+        'products_count': len(scores),
+        'avg_completeness_score': float(scores['completeness_score'].mean()) if len(scores) else None,
+        'avg_quality_score': float(scores['quality_score'].mean()) if len(scores) else None,
+        'products': [
+            {
+                'product_id': int(product_id),
+                'completeness_score': int(row.completeness_score),
+                'quality_score': int(row.quality_score),
+            }
+            for product_id, row in scores.iterrows()
+        ],
+    })
+
 # ========== ТОВАРЫ ==========
 
 @bp.route('/products', methods=['GET'])
@@ -392,22 +417,23 @@ def get_products():
             except KeyError:
                 pass
         
-        # Пагинация
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
-        per_page = min(per_page, 100)  # Максимум 100 на страницу
-        
-        # Применить пагинацию
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        products = pagination.items
+        # Пагинация по номеру страницы или по курсору (максимум 100 на страницу)
+        result = paginate(
+            query, (Product.created_at, Product.id),
+            **request_args(request.args, per_page=50, max_per_page=100)
+        )
         
         return jsonify({
-            'items': [ProductSerializer.serialize(prod, include_attributes=include_attributes, include_verification=include_verification) for prod in products],
-            'total': pagination.total,
-            'page': page,
-            'per_page': per_page,
-            'pages': pagination.pages
+            'items': ProductSerializer.serialize_many(result['items'], include_attributes=include_attributes, include_verification=include_verification),
+            'total': result['total'],
+            'page': result['page'],
+            'per_page': result['per_page'],
+            'pages': result['pages'],
+            'next_cursor': result['next_cursor'],
+            'has_more': result['has_more'],
         })
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         from flask import current_app
         current_app.logger.error(f"Ошибка при получении товаров: {str(e)}")
@@ -427,9 +453,10 @@ def get_product(product_id):
 def verify_product(product_id):
     """Запустить верификацию товара"""
     product = Product.query.get_or_404(product_id)
+    force = request.args.get('force', 'false').lower() == 'true'
     
     try:
-        verification = VerificationService.verify_product(product, current_user)
+        verification = VerificationService.verify_product(product, current_user, force=force)
         return jsonify(VerificationSerializer.serialize(verification, include_issues=True)), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -609,6 +636,163 @@ def delete_attribute(attribute_id):
     
     return jsonify({'message': 'Атрибут удален'}), 200
 
+# ========== ПЕРЕСЧЕТ ОЦЕНОК ==========
+
+@bp.route('/verification/rescore', methods=['POST'])
+@login_required
+def rescore_verifications():
+    """Пересчитать общие оценки и статусы с другими весами и порогами (preview или apply)"""
+    from app.services.scoring_service import ScoringService
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        result = ScoringService.rescore(
+            weights=data.get('weights'),
+            thresholds=data.get('thresholds'),
+            subcategory_id=data.get('subcategory_id'),
+            apply=bool(data.get('apply', False)),
+            user=current_user
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify(result)
+
+@bp.route('/verification/purge', methods=['POST'])
+@login_required
+def purge_verification_history():
+    """Запустить очистку истории верификаций в фоне (старые верификации сворачиваются в сводки)"""
+    from app.services.verification_history_service import VerificationHistoryService
+    
+    data = request.get_json(silent=True) or {}
+    keep = data.get('keep')
+    if keep is not None and (not isinstance(keep, int) or keep < 1):
+        return jsonify({'error': 'keep должен быть целым числом больше 0'}), 400
+    
+    VerificationHistoryService.start_purge(keep=keep)
+    return jsonify({'message': 'Очистка истории верификаций запущена'}), 202
+
+# ========== ОБЪЕМ МЕДИА-ФАЙЛОВ ==========
+
+@bp.route('/media/usage', methods=['GET'])
+@login_required
+def get_media_usage():
+    """Объем медиа-файлов с группировкой по поставщику, подкатегории и типу (по счетчикам, без обхода файлов)"""
+    from app.models.product_media import MediaType
+    from app.services.media_usage_service import MediaUsageService
+    
+    group_by = [name.strip() for name in request.args.get('group_by', 'supplier').split(',') if name.strip()]
+    unknown = [name for name in group_by if name not in MediaUsageService.GROUP_COLUMNS]
+    if unknown:
+        return jsonify({'error': f"Неизвестные поля группировки: {', '.join(unknown)}"}), 400
+    
+    media_type = request.args.get('media_type')
+    if media_type:
+        try:
+            media_type = MediaType(media_type)
+        except ValueError:
+            return jsonify({'error': f'Неизвестный тип медиа: {media_type}'}), 400
+    
+    return jsonify(MediaUsageService.usage(
+        group_by=group_by,
+        supplier_id=request.args.get('supplier_id', type=int),
+        subcategory_id=request.args.get('subcategory_id', type=int),
+        media_type=media_type or None
+    ))
+
+@bp.route('/suppliers/<int:supplier_id>/media-usage', methods=['GET'])
+@login_required
+def get_supplier_media_usage(supplier_id):
+    """Объем медиа-файлов поставщика и его квоты"""
+    from app.services.media_usage_service import MediaUsageService
+    
+    supplier = Supplier.query.get_or_404(supplier_id)
+    file_count, total_bytes = MediaUsageService.supplier_usage([supplier.id]).get(supplier.id, (0, 0))
+    return jsonify({
+        'supplier_id': supplier.id,
+        'file_count': file_count,
+        'total_bytes': total_bytes,
+        'quota_files': supplier.media_quota_files,
+        'quota_bytes': supplier.media_quota_bytes,
+        'by_media_type': MediaUsageService.usage(group_by=['media_type'], supplier_id=supplier.id),
+    })
+
+@bp.route('/suppliers/<int:supplier_id>/media-quota', methods=['PUT'])
+@login_required
+def update_supplier_media_quota(supplier_id):
+    """Установить квоты поставщика на медиа-файлы (null - без ограничения)"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Только администраторы могут менять квоты'}), 403
+    
+    supplier = Supplier.query.get_or_404(supplier_id)
+    data = request.get_json(silent=True) or {}
+    for key, field in (('quota_bytes', 'media_quota_bytes'), ('quota_files', 'media_quota_files')):
+        if key not in data:
+            continue
+        value = data[key]
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+            return jsonify({'error': f'{key} должен быть неотрицательным целым числом или null'}), 400
+        setattr(supplier, field, value)
+    
+    db.session.commit()
+    return jsonify({
+        'supplier_id': supplier.id,
+        'quota_files': supplier.media_quota_files,
+        'quota_bytes': supplier.media_quota_bytes,
+    })
+
+# ========== ПОХОЖИЕ ИЗОБРАЖЕНИЯ ==========
+
+@bp.route('/media/<int:media_id>/similar', methods=['GET'])
+@login_required
+def get_similar_images(media_id):
+    """Изображения других товаров, похожие на изображение (по перцептивному хэшу)"""
+    from app.models.product_media import ProductMedia, MediaType
+    from app.services.image_similarity_service import ImageSimilarityService
+    from config import Config
+    
+    media = ProductMedia.query.get_or_404(media_id)
+    if media.media_type != MediaType.IMAGE:
+        return jsonify({'error': 'Поиск похожих доступен только для изображений'}), 400
+    if not media.phash:
+        return jsonify({'error': 'Изображение еще не проанализировано'}), 409
+    
+    max_distance = request.args.get('max_distance', Config.IMAGE_SIMILAR_MAX_DISTANCE, type=int)
+    if not 0 <= max_distance <= 16:
+        return jsonify({'error': 'max_distance должен быть от 0 до 16'}), 400
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    
+    return jsonify({
+        'media_id': media.id,
+        'product_id': media.product_id,
+        'phash': media.phash,
+        'max_distance': max_distance,
+        'similar': ImageSimilarityService.find_similar(media, max_distance=max_distance, limit=limit),
+    })
+
+# ========== ДУБЛИКАТЫ ==========
+
+@bp.route('/duplicates', methods=['GET'])
+@login_required
+def get_duplicates():
+    """Получить все группы дубликатов значений уникальных атрибутов (один проход по каталогу)"""
+    from app.services.duplicate_service import DuplicateService
+    
+    attribute_id = request.args.get('attribute_id', type=int)
+    subcategory_id = request.args.get('subcategory_id', type=int)
+    
+    clusters = DuplicateService.get_clusters(
+        attribute_ids=[attribute_id] if attribute_id else None,
+        subcategory_id=subcategory_id
+    )
+    return jsonify({
+        'clusters': clusters,
+        'clusters_count': len(clusters),
+        'products_count': len({product['id'] for cluster in clusters for product in cluster['products']}),
+    })
+
 # ========== DASHBOARD STATS ==========
 
 @bp.route('/dashboard/stats', methods=['GET'])
@@ -2,6 +2,7 @@
 Сериализаторы для API
 """
 from flask import url_for
+from sqlalchemy.orm import joinedload
 from app.models.category import ProductCategory
 from app.models.supplier import Supplier
 from app.models.subcategory import Subcategory
@@ -43,7 +44,7 @@ class SubcategorySerializer:
         if include_attributes:
             data['attributes'] = [attr.to_dict() for attr in subcategory.get_all_attributes()]
         if include_products:
-            data['products'] = [ProductSerializer.serialize(p) for p in subcategory.products.all()]
+            data['products'] = ProductSerializer.serialize_many(subcategory.products.all())
         return data
 
 class ProductSerializer:
@@ -52,10 +53,25 @@ class ProductSerializer:
     @staticmethod
     def serialize(product, include_attributes=False, include_verification=False, include_history=False):
         """Сериализовать товар"""
-        data = product.to_dict(include_attributes=include_attributes, include_verification=include_verification)
-        if include_history:
-            data['status_history'] = [h.to_dict() for h in product.status_history.all()]
-        return data
+        return ProductSerializer.serialize_many(
+            [product], include_attributes=include_attributes,
+            include_verification=include_verification, include_history=include_history
+        )[0]
+    
+    @staticmethod
+    def serialize_many(products, include_attributes=False, include_verification=False, include_history=False):
+        """Сериализовать список товаров (связанные данные загружаются для всего списка сразу)"""
+        products = list(products)
+        items = Product.to_dicts(products, include_attributes=include_attributes, include_verification=include_verification)
+        if include_history and products:
+            history = {}
+            for entry in ProductStatusHistory.query.options(joinedload(ProductStatusHistory.changed_by)).filter(
+                ProductStatusHistory.product_id.in_([product.id for product in products])
+            ).order_by(ProductStatusHistory.changed_at.desc()):
+                history.setdefault(entry.product_id, []).append(entry.to_dict())
+            for product, data in zip(products, items):
+                data['status_history'] = history.get(product.id, [])
+        return items
 
 class AttributeSerializer:
     """Сериализатор для атрибутов"""
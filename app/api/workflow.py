@@ -10,6 +10,7 @@ from app.services.workflow import (
     ExportService
 )
 from app.viewmodels.data_collection_viewmodel import DataCollectionViewModel
+from app.utils.pagination import CursorError, request_args
 from flask import current_app
 
 bp = Blueprint('workflow_api', __name__, url_prefix='/api/workflow')
@@ -105,12 +106,11 @@ def api_processing():
         # Удалить None значения
         filters = {k: v for k, v in filters.items() if v is not None and v != ''}
         
-        # Пагинация
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        # Пагинация (по номеру страницы или по курсору)
+        pagination = request_args(request.args, per_page=20)
         
         # Получить данные через сервис
-        files_result = ProcessingService.get_files(filters, page, per_page)
+        files_result = ProcessingService.get_files(filters, **pagination)
         stats = ProcessingService.get_stats()
         
         # Преобразовать файлы в словари
@@ -142,8 +142,12 @@ def api_processing():
                 'per_page': files_result['per_page'],
                 'total': files_result['total'],
                 'pages': files_result['pages'],
+                'next_cursor': files_result['next_cursor'],
+                'has_more': files_result['has_more'],
             }
         })
+    except CursorError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Ошибка в API processing: {str(e)}", exc_info=True)
         return jsonify({
@@ -170,12 +174,11 @@ def api_catalog():
         # Удалить None значения
         filters = {k: v for k, v in filters.items() if v is not None and v != ''}
         
-        # Пагинация
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        # Пагинация (по номеру страницы или по курсору)
+        pagination = request_args(request.args, per_page=20)
         
         # Получить данные через сервис
-        imports_result = CatalogService.get_imports(filters, page, per_page)
+        imports_result = CatalogService.get_imports(filters, **pagination)
         stats = CatalogService.get_stats()
         
         # Преобразовать импорты в словари
@@ -206,8 +209,12 @@ def api_catalog():
                 'per_page': imports_result['per_page'],
                 'total': imports_result['total'],
                 'pages': imports_result['pages'],
+                'next_cursor': imports_result['next_cursor'],
+                'has_more': imports_result['has_more'],
             }
         })
+    except CursorError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Ошибка в API catalog: {str(e)}", exc_info=True)
         return jsonify({
@@ -234,12 +241,11 @@ def api_export():
         # Удалить None значения
         filters = {k: v for k, v in filters.items() if v is not None and v != ''}
         
-        # Пагинация
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        # Пагинация (по номеру страницы или по курсору)
+        pagination = request_args(request.args, per_page=20)
         
         # Получить данные через сервис
-        exports_result = ExportService.get_exports(filters, page, per_page)
+        exports_result = ExportService.get_exports(filters, **pagination)
         stats = ExportService.get_stats()
         
         # Преобразовать экспорты в словари
@@ -270,8 +276,12 @@ def api_export():
                 'per_page': exports_result['per_page'],
                 'total': exports_result['total'],
                 'pages': exports_result['pages'],
+                'next_cursor': exports_result['next_cursor'],
+                'has_more': exports_result['has_more'],
             }
         })
+    except CursorError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Ошибка в API export: {str(e)}", exc_info=True)
         return jsonify({
@@ -724,13 +724,15 @@ def products():
             (Product.sku.ilike(f'%{search}%'))
         )
     
-    # Пагинация
-    from config import Config
-    pagination = query.order_by(Product.created_at.desc()).paginate(
-        page=page,
-        per_page=Config.ITEMS_PER_PAGE,
-        error_out=False
-    )
+    # Пагинация: следующая страница - по курсору, переход на номер страницы - со смещением;
+    # общее количество кэшируется, чтобы не считать его на каждой странице
+    from app.utils.pagination import CursorError, PageNavigation, paginate
+    cursor = request.args.get('cursor') or None
+    try:
+        result = paginate(query, (Product.created_at, Product.id), page=page, cursor=cursor, total='cached')
+    except CursorError:
+        result = paginate(query, (Product.created_at, Product.id), page=page, total='cached')
+    pagination = PageNavigation(result, page)
     
     subcategories = Subcategory.query.order_by(Subcategory.name).all()
     statuses = [s.value for s in ProductStatus]
@@ -766,7 +768,7 @@ def product_detail(product_id):
     from app.models.verification import ProductVerification
     latest_verification = ProductVerification.query.filter_by(
         product_id=product.id
-    ).order_by(ProductVerification.verified_at.desc()).first()
+    ).order_by(*ProductVerification.newest_first()).first()
     
     # Получить последнюю версию
     from app.models.version import ProductVersion
@@ -1447,39 +1449,66 @@ def get_import_log(import_history_id):
 @bp.route('/api/import/<int:import_history_id>/reverify', methods=['POST'])
 @login_required
 def reverify_import(import_history_id):
-    """Повторная верификация всех товаров из файла"""
+    """Повторная верификация всех товаров из файла (фоновое задание)"""
     from app.models.import_history import ImportHistory
-    from app.models.product import Product
-    from app.services.verification_service import VerificationService
     
     try:
         import_file = ImportHistory.query.get_or_404(import_history_id)
-        products = Product.query.filter_by(import_history_id=import_history_id).all()
-        
-        if not products:
-            return jsonify({'error': 'В файле нет товаров'}), 400
+        return _start_verification_job(import_history_id=import_file.id)
         
-        verified_count = 0
-        errors = []
-        
-        for product in products:
-            try:
-                VerificationService.verify_product(product, current_user)
-                verified_count += 1
-            except Exception as e:
-                errors.append(f"Товар {product.sku}: {str(e)}")
-        
-        return jsonify({
-            'success': True,
-            'verified_count': verified_count,
-            'total_count': len(products),
-            'errors': errors
-        })
+    except Exception as e:
+        current_app.logger.error(f"Ошибка при повторной верификации: {str(e)}")
+        return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
+
+@bp.route('/api/subcategory/<int:subcategory_id>/reverify', methods=['POST'])
+@login_required
+def reverify_subcategory(subcategory_id):
+    """Повторная верификация всех товаров подкатегории (фоновое задание)"""
+    try:
+        subcategory = Subcategory.query.get_or_404(subcategory_id)
+        return _start_verification_job(subcategory_id=subcategory.id)
         
     except Exception as e:
         current_app.logger.error(f"Ошибка при повторной верификации: {str(e)}")
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
+@bp.route('/api/verification-jobs/<int:job_id>')
+@login_required
+def verification_job_status(job_id):
+    """Прогресс задания массовой верификации"""
+    from app.models.verification import VerificationJob
+    from app.services.verification_job_service import VerificationJobService
+    job = VerificationJob.query.get_or_404(job_id)
+    VerificationJobService.fail_stale_jobs(job.id)
+    return jsonify(job.to_dict())
+
+def _start_verification_job(import_history_id=None, subcategory_id=None):
+    """Создать и запустить задание верификации, вернуть его ID сразу"""
+    from app.services.verification_job_service import VerificationJobService
+    
+    # force - пересчитать без сравнения отпечатков; sampling - выборочная проверка медиа
+    force = request.args.get('force', 'false').lower() == 'true'
+    sampling = request.args.get('sampling')
+    
+    job = VerificationJobService.create_job(
+        current_user,
+        import_history_id=import_history_id,
+        subcategory_id=subcategory_id,
+        force=force,
+        sampling=sampling.lower() == 'true' if sampling else None
+    )
+    if not job.total_count:
+        return jsonify({'error': 'Нет товаров для верификации'}), 400
+    
+    VerificationJobService.start_job(job)
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'total_count': job.total_count,
+        'status_url': url_for('main.verification_job_status', job_id=job.id)
+    }), 202
+
 @bp.route('/api/import/<int:import_history_id>/cancel', methods=['POST'])
 @login_required
 def cancel_import(import_history_id):
@@ -1496,10 +1525,12 @@ def cancel_import(import_history_id):
         if import_file.file_status == ImportFileStatus.EXPORTED:
             return jsonify({'error': 'Нельзя отменить импорт экспортированного файла'}), 400
         
-        # Удалить все товары из этого файла
+        # Удалить все товары из этого файла (вместе с их медиа-файлами)
         products = Product.query.filter_by(import_history_id=import_history_id).all()
         products_count = len(products)
         
+        from app.services.media_service import MediaService
+        MediaService.release_products_media([product.id for product in products])
         for product in products:
             db.session.delete(product)
         
@@ -1554,7 +1585,6 @@ def get_export_details(import_history_id):
 @login_required
 def serve_media(file_path):
     """Отдать медиа-файл"""
-    from flask import send_from_directory
     from config import Config
     import os
     
@@ -1569,14 +1599,84 @@ def serve_media(file_path):
         from flask import abort
         abort(403)
     
-    if not full_path.exists():
-        from flask import abort
+    # Подписанная ссылка объектного хранилища, отдача через прокси (X-Accel-Redirect/X-Sendfile)
+    # или приложением с ETag и Range
+    from app.utils.media_response import send_stored_media
+    return send_stored_media(file_path)
+
+@bp.route('/media/<int:media_id>/thumb/<int:size>')
+@login_required
+def serve_media_derivative(media_id, size):
+    """Отдать уменьшенную копию изображения (создается при первом запросе)"""
+    from config import Config
+    from app.models.product_media import ProductMedia, MediaType
+    from app.services.image_derivative_service import ImageDerivativeService
+    
+    if size not in Config.IMAGE_DERIVATIVE_SIZES:
         abort(404)
     
-    directory = str(full_path.parent)
-    filename = full_path.name
+    media = ProductMedia.query.get_or_404(media_id)
+    if media.media_type != MediaType.IMAGE:
+        abort(404)
+    
+    derivative = ImageDerivativeService.get_or_create(media, size)
+    if derivative is None:
+        # Копию создать не удалось - отдать оригинал
+        return redirect(url_for('main.serve_media', file_path=media.file_path))
+    
+    # Копия неизменна (имя по хэшу содержимого) - долгое кэширование в браузере
+    from app.utils.media_response import send_stored_media
+    return send_stored_media(
+        derivative.file_path,
+        mimetype=ImageDerivativeService.mime_type(derivative.format)
+    )
+
+@bp.route('/products/<int:product_id>/media.zip')
+@login_required
+def download_product_media_bundle(product_id):
+    """Скачать медиа-файлы товара одним ZIP-архивом"""
+    from app.services.media_bundle_service import MediaBundleService
+    
+    product = Product.query.get_or_404(product_id)
+    entries = MediaBundleService.iter_media_entries(product_filter=Product.id == product.id)
+    return _media_bundle_response(entries, f'product_{product.id}_media.zip')
+
+@bp.route('/imports/<int:import_history_id>/media.zip')
+@login_required
+def download_import_media_bundle(import_history_id):
+    """Скачать медиа-файлы всех товаров импорта одним ZIP-архивом"""
+    from app.models.import_history import ImportHistory
+    from app.services.media_bundle_service import MediaBundleService
+    
+    import_history = ImportHistory.query.get_or_404(import_history_id)
+    entries = MediaBundleService.iter_media_entries(
+        product_filter=Product.import_history_id == import_history.id
+    )
+    return _media_bundle_response(entries, f'import_{import_history.id}_media.zip')
+
+@bp.route('/exports/<int:export_id>/media.zip')
+@login_required
+def download_export_media_bundle(export_id):
+    """Скачать медиа-файлы товаров выгрузки одним ZIP-архивом"""
+    from app.models.export_history import ExportHistory
+    from app.services.media_bundle_service import MediaBundleService
     
-    return send_from_directory(directory, filename)
+    export_history = ExportHistory.query.get_or_404(export_id)
+    entries = MediaBundleService.iter_media_entries(product_ids=export_history.get_products_ids())
+    return _media_bundle_response(entries, f'export_{export_history.id}_media.zip')
+
+def _media_bundle_response(entries, download_name):
+    """Потоковый ответ с ZIP-архивом (формируется по мере отправки)"""
+    from flask import Response, stream_with_context
+    from app.services.media_bundle_service import MediaBundleService
+    
+    response = Response(
+        stream_with_context(MediaBundleService.iter_zip(entries)),
+        mimetype='application/zip'
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx передает архив без буферизации
+    return response
 
 @bp.route('/products/<int:product_id>/download-media')
 @login_required
@@ -7,12 +7,14 @@ from app.models.subcategory import Subcategory
 from app.models.attribute import Attribute, AttributeValue
 from app.models.subcategory_attribute import SubcategoryAttribute
 from app.models.product import Product, ProductAttributeValue
-from app.models.verification import ProductVerification, VerificationIssue
+from app.models.verification import (
+    ProductVerification, VerificationIssue, VerificationSummary, VerificationJob, VerificationJobStatus
+)
 from app.models.workflow import ProductStatusHistory
 from app.models.version import ProductVersion
 from app.models.user import User
 from app.models.import_history import ImportHistory, ImportFileStatus
-from app.models.product_media import ProductMedia, MediaType
+from app.models.product_media import ProductMedia, MediaType, MediaBlob, MediaDerivative, MediaDownloadRetry, MediaUsage
 from app.models.data_request import DataRequest, DataRequestStatus
 from app.models.export_history import ExportHistory
 
@@ -27,6 +29,9 @@ __all__ = [
     'ProductAttributeValue',
     'ProductVerification',
     'VerificationIssue',
+    'VerificationSummary',
+    'VerificationJob',
+    'VerificationJobStatus',
     'ProductStatusHistory',
     'ProductVersion',
     'User',
@@ -34,6 +39,10 @@ __all__ = [
     'ImportFileStatus',
     'ProductMedia',
     'MediaType',
+    'MediaBlob',
+    'MediaDerivative',
+    'MediaDownloadRetry',
+    'MediaUsage',
     'DataRequest',
     'DataRequestStatus',
     'ExportHistory',
@@ -50,6 +50,13 @@ class ImportHistory(db.Model):
     data_request = db.relationship('DataRequest', foreign_keys=[data_request_id], backref='imports')
     exported_by = db.relationship('User', foreign_keys=[exported_by_id], backref='exported_imports')
     
+    # Индексы курсорной пагинации этапов workflow (пустые exported_at - в конце списка)
+    __table_args__ = (
+        db.Index('ix_import_history_status_imported_at_id', 'file_status', 'imported_at', 'id'),
+        db.Index('ix_import_history_status_exported_at_id', 'file_status', 'exported_at', 'id',
+                 postgresql_ops={'exported_at': 'DESC NULLS LAST', 'id': 'DESC'}),
+    )
+    
     def __repr__(self):
         return f'<ImportHistory {self.filename} ({self.imported_count}/{self.total_rows})>'
     
@@ -3,6 +3,8 @@
 """
 from app import db
 from datetime import datetime
+from sqlalchemy.orm import validates
+import hashlib
 import enum
 
 class ProductStatus(enum.Enum):
@@ -42,19 +44,36 @@ class Product(db.Model):
     versions = db.relationship('ProductVersion', backref='product', lazy='dynamic', cascade='all, delete-orphan', order_by='ProductVersion.version_number.desc()')
     import_file = db.relationship('ImportHistory', foreign_keys=[import_history_id], backref='products')
     
+    # Индексы курсорной пагинации списка товаров (сортировка по created_at, id)
+    __table_args__ = (
+        db.Index('ix_products_created_at_id', 'created_at', 'id'),
+        db.Index('ix_products_subcategory_created_at_id', 'subcategory_id', 'created_at', 'id'),
+        db.Index('ix_products_status_created_at_id', 'status', 'created_at', 'id'),
+    )
+    
     def __repr__(self):
         return f'<Product {self.sku}: {self.name}>'
     
-    def to_dict(self, include_attributes=False, include_verification=False):
-        """Сериализация в словарь"""
+    def to_dict(self, include_attributes=False, include_verification=False, related=None):
+        """
+        Сериализация в словарь
+        
+        Args:
+            related: Данные, загруженные сразу для списка товаров (Product.load_related);
+                     без них связи читаются отдельными запросами
+        """
+        if related is None:
+            related = Product.load_related([self], include_attributes, include_verification)
+        subcategory = self.subcategory
+        category = subcategory.category if subcategory else None
         data = {
             'id': self.id,
             'sku': self.sku,
             'name': self.name,
             'subcategory_id': self.subcategory_id,
-            'subcategory_name': self.subcategory.name if self.subcategory else None,
-            'supplier_name': self.subcategory.suppliers.first().name if self.subcategory and self.subcategory.suppliers.first() else None,
-            'category_name': self.subcategory.category.name if self.subcategory and self.subcategory.category else None,
+            'subcategory_name': subcategory.name if subcategory else None,
+            'supplier_name': related['supplier_names'].get(self.subcategory_id),
+            'category_name': category.name if category else None,
             'status': self.status.value,
             'description': self.description,
             'import_history_id': self.import_history_id,
@@ -65,16 +84,75 @@ class Product(db.Model):
         }
         
         if include_attributes:
-            data['attributes'] = {av.attribute.code: av.value for av in self.attribute_values.all()}
+            data['attributes'] = related['attributes'].get(self.id, {})
         
         if include_verification:
-            from app.models.verification import ProductVerification
-            latest_verification = self.verifications.order_by(ProductVerification.verified_at.desc()).first()
+            latest_verification = related['verifications'].get(self.id)
             if latest_verification:
                 data['verification'] = latest_verification.to_dict()
         
         return data
     
+    @staticmethod
+    def to_dicts(products, include_attributes=False, include_verification=False):
+        """Сериализация списка товаров (связи загружаются постоянным числом запросов)"""
+        products = list(products)
+        related = Product.load_related(products, include_attributes, include_verification)
+        return [product.to_dict(include_attributes, include_verification, related) for product in products]
+    
+    @staticmethod
+    def load_related(products, include_attributes=False, include_verification=False):
+        """
+        Загрузить связанные данные списка товаров для to_dict (по запросу на вид связи)
+        
+        Подкатегории и категории загружаются в сессию (дальше берутся из identity map),
+        поставщик подкатегории - первый по ID, значения атрибутов - с кодами атрибутов,
+        верификация - последняя по времени.
+        
+        Returns:
+            dict: supplier_names {subcategory_id: имя}, attributes {product_id: {код: значение}},
+                  verifications {product_id: ProductVerification}
+        """
+        from sqlalchemy.orm import joinedload
+        from app.models.attribute import Attribute
+        from app.models.subcategory import Subcategory, supplier_subcategories
+        from app.models.supplier import Supplier
+        from app.models.verification import ProductVerification
+        
+        related = {'supplier_names': {}, 'attributes': {}, 'verifications': {}}
+        product_ids = [product.id for product in products if product.id is not None]
+        subcategory_ids = {product.subcategory_id for product in products if product.subcategory_id is not None}
+        
+        if subcategory_ids:
+            Subcategory.query.options(joinedload(Subcategory.category)).filter(
+                Subcategory.id.in_(subcategory_ids)
+            ).all()
+            rows = db.session.query(supplier_subcategories.c.subcategory_id, Supplier.name).join(
+                Supplier, Supplier.id == supplier_subcategories.c.supplier_id
+            ).filter(
+                supplier_subcategories.c.subcategory_id.in_(subcategory_ids)
+            ).order_by(supplier_subcategories.c.subcategory_id, Supplier.id)
+            for subcategory_id, name in rows:
+                related['supplier_names'].setdefault(subcategory_id, name)
+        
+        if include_attributes and product_ids:
+            rows = db.session.query(ProductAttributeValue.product_id, Attribute.code, ProductAttributeValue.value).join(
+                Attribute, ProductAttributeValue.attribute_id == Attribute.id
+            ).filter(
+                ProductAttributeValue.product_id.in_(product_ids)
+            ).order_by(ProductAttributeValue.id)
+            for product_id, code, value in rows:
+                related['attributes'].setdefault(product_id, {})[code] = value
+        
+        if include_verification and product_ids:
+            latest = ProductVerification.latest_subquery(ProductVerification.product_id.in_(product_ids))
+            for verification in ProductVerification.query.join(
+                latest, ProductVerification.id == latest.c.verification_id
+            ):
+                related['verifications'][verification.product_id] = verification
+        
+        return related
+    
     def get_attribute_value(self, attribute_code):
         """Получить значение атрибута по коду"""
         pav = self.attribute_values.join('attribute').filter_by(code=attribute_code).first()
@@ -124,9 +202,33 @@ class ProductAttributeValue(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     attribute_id = db.Column(db.Integer, db.ForeignKey('attributes.id'), nullable=False)
     value = db.Column(db.Text, nullable=False)  # JSON для сложных типов
+    value_hash = db.Column(db.String(40))  # Хэш нормализованного значения (поиск дубликатов)
     
     # Уникальность: один атрибут - одно значение для товара
-    __table_args__ = (db.UniqueConstraint('product_id', 'attribute_id', name='uq_product_attribute'),)
+    # Индекс по хэшу значения: поиск дубликатов без сравнения Text-колонки
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'attribute_id', name='uq_product_attribute'),
+        db.Index('ix_pav_attribute_value_hash', 'attribute_id', 'value_hash'),
+    )
+    
+    # Связи
+    attribute = db.relationship('Attribute')
+    
+    @staticmethod
+    def hash_value(value):
+        """Хэш нормализованного значения (без пробелов по краям); None для пустых значений"""
+        if value is None:
+            return None
+        normalized = str(value).strip()
+        if not normalized:
+            return None
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    
+    @validates('value')
+    def _update_value_hash(self, key, value):
+        """Пересчитывать хэш при каждом изменении значения"""
+        self.value_hash = ProductAttributeValue.hash_value(value)
+        return value
     
     def __repr__(self):
         return f'<ProductAttributeValue product={self.product_id} attribute={self.attribute_id} value={self.value[:50]}>'
@@ -10,6 +10,40 @@ class MediaType(enum.Enum):
     IMAGE = 'image'  # Изображение
     THREE_D_MODEL = '3d_model'  # 3D модель
 
+class MediaBlob(db.Model):
+    """
+    Содержимое медиа-файла в хранилище с адресацией по SHA-256
+    
+    Файл хранится один раз (media/<тип>/ab/cd/<sha256>.<ext>), записи ProductMedia
+    ссылаются на него; ref_count - количество ссылающихся записей.
+    """
+    __tablename__ = 'media_blobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False, index=True)  # Хэш содержимого
+    media_type = db.Column(db.Enum(MediaType), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)  # Путь к файлу в хранилище
+    file_size = db.Column(db.Integer)  # Размер файла в байтах
+    mime_type = db.Column(db.String(100))  # MIME тип файла
+    ref_count = db.Column(db.Integer, default=0, nullable=False)  # Количество ссылок ProductMedia
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<MediaBlob {self.sha256[:12]} refs={self.ref_count}>'
+    
+    def to_dict(self):
+        """Сериализация в словарь"""
+        return {
+            'id': self.id,
+            'sha256': self.sha256,
+            'media_type': self.media_type.value,
+            'file_path': self.file_path,
+            'file_size': self.file_size,
+            'mime_type': self.mime_type,
+            'ref_count': self.ref_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
 class ProductMedia(db.Model):
     """Медиа-файл товара (фото или 3D модель)"""
     __tablename__ = 'product_media'
@@ -18,11 +52,12 @@ class ProductMedia(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     attribute_id = db.Column(db.Integer, db.ForeignKey('attributes.id'))  # Связь с атрибутом
     media_type = db.Column(db.Enum(MediaType), nullable=False)
+    blob_id = db.Column(db.Integer, db.ForeignKey('media_blobs.id'), index=True)  # Содержимое в хранилище (None - файл до перехода на хранилище)
     
     # Информация о файле
-    original_url = db.Column(db.String(500))  # Оригинальный URL
-    file_path = db.Column(db.String(500), nullable=False)  # Путь к файлу в файловой системе
-    file_name = db.Column(db.String(255), nullable=False)  # Имя файла
+    original_url = db.Column(db.String(500), index=True)  # Оригинальный URL
+    file_path = db.Column(db.String(500), nullable=False)  # Путь к файлу в файловой системе (для записей с blob - путь blob)
+    file_name = db.Column(db.String(255), nullable=False)  # Имя файла (из URL)
     file_size = db.Column(db.Integer)  # Размер файла в байтах
     mime_type = db.Column(db.String(100))  # MIME тип файла
     
@@ -30,8 +65,29 @@ class ProductMedia(db.Model):
     width = db.Column(db.Integer)  # Ширина изображения
     height = db.Column(db.Integer)  # Высота изображения
     
+    # Результаты анализа изображения (ImageAnalysisService)
+    is_valid = db.Column(db.Boolean)  # Изображение полностью декодируется
+    is_blank = db.Column(db.Boolean)  # Изображение почти однотонное
+    aspect_ratio = db.Column(db.Float)  # Соотношение сторон (ширина / высота)
+    analysis_error = db.Column(db.String(255))  # Ошибка декодирования
+    analyzed_at = db.Column(db.DateTime)  # Время анализа (None - еще не анализировалось)
+    
+    # Перцептивный хэш для поиска похожих изображений (app.utils.image_hash):
+    # части по 16 бит в отдельных индексированных столбцах
+    phash = db.Column(db.String(16))
+    phash_b0 = db.Column(db.Integer, index=True)
+    phash_b1 = db.Column(db.Integer, index=True)
+    phash_b2 = db.Column(db.Integer, index=True)
+    phash_b3 = db.Column(db.Integer, index=True)
+    
     # Метаданные для 3D моделей
     model_format = db.Column(db.String(50))  # Формат 3D модели (glb, gltf, obj и т.д.)
+    model_stats = db.Column(db.JSON)  # Параметры 3D модели из заголовка (GLB: версия, меши, вершины и т.д.)
+    
+    # Валидаторы ответа поставщика для условной перепроверки URL
+    etag = db.Column(db.String(255))  # Заголовок ETag
+    last_modified = db.Column(db.String(64))  # Заголовок Last-Modified
+    checked_at = db.Column(db.DateTime, index=True)  # Время последней проверки URL
     
     # Порядок сортировки
     sort_order = db.Column(db.Integer, default=0, nullable=False)
@@ -43,10 +99,18 @@ class ProductMedia(db.Model):
     # Связи
     product = db.relationship('Product', backref='media_files')
     attribute = db.relationship('Attribute', backref='media_files')
+    blob = db.relationship('MediaBlob', backref=db.backref('media', lazy='dynamic'))
     
     def __repr__(self):
         return f'<ProductMedia {self.media_type.value} for product {self.product_id}>'
     
+    def set_phash(self, value):
+        """Сохранить перцептивный хэш вместе с частями для индекса (None - сбросить)"""
+        from app.utils.image_hash import hash_bands
+        self.phash = value
+        bands = hash_bands(value) if value else [None] * 4
+        self.phash_b0, self.phash_b1, self.phash_b2, self.phash_b3 = bands
+    
     def to_dict(self):
         """Сериализация в словарь"""
         return {
@@ -54,6 +118,7 @@ class ProductMedia(db.Model):
             'product_id': self.product_id,
             'attribute_id': self.attribute_id,
             'media_type': self.media_type.value,
+            'blob_id': self.blob_id,
             'original_url': self.original_url,
             'file_path': self.file_path,
             'file_name': self.file_name,
@@ -61,9 +126,140 @@ class ProductMedia(db.Model):
             'mime_type': self.mime_type,
             'width': self.width,
             'height': self.height,
+            'is_valid': self.is_valid,
+            'is_blank': self.is_blank,
+            'aspect_ratio': self.aspect_ratio,
+            'analysis_error': self.analysis_error,
+            'analyzed_at': self.analyzed_at.isoformat() if self.analyzed_at else None,
+            'phash': self.phash,
             'model_format': self.model_format,
+            'model_stats': self.model_stats,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'checked_at': self.checked_at.isoformat() if self.checked_at else None,
             'sort_order': self.sort_order,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'downloaded_at': self.downloaded_at.isoformat() if self.downloaded_at else None,
         }
 
+
+class MediaDerivative(db.Model):
+    """Уменьшенная копия изображения (миниатюра, WebP)"""
+    __tablename__ = 'media_derivatives'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    media_id = db.Column(db.Integer, db.ForeignKey('product_media.id'), nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=False)  # Размер по длинной стороне
+    format = db.Column(db.String(10), nullable=False)  # webp, jpeg
+    file_path = db.Column(db.String(500), nullable=False)  # Путь к файлу копии
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    file_size = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Одна копия каждого размера и формата
+    __table_args__ = (
+        db.UniqueConstraint('media_id', 'size', 'format', name='uq_media_derivative'),
+    )
+    
+    # Связи
+    media = db.relationship('ProductMedia', backref=db.backref('derivatives', lazy='dynamic', cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<MediaDerivative {self.size} {self.format} for media {self.media_id}>'
+    
+    def to_dict(self):
+        """Сериализация в словарь"""
+        return {
+            'id': self.id,
+            'media_id': self.media_id,
+            'size': self.size,
+            'format': self.format,
+            'file_path': self.file_path,
+            'width': self.width,
+            'height': self.height,
+            'file_size': self.file_size,
+        }
+
+class MediaDownloadRetry(db.Model):
+    """Очередь повторного скачивания медиа-файлов после временных ошибок"""
+    __tablename__ = 'media_download_retries'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    attribute_id = db.Column(db.Integer, db.ForeignKey('attributes.id'))
+    url = db.Column(db.String(500), nullable=False)
+    media_type = db.Column(db.Enum(MediaType), nullable=False)
+    sort_order = db.Column(db.Integer, default=0, nullable=False)
+    
+    attempts = db.Column(db.Integer, default=0, nullable=False)  # Неудачных попыток
+    last_error = db.Column(db.String(500))
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Одна запись на файл товара
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'attribute_id', 'url', name='uq_media_download_retry'),
+    )
+    
+    # Связи
+    product = db.relationship('Product', backref=db.backref('media_download_retries', cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<MediaDownloadRetry product={self.product_id} attempts={self.attempts} {self.url[:50]}>'
+    
+    def to_dict(self):
+        """Сериализация в словарь"""
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'attribute_id': self.attribute_id,
+            'url': self.url,
+            'media_type': self.media_type.value,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+        }
+
+class MediaUsage(db.Model):
+    """
+    Счетчики объема медиа-файлов по поставщику, подкатегории и типу медиа
+    
+    Обновляются инкрементально при добавлении, изменении и удалении ProductMedia
+    (app.services.media_usage_service), поэтому объем поставщика считается
+    суммой нескольких строк, без обхода файлов и записей медиа.
+    Объем логический: файл, общий для нескольких товаров, учитывается у каждого.
+    """
+    __tablename__ = 'media_usage'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'), index=True)  # None - поставщик не определен
+    subcategory_id = db.Column(db.Integer, db.ForeignKey('subcategories.id'), nullable=False)
+    media_type = db.Column(db.Enum(MediaType), nullable=False)
+    file_count = db.Column(db.Integer, default=0, nullable=False)
+    total_bytes = db.Column(db.BigInteger, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('supplier_id', 'subcategory_id', 'media_type', name='uq_media_usage_scope'),
+        # NULL в уникальном ограничении не совпадает с NULL - строки без поставщика ограничены отдельно
+        db.Index(
+            'uq_media_usage_scope_no_supplier', 'subcategory_id', 'media_type', unique=True,
+            postgresql_where=db.text('supplier_id IS NULL'),
+            sqlite_where=db.text('supplier_id IS NULL')
+        ),
+    )
+    
+    def __repr__(self):
+        return f'<MediaUsage supplier={self.supplier_id} subcategory={self.subcategory_id} {self.media_type.value}: {self.total_bytes}>'
+    
+    def to_dict(self):
+        """Сериализация в словарь"""
+        return {
+            'supplier_id': self.supplier_id,
+            'subcategory_id': self.subcategory_id,
+            'media_type': self.media_type.value,
+            'file_count': self.file_count,
+            'total_bytes': self.total_bytes,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
@@ -22,6 +22,10 @@ class Supplier(db.Model):
     phone = db.Column(db.String(50))
     address = db.Column(db.Text)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
+    
+    # Квоты на медиа-файлы (None - без ограничения)
+    media_quota_bytes = db.Column(db.BigInteger)  # Максимальный объем, байт
+    media_quota_files = db.Column(db.Integer)  # Максимальное количество файлов
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -53,6 +57,8 @@ class Supplier(db.Model):
             'phone': self.phone,
             'address': self.address,
             'is_active': self.is_active,
+            'media_quota_bytes': self.media_quota_bytes,
+            'media_quota_files': self.media_quota_files,
             'categories_count': self.categories.count(),
             'subcategories_count': subcategories_count,
             'created_at': self.created_at.isoformat() if self.created_at else None,
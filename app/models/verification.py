@@ -3,6 +3,8 @@
 """
 from app import db
 from datetime import datetime
+from sqlalchemy import func, select
+from sqlalchemy.orm import selectinload
 import enum
 
 class IssueType(enum.Enum):
@@ -16,6 +18,49 @@ class IssueType(enum.Enum):
     IMAGE_LOW_RESOLUTION = 'image_low_resolution'  # Низкое разрешение изображения
     IMAGE_INVALID_FORMAT = 'image_invalid_format'  # Неверный формат изображения
     MEDIA_COUNT_LOW = 'media_count_low'  # Мало медиа-файлов
+    MEDIA_SAMPLED = 'media_sampled'  # Медиа приняты по выборочной проверке
+    IMAGE_CORRUPTED = 'image_corrupted'  # Файл изображения поврежден
+    IMAGE_BLANK = 'image_blank'  # Пустое (однотонное) изображение
+    IMAGE_BAD_ASPECT_RATIO = 'image_bad_aspect_ratio'  # Недопустимое соотношение сторон
+    IMAGE_SIMILAR = 'image_similar'  # Похожее изображение у других товаров
+
+# Шаблоны сообщений о проблемах: в БД хранятся код и параметры, сообщение формируется при чтении
+# ({attribute} - название атрибута проблемы)
+ISSUE_MESSAGES = {
+    'missing_required': 'Отсутствует обязательное поле: {attribute}',
+    'invalid_type': 'Неверный тип данных для атрибута {attribute}',
+    'invalid_rules': 'Значение не соответствует правилам валидации для {attribute}',
+    'duplicate': 'Дубликат значения для уникального атрибута {attribute}: {value}',
+    'no_images': 'Отсутствуют изображения товара',
+    'few_images': 'Мало изображений товара: {count} (рекомендуется минимум {min_count})',
+    'image_check_skipped': 'Проверка изображения пропущена ({reason}): {url}',
+    'image_not_accessible': 'Изображение недоступно: {url}',
+    'image_low_resolution': 'Низкое разрешение изображения ({width}x{height}): {url}',
+    'image_invalid_format': 'Неподдерживаемый формат изображения ({format}): {url}',
+    'image_too_large': 'Слишком большой размер файла ({size_mb:.1f}MB): {url}',
+    'image_corrupted': 'Файл изображения поврежден ({error}): {url}',
+    'image_blank': 'Изображение пустое (однотонное): {url}',
+    'image_bad_aspect_ratio': 'Недопустимое соотношение сторон изображения ({width}x{height}): {url}',
+    'image_similar': 'Похожее изображение используется у других товаров ({count} шт.: {skus}): {url}',
+    'media_sampled': (
+        'Изображения приняты по выборочной проверке (sampled-ok): {count} шт., хост {host}; '
+        'в выборке {checked} проверено, {failures} с ошибками, '
+        'доступность не ниже {accessible_lower_bound:.0%}, '
+        'разрешение в норме не ниже {resolution_lower_bound:.0%} (95%)'
+    ),
+    'model_check_skipped': 'Проверка 3D модели пропущена ({reason}): {url}',
+    'model_not_accessible': '3D модель недоступна: {url}',
+}
+
+def render_issue_message(code, params=None, attribute_name=None):
+    """Сформировать текст сообщения о проблеме по коду и параметрам"""
+    template = ISSUE_MESSAGES.get(code)
+    if template is None:
+        return code or ''
+    try:
+        return template.format(attribute=attribute_name or '', **(params or {}))
+    except (KeyError, ValueError, IndexError, TypeError):
+        return template
 
 class ProductVerification(db.Model):
     """Результаты верификации товара"""
@@ -30,6 +75,15 @@ class ProductVerification(db.Model):
     verified_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     verified_by_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     
+    # Отпечатки входных данных (для пропуска неизменившихся товаров при повторной верификации)
+    input_fingerprint = db.Column(db.String(40))  # Общий отпечаток (None - результат не переиспользуется)
+    check_fingerprints = db.Column(db.JSON)  # {'completeness': ..., 'quality': {attribute_id: ...}, 'media': ..., 'external': {'quality': ..., 'media': ...}}
+    
+    issues_count = db.Column(db.Integer, default=0, nullable=False)  # Количество проблем (без запроса к issues)
+    
+    # Не колонка: верификация возвращена повторно, т.к. входные данные не изменились
+    unchanged = False
+    
     # Связи
     issues = db.relationship('VerificationIssue', backref='verification', lazy='dynamic', cascade='all, delete-orphan')
     verified_by = db.relationship('User', backref='verifications', foreign_keys=[verified_by_id])
@@ -37,6 +91,41 @@ class ProductVerification(db.Model):
     def __repr__(self):
         return f'<ProductVerification product={self.product_id} score={self.overall_score}%>'
     
+    @staticmethod
+    def newest_first():
+        """Порядок верификаций товара от последней к первой (определяет последнюю верификацию)"""
+        return ProductVerification.verified_at.desc(), ProductVerification.id.desc()
+    
+    @staticmethod
+    def latest_subquery(*criteria):
+        """
+        Подзапрос последних верификаций товаров
+        
+        Args:
+            criteria: Условия отбора верификаций (например, по product_id)
+        
+        Returns:
+            Subquery: product_id, verification_id
+        """
+        ranked = select(
+            ProductVerification.product_id,
+            ProductVerification.id.label('verification_id'),
+            func.row_number().over(
+                partition_by=ProductVerification.product_id,
+                order_by=ProductVerification.newest_first()
+            ).label('position')
+        ).where(*criteria).subquery()
+        return select(ranked.c.product_id, ranked.c.verification_id).where(ranked.c.position == 1).subquery()
+    
+    def issues_with_attributes(self, *criteria):
+        """
+        Проблемы верификации с атрибутами, загруженными одним запросом (для текста сообщений)
+        
+        Args:
+            criteria: Условия отбора проблем
+        """
+        return self.issues.filter(*criteria).options(selectinload(VerificationIssue.attribute)).all()
+    
     def to_dict(self, include_issues=False):
         """Сериализация в словарь"""
         data = {
@@ -47,11 +136,11 @@ class ProductVerification(db.Model):
             'media_score': self.media_score,
             'overall_score': self.overall_score,
             'verified_at': self.verified_at.isoformat() if self.verified_at else None,
-            'issues_count': self.issues.count(),
+            'issues_count': self.issues_count or 0,
         }
         
         if include_issues:
-            data['issues'] = [issue.to_dict() for issue in self.issues.all()]
+            data['issues'] = [issue.to_dict() for issue in self.issues_with_attributes()]
         
         return data
 
@@ -63,12 +152,25 @@ class VerificationIssue(db.Model):
     verification_id = db.Column(db.Integer, db.ForeignKey('product_verifications.id'), nullable=False)
     issue_type = db.Column(db.Enum(IssueType), nullable=False)
     attribute_id = db.Column(db.Integer, db.ForeignKey('attributes.id'))
-    message = db.Column(db.Text, nullable=False)
+    code = db.Column(db.String(40))  # Код шаблона сообщения (ISSUE_MESSAGES)
+    params = db.Column(db.JSON)  # Параметры сообщения
+    stored_message = db.Column('message', db.Text)  # Готовый текст (только записи без кода)
     severity = db.Column(db.String(20), default='warning')  # error, warning, info
     
     # Связи
     attribute = db.relationship('Attribute', backref='verification_issues')
     
+    @property
+    def message(self):
+        """Текст сообщения (формируется из кода и параметров)"""
+        if self.code:
+            return render_issue_message(self.code, self.params, self.attribute.name if self.attribute else None)
+        return self.stored_message or ''
+    
+    @message.setter
+    def message(self, value):
+        self.stored_message = value
+    
     def __repr__(self):
         return f'<VerificationIssue {self.issue_type.value}: {self.message[:50]}>'
     
@@ -84,3 +186,100 @@ class VerificationIssue(db.Model):
             'severity': self.severity,
         }
 
+
+class VerificationSummary(db.Model):
+    """Сводка старых верификаций товара, удаленных политикой хранения истории"""
+    __tablename__ = 'verification_summaries'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
+    period_start = db.Column(db.DateTime, nullable=False)  # Первая верификация периода
+    period_end = db.Column(db.DateTime, nullable=False)  # Последняя верификация периода
+    verifications_count = db.Column(db.Integer, default=0, nullable=False)
+    min_overall_score = db.Column(db.Integer)
+    max_overall_score = db.Column(db.Integer)
+    avg_overall_score = db.Column(db.Float)
+    issues_count = db.Column(db.Integer, default=0, nullable=False)  # Всего проблем за период
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Связи
+    product = db.relationship('Product', backref=db.backref('verification_summaries', lazy='dynamic', cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<VerificationSummary product={self.product_id} count={self.verifications_count}>'
+    
+    def to_dict(self):
+        """Сериализация в словарь"""
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'period_start': self.period_start.isoformat() if self.period_start else None,
+            'period_end': self.period_end.isoformat() if self.period_end else None,
+            'verifications_count': self.verifications_count,
+            'min_overall_score': self.min_overall_score,
+            'max_overall_score': self.max_overall_score,
+            'avg_overall_score': round(self.avg_overall_score, 1) if self.avg_overall_score is not None else None,
+            'issues_count': self.issues_count,
+        }
+
+
+class VerificationJobStatus(enum.Enum):
+    """Статусы задания массовой верификации"""
+    PENDING = 'pending'  # Ожидает запуска
+    RUNNING = 'running'  # Выполняется
+    COMPLETED = 'completed'  # Завершено
+    FAILED = 'failed'  # Ошибка выполнения
+
+class VerificationJob(db.Model):
+    """Задание массовой верификации (файл импорта или подкатегория), выполняется по частям"""
+    __tablename__ = 'verification_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    import_history_id = db.Column(db.Integer, db.ForeignKey('import_history.id'), nullable=True)
+    subcategory_id = db.Column(db.Integer, db.ForeignKey('subcategories.id'), nullable=True)
+    status = db.Column(db.Enum(VerificationJobStatus), default=VerificationJobStatus.PENDING, nullable=False)
+    
+    # Параметры
+    force = db.Column(db.Boolean, default=False, nullable=False)  # Пересчитать без сравнения отпечатков
+    sampling = db.Column(db.Boolean)  # Выборочная проверка медиа (None - по конфигурации)
+    
+    # Прогресс
+    total_count = db.Column(db.Integer, default=0, nullable=False)  # Всего товаров
+    processed_count = db.Column(db.Integer, default=0, nullable=False)  # Обработано товаров
+    unchanged_count = db.Column(db.Integer, default=0, nullable=False)  # Пропущено без изменений
+    errors_count = db.Column(db.Integer, default=0, nullable=False)  # Ошибок верификации
+    chunks_total = db.Column(db.Integer, default=0, nullable=False)  # Всего частей
+    chunks_done = db.Column(db.Integer, default=0, nullable=False)  # Обработано частей
+    errors = db.Column(db.JSON)  # Первые сообщения об ошибках
+    error_message = db.Column(db.Text)  # Ошибка задания, если статус failed
+    
+    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # Последняя отметка выполняющегося задания (после каждой части)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<VerificationJob {self.id} {self.status.value} {self.processed_count}/{self.total_count}>'
+    
+    def to_dict(self):
+        """Сериализация в словарь"""
+        return {
+            'id': self.id,
+            'import_history_id': self.import_history_id,
+            'subcategory_id': self.subcategory_id,
+            'status': self.status.value,
+            'force': self.force,
+            'total_count': self.total_count,
+            'processed_count': self.processed_count,
+            'unchanged_count': self.unchanged_count,
+            'errors_count': self.errors_count,
+            'chunks_total': self.chunks_total,
+            'chunks_done': self.chunks_done,
+            'progress': int(self.processed_count / self.total_count * 100) if self.total_count else 0,
+            'errors': self.errors or [],
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -0,0 +1,230 @@
+"""
+Поиск дубликатов значений уникальных атрибутов по всему каталогу
+
+Дубликаты находятся одним запросом GROUP BY по индексу (attribute_id, value_hash)
+вместо отдельного запроса на каждую пару (товар, уникальный атрибут).
+"""
+from sqlalchemy import and_, func, or_
+from app import db
+from app.models.attribute import Attribute
+from app.models.product import Product, ProductAttributeValue
+from config import Config
+
+
+class DuplicateIndex:
+    """Предвычисленные группы дубликатов: (attribute_id, value_hash) -> ID товаров"""
+    
+    def __init__(self, groups):
+        """
+        Args:
+            groups: {(attribute_id, value_hash): [product_id, ...]} - только группы из 2+ товаров
+        """
+        self.groups = groups
+    
+    def find_duplicate(self, attribute_id, value, product_id):
+        """
+        Найти другой товар с тем же значением атрибута
+        
+        Returns:
+            int or None: ID товара-дубликата
+        """
+        product_ids = self.groups.get((attribute_id, ProductAttributeValue.hash_value(value)))
+        if not product_ids:
+            return None
+        return next((other_id for other_id in product_ids if other_id != product_id), None)
+    
+    def find_duplicates(self, values, product_id):
+        """
+        Найти дубликаты нескольких значений товара
+        
+        Args:
+            values: [(attribute_id, value)]
+        
+        Returns:
+            dict: {attribute_id: ID товара-дубликата или None}
+        """
+        return {
+            attribute_id: self.find_duplicate(attribute_id, value, product_id)
+            for attribute_id, value in values
+        }
+
+
+class DuplicateService:
+    """Сервис поиска дубликатов уникальных атрибутов"""
+    
+    @staticmethod
+    def build_index(attribute_ids=None):
+        """
+        Построить индекс дубликатов по всему каталогу (один проход GROUP BY)
+        
+        Args:
+            attribute_ids: Ограничить атрибутами (None - все атрибуты с is_unique)
+        
+        Returns:
+            DuplicateIndex
+        """
+        groups = {}
+        for attribute_id, value_hash, product_id in DuplicateService._members_query(attribute_ids).with_entities(
+            ProductAttributeValue.attribute_id,
+            ProductAttributeValue.value_hash,
+            ProductAttributeValue.product_id
+        ).order_by(ProductAttributeValue.product_id):
+            groups.setdefault((attribute_id, value_hash), []).append(product_id)
+        return DuplicateIndex(groups)
+    
+    @staticmethod
+    def find_duplicate(attribute_id, value, product_id):
+        """
+        Найти другой товар с тем же значением атрибута (точечный запрос по индексу хэша)
+        
+        Returns:
+            int or None: ID товара-дубликата
+        """
+        value_hash = ProductAttributeValue.hash_value(value)
+        if value_hash is None:
+            return None
+        
+        row = db.session.query(ProductAttributeValue.product_id).filter(
+            ProductAttributeValue.attribute_id == attribute_id,
+            ProductAttributeValue.value_hash == value_hash,
+            ProductAttributeValue.product_id != product_id
+        ).order_by(ProductAttributeValue.product_id).first()
+        return row[0] if row else None
+    
+    @staticmethod
+    def find_duplicates(values, product_id):
+        """
+        Найти дубликаты нескольких значений товара одним запросом
+        
+        Args:
+            values: [(attribute_id, value)]
+        
+        Returns:
+            dict: {attribute_id: ID товара-дубликата с наименьшим ID или None}
+        """
+        result = {attribute_id: None for attribute_id, _ in values}
+        conditions = []
+        for attribute_id, value in values:
+            value_hash = ProductAttributeValue.hash_value(value)
+            if value_hash is not None:
+                conditions.append(and_(
+                    ProductAttributeValue.attribute_id == attribute_id,
+                    ProductAttributeValue.value_hash == value_hash
+                ))
+        if not conditions:
+            return result
+        
+        rows = db.session.query(
+            ProductAttributeValue.attribute_id,
+            func.min(ProductAttributeValue.product_id)
+        ).filter(
+            or_(*conditions),
+            ProductAttributeValue.product_id != product_id
+        ).group_by(ProductAttributeValue.attribute_id)
+        result.update(dict(rows))
+        return result
+    
+    @staticmethod
+    def get_clusters(attribute_ids=None, subcategory_id=None):
+        """
+        Получить все группы дубликатов (отчет)
+        
+        Args:
+            attribute_ids: Ограничить атрибутами (None - все атрибуты с is_unique)
+            subcategory_id: Показать только группы, в которые входят товары подкатегории
+        
+        Returns:
+            list: [{attribute_id, attribute_code, attribute_name, value, count, products: [{id, sku, name}]}]
+        """
+        rows = DuplicateService._members_query(attribute_ids).join(
+            Product, Product.id == ProductAttributeValue.product_id
+        ).join(
+            Attribute, Attribute.id == ProductAttributeValue.attribute_id
+        ).with_entities(
+            ProductAttributeValue.attribute_id,
+            ProductAttributeValue.value_hash,
+            ProductAttributeValue.value,
+            Attribute.code,
+            Attribute.name,
+            Product.id,
+            Product.sku,
+            Product.name,
+            Product.subcategory_id
+        ).order_by(ProductAttributeValue.attribute_id, ProductAttributeValue.value_hash, Product.id).all()
+        
+        clusters = {}
+        for attribute_id, value_hash, value, code, attr_name, product_id, sku, name, product_subcategory_id in rows:
+            cluster = clusters.setdefault((attribute_id, value_hash), {
+                'attribute_id': attribute_id,
+                'attribute_code': code,
+                'attribute_name': attr_name,
+                'value': value.strip(),
+                'count': 0,
+                'products': [],
+                'subcategory_ids': set(),
+            })
+            cluster['count'] += 1
+            cluster['products'].append({'id': product_id, 'sku': sku, 'name': name})
+            cluster['subcategory_ids'].add(product_subcategory_id)
+        
+        result = []
+        for cluster in clusters.values():
+            subcategory_ids = cluster.pop('subcategory_ids')
+            if subcategory_id is None or subcategory_id in subcategory_ids:
+                result.append(cluster)
+        return result
+    
+    @staticmethod
+    def ensure_hashes(batch_size=None):
+        """
+        Заполнить хэши значений, отсутствующие у старых записей или записей, созданных в обход ORM
+        
+        Returns:
+            int: Количество обновленных записей
+        """
+        batch_size = batch_size or Config.DUPLICATE_HASH_BATCH_SIZE
+        updated = 0
+        last_id = 0
+        while True:
+            rows = db.session.query(ProductAttributeValue.id, ProductAttributeValue.value).filter(
+                ProductAttributeValue.value_hash.is_(None),
+                ProductAttributeValue.id > last_id
+            ).order_by(ProductAttributeValue.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            
+            mappings = [
+                {'id': pav_id, 'value_hash': ProductAttributeValue.hash_value(value)}
+                for pav_id, value in rows
+            ]
+            mappings = [mapping for mapping in mappings if mapping['value_hash']]
+            if mappings:
+                db.session.bulk_update_mappings(ProductAttributeValue, mappings)
+                db.session.commit()
+                updated += len(mappings)
+        return updated
+    
+    @staticmethod
+    def _members_query(attribute_ids=None):
+        """Запрос значений, входящих в группы дубликатов (подзапрос GROUP BY ... HAVING COUNT > 1)"""
+        groups = db.session.query(
+            ProductAttributeValue.attribute_id.label('attribute_id'),
+            ProductAttributeValue.value_hash.label('value_hash')
+        ).join(
+            Attribute, Attribute.id == ProductAttributeValue.attribute_id
+        ).filter(
+            Attribute.is_unique.is_(True),
+            ProductAttributeValue.value_hash.isnot(None)
+        )
+        if attribute_ids is not None:
+            groups = groups.filter(ProductAttributeValue.attribute_id.in_(attribute_ids))
+        groups = groups.group_by(
+            ProductAttributeValue.attribute_id, ProductAttributeValue.value_hash
+        ).having(func.count(ProductAttributeValue.id) > 1).subquery()
+        
+        return ProductAttributeValue.query.join(
+            groups,
+            (ProductAttributeValue.attribute_id == groups.c.attribute_id) &
+            (ProductAttributeValue.value_hash == groups.c.value_hash)
+        )
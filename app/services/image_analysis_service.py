@@ -0,0 +1,243 @@
+"""
+Анализ скачанных изображений в пуле процессов
+
+Полное декодирование изображения (проверка целостности, соотношение сторон,
+поиск "пустых" изображений) нагружает процессор и держит GIL, поэтому
+выполняется пакетами в ProcessPoolExecutor, а не в потоке веб-запроса.
+Пул запускается методом spawn: его создают потоки запросов и фоновые потоки,
+а fork копирует состояние только вызывающего потока (блокировки, соединения).
+В процессах заданий верификации пул ограничен Config.IMAGE_ANALYSIS_JOB_WORKERS,
+чтобы пулы обработчиков не умножали число процессов.
+Результаты сохраняются в ProductMedia и используются верификацией.
+Заодно вычисляется перцептивный хэш для поиска похожих изображений.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from PIL import Image, ImageStat
+from sqlalchemy import and_, or_
+from app import db
+from app.models.product_media import ProductMedia, MediaType
+from app.utils.image_hash import phash
+from config import Config
+
+
+# Размер уменьшенной копии для поиска "пустых" изображений
+BLANK_CHECK_SIZE = (64, 64)
+
+
+def analyze_image_file(path, blank_stddev=None):
+    """
+    Проанализировать локальный файл изображения (выполняется в дочернем процессе)
+    
+    Args:
+        path: Абсолютный путь к файлу
+        blank_stddev: Порог стандартного отклонения яркости для "пустого" изображения
+    
+    Returns:
+        dict: is_valid, width, height, format, aspect_ratio, is_blank, phash, error
+    """
+    if blank_stddev is None:
+        blank_stddev = Config.IMAGE_BLANK_STDDEV
+    
+    result = {
+        'is_valid': False,
+        'width': None,
+        'height': None,
+        'format': None,
+        'aspect_ratio': None,
+        'is_blank': None,
+        'phash': None,
+        'error': None,
+    }
+    
+    try:
+        # verify() проверяет структуру файла, но после него изображение нужно открыть заново
+        with Image.open(path) as img:
+            img.verify()
+        
+        with Image.open(path) as img:
+            result['width'], result['height'] = img.size
+            result['format'] = img.format
+            
+            # Для JPEG декодирование сразу в уменьшенном размере
+            img.draft('L', (BLANK_CHECK_SIZE[0] * 4, BLANK_CHECK_SIZE[1] * 4))
+            img.load()  # Полное декодирование - обрезанные файлы дают ошибку здесь
+            
+            gray = img.convert('L')
+            result['phash'] = phash(gray)
+            gray.thumbnail(BLANK_CHECK_SIZE)
+            result['is_blank'] = ImageStat.Stat(gray).stddev[0] < blank_stddev
+        
+        width, height = result['width'], result['height']
+        if width and height:
+            result['aspect_ratio'] = round(width / height, 4)
+        result['is_valid'] = True
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'[:255]
+    
+    return result
+
+
+class ImageAnalysisService:
+    """Сервис анализа скачанных изображений"""
+    
+    _executor = None
+    _workers = 1
+    _workers_limit = None  # Ограничение размера пула (limit_workers)
+    _executor_lock = threading.Lock()
+    
+    @staticmethod
+    def analyze_files(paths):
+        """
+        Проанализировать пакет файлов изображений
+        
+        Небольшие пакеты обрабатываются в текущем процессе, остальные - в пуле процессов.
+        
+        Args:
+            paths: Список абсолютных путей
+        
+        Returns:
+            list: Результаты analyze_image_file в порядке paths
+        """
+        paths = [str(path) for path in paths]
+        blank_stddev = Config.IMAGE_BLANK_STDDEV
+        
+        if len(paths) < Config.IMAGE_ANALYSIS_MIN_POOL_BATCH or ImageAnalysisService._workers_limit == 1:
+            return [analyze_image_file(path, blank_stddev) for path in paths]
+        
+        executor = ImageAnalysisService._get_executor()
+        chunksize = max(1, len(paths) // (ImageAnalysisService._workers * 4))
+        return list(executor.map(
+            analyze_image_file,
+            paths,
+            [blank_stddev] * len(paths),
+            chunksize=chunksize
+        ))
+    
+    @staticmethod
+    def analyze_media(media_list, commit=True):
+        """
+        Проанализировать изображения и сохранить результаты в ProductMedia
+        
+        Args:
+            media_list: Список ProductMedia (3D модели и отсутствующие файлы пропускаются)
+            commit: Зафиксировать изменения в БД
+        
+        Returns:
+            int: Количество проанализированных изображений
+        """
+        from app.services.media_service import MediaService
+        
+        to_analyze = []
+        for media in media_list:
+            if media.media_type != MediaType.IMAGE:
+                continue
+            path = MediaService.get_media_path(media.file_path)
+            if path.exists():
+                to_analyze.append((media, path))
+        
+        if not to_analyze:
+            return 0
+        
+        results = ImageAnalysisService.analyze_files([path for _, path in to_analyze])
+        
+        now = datetime.utcnow()
+        for (media, _), result in zip(to_analyze, results):
+            ImageAnalysisService._apply_result(media, result, now)
+        
+        if commit:
+            db.session.commit()
+        
+        return len(to_analyze)
+    
+    @staticmethod
+    def analyze_pending(product_ids=None, batch_size=None):
+        """
+        Проанализировать все еще не проанализированные изображения
+        и изображения без перцептивного хэша (проанализированные до его появления)
+        
+        Args:
+            product_ids: Ограничить товарами (None - все товары)
+            batch_size: Размер пакета (по умолчанию Config.IMAGE_ANALYSIS_BATCH_SIZE)
+        
+        Returns:
+            int: Количество проанализированных изображений
+        """
+        batch_size = batch_size or Config.IMAGE_ANALYSIS_BATCH_SIZE
+        
+        query = ProductMedia.query.filter(
+            ProductMedia.media_type == MediaType.IMAGE,
+            or_(
+                ProductMedia.analyzed_at.is_(None),
+                and_(ProductMedia.is_valid.is_(True), ProductMedia.phash.is_(None))
+            )
+        )
+        if product_ids is not None:
+            if not product_ids:
+                return 0
+            query = query.filter(ProductMedia.product_id.in_(product_ids))
+        
+        total = 0
+        last_id = 0
+        while True:
+            batch = query.filter(ProductMedia.id > last_id).order_by(ProductMedia.id).limit(batch_size).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+            total += ImageAnalysisService.analyze_media(batch)
+        
+        return total
+    
+    @staticmethod
+    def _apply_result(media, result, analyzed_at):
+        """Сохранить результат анализа в ProductMedia"""
+        media.is_valid = result['is_valid']
+        media.is_blank = result['is_blank']
+        media.aspect_ratio = result['aspect_ratio']
+        media.analysis_error = result['error']
+        media.analyzed_at = analyzed_at
+        media.set_phash(result.get('phash') if result['is_valid'] else None)
+        
+        # Размеры по полному декодированию надежнее, чем по заголовку
+        if result['is_valid']:
+            media.width = result['width']
+            media.height = result['height']
+    
+    @staticmethod
+    def _get_executor():
+        """Получить общий пул процессов (создается при первом обращении)"""
+        with ImageAnalysisService._executor_lock:
+            if ImageAnalysisService._executor is None:
+                workers = Config.IMAGE_ANALYSIS_WORKERS or os.cpu_count() or 1
+                if ImageAnalysisService._workers_limit:
+                    workers = min(workers, ImageAnalysisService._workers_limit)
+                ImageAnalysisService._workers = workers
+                ImageAnalysisService._executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                atexit.register(ImageAnalysisService.shutdown)
+            return ImageAnalysisService._executor
+    
+    @staticmethod
+    def limit_workers(workers):
+        """
+        Ограничить размер пула в текущем процессе (процессы-обработчики заданий)
+        
+        Args:
+            workers: Максимальное количество процессов (1 - анализ в текущем процессе)
+        """
+        ImageAnalysisService.shutdown()
+        ImageAnalysisService._workers_limit = max(1, workers)
+    
+    @staticmethod
+    def shutdown():
+        """Остановить пул процессов"""
+        with ImageAnalysisService._executor_lock:
+            if ImageAnalysisService._executor is not None:
+                ImageAnalysisService._executor.shutdown(wait=True)
+                ImageAnalysisService._executor = None
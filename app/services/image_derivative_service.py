@@ -0,0 +1,277 @@
+"""
+Уменьшенные копии изображений (миниатюры и WebP)
+
+Для каждого скачанного изображения создаются копии заданных размеров
+(Config.IMAGE_DERIVATIVE_SIZES, по длинной стороне) в формате WebP или JPEG.
+Файлы копий лежат рядом с оригиналом (<sha256>_<размер>.<ext>), поэтому товары
+с общим содержимым используют одни и те же файлы. Генерация выполняется
+в пуле процессов анализа изображений в фоновом потоке после скачивания
+(общий пул из Config.IMAGE_DERIVATIVE_THREADS потоков); отсутствующий размер
+создается при первом запросе в текущем процессе. Копии создаются из локального
+файла (для объектного хранилища - из копии в кэше) и переносятся в хранилище.
+"""
+import atexit
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from PIL import Image
+from app import db
+from app.models.product_media import ProductMedia, MediaDerivative, MediaType
+from app.utils.media_storage import get_storage
+from config import Config
+
+
+# Формат копии -> (формат PIL, расширение файла, MIME тип)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', '.webp', 'image/webp'),
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg'),
+}
+
+
+def derivative_path(source, size, fmt):
+    """Путь уменьшенной копии рядом с оригиналом"""
+    source = Path(source)
+    return source.parent / f'{source.stem}_{size}{DERIVATIVE_FORMATS[fmt][1]}'
+
+
+def make_derivatives(path, sizes, fmt, quality):
+    """
+    Создать уменьшенные копии изображения (выполняется в дочернем процессе)
+    
+    Уже существующие файлы копий не пересоздаются. Копии меньших размеров
+    получаются из предыдущей (большей) копии, а не из оригинала.
+    
+    Args:
+        path: Абсолютный путь к оригиналу
+        sizes: Размеры по длинной стороне
+        fmt: Формат копий ('webp' или 'jpeg')
+        quality: Качество сжатия
+    
+    Returns:
+        list: dict с ключами size, file_path, width, height, file_size, error
+    """
+    pil_format = DERIVATIVE_FORMATS[fmt][0]
+    results = []
+    missing = []
+    for size in sorted(set(sizes), reverse=True):
+        target = derivative_path(path, size, fmt)
+        if target.exists():
+            try:
+                with Image.open(target) as img:
+                    width, height = img.size
+                results.append({
+                    'size': size, 'file_path': str(target), 'width': width, 'height': height,
+                    'file_size': target.stat().st_size, 'error': None,
+                })
+                continue
+            except Exception:
+                pass
+        missing.append(size)
+    
+    if not missing:
+        return results
+    
+    try:
+        with Image.open(path) as img:
+            # Для JPEG декодирование сразу в уменьшенном размере
+            img.draft('RGB', (missing[0], missing[0]))
+            img.load()
+            has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+            current = img.convert('RGBA' if has_alpha and fmt == 'webp' else 'RGB')
+        
+        for size in missing:
+            current = current.copy()
+            current.thumbnail((size, size), Image.LANCZOS)
+            
+            target = derivative_path(path, size, fmt)
+            tmp_path = target.with_name(f'{target.name}.{os.getpid()}.tmp')
+            current.save(tmp_path, format=pil_format, quality=quality)
+            os.replace(tmp_path, target)
+            
+            results.append({
+                'size': size, 'file_path': str(target), 'width': current.width, 'height': current.height,
+                'file_size': target.stat().st_size, 'error': None,
+            })
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'[:255]
+        done = {result['size'] for result in results}
+        results.extend({'size': size, 'error': error} for size in missing if size not in done)
+    
+    return results
+
+
+class ImageDerivativeService:
+    """Сервис уменьшенных копий изображений"""
+    
+    _executor = None
+    _executor_lock = threading.Lock()
+    
+    @staticmethod
+    def generate(media_list, sizes=None, commit=True, in_process=False):
+        """
+        Создать недостающие уменьшенные копии изображений и записи MediaDerivative
+        
+        Args:
+            media_list: Список ProductMedia (3D модели и отсутствующие файлы пропускаются)
+            sizes: Размеры (по умолчанию Config.IMAGE_DERIVATIVE_SIZES)
+            commit: Зафиксировать изменения в БД
+            in_process: Создавать копии в текущем процессе, не обращаясь к пулу процессов
+        
+        Returns:
+            int: Количество созданных или обновленных записей
+        """
+        from app.services.image_analysis_service import ImageAnalysisService
+        from app.services.media_service import MediaService
+        
+        sizes = list(sizes or Config.IMAGE_DERIVATIVE_SIZES)
+        fmt = Config.IMAGE_DERIVATIVE_FORMAT
+        images = [media for media in media_list if media.media_type == MediaType.IMAGE]
+        if not images:
+            return 0
+        
+        existing = {
+            (derivative.media_id, derivative.size): derivative
+            for derivative in MediaDerivative.query.filter(
+                MediaDerivative.media_id.in_([media.id for media in images]),
+                MediaDerivative.format == fmt
+            )
+        }
+        
+        # Недостающие размеры по файлам (общий blob обрабатывается один раз)
+        storage = get_storage()
+        todo = {}
+        for media in images:
+            for size in sizes:
+                derivative = existing.get((media.id, size))
+                if derivative is None or not storage.exists(derivative.file_path):
+                    key_sizes, key_media = todo.setdefault(media.file_path, (set(), []))
+                    key_sizes.add(size)
+                    key_media.append((media, size))
+        
+        # Локальные файлы оригиналов (отсутствующие в хранилище пропускаются)
+        keys = []
+        paths = []
+        for key in todo:
+            path = MediaService.get_media_path(key)
+            if path.is_file():
+                keys.append(key)
+                paths.append(str(path))
+        
+        if not paths:
+            return 0
+        
+        size_lists = [sorted(todo[key][0]) for key in keys]
+        quality = Config.IMAGE_DERIVATIVE_QUALITY
+        if in_process or len(paths) < Config.IMAGE_ANALYSIS_MIN_POOL_BATCH:
+            results = [make_derivatives(path, path_sizes, fmt, quality) for path, path_sizes in zip(paths, size_lists)]
+        else:
+            executor = ImageAnalysisService._get_executor()
+            results = list(executor.map(
+                make_derivatives, paths, size_lists, [fmt] * len(paths), [quality] * len(paths)
+            ))
+        
+        count = 0
+        for key, path_results in zip(keys, results):
+            by_size = {result['size']: result for result in path_results if not result['error']}
+            stored = {}
+            for media, size in todo[key][1]:
+                result = by_size.get(size)
+                if result is None:
+                    continue
+                if size not in stored:
+                    stored[size] = str(derivative_path(key, size, fmt))
+                    storage.put_file(stored[size], result['file_path'])
+                derivative = existing.get((media.id, size))
+                if derivative is None:
+                    derivative = MediaDerivative(media_id=media.id, size=size, format=fmt)
+                    db.session.add(derivative)
+                    existing[(media.id, size)] = derivative
+                derivative.file_path = stored[size]
+                derivative.width = result['width']
+                derivative.height = result['height']
+                derivative.file_size = result['file_size']
+                count += 1
+        
+        if commit:
+            db.session.commit()
+        
+        return count
+    
+    @staticmethod
+    def get_or_create(media, size):
+        """
+        Получить уменьшенную копию изображения, создав ее при отсутствии
+        
+        Returns:
+            MediaDerivative: Запись копии или None (файл оригинала недоступен или не декодируется)
+        """
+        fmt = Config.IMAGE_DERIVATIVE_FORMAT
+        derivative = MediaDerivative.query.filter_by(media_id=media.id, size=size, format=fmt).first()
+        if derivative is not None and get_storage().exists(derivative.file_path):
+            return derivative
+        
+        # Один файл по запросу страницы - в текущем процессе, без запуска пула процессов
+        ImageDerivativeService.generate([media], sizes=[size], in_process=True)
+        return MediaDerivative.query.filter_by(media_id=media.id, size=size, format=fmt).first()
+    
+    @staticmethod
+    def start_generation(media_ids):
+        """
+        Создать уменьшенные копии в фоне (в общем пуле потоков ограниченного размера)
+        
+        Returns:
+            concurrent.futures.Future: Задание генерации
+        """
+        from flask import current_app
+        app = current_app._get_current_object()
+        media_ids = list(media_ids)
+        
+        def run():
+            with app.app_context():
+                try:
+                    batch_size = Config.IMAGE_ANALYSIS_BATCH_SIZE
+                    for start in range(0, len(media_ids), batch_size):
+                        media_list = ProductMedia.query.filter(
+                            ProductMedia.id.in_(media_ids[start:start + batch_size])
+                        ).all()
+                        ImageDerivativeService.generate(media_list)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Ошибка создания уменьшенных копий изображений: {str(e)}", exc_info=True)
+                finally:
+                    db.session.remove()
+        
+        return ImageDerivativeService._get_executor().submit(run)
+    
+    @staticmethod
+    def _get_executor():
+        """Получить общий пул фоновых потоков (создается при первом обращении)"""
+        with ImageDerivativeService._executor_lock:
+            if ImageDerivativeService._executor is None:
+                ImageDerivativeService._executor = ThreadPoolExecutor(
+                    max_workers=max(Config.IMAGE_DERIVATIVE_THREADS, 1), thread_name_prefix='image-derivatives'
+                )
+                atexit.register(ImageDerivativeService.shutdown)
+            return ImageDerivativeService._executor
+    
+    @staticmethod
+    def shutdown():
+        """Остановить пул фоновых потоков (дождавшись начатых заданий)"""
+        with ImageDerivativeService._executor_lock:
+            if ImageDerivativeService._executor is not None:
+                ImageDerivativeService._executor.shutdown(wait=True)
+                ImageDerivativeService._executor = None
+    
+    @staticmethod
+    def mime_type(fmt=None):
+        """MIME тип копий"""
+        return DERIVATIVE_FORMATS[fmt or Config.IMAGE_DERIVATIVE_FORMAT][2]
+    
+    @staticmethod
+    def remove_files(source_key):
+        """Удалить из хранилища файлы всех уменьшенных копий оригинала"""
+        storage = get_storage()
+        for fmt in DERIVATIVE_FORMATS:
+            for size in Config.IMAGE_DERIVATIVE_SIZES:
+                storage.delete(str(derivative_path(source_key, size, fmt)))
@@ -0,0 +1,116 @@
+"""
+Поиск похожих изображений по перцептивному хэшу
+
+Поставщики часто используют одно и то же фото для разных товаров под разными
+URL и в разном разрешении. Перцептивный хэш (app.utils.image_hash) вычисляется
+при анализе скачанного изображения; похожие изображения ищутся по индексу из
+частей хэша: кандидаты отбираются точными запросами по индексированным столбцам
+phash_b0..phash_b3, расстояние Хэмминга проверяется только у кандидатов.
+"""
+from collections import defaultdict
+from sqlalchemy import or_
+from app import db
+from app.models.product import Product
+from app.models.product_media import ProductMedia, MediaType
+from app.utils.image_hash import PHASH_BANDS, band_neighbours, hamming, hash_bands
+from config import Config
+
+
+class ImageSimilarityService:
+    """Сервис поиска похожих изображений"""
+    
+    BAND_COLUMNS = (ProductMedia.phash_b0, ProductMedia.phash_b1, ProductMedia.phash_b2, ProductMedia.phash_b3)
+    
+    @staticmethod
+    def find_similar(media, max_distance=None, limit=None):
+        """
+        Изображения других товаров, похожие на изображение
+        
+        Args:
+            media: ProductMedia с вычисленным phash
+            max_distance: Максимальное расстояние Хэмминга (по умолчанию Config.IMAGE_SIMILAR_MAX_DISTANCE)
+            limit: Максимальное количество результатов
+        
+        Returns:
+            list: dict media_id, product_id, sku, original_url, distance (по возрастанию расстояния)
+        """
+        if not media.phash:
+            return []
+        
+        matches = ImageSimilarityService._match({media.id: media.phash}, max_distance, media.product_id)
+        found = sorted(matches.get(media.id, []), key=lambda match: (match[2], match[0]))
+        if limit is not None:
+            found = found[:limit]
+        if not found:
+            return []
+        
+        rows = {
+            row.id: row for row in db.session.query(
+                ProductMedia.id, ProductMedia.original_url, Product.sku
+            ).join(Product, ProductMedia.product_id == Product.id).filter(
+                ProductMedia.id.in_([media_id for media_id, _, _ in found])
+            )
+        }
+        return [
+            {
+                'media_id': media_id,
+                'product_id': product_id,
+                'sku': rows[media_id].sku if media_id in rows else None,
+                'original_url': rows[media_id].original_url if media_id in rows else None,
+                'distance': distance,
+            }
+            for media_id, product_id, distance in found
+        ]
+    
+    @staticmethod
+    def similar_for_product(product_id, max_distance=None):
+        """
+        Похожие изображения других товаров для всех изображений товара (одним запросом кандидатов)
+        
+        Returns:
+            dict: {media_id: [(media_id другого товара, product_id, расстояние)]}
+        """
+        hashes = dict(db.session.query(ProductMedia.id, ProductMedia.phash).filter(
+            ProductMedia.product_id == product_id,
+            ProductMedia.media_type == MediaType.IMAGE,
+            ProductMedia.phash.isnot(None)
+        ).all())
+        return ImageSimilarityService._match(hashes, max_distance, product_id)
+    
+    @staticmethod
+    def _match(hashes, max_distance=None, exclude_product_id=None):
+        """
+        Найти изображения на расстоянии не больше max_distance от заданных хэшей
+        
+        Args:
+            hashes: {ключ: phash}
+            exclude_product_id: Не искать среди изображений этого товара
+        
+        Returns:
+            dict: {ключ: [(media_id, product_id, расстояние)]}
+        """
+        if not hashes:
+            return {}
+        max_distance = Config.IMAGE_SIMILAR_MAX_DISTANCE if max_distance is None else max_distance
+        radius = max_distance // PHASH_BANDS
+        
+        # Значения каждой части, при которых хэш может оказаться на нужном расстоянии
+        band_values = [set() for _ in range(PHASH_BANDS)]
+        for value in hashes.values():
+            for index, band in enumerate(hash_bands(value)):
+                band_values[index].update(band_neighbours(band, radius))
+        
+        query = db.session.query(ProductMedia.id, ProductMedia.product_id, ProductMedia.phash).filter(
+            or_(*[column.in_(sorted(values)) for column, values in zip(ImageSimilarityService.BAND_COLUMNS, band_values)]),
+            ProductMedia.media_type == MediaType.IMAGE
+        )
+        if exclude_product_id is not None:
+            query = query.filter(ProductMedia.product_id != exclude_product_id)
+        
+        matches = defaultdict(list)
+        for media_id, product_id, candidate in query.yield_per(Config.IMAGE_SIMILAR_BATCH_SIZE):
+            for key, value in hashes.items():
+                distance = hamming(value, candidate)
+                if distance <= max_distance:
+                    matches[key].append((media_id, product_id, distance))
+        return dict(matches)
@@ -13,6 +13,7 @@ from app.models.subcategory_attribute import SubcategoryAttribute
 from app.models.product import ProductAttributeValue
 from app.models.workflow import ProductStatusHistory
 from app.services.verification_service import VerificationService
+from app.utils.attribute_validators import validator_registry
 from flask_login import current_user
 from datetime import datetime
 
@@ -224,6 +225,7 @@ class ImportService:
         errors = []
         warnings = []
         products = []
+        row_numbers = {}  # product_id -> номер строки файла
         
         # Получить эталонные атрибуты подкатегории
         reference_attributes = {attr.attribute.code: attr for attr in subcategory.get_all_attributes()}
@@ -237,6 +239,10 @@ class ImportService:
                 'products': []
             }
         
+        # Выборочная проверка медиа для всего файла (если включена в конфигурации)
+        from app.services.media_sampler import MediaSampler
+        sampler = MediaSampler.from_config()
+        
         # Получить названия колонок из первой строки
         first_row = data[0]
         column_mapping = ImportService._auto_map_fields(first_row.keys(), reference_attributes.keys())
@@ -245,42 +251,51 @@ class ImportService:
         for row_num, row_data in enumerate(data, start=2):  # Начинаем с 2 (первая строка - заголовки)
             try:
                 # Создать товар
+                row_warnings = []
                 product = ImportService._create_product_from_row(
                     row_data, 
                     subcategory, 
                     column_mapping, 
                     reference_attributes,
-                    user
+                    user,
+                    import_history_id=import_history_id,
+                    warnings=row_warnings
                 )
                 
                 products.append(product)
+                row_numbers[product.id] = row_num
                 imported_count += 1
-                
-                # Скачать медиа-файлы (фото и 3D модели)
-                try:
-                    from app.services.media_service import MediaService
-                    media_stats = MediaService.process_product_media(product, auto_download=True)
-                    if media_stats['images_downloaded'] > 0:
-                        warnings.append(f"Строка {row_num}: Скачано изображений: {media_stats['images_downloaded']}")
-                    if media_stats['models_downloaded'] > 0:
-                        warnings.append(f"Строка {row_num}: Скачано 3D моделей: {media_stats['models_downloaded']}")
-                    if media_stats['errors']:
-                        for error in media_stats['errors']:
-                            warnings.append(f"Строка {row_num}: {error}")
-                except Exception as e:
-                    warnings.append(f"Строка {row_num}: Ошибка при скачивании медиа-файлов - {str(e)}")
-                
-                # Автоматическая верификация
-                if auto_verify:
-                    try:
-                        VerificationService.verify_product(product, user)
-                    except Exception as e:
-                        warnings.append(f"Строка {row_num}: Ошибка верификации - {str(e)}")
-                
+                warnings.extend(f"Строка {row_num}: {warning}" for warning in row_warnings)
+            
             except Exception as e:
                 errors.append(f"Строка {row_num}: {str(e)}")
                 continue
         
+        # Скачать медиа-файлы (фото и 3D модели) всех товаров файла параллельно
+        try:
+            from app.services.media_service import MediaService
+            media_stats = MediaService.process_products_media(products, auto_download=True)
+        except Exception as e:
+            media_stats = {}
+            warnings.append(f"Ошибка при скачивании медиа-файлов - {str(e)}")
+        
+        for product_id, stats in media_stats.items():
+            row_num = row_numbers[product_id]
+            if stats['images_downloaded'] > 0:
+                warnings.append(f"Строка {row_num}: Скачано изображений: {stats['images_downloaded']}")
+            if stats['models_downloaded'] > 0:
+                warnings.append(f"Строка {row_num}: Скачано 3D моделей: {stats['models_downloaded']}")
+            for error in stats['errors']:
+                warnings.append(f"Строка {row_num}: {error}")
+        
+        # Автоматическая верификация (после скачивания медиа)
+        if auto_verify:
+            for product in products:
+                try:
+                    VerificationService.verify_product(product, user, sampler=sampler)
+                except Exception as e:
+                    warnings.append(f"Строка {row_numbers[product.id]}: Ошибка верификации - {str(e)}")
+        
         db.session.commit()
         
         return {
@@ -288,7 +303,7 @@ class ImportService:
             'total_rows': total_rows,
             'errors': errors,
             'warnings': warnings,
-            'products': [p.to_dict() for p in products]
+            'products': Product.to_dicts(products)
         }
     
     @staticmethod
@@ -341,7 +356,8 @@ class ImportService:
         return mapping
     
     @staticmethod
-    def _create_product_from_row(row_data, subcategory, column_mapping, reference_attributes, user):
+    def _create_product_from_row(row_data, subcategory, column_mapping, reference_attributes, user,
+                                 import_history_id=None, warnings=None):
         """
         Создать товар из строки данных
         
@@ -351,6 +367,8 @@ class ImportService:
             column_mapping: Маппинг колонок на коды атрибутов
             reference_attributes: Словарь эталонных атрибутов {code: SubcategoryAttribute}
             user: Пользователь
+            import_history_id: ID записи ImportHistory
+            warnings: Список для предупреждений о значениях, не соответствующих типу
         
         Returns:
             Product: Созданный товар
@@ -401,7 +419,6 @@ class ImportService:
         # Проверить дублирование по артикулу производителя
         if manufacturer_sku:
             from app.models.attribute import Attribute
-            from app.models.product import ProductAttributeValue
             
             # Найти атрибут артикула производителя
             manufacturer_attr = Attribute.query.filter(
@@ -445,6 +462,7 @@ class ImportService:
             import_history_id=import_history_id  # Связь с файлом импорта
         )
         db.session.add(product)
+        db.session.flush()  # ID товара для истории статусов и значений атрибутов
         
         # Записать переход в статус in_progress
         history = ProductStatusHistory(
@@ -480,9 +498,10 @@ class ImportService:
             if not str_value:
                 continue
             
-            # Валидация типа данных
-            if not ImportService._validate_attribute_value(attribute, str_value):
-                continue  # Пропустить невалидные значения
+            # Валидация типа данных: значение сохраняется (верификация отметит его как invalid_type),
+            # чтобы данные поставщика не терялись при импорте
+            if not ImportService._validate_attribute_value(attribute, str_value) and warnings is not None:
+                warnings.append(f"Значение атрибута '{attribute.name}' не соответствует типу: {str_value}")
             
             # Создать или обновить значение атрибута
             pav = ProductAttributeValue.query.filter_by(
@@ -506,22 +525,6 @@ class ImportService:
     
     @staticmethod
     def _validate_attribute_value(attribute, value):
-        """Проверить значение атрибута на соответствие типу"""
-        try:
-            if attribute.type == AttributeType.NUMBER:
-                float(value)
-            elif attribute.type == AttributeType.BOOLEAN:
-                value.lower() in ['true', 'false', '1', '0', 'yes', 'no', 'да', 'нет']
-            elif attribute.type == AttributeType.DATE:
-                # Попробовать разные форматы даты
-                from dateutil import parser
-                parser.parse(value)
-            elif attribute.type == AttributeType.SELECT:
-                # Проверить, что значение есть в списке допустимых
-                allowed_values = [av.value for av in attribute.values.all()]
-                return value in allowed_values
-        except (ValueError, TypeError):
-            return False
-        
-        return True
+        """Проверить значение атрибута на соответствие типу (те же правила, что и при верификации)"""
+        return validator_registry.get_validator(attribute).check_type(value)
 
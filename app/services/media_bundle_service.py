@@ -0,0 +1,175 @@
+"""
+Потоковая выгрузка медиа-файлов в ZIP-архив
+
+Архив формируется на лету: файлы читаются блоками и сразу отдаются клиенту,
+без временных файлов и без накопления архива в памяти. Уже сжатые форматы
+(JPEG, PNG, WebP, GLB и т.п.) записываются без повторного сжатия (ZIP_STORED).
+Для больших архивов и файлов используется ZIP64. Файлы читаются потоком
+из хранилища медиа-файлов (локального или объектного).
+"""
+import re
+import time
+import zipfile
+from pathlib import Path
+from app import db
+from app.models.product import Product
+from app.models.product_media import ProductMedia, MediaType
+from app.utils.media_storage import get_storage
+from config import Config
+
+
+# Форматы, которые уже сжаты - повторное сжатие только тратит процессор
+STORED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.glb', '.fbx', '.3ds', '.zip', '.gz', '.mp4'
+}
+
+# Символы, недопустимые в части пути архива (разделители, диск Windows, управляющие)
+UNSAFE_NAME_CHARS = re.compile(r'[\\/:\x00-\x1f\x7f]')
+
+
+def safe_name(value, default='_'):
+    """
+    Часть пути в архиве из данных поставщика (артикул, имя файла)
+    
+    Разделители путей и управляющие символы заменяются на '_', имена '.' и '..'
+    не допускаются - при распаковке файл не может оказаться вне каталога архива.
+    """
+    name = UNSAFE_NAME_CHARS.sub('_', str(value or '')).strip()
+    if not name.strip('.'):
+        return default
+    return name
+
+
+class _ZipStream:
+    """Приемник данных ZipFile без поддержки seek: записанные байты забираются генератором"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def pop(self):
+        """Забрать накопленные байты"""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class MediaBundleService:
+    """Сервис выгрузки медиа-файлов архивом"""
+    
+    @staticmethod
+    def iter_zip(entries):
+        """
+        Сформировать ZIP-архив потоком
+        
+        Args:
+            entries: Итератор пар (имя в архиве, ключ файла в хранилище);
+                отсутствующие файлы пропускаются
+        
+        Yields:
+            bytes: Очередной фрагмент архива
+        """
+        stream = _ZipStream()
+        chunk_size = Config.MEDIA_BUNDLE_CHUNK_SIZE
+        storage = get_storage()
+        
+        with zipfile.ZipFile(stream, 'w', allowZip64=True) as archive:
+            for arcname, key in entries:
+                stored = storage.stat(key)
+                if stored is None:
+                    continue
+                zinfo = zipfile.ZipInfo(arcname, max(time.localtime(stored.mtime)[:6], (1980, 1, 1, 0, 0, 0)))
+                zinfo.external_attr = 0o100644 << 16
+                zinfo.file_size = stored.size
+                if Path(key).suffix.lower() in STORED_EXTENSIONS:
+                    zinfo.compress_type = zipfile.ZIP_STORED
+                else:
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                
+                # Размер известен заранее - ZipFile сам включит ZIP64 для больших файлов
+                try:
+                    source = storage.open(key)
+                except FileNotFoundError:
+                    continue
+                with source, archive.open(zinfo, 'w') as target:
+                    while True:
+                        chunk = source.read(chunk_size)
+                        if not chunk:
+                            break
+                        target.write(chunk)
+                        data = stream.pop()
+                        if data:
+                            yield data
+                
+                data = stream.pop()
+                if data:
+                    yield data
+        
+        # Центральный каталог архива
+        data = stream.pop()
+        if data:
+            yield data
+    
+    @staticmethod
+    def iter_media_entries(product_filter=None, product_ids=None):
+        """
+        Файлы медиа товаров для архива: <артикул>/<images|models>/<порядок>_<имя файла>
+        
+        Записи читаются пакетами по ProductMedia.id, поэтому в памяти не держится
+        список всех файлов выгрузки.
+        
+        Args:
+            product_filter: Условие SQLAlchemy на Product (например, товары импорта)
+            product_ids: Список ID товаров (обрабатывается частями)
+        
+        Yields:
+            tuple: (имя в архиве, ключ файла в хранилище)
+        """
+        if product_ids is not None:
+            ids = sorted(set(product_ids))
+            batch_size = Config.MEDIA_BUNDLE_BATCH_SIZE
+            filters = [Product.id.in_(ids[start:start + batch_size]) for start in range(0, len(ids), batch_size)]
+        else:
+            filters = [product_filter]
+        
+        names = set()
+        for condition in filters:
+            for row in MediaBundleService._iter_media_rows(condition):
+                folder = 'images' if row.media_type == MediaType.IMAGE else 'models'
+                sku = safe_name(row.sku, f'product_{row.product_id}')
+                arcname = f'{sku}/{folder}/{row.sort_order:02d}_{safe_name(row.file_name, "file")}'
+                if arcname in names:
+                    path = Path(arcname)
+                    arcname = f'{path.parent.as_posix()}/{path.stem}_{row.id}{path.suffix}'
+                names.add(arcname)
+                
+                yield arcname, row.file_path
+    
+    @staticmethod
+    def _iter_media_rows(condition):
+        """Записи медиа товаров по условию, пакетами по ProductMedia.id"""
+        batch_size = Config.MEDIA_BUNDLE_BATCH_SIZE
+        last_id = 0
+        while True:
+            rows = db.session.query(
+                ProductMedia.id,
+                ProductMedia.media_type,
+                ProductMedia.file_path,
+                ProductMedia.file_name,
+                ProductMedia.sort_order,
+                ProductMedia.product_id,
+                Product.sku
+            ).join(Product, ProductMedia.product_id == Product.id).filter(
+                condition,
+                ProductMedia.id > last_id
+            ).order_by(ProductMedia.id).limit(batch_size).all()
+            if not rows:
+                return
+            last_id = rows[-1].id
+            yield from rows
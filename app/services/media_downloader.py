@@ -0,0 +1,239 @@
+"""
+Параллельное скачивание медиа-файлов
+
+Файлы скачиваются в ограниченном пуле потоков. Каждый поток использует свою
+сессию requests с пулом keep-alive соединений, поэтому повторные запросы к хосту
+поставщика не открывают новое TCP/TLS соединение. Временные ошибки (сеть, таймаут,
+HTTP 429 и 5xx) повторяются с экспоненциальной задержкой; ограничения хостов
+(host_guard) действуют так же, как при последовательном скачивании.
+
+Тип файла определяется по сигнатуре первых байт (app.utils.media_sniffer),
+а лимиты MAX_IMAGE_SIZE/MAX_MODEL_SIZE проверяются во время записи, даже
+без заголовка Content-Length.
+"""
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from app.models.product_media import MediaType
+from app.services.media_service import MediaService
+from app.utils.host_guard import host_guard, is_host_error_status, HostUnavailableError
+from app.utils.media_sniffer import (
+    SNIFF_BYTES, MediaFormatError, sniff_media, image_size_from_header, glb_declared_length, parse_glb_stats
+)
+from config import Config
+
+
+# Расширения в URL, означающие тот же формат, что и определенный по содержимому
+SAME_FORMAT_EXTENSIONS = {('.jpg', '.jpeg'), ('.jpg', '.jpe')}
+
+
+class TransientDownloadError(Exception):
+    """Временная ошибка сервера (HTTP 429 или 5xx), запрос можно повторить"""
+
+
+class MediaDownloader:
+    """
+    Пул потоков для скачивания медиа-файлов
+    
+    Задание на скачивание - словарь с ключами product_id, sku, attribute_id,
+    attribute_code, url, media_type и sort_order. Результат - словарь задания,
+    дополненный sha256, file_path, file_name, file_size, mime_type, width, height,
+    model_stats, etag, last_modified и фактическим media_type (при успехе)
+    или error и transient (при ошибке).
+    
+    Если в задании есть etag/last_modified, запрос условный; при HTTP 304
+    результат содержит not_modified=True и новые etag, last_modified (если переданы).
+    """
+    
+    def __init__(self, workers=None, retries=None, backoff=None, timeout=None):
+        """
+        Args:
+            workers: Количество потоков (по умолчанию Config.MEDIA_DOWNLOAD_WORKERS)
+            retries: Повторов при временной ошибке (по умолчанию Config.MEDIA_DOWNLOAD_RETRIES)
+            backoff: Начальная задержка перед повтором в секундах, удваивается с каждой попыткой
+            timeout: Таймауты (подключение, чтение) в секундах
+        """
+        self.workers = max(1, workers or Config.MEDIA_DOWNLOAD_WORKERS)
+        self.retries = Config.MEDIA_DOWNLOAD_RETRIES if retries is None else retries
+        self.backoff = Config.MEDIA_DOWNLOAD_BACKOFF if backoff is None else backoff
+        self.timeout = timeout or Config.MEDIA_DOWNLOAD_TIMEOUT
+        
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def close(self):
+        """Закрыть сессии всех потоков"""
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions.clear()
+    
+    def download_all(self, tasks):
+        """
+        Скачать файлы в пуле потоков
+        
+        Args:
+            tasks: Список заданий на скачивание
+        
+        Yields:
+            dict: Результат скачивания в порядке завершения
+        """
+        if not tasks:
+            return
+        
+        if self.workers == 1 or len(tasks) == 1:
+            for task in tasks:
+                yield self.fetch(task)
+            return
+        
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(tasks)), thread_name_prefix='media-download') as executor:
+            futures = [executor.submit(self.fetch, task) for task in tasks]
+            for future in as_completed(futures):
+                yield future.result()
+    
+    def fetch(self, task):
+        """
+        Скачать один файл с повторами при временных ошибках
+        
+        Returns:
+            dict: Результат скачивания
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._fetch_once(task)
+            except HostUnavailableError as e:
+                # Хост отключен после серии ошибок - повторить позже из очереди
+                return dict(task, error=e.reason, transient=True)
+            except (requests.ConnectionError, requests.Timeout, TransientDownloadError) as e:
+                if attempt >= self.retries:
+                    return dict(task, error=str(e) or type(e).__name__, transient=True)
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+            except Exception as e:
+                return dict(task, error=str(e), transient=False)
+    
+    def _session(self):
+        """Сессия текущего потока (keep-alive соединения переиспользуются между файлами)"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+    
+    def _fetch_once(self, task):
+        """
+        Одна попытка скачивания файла
+        
+        Тип и формат определяются по первым байтам, размер проверяется по мере
+        чтения: файл неподдерживаемого формата или больше лимита не попадает в хранилище.
+        """
+        url = task['url']
+        
+        # Условный запрос при перепроверке уже скачанного файла
+        headers = {}
+        if task.get('etag'):
+            headers['If-None-Match'] = task['etag']
+        if task.get('last_modified'):
+            headers['If-Modified-Since'] = task['last_modified']
+        
+        # Скачать файл (с учетом состояния хоста: отключение после ошибок, лимит запросов)
+        with host_guard.slot(url) as guarded:
+            with self._session().get(url, timeout=self.timeout, stream=True, headers=headers or None) as response:
+                if is_host_error_status(guarded.observe(response).status_code):
+                    raise TransientDownloadError(f'HTTP {response.status_code}')
+                if response.status_code == 304 and headers:
+                    return dict(
+                        task,
+                        not_modified=True,
+                        etag=response.headers.get('ETag'),
+                        last_modified=response.headers.get('Last-Modified'),
+                    )
+                response.raise_for_status()
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                
+                # Определить тип и формат по содержимому
+                url_name = os.path.basename(urlparse(url).path)
+                url_ext = Path(url_name).suffix.lower()
+                chunks = response.iter_content(chunk_size=Config.MEDIA_DOWNLOAD_CHUNK_SIZE)
+                head = self._read_head(chunks)
+                media_type, ext, mime_type = sniff_media(head, url_ext)
+                
+                # Проверить размер файла по заголовкам до начала записи
+                max_size = Config.MAX_IMAGE_SIZE if media_type == MediaType.IMAGE else Config.MAX_MODEL_SIZE
+                declared_size = int(response.headers.get('Content-Length') or 0)
+                if ext == '.glb':
+                    declared_size = max(declared_size, glb_declared_length(head) or 0)
+                if declared_size > max_size:
+                    raise ValueError(f'размер файла {declared_size} превышает {max_size}')
+                
+                # Имя файла для отображения (расширение - по фактическому формату)
+                if not url_name or '.' not in url_name:
+                    file_name = f"{task['sku']}_{task['attribute_code']}_{task['sort_order']}{ext}"
+                elif url_ext == ext or (ext, url_ext) in SAME_FORMAT_EXTENSIONS:
+                    file_name = url_name
+                else:
+                    file_name = f'{Path(url_name).stem}{ext}'
+                
+                header = {'width': None, 'height': None, 'model_stats': None}
+                if media_type == MediaType.IMAGE:
+                    header['width'], header['height'] = image_size_from_header(head) or (None, None)
+                
+                def inspect(path):
+                    # GLB: параметры модели и проверка полноты файла по заголовку
+                    if ext == '.glb':
+                        stats = parse_glb_stats(path)
+                        if stats['length'] != path.stat().st_size:
+                            raise MediaFormatError(
+                                f"размер GLB {path.stat().st_size} не совпадает с заголовком ({stats['length']})"
+                            )
+                        header['model_stats'] = stats
+                
+                # Сохранить в хранилище по хэшу содержимого (SHA-256 считается при записи)
+                media_folder = Config.IMAGES_FOLDER if media_type == MediaType.IMAGE else Config.MODELS_FOLDER
+                sha256, file_path, file_size = MediaService._store_stream(
+                    media_folder, ext, itertools.chain([head], chunks), max_size=max_size, inspect=inspect
+                )
+        
+        return dict(
+            task,
+            media_type=media_type,
+            sha256=sha256,
+            file_path=file_path,
+            file_name=file_name,
+            file_size=file_size,
+            mime_type=mime_type,
+            model_format=ext if media_type == MediaType.THREE_D_MODEL else None,
+            etag=etag,
+            last_modified=last_modified,
+            **header
+        )
+    
+    @staticmethod
+    def _read_head(chunks):
+        """Прочитать из потока первые SNIFF_BYTES байт (или весь файл, если он меньше)"""
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= SNIFF_BYTES:
+                break
+        return head
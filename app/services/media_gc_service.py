@@ -0,0 +1,251 @@
+"""
+Сборка мусора в хранилище медиа-файлов
+
+Файлы хранилища сравниваются с живыми ссылками ProductMedia: папки изображений
+и 3D моделей обходятся потоково (os.scandir или постраничный список объектов
+S3, без построения списка всех файлов),
+найденные файлы проверяются пакетами по уникальному индексу media_blobs.sha256
+и индексу product_media.blob_id. Файлы старого формата (без хэша в имени)
+сверяются с путями записей без blob, загруженными за один проход по БД.
+
+Удаляются только файлы старше Config.MEDIA_GC_GRACE_SECONDS: файл, только что
+перенесенный в хранилище, может еще не иметь зафиксированной записи в БД.
+"""
+import os
+import time
+from pathlib import Path, PurePath
+from sqlalchemy import and_, func, or_
+from app import db
+from app.models.product import ProductAttributeValue
+from app.models.product_media import ProductMedia, MediaBlob
+from app.utils.media_response import CONTENT_ADDRESSED_NAME
+from app.utils.media_storage import get_storage, LocalStorage
+from config import Config
+
+
+class MediaGCService:
+    """Сервис очистки хранилища медиа-файлов"""
+    
+    @staticmethod
+    def collect(grace_seconds=None, dry_run=False):
+        """
+        Удалить файлы хранилища, на которые не ссылается ни одна запись ProductMedia
+        
+        Записи MediaBlob без живых ссылок удаляются вместе с файлами и уменьшенными
+        копиями. Незавершенные временные файлы скачивания (.tmp) удаляются по тому же сроку.
+        Локальный кэш объектного хранилища сокращается до Config.MEDIA_CACHE_MAX_BYTES.
+        
+        Args:
+            grace_seconds: Минимальный возраст удаляемого файла (по умолчанию Config.MEDIA_GC_GRACE_SECONDS)
+            dry_run: Только подсчитать, ничего не удалять
+        
+        Returns:
+            dict: scanned, orphaned, deleted, kept_recent, blobs_deleted, reclaimed_bytes, errors,
+                  cache_freed_bytes
+        """
+        grace = Config.MEDIA_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+        cutoff = time.time() - grace
+        result = {
+            'scanned': 0, 'orphaned': 0, 'deleted': 0, 'kept_recent': 0,
+            'blobs_deleted': 0, 'reclaimed_bytes': 0, 'errors': 0, 'cache_freed_bytes': 0,
+        }
+        
+        # Один проход по БД: файлы записей, сохраненных до перехода на хранилище по хэшу
+        storage = get_storage()
+        legacy_paths = {
+            storage.normalize(file_path)
+            for (file_path,) in db.session.query(ProductMedia.file_path).filter(
+                ProductMedia.blob_id.is_(None)
+            ).yield_per(Config.MEDIA_GC_BATCH_SIZE)
+        }
+        
+        batch = []
+        for folder in (Config.IMAGES_FOLDER, Config.MODELS_FOLDER):
+            for entry in MediaGCService._scan(storage, Path(folder)):
+                result['scanned'] += 1
+                batch.append(entry)
+                if len(batch) >= Config.MEDIA_GC_BATCH_SIZE:
+                    MediaGCService._sweep_batch(batch, legacy_paths, cutoff, dry_run, result)
+                    batch = []
+        if batch:
+            MediaGCService._sweep_batch(batch, legacy_paths, cutoff, dry_run, result)
+        
+        if not dry_run:
+            result['cache_freed_bytes'] = storage.trim_cache()['bytes']
+        
+        return result
+    
+    @staticmethod
+    def prune_stale_media(dry_run=False):
+        """
+        Удалить записи ProductMedia, URL которых больше не указан в атрибуте товара
+        
+        После повторного импорта с новыми ссылками старые файлы остаются у товара
+        рядом с новыми. Записи без атрибута (загруженные вручную) не затрагиваются.
+        Освобожденные файлы удаляются следующим вызовом collect().
+        
+        Returns:
+            int: Количество удаленных (при dry_run - найденных) записей
+        """
+        from app.services.media_service import MediaService
+        
+        pruned = 0
+        last_id = 0
+        while True:
+            media_list = ProductMedia.query.outerjoin(
+                ProductAttributeValue,
+                and_(
+                    ProductAttributeValue.product_id == ProductMedia.product_id,
+                    ProductAttributeValue.attribute_id == ProductMedia.attribute_id
+                )
+            ).filter(
+                ProductMedia.id > last_id,
+                ProductMedia.attribute_id.isnot(None),
+                ProductMedia.original_url.isnot(None),
+                or_(
+                    ProductAttributeValue.id.is_(None),
+                    func.trim(ProductAttributeValue.value) != ProductMedia.original_url
+                )
+            ).order_by(ProductMedia.id).limit(Config.MEDIA_GC_BATCH_SIZE).all()
+            if not media_list:
+                break
+            
+            last_id = media_list[-1].id
+            pruned += len(media_list)
+            if not dry_run:
+                for media in media_list:
+                    MediaService.release_media(media)
+                db.session.commit()
+        
+        return pruned
+    
+    @staticmethod
+    def _scan(storage, folder):
+        """
+        Потоковый обход папки хранилища и локальных временных файлов скачивания
+        
+        Yields:
+            tuple: (ключ файла или путь временного файла, размер, время изменения, признак временного файла)
+        """
+        from app.services.media_service import MediaService
+        
+        for stored in storage.iter_files(MediaService._to_stored_path(folder)):
+            yield stored.key, stored.size, stored.mtime, False
+        
+        # Временные файлы всегда пишутся на локальный диск (MediaService._store_stream)
+        tmp_folder = folder / '.tmp'
+        if not tmp_folder.is_dir():
+            return
+        stack = [tmp_folder]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(Path(entry.path))
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            yield entry.path, stat.st_size, stat.st_mtime, True
+            except FileNotFoundError:
+                continue
+    
+    @staticmethod
+    def _sweep_batch(batch, legacy_paths, cutoff, dry_run, result):
+        """Найти и удалить неиспользуемые файлы пакета"""
+        storage = get_storage()
+        # Файлы записей без blob используются всегда
+        batch = [
+            entry for entry in batch
+            if entry[3] or storage.normalize(entry[0]) not in legacy_paths
+        ]
+        
+        # Хэши содержимого из имен файлов (оригиналы и уменьшенные копии)
+        hashes = {}
+        for key, size, mtime, is_tmp in batch:
+            match = None if is_tmp else CONTENT_ADDRESSED_NAME.match(PurePath(key).stem)
+            if match:
+                hashes[key] = match.group('sha256')
+        
+        # Живые blob: есть хотя бы одна запись ProductMedia (индексы по sha256 и blob_id)
+        live = set()
+        orphan_blobs = {}
+        if hashes:
+            rows = db.session.query(
+                MediaBlob.id,
+                MediaBlob.sha256,
+                db.session.query(ProductMedia.id).filter(ProductMedia.blob_id == MediaBlob.id).exists()
+            ).filter(MediaBlob.sha256.in_(set(hashes.values()))).all()
+            for blob_id, sha256, referenced in rows:
+                if referenced:
+                    live.add(sha256)
+                else:
+                    orphan_blobs[sha256] = blob_id
+        
+        orphans = []
+        for key, size, mtime, is_tmp in batch:
+            if key in hashes and hashes[key] in live:
+                continue
+            result['orphaned'] += 1
+            if mtime > cutoff:
+                result['kept_recent'] += 1
+                continue
+            orphans.append((key, size, is_tmp))
+        
+        if not orphans:
+            return
+        
+        # Записи blob удаляются, только если ссылки так и не появились: строки блокируются
+        # и проверяются в той же транзакции (MediaService._get_or_create_blob блокирует
+        # ту же строку, прежде чем сослаться на нее); файлы удаляются до фиксации,
+        # пока блокировка удерживается
+        deletable = {hashes[key] for key, _, _ in orphans if key in hashes}
+        blob_ids = [blob_id for sha256, blob_id in orphan_blobs.items() if sha256 in deletable]
+        if blob_ids and not dry_run:
+            deleted_ids = {
+                blob_id for (blob_id,) in db.session.query(MediaBlob.id).filter(
+                    MediaBlob.id.in_(blob_ids),
+                    ~db.session.query(ProductMedia.id).filter(ProductMedia.blob_id == MediaBlob.id).exists()
+                ).with_for_update().all()
+            }
+            if deleted_ids:
+                MediaBlob.query.filter(MediaBlob.id.in_(deleted_ids)).delete(synchronize_session=False)
+            result['blobs_deleted'] += len(deleted_ids)
+            # Ссылка появилась после первой проверки - файлы blob не трогать
+            deletable -= {sha256 for sha256, blob_id in orphan_blobs.items() if blob_id not in deleted_ids}
+        elif blob_ids:
+            result['blobs_deleted'] += len(blob_ids)
+        
+        for key, size, is_tmp in orphans:
+            if key in hashes and hashes[key] not in deletable:
+                continue
+            if not dry_run:
+                try:
+                    if is_tmp:
+                        os.unlink(key)
+                    else:
+                        storage.delete(key)
+                except FileNotFoundError:
+                    continue
+                except Exception:
+                    result['errors'] += 1
+                    continue
+                if not is_tmp and isinstance(storage, LocalStorage):
+                    MediaGCService._remove_empty_parents(storage.local_path(key).parent)
+            result['deleted'] += 1
+            result['reclaimed_bytes'] += size
+        
+        if not dry_run:
+            db.session.commit()
+    
+    @staticmethod
+    def _remove_empty_parents(directory):
+        """Удалить опустевшие папки шардов (ab/cd) внутри хранилища"""
+        roots = {Path(Config.IMAGES_FOLDER).resolve(), Path(Config.MODELS_FOLDER).resolve()}
+        directory = directory.resolve()
+        while directory not in roots and directory.name != '.tmp' and any(root in directory.parents for root in roots):
+            try:
+                directory.rmdir()
+            except OSError:
+                return
+            directory = directory.parent
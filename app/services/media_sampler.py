@@ -0,0 +1,177 @@
+"""
+Выборочная проверка удаленных медиа-файлов при массовой верификации
+
+Для поставщиков, у которых все изображения лежат на одном CDN по одному шаблону,
+проверяется случайная выборка URL по каждой паре (поставщик, хост). Остальные
+изображения принимаются как "sampled-ok", пока доля ошибок в выборке не превысит
+порог - после этого пара переводится на полную проверку.
+
+Задание верификации в пуле процессов ведет общую статистику: каждая часть
+получает накопленные счетчики (export_stats), а ее результаты добавляются
+к статистике задания (merge_stats).
+"""
+import math
+import random
+import threading
+from config import Config
+
+
+class SampleStats:
+    """Статистика выборки для пары (поставщик, хост)"""
+    
+    def __init__(self):
+        self.checked = 0  # Проверено по сети
+        self.not_accessible = 0  # Недоступно
+        self.low_resolution = 0  # Доступно, но низкое разрешение
+        self.skipped = 0  # Принято без проверки (sampled-ok)
+        self.escalated = False  # Переведено на полную проверку
+    
+    @property
+    def failures(self):
+        """Количество проверенных изображений с ошибками"""
+        return self.not_accessible + self.low_resolution
+    
+    def as_tuple(self):
+        """Счетчики для передачи между процессами"""
+        return (self.checked, self.not_accessible, self.low_resolution, self.skipped, self.escalated)
+
+
+class MediaSampler:
+    """Выборочная проверка медиа-файлов по парам (поставщик, хост)"""
+    
+    def __init__(self, sample_rate=0.05, min_sample=30, max_failure_rate=0.05, confidence_z=1.96, rng=None):
+        """
+        Args:
+            sample_rate: Доля URL, проверяемых после набора минимальной выборки
+            min_sample: Сколько первых URL каждой пары проверяется всегда
+            max_failure_rate: Доля ошибок в выборке, после которой включается полная проверка
+            confidence_z: Квантиль нормального распределения для доверительной границы (1.96 = 95%)
+            rng: Генератор случайных чисел (для воспроизводимости в тестах)
+        """
+        self.sample_rate = sample_rate
+        self.min_sample = min_sample
+        self.max_failure_rate = max_failure_rate
+        self.confidence_z = confidence_z
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._stats = {}
+    
+    @classmethod
+    def from_config(cls, enabled=None):
+        """
+        Создать выборку с параметрами из конфигурации
+        
+        Args:
+            enabled: Принудительно включить/выключить (None - по Config.MEDIA_SAMPLING_ENABLED)
+        
+        Returns:
+            MediaSampler или None, если выборочная проверка выключена
+        """
+        if enabled is None:
+            enabled = Config.MEDIA_SAMPLING_ENABLED
+        if not enabled:
+            return None
+        return cls(
+            sample_rate=Config.MEDIA_SAMPLE_RATE,
+            min_sample=Config.MEDIA_SAMPLE_MIN,
+            max_failure_rate=Config.MEDIA_SAMPLE_MAX_FAILURE_RATE
+        )
+    
+    def should_check(self, key):
+        """Нужно ли проверять очередной URL пары key по сети"""
+        with self._lock:
+            stats = self._stats.setdefault(key, SampleStats())
+            if stats.escalated or stats.checked < self.min_sample:
+                return True
+            return self._rng.random() < self.sample_rate
+    
+    def record(self, key, accessible, resolution_ok=True):
+        """Зафиксировать результат сетевой проверки URL пары key"""
+        with self._lock:
+            stats = self._stats.setdefault(key, SampleStats())
+            stats.checked += 1
+            if not accessible:
+                stats.not_accessible += 1
+            elif not resolution_ok:
+                stats.low_resolution += 1
+            
+            self._update_escalation(stats)
+    
+    def _update_escalation(self, stats):
+        """Перевести пару на полную проверку, если доля ошибок в выборке превысила порог"""
+        if not stats.escalated and stats.checked >= self.min_sample:
+            if stats.failures / stats.checked > self.max_failure_rate:
+                stats.escalated = True
+    
+    def export_stats(self, since=None):
+        """
+        Счетчики пар для передачи между процессами
+        
+        Args:
+            since: Прежний результат export_stats - вернуть только прирост с того момента
+        
+        Returns:
+            dict: {key: (checked, not_accessible, low_resolution, skipped, escalated)}
+        """
+        since = since or {}
+        result = {}
+        with self._lock:
+            for key, stats in self._stats.items():
+                values = stats.as_tuple()
+                base = since.get(key)
+                if base is not None:
+                    values = tuple(value - old for value, old in zip(values[:4], base[:4])) + (values[4],)
+                if any(values[:4]) or values[4]:
+                    result[key] = values
+        return result
+    
+    def merge_stats(self, stats):
+        """Добавить счетчики (прирост из export_stats другого процесса)"""
+        with self._lock:
+            for key, values in stats.items():
+                current = self._stats.setdefault(key, SampleStats())
+                current.checked += values[0]
+                current.not_accessible += values[1]
+                current.low_resolution += values[2]
+                current.skipped += values[3]
+                current.escalated = current.escalated or values[4]
+                self._update_escalation(current)
+    
+    def mark_skipped(self, key):
+        """Зафиксировать URL, принятый без проверки"""
+        with self._lock:
+            self._stats.setdefault(key, SampleStats()).skipped += 1
+    
+    def summary(self, key):
+        """
+        Оценка качества пары key по выборке
+        
+        Returns:
+            dict: checked, skipped, failures, escalated, доли доступных изображений
+                  и изображений с достаточным разрешением с нижней доверительной границей
+        """
+        with self._lock:
+            stats = self._stats.get(key) or SampleStats()
+            accessible = stats.checked - stats.not_accessible
+            resolution_ok = accessible - stats.low_resolution
+            return {
+                'checked': stats.checked,
+                'skipped': stats.skipped,
+                'failures': stats.failures,
+                'escalated': stats.escalated,
+                'accessible_rate': accessible / stats.checked if stats.checked else None,
+                'accessible_lower_bound': self._wilson_lower_bound(accessible, stats.checked),
+                'resolution_rate': resolution_ok / accessible if accessible else None,
+                'resolution_lower_bound': self._wilson_lower_bound(resolution_ok, accessible),
+            }
+    
+    def _wilson_lower_bound(self, successes, total):
+        """Нижняя граница доверительного интервала Уилсона для доли успехов"""
+        if not total:
+            return 0.0
+        z = self.confidence_z
+        p = successes / total
+        denominator = 1 + z * z / total
+        center = p + z * z / (2 * total)
+        margin = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total))
+        return max(0.0, (center - margin) / denominator)
@@ -1,17 +1,29 @@
 """
 Сервис для работы с медиа-файлами товаров
 """
+import hashlib
 import os
-import requests
+import tempfile
+from datetime import datetime, timedelta
 from pathlib import Path
 from urllib.parse import urlparse
+from sqlalchemy import delete, event, exists, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
 from app import db
-from app.models.product_media import ProductMedia, MediaType
+from app.models.product_media import ProductMedia, MediaType, MediaBlob, MediaDerivative, MediaDownloadRetry
 from app.models.attribute import AttributeType
+from app.services.media_usage_service import MediaUsageService
+from app.utils.host_guard import host_guard, HostUnavailableError
+from app.utils.media_storage import get_storage
 from config import Config
-from PIL import Image
+from flask import current_app, has_app_context
 import io
 
+
+# Ключ session.info: blob и файлы, освобожденные в текущей транзакции
+RELEASED_MEDIA_KEY = 'released_media'
+
 class MediaService:
     """Сервис для скачивания и хранения медиа-файлов"""
     
@@ -44,97 +56,41 @@ class MediaService:
             url: URL медиа-файла
             sort_order: Порядок сортировки
         
+        Размеры и проверка целостности изображения заполняются отдельно
+        (ImageAnalysisService.analyze_media), чтобы декодирование не выполнялось в потоке запроса.
+        Недавно скачанный URL и уже сохраненное содержимое повторно не сохраняются.
+        
         Returns:
             ProductMedia: Созданный объект медиа-файла или None при ошибке
         """
+        from app.models.attribute import Attribute
+        from app.services.media_downloader import MediaDownloader
+        
         try:
             # Определить тип медиа-файла
             media_type = MediaService._detect_media_type(url)
             if not media_type:
                 return None
             
-            # Скачать файл
-            response = requests.get(url, timeout=30, stream=True)
-            response.raise_for_status()
-            
-            # Получить информацию о файле
-            content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
-            file_size = int(response.headers.get('Content-Length', 0))
-            
-            # Проверить размер файла
-            if media_type == MediaType.IMAGE and file_size > Config.MAX_IMAGE_SIZE:
-                return None
-            if media_type == MediaType.THREE_D_MODEL and file_size > Config.MAX_MODEL_SIZE:
-                return None
-            
-            # Определить расширение и имя файла
-            parsed_url = urlparse(url)
-            original_filename = os.path.basename(parsed_url.path)
-            if not original_filename or '.' not in original_filename:
-                # Сгенерировать имя файла
-                ext = MediaService._get_extension_from_mime(content_type, media_type)
-                original_filename = f"{product.sku}_{attribute_code}_{sort_order}{ext}"
-            
-            # Создать директории
-            if media_type == MediaType.IMAGE:
-                media_folder = Config.IMAGES_FOLDER
-            else:
-                media_folder = Config.MODELS_FOLDER
-            
-            # Создать папки, если их нет
-            os.makedirs(media_folder, exist_ok=True)
-            
-            # Сгенерировать уникальное имя файла
-            file_name = MediaService._generate_unique_filename(media_folder, original_filename, product.id)
-            file_path = media_folder / file_name
-            
-            # Сохранить файл
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            # Получить реальный размер файла
-            actual_size = file_path.stat().st_size
-            
-            # Получить атрибут
-            from app.models.attribute import Attribute
             attribute = Attribute.query.filter_by(code=attribute_code).first()
-            
-            # Метаданные для изображений
-            width = None
-            height = None
-            if media_type == MediaType.IMAGE:
-                try:
-                    with Image.open(file_path) as img:
-                        width, height = img.size
-                except Exception:
-                    pass
-            
-            # Метаданные для 3D моделей
-            model_format = None
-            if media_type == MediaType.THREE_D_MODEL:
-                model_format = Path(file_name).suffix.lower()
-            
-            # Создать запись в БД
-            media = ProductMedia(
-                product_id=product.id,
-                attribute_id=attribute.id if attribute else None,
-                media_type=media_type,
-                original_url=url,
-                file_path=str(file_path.relative_to(Config.basedir)),
-                file_name=file_name,
-                file_size=actual_size,
-                mime_type=content_type,
-                width=width,
-                height=height,
-                model_format=model_format,
-                sort_order=sort_order
+            task = MediaService._download_task(
+                product.id, product.sku, attribute.id if attribute else None, attribute_code,
+                url, media_type, sort_order
             )
+            tasks, over_quota = MediaUsageService.check_quota([task])
+            with MediaDownloader(workers=1) as downloader:
+                downloaded, failed = MediaService._download_tasks(tasks, downloader)
+            failed += over_quota
+            
+            if failed:
+                from flask import current_app
+                if current_app:
+                    current_app.logger.error(f"Ошибка при скачивании медиа-файла {url}: {failed[0]['error']}")
+                return None
             
-            db.session.add(media)
             db.session.commit()
             
-            return media
+            return downloaded[0]
             
         except Exception as e:
             from flask import current_app
@@ -142,6 +98,29 @@ class MediaService:
                 current_app.logger.error(f"Ошибка при скачивании медиа-файла {url}: {str(e)}", exc_info=True)
             return None
     
+    @staticmethod
+    def get_media_path(file_path):
+        """
+        Получить локальный путь к сохраненному медиа-файлу по ProductMedia.file_path
+        
+        Для объектного хранилища файл скачивается в локальный кэш; для проверки
+        наличия файла без скачивания используется media_exists().
+        """
+        return get_storage().local_path(file_path)
+    
+    @staticmethod
+    def media_exists(file_path):
+        """Есть ли файл в хранилище медиа-файлов"""
+        return get_storage().exists(file_path)
+    
+    @staticmethod
+    def _to_stored_path(file_path):
+        """Путь для сохранения в БД: относительно корня проекта, если файл внутри него"""
+        try:
+            return str(Path(file_path).relative_to(Config.basedir))
+        except ValueError:
+            return str(file_path)
+    
     @staticmethod
     def _detect_media_type(url):
         """Определить тип медиа-файла по URL"""
@@ -155,12 +134,14 @@ class MediaService:
         # Ключевые слова для 3D моделей
         model_keywords = ['3d', 'model', 'glb', 'gltf', 'obj', 'fbx', 'dae', '3ds', 'stl']
         
-        if ext in MediaService.MODEL_EXTENSIONS or any(kw in url_lower for kw in model_keywords):
-            return MediaType.THREE_D_MODEL
-        
+        # Расширение важнее ключевых слов (model_photo.jpg - изображение).
+        # Это лишь предварительная оценка: при скачивании тип уточняется по содержимому
         if ext in MediaService.IMAGE_EXTENSIONS:
             return MediaType.IMAGE
         
+        if ext in MediaService.MODEL_EXTENSIONS or any(kw in url_lower for kw in model_keywords):
+            return MediaType.THREE_D_MODEL
+        
         # По умолчанию считаем изображением
         return MediaType.IMAGE
     
@@ -191,22 +172,169 @@ class MediaService:
             return '.glb'
     
     @staticmethod
-    def _generate_unique_filename(folder, filename, product_id):
-        """Сгенерировать уникальное имя файла"""
-        base_name = Path(filename).stem
-        ext = Path(filename).suffix
-        
-        counter = 1
-        while True:
-            if counter == 1:
-                new_filename = f"{product_id}_{base_name}{ext}"
+    def _blob_path(folder, sha256, ext):
+        """Путь файла в хранилище: <папка>/ab/cd/<sha256><ext>"""
+        return folder / sha256[:2] / sha256[2:4] / f'{sha256}{ext}'
+    
+    @staticmethod
+    def _store_stream(folder, ext, chunks, max_size=None, inspect=None):
+        """
+        Записать поток в хранилище с адресацией по содержимому
+        
+        Данные пишутся во временный файл с одновременным подсчетом SHA-256,
+        затем файл переносится в хранилище (app.utils.media_storage) под ключом
+        по хэшу. Если такое содержимое уже сохранено, временный файл удаляется. При превышении max_size или ошибке
+        проверки запись прерывается, временный файл удаляется.
+        
+        Args:
+            folder: Папка хранилища (изображения или 3D модели)
+            ext: Расширение файла
+            chunks: Итератор блоков данных
+            max_size: Максимальный размер в байтах
+            inspect: Проверка записанного временного файла до переноса (функция от пути)
+        
+        Returns:
+            tuple: (sha256, Path файла (ключ хранилища - MediaService._to_stored_path), размер в байтах)
+        """
+        tmp_folder = folder / '.tmp'
+        os.makedirs(tmp_folder, exist_ok=True)
+        
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_name = tempfile.mkstemp(dir=tmp_folder)
+        tmp_path = Path(tmp_name)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise ValueError(f'размер файла превышает {max_size}')
+                    digest.update(chunk)
+                    f.write(chunk)
+            
+            if inspect is not None:
+                inspect(tmp_path)
+            
+            sha256 = digest.hexdigest()
+            file_path = MediaService._blob_path(folder, sha256, ext)
+            key = MediaService._to_stored_path(file_path)
+            storage = get_storage()
+            if storage.exists(key):
+                tmp_path.unlink()
+                # Файл снова используется - сборка мусора отсчитывает срок хранения заново
+                storage.touch(key)
             else:
-                new_filename = f"{product_id}_{base_name}_{counter}{ext}"
+                storage.put_file(key, tmp_path)
+        except BaseException:
+            # Не оставлять частично записанный файл
+            tmp_path.unlink(missing_ok=True)
+            raise
+        
+        return sha256, file_path, size
+    
+    @staticmethod
+    def release_media(media):
+        """
+        Удалить запись медиа-файла товара (без фиксации)
+        
+        Счетчик ссылок blob уменьшается. Файл, на который после фиксации не осталось
+        ссылок, удаляется из хранилища вместе с уменьшенными копиями (purge_released).
+        """
+        blob = media.blob
+        db.session.delete(media)
+        MediaService._release_file(media.file_path, blob)
+    
+    @staticmethod
+    def release_products_media(product_ids):
+        """
+        Освободить медиа-файлы удаляемых товаров (без фиксации)
+        
+        Удаляет записи ProductMedia и очереди повторного скачивания товаров,
+        уменьшая счетчики ссылок blob; файлы без ссылок удаляются после фиксации.
+        """
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        
+        for media in ProductMedia.query.options(joinedload(ProductMedia.blob)).filter(
+            ProductMedia.product_id.in_(product_ids)
+        ).all():
+            MediaService.release_media(media)
+        MediaDownloadRetry.query.filter(
+            MediaDownloadRetry.product_id.in_(product_ids)
+        ).delete(synchronize_session=False)
+    
+    @staticmethod
+    def _release_file(file_path, blob):
+        """
+        Освободить файл записи (без фиксации)
+        
+        Счетчик ссылок blob уменьшается в SQL. Файлы не удаляются до фиксации:
+        при откате записи остались бы без файлов. Blob (или файл записи без blob)
+        запоминается в сессии и проверяется после фиксации.
+        """
+        released = db.session.info.setdefault(RELEASED_MEDIA_KEY, {'blobs': set(), 'files': set()})
+        if blob is None:
+            released['files'].add(file_path)
+            return
+        
+        MediaService._change_ref_count(blob, -1)
+        released['blobs'].add(blob.id)
+    
+    @staticmethod
+    def _change_ref_count(blob, delta):
+        """
+        Изменить счетчик ссылок blob одним UPDATE (без чтения-изменения-записи в Python)
+        
+        Returns:
+            bool: Строка blob существует (не удалена параллельной очисткой)
+        """
+        statement = update(MediaBlob).where(MediaBlob.id == blob.id).values(ref_count=MediaBlob.ref_count + delta)
+        if delta < 0:
+            statement = statement.where(MediaBlob.ref_count > 0)
+        return db.session.execute(statement).rowcount > 0
+    
+    @staticmethod
+    def purge_released(bind, released):
+        """
+        Удалить освобожденные файлы, на которые после фиксации не осталось ссылок
+        
+        Строки blob блокируются (SELECT ... FOR UPDATE) и проверяются на ссылки в той же
+        транзакции, что и удаление: запись, параллельно ссылающаяся на blob, либо уже
+        заблокировала строку (blob остается), либо после удаления не найдет его
+        (_get_or_create_blob). Ошибка удаления файла не мешает удалению остальных -
+        оставшиеся файлы удалит MediaGCService.collect.
+        
+        Args:
+            bind: Engine базы данных
+            released: {'blobs': ID MediaBlob, 'files': пути записей без blob}
+        """
+        from app.services.image_derivative_service import ImageDerivativeService
+        
+        blobs = MediaBlob.__table__
+        media = ProductMedia.__table__
+        storage = get_storage()
+        with bind.begin() as connection:
+            unreferenced = ~exists().where(media.c.blob_id == blobs.c.id)
+            rows = connection.execute(
+                select(blobs.c.id, blobs.c.file_path).where(blobs.c.id.in_(released['blobs']), unreferenced).with_for_update()
+            ).all() if released['blobs'] else []
             
-            if not (folder / new_filename).exists():
-                return new_filename
+            files = set(released['files'])
+            if files:
+                files -= set(connection.execute(select(media.c.file_path).where(media.c.file_path.in_(files))).scalars())
+            files.update(file_path for _, file_path in rows)
+            
+            for file_path in files:
+                try:
+                    storage.delete(file_path)
+                    ImageDerivativeService.remove_files(file_path)
+                except Exception as e:
+                    if has_app_context():
+                        current_app.logger.warning(f"Не удалось удалить медиа-файл {file_path}: {str(e)}")
             
-            counter += 1
+            if rows:
+                connection.execute(delete(blobs).where(blobs.c.id.in_([blob_id for blob_id, _ in rows])))
     
     @staticmethod
     def process_product_media(product, auto_download=True):
@@ -220,85 +348,652 @@ class MediaService:
         Returns:
             dict: Статистика обработки
         """
-        from app.models.attribute import AttributeType
+        return MediaService.process_products_media([product], auto_download)[product.id]
+    
+    @staticmethod
+    def process_products_media(products, auto_download=True):
+        """
+        Обработать медиа-файлы нескольких товаров (например, всех товаров импорта)
+        
+        Файлы скачиваются параллельно (MediaDownloader), записи ProductMedia
+        сохраняются одной фиксацией на пакет из Config.MEDIA_DOWNLOAD_BATCH_SIZE товаров.
+        Файлы, не скачанные из-за временных ошибок, ставятся в очередь повторного
+        скачивания (retry_failed_downloads).
+        
+        Args:
+            products: Список объектов Product
+            auto_download: Автоматически скачивать файлы
+        
+        Returns:
+            dict: {product_id: статистика обработки}
+        """
+        from app.services.media_downloader import MediaDownloader
+        
+        stats = {}
+        batch_size = Config.MEDIA_DOWNLOAD_BATCH_SIZE
+        with MediaDownloader() as downloader:
+            for start in range(0, len(products), batch_size):
+                stats.update(MediaService._process_media_batch(
+                    products[start:start + batch_size], auto_download, downloader
+                ))
+        return stats
+    
+    @staticmethod
+    def retry_failed_downloads(limit=None):
+        """
+        Повторить скачивание файлов из очереди, время повтора которых наступило
+        
+        После Config.MEDIA_RETRY_MAX_ATTEMPTS неудачных попыток файл удаляется из очереди.
+        
+        Args:
+            limit: Максимум файлов за вызов (по умолчанию Config.MEDIA_DOWNLOAD_BATCH_SIZE)
+        
+        Returns:
+            dict: processed, downloaded, failed, dropped
+        """
+        from app.models.attribute import Attribute
+        from app.models.product import Product
+        from app.services.media_downloader import MediaDownloader
+        
+        rows = db.session.query(MediaDownloadRetry, Product.sku, Attribute.code).join(
+            Product, MediaDownloadRetry.product_id == Product.id
+        ).outerjoin(
+            Attribute, MediaDownloadRetry.attribute_id == Attribute.id
+        ).filter(
+            MediaDownloadRetry.next_attempt_at <= datetime.utcnow()
+        ).order_by(MediaDownloadRetry.next_attempt_at, MediaDownloadRetry.id).limit(
+            limit or Config.MEDIA_DOWNLOAD_BATCH_SIZE
+        ).all()
+        
+        result = {'processed': len(rows), 'downloaded': 0, 'failed': 0, 'dropped': 0}
+        if not rows:
+            return result
+        
+        tasks = [
+            MediaService._download_task(
+                retry.product_id, sku, retry.attribute_id, code or 'media',
+                retry.url, retry.media_type, retry.sort_order
+            )
+            for retry, sku, code in rows
+        ]
+        product_ids = {task['product_id'] for task in tasks}
+        
+        # Превышение квоты поставщика - постоянная ошибка, файл удаляется из очереди
+        tasks, over_quota = MediaUsageService.check_quota(tasks)
+        with MediaDownloader() as downloader:
+            downloaded, failed = MediaService._download_tasks(tasks, downloader)
+        failed += over_quota
+        result['downloaded'] = len(downloaded)
+        result['failed'] = len(failed)
+        result['dropped'] = MediaService._sync_retries(product_ids, downloaded, failed)
+        db.session.commit()
+        
+        MediaService._analyze_downloaded(downloaded)
+        MediaService._schedule_derivatives(downloaded)
+        return result
+    
+    @staticmethod
+    def refresh_media(limit=None):
+        """
+        Перепроверить URL скачанных медиа-файлов и обновить изменившиеся
+        
+        Записи, не проверявшиеся дольше Config.MEDIA_REFRESH_INTERVAL, обрабатываются
+        пакетами. Запрос условный (If-None-Match / If-Modified-Since по сохраненным
+        ETag и Last-Modified): неизменившийся файл не скачивается (HTTP 304).
+        Если сервер вернул файл с тем же содержимым, меняются только отметки проверки.
+        Для изменившегося файла запись переводится на новый blob, метаданные
+        и уменьшенные копии создаются заново, старый файл освобождается.
+        
+        Args:
+            limit: Максимум записей за вызов (по умолчанию все, время проверки которых наступило)
+        
+        Returns:
+            dict: checked, unchanged, updated, failed
+        """
+        from app.services.media_downloader import MediaDownloader
+        
+        result = {'checked': 0, 'unchanged': 0, 'updated': 0, 'failed': 0}
+        started_at = datetime.utcnow()
+        threshold = started_at - timedelta(seconds=Config.MEDIA_REFRESH_INTERVAL)
+        
+        with MediaDownloader() as downloader:
+            while limit is None or result['checked'] < limit:
+                batch_size = Config.MEDIA_REFRESH_BATCH_SIZE
+                if limit is not None:
+                    batch_size = min(batch_size, limit - result['checked'])
+                
+                # Проверенные в этом вызове записи получают checked_at >= started_at и не выбираются повторно
+                media_list = ProductMedia.query.options(joinedload(ProductMedia.blob)).filter(
+                    ProductMedia.original_url.isnot(None),
+                    or_(ProductMedia.checked_at.is_(None), ProductMedia.checked_at < threshold)
+                ).order_by(
+                    ProductMedia.checked_at.asc().nullsfirst(), ProductMedia.id
+                ).limit(batch_size).all()
+                if not media_list:
+                    break
+                
+                batch = MediaService._refresh_media_batch(media_list, downloader)
+                for key in result:
+                    result[key] += batch[key]
+        
+        return result
+    
+    @staticmethod
+    def _refresh_media_batch(media_list, downloader):
+        """Условная перепроверка пакета записей ProductMedia"""
+        from app.models.product import Product
+        
+        result = {'checked': len(media_list), 'unchanged': 0, 'updated': 0, 'failed': 0}
+        skus = dict(db.session.query(Product.id, Product.sku).filter(
+            Product.id.in_({media.product_id for media in media_list})
+        ).all())
+        
+        # Один запрос на URL; валидаторы - от записи, проверенной последней
+        media_by_url = {}
+        for media in media_list:
+            media_by_url.setdefault(media.original_url, []).append(media)
+        tasks = []
+        for url, url_media in media_by_url.items():
+            media = max(url_media, key=lambda m: (m.checked_at or m.downloaded_at, m.id))
+            task = MediaService._download_task(
+                media.product_id, skus.get(media.product_id, 'media'), media.attribute_id, 'media',
+                url, media.media_type, media.sort_order
+            )
+            task.update(etag=media.etag, last_modified=media.last_modified)
+            tasks.append(task)
+        
+        now = datetime.utcnow()
+        blobs = {}
+        updated = []
+        for download in downloader.download_all(tasks):
+            url_media = media_by_url[download['url']]
+            for media in url_media:
+                media.checked_at = now
+            
+            if download.get('error'):
+                result['failed'] += len(url_media)
+                continue
+            
+            if download.get('not_modified'):
+                for media in url_media:
+                    media.etag = download['etag'] or media.etag
+                    media.last_modified = download['last_modified'] or media.last_modified
+                result['unchanged'] += len(url_media)
+                continue
+            
+            blob = MediaService._get_or_create_blob(download, blobs)
+            if blob is None:
+                result['failed'] += len(url_media)
+                continue
+            source = MediaService._analysis_source(blob)
+            for media in url_media:
+                media.etag = download['etag']
+                media.last_modified = download['last_modified']
+                if media.blob_id is not None and media.blob_id == blob.id:
+                    result['unchanged'] += 1
+                    continue
+                MediaService._replace_blob(media, blob, download, source)
+                updated.append(media)
+                result['updated'] += 1
+        
+        db.session.commit()
+        
+        MediaService._analyze_downloaded(updated)
+        MediaService._schedule_derivatives(updated)
+        return result
+    
+    @staticmethod
+    def _replace_blob(media, blob, download, source=None):
+        """Перевести запись на новое содержимое (без фиксации)"""
+        old_blob = media.blob
+        old_file_path = media.file_path
+        
+        media.blob = blob
+        MediaService._change_ref_count(blob, 1)
+        media.media_type = blob.media_type
+        media.file_path = blob.file_path
+        media.file_name = download['file_name']
+        media.file_size = blob.file_size
+        media.mime_type = blob.mime_type
+        media.model_format = download['model_format']
+        media.model_stats = download.get('model_stats')
+        media.width = download.get('width')
+        media.height = download.get('height')
+        media.downloaded_at = datetime.utcnow()
+        
+        # Результаты анализа и уменьшенные копии относились к старому содержимому
+        media.is_valid = None
+        media.is_blank = None
+        media.aspect_ratio = None
+        media.analysis_error = None
+        media.analyzed_at = None
+        media.set_phash(None)
+        if source is not None and source.analyzed_at is not None:
+            media.width = source.width
+            media.height = source.height
+            media.is_valid = source.is_valid
+            media.is_blank = source.is_blank
+            media.aspect_ratio = source.aspect_ratio
+            media.analysis_error = source.analysis_error
+            media.analyzed_at = source.analyzed_at
+            media.set_phash(source.phash)
+        MediaDerivative.query.filter_by(media_id=media.id).delete()
+        
+        MediaService._release_file(old_file_path, old_blob)
+    
+    @staticmethod
+    def _process_media_batch(products, auto_download, downloader):
+        """Найти и скачать медиа-файлы пакета товаров"""
+        from app.models.attribute import Attribute
+        from app.models.product import ProductAttributeValue
         
         stats = {
-            'images_found': 0,
-            'images_downloaded': 0,
-            'models_found': 0,
-            'models_downloaded': 0,
-            'errors': []
+            product.id: {
+                'images_found': 0,
+                'images_downloaded': 0,
+                'models_found': 0,
+                'models_downloaded': 0,
+                'errors': []
+            }
+            for product in products
         }
+        skus = {product.id: product.sku for product in products}
         
-        # Найти все атрибуты типа IMAGE
-        image_attrs = [pav for pav in product.attribute_values.all() 
-                      if pav.attribute.type == AttributeType.IMAGE]
+        # Значения атрибутов типа IMAGE и URL (могут быть 3D модели) всех товаров пакета
+        values = db.session.query(
+            ProductAttributeValue.product_id,
+            ProductAttributeValue.attribute_id,
+            ProductAttributeValue.value,
+            Attribute.code,
+            Attribute.type
+        ).join(Attribute, ProductAttributeValue.attribute_id == Attribute.id).filter(
+            ProductAttributeValue.product_id.in_(skus),
+            Attribute.type.in_([AttributeType.IMAGE, AttributeType.URL])
+        ).order_by(ProductAttributeValue.product_id, ProductAttributeValue.id).all()
         
-        # Найти все атрибуты типа URL (могут быть 3D модели)
-        url_attrs = [pav for pav in product.attribute_values.all() 
-                    if pav.attribute.type == AttributeType.URL]
+        # Уже скачанные файлы
+        existing = set(db.session.query(
+            ProductMedia.product_id, ProductMedia.attribute_id, ProductMedia.original_url
+        ).filter(ProductMedia.product_id.in_(skus)).all())
         
-        # Обработать изображения
-        for pav in image_attrs:
-            if not pav.value or not pav.value.strip():
+        tasks = []
+        skipped = []
+        for product_id, attribute_id, value, attribute_code, attribute_type in values:
+            url = (value or '').strip()
+            if not url:
                 continue
             
-            stats['images_found'] += 1
+            product_stats = stats[product_id]
+            if attribute_type == AttributeType.IMAGE:
+                media_type = MediaType.IMAGE
+                product_stats['images_found'] += 1
+                sort_order = product_stats['images_found']
+            elif MediaService._detect_media_type(url) == MediaType.THREE_D_MODEL:
+                media_type = MediaType.THREE_D_MODEL
+                product_stats['models_found'] += 1
+                sort_order = product_stats['models_found']
+            else:
+                continue
             
-            # Проверить, не скачан ли уже этот файл
-            existing = ProductMedia.query.filter_by(
-                product_id=product.id,
-                attribute_id=pav.attribute_id,
-                original_url=pav.value.strip()
-            ).first()
+            if not auto_download or (product_id, attribute_id, url) in existing:
+                continue
             
-            if existing:
+            task = MediaService._download_task(
+                product_id, skus[product_id], attribute_id, attribute_code, url, media_type, sort_order
+            )
+            try:
+                host_guard.check(url)
+            except HostUnavailableError as e:
+                kind = 'изображения' if media_type == MediaType.IMAGE else '3D модели'
+                product_stats['errors'].append(f"Скачивание {kind} пропущено ({e.reason}): {url}")
+                skipped.append(dict(task, error=e.reason, transient=True))
+                continue
+            tasks.append(task)
+        
+        if not tasks and not skipped:
+            return stats
+        
+        # Квоты поставщиков на медиа-файлы проверяются до скачивания
+        tasks, over_quota = MediaUsageService.check_quota(tasks)
+        for result in over_quota:
+            kind = 'изображения' if result['media_type'] == MediaType.IMAGE else '3D модели'
+            stats[result['product_id']]['errors'].append(f"Скачивание {kind} пропущено ({result['error']}): {result['url']}")
+        
+        downloaded, failed = MediaService._download_tasks(tasks, downloader)
+        for media in downloaded:
+            key = 'images_downloaded' if media.media_type == MediaType.IMAGE else 'models_downloaded'
+            stats[media.product_id][key] += 1
+        for result in failed:
+            kind = 'изображение' if result['media_type'] == MediaType.IMAGE else '3D модель'
+            stats[result['product_id']]['errors'].append(f"Не удалось скачать {kind}: {result['url']}")
+        
+        MediaService._sync_retries(list(skus), downloaded, failed + skipped + over_quota)
+        db.session.commit()
+        
+        # Анализ скачанных изображений в пуле процессов (размеры, целостность, пустые изображения)
+        try:
+            MediaService._analyze_downloaded(downloaded, raise_errors=True)
+        except Exception as e:
+            for product_id in {media.product_id for media in downloaded if media.media_type == MediaType.IMAGE}:
+                stats[product_id]['errors'].append(f"Ошибка анализа изображений: {str(e)}")
+        
+        MediaService._schedule_derivatives(downloaded)
+        
+        return stats
+    
+    @staticmethod
+    def _download_task(product_id, sku, attribute_id, attribute_code, url, media_type, sort_order):
+        """Задание на скачивание для MediaDownloader"""
+        return {
+            'product_id': product_id,
+            'sku': sku,
+            'attribute_id': attribute_id,
+            'attribute_code': attribute_code,
+            'url': url,
+            'media_type': media_type,
+            'sort_order': sort_order,
+        }
+    
+    @staticmethod
+    def _download_tasks(tasks, downloader):
+        """
+        Скачать файлы заданий и добавить записи ProductMedia в сессию (без фиксации)
+        
+        Каждый URL скачивается один раз, даже если он встречается у многих товаров
+        (например, общее фото цветовых вариантов). URL, скачанный не раньше
+        Config.MEDIA_URL_REUSE_SECONDS назад, не скачивается: запись ссылается на тот же blob.
+        
+        Returns:
+            tuple: (список созданных ProductMedia, список результатов с ошибками)
+        """
+        tasks_by_url = {}
+        for task in tasks:
+            tasks_by_url.setdefault(task['url'], []).append(task)
+        
+        downloaded = []
+        failed = []
+        
+        # Недавно скачанные URL
+        recent = MediaService._recent_media_by_url(list(tasks_by_url))
+        for url, source in recent.items():
+            for task in tasks_by_url.pop(url):
+                media = MediaService._media_from_blob(
+                    task, source.blob, source.file_name, source.model_format,
+                    source=source, downloaded_at=source.downloaded_at,
+                    header={
+                        'width': source.width, 'height': source.height, 'model_stats': source.model_stats,
+                        'etag': source.etag, 'last_modified': source.last_modified,
+                    }
+                )
+                downloaded.append(media)
+        
+        blobs = {}
+        sources = {}
+        unique_tasks = [url_tasks[0] for url_tasks in tasks_by_url.values()]
+        for result in downloader.download_all(unique_tasks):
+            url_tasks = tasks_by_url[result['url']]
+            if result.get('error'):
+                failed.extend(
+                    dict(task, error=result['error'], transient=result['transient']) for task in url_tasks
+                )
                 continue
             
-            if auto_download:
-                media = MediaService.download_and_save_media(
-                    product, 
-                    pav.attribute.code, 
-                    pav.value.strip(),
-                    sort_order=stats['images_found']
+            blob = MediaService._get_or_create_blob(result, blobs)
+            if blob is None:
+                failed.extend(
+                    dict(task, error='файл удален во время сохранения', transient=True) for task in url_tasks
                 )
-                if media:
-                    stats['images_downloaded'] += 1
-                else:
-                    stats['errors'].append(f"Не удалось скачать изображение: {pav.value}")
+                continue
+            if blob.id not in sources:
+                sources[blob.id] = MediaService._analysis_source(blob)
+            for task in url_tasks:
+                media = MediaService._media_from_blob(
+                    task, blob, result['file_name'], result['model_format'],
+                    source=sources[blob.id], header=result
+                )
+                downloaded.append(media)
+        
+        return downloaded, failed
+    
+    @staticmethod
+    def _recent_media_by_url(urls):
+        """
+        Записи ProductMedia с недавно скачанными URL
         
-        # Обработать URL (проверить на 3D модели)
-        for pav in url_attrs:
-            if not pav.value or not pav.value.strip():
+        Returns:
+            dict: {url: ProductMedia} (последняя запись с существующим файлом)
+        """
+        if not urls or not Config.MEDIA_URL_REUSE_SECONDS:
+            return {}
+        
+        since = datetime.utcnow() - timedelta(seconds=Config.MEDIA_URL_REUSE_SECONDS)
+        rows = ProductMedia.query.options(joinedload(ProductMedia.blob)).filter(
+            ProductMedia.original_url.in_(urls),
+            ProductMedia.blob_id.isnot(None),
+            ProductMedia.downloaded_at >= since
+        ).order_by(ProductMedia.downloaded_at.desc(), ProductMedia.id.desc()).all()
+        
+        recent = {}
+        for media in rows:
+            if media.original_url in recent:
+                continue
+            if MediaService.media_exists(media.blob.file_path):
+                recent[media.original_url] = media
+        return recent
+    
+    @staticmethod
+    def _get_or_create_blob(result, blobs):
+        """
+        Получить или создать MediaBlob по результату скачивания
+        
+        Строка blob блокируется до фиксации, чтобы очистка (purge_released,
+        MediaGCService) не удалила ее, пока на нее создаются ссылки.
+        
+        Args:
+            result: Результат MediaDownloader
+            blobs: Кэш {sha256: MediaBlob} текущей обработки
+        
+        Returns:
+            MediaBlob или None, если файл удален параллельной очисткой
+            после скачивания (скачивание нужно повторить)
+        """
+        sha256 = result['sha256']
+        if sha256 in blobs:
+            return blobs[sha256]
+        blob = MediaBlob.query.filter_by(sha256=sha256).with_for_update().populate_existing().first()
+        
+        if blob is None:
+            blob = MediaBlob(
+                sha256=sha256,
+                media_type=result['media_type'],
+                file_path=MediaService._to_stored_path(result['file_path']),
+                file_size=result['file_size'],
+                mime_type=result['mime_type'],
+                ref_count=0
+            )
+            try:
+                with db.session.begin_nested():
+                    db.session.add(blob)
+            except IntegrityError:
+                # Такое же содержимое одновременно сохранено другим процессом
+                blob = MediaBlob.query.filter_by(sha256=sha256).one()
+        
+        stored_path = MediaService._to_stored_path(result['file_path'])
+        if blob.file_path != stored_path:
+            # То же содержимое уже хранится под другим расширением
+            get_storage().delete(stored_path)
+        
+        # Очистка могла удалить файл между сохранением и блокировкой строки
+        if not MediaService.media_exists(blob.file_path):
+            return None
+        
+        blobs[sha256] = blob
+        return blob
+    
+    @staticmethod
+    def _analysis_source(blob):
+        """Проанализированная запись с тем же содержимым (результаты анализа копируются)"""
+        if blob.id is None:
+            return None
+        return ProductMedia.query.filter(
+            ProductMedia.blob_id == blob.id,
+            ProductMedia.analyzed_at.isnot(None)
+        ).first()
+    
+    @staticmethod
+    def _media_from_blob(task, blob, file_name, model_format, source=None, downloaded_at=None, header=None):
+        """
+        Запись ProductMedia задания, ссылающаяся на blob (добавляется в сессию)
+        
+        Тип медиа берется из blob (определен по содержимому файла), а не из задания.
+        header - данные заголовка файла: width, height (изображения), model_stats (GLB)
+        и валидаторы ответа etag, last_modified (для условной перепроверки URL).
+        """
+        header = header or {}
+        media = ProductMedia(
+            product_id=task['product_id'],
+            attribute_id=task['attribute_id'],
+            media_type=blob.media_type,
+            blob=blob,
+            original_url=task['url'],
+            file_path=blob.file_path,
+            file_name=file_name,
+            file_size=blob.file_size,
+            mime_type=blob.mime_type,
+            model_format=model_format,
+            model_stats=header.get('model_stats'),
+            width=header.get('width'),
+            height=header.get('height'),
+            etag=header.get('etag'),
+            last_modified=header.get('last_modified'),
+            sort_order=task['sort_order'],
+            downloaded_at=downloaded_at or datetime.utcnow(),
+            checked_at=datetime.utcnow()
+        )
+        
+        # Содержимое уже анализировалось - повторный анализ не нужен
+        if source is not None and source.analyzed_at is not None:
+            media.width = source.width
+            media.height = source.height
+            media.is_valid = source.is_valid
+            media.is_blank = source.is_blank
+            media.aspect_ratio = source.aspect_ratio
+            media.analysis_error = source.analysis_error
+            media.analyzed_at = source.analyzed_at
+            media.set_phash(source.phash)
+        
+        db.session.add(media)
+        # UPDATE счетчика сохраняет запись до выполнения (autoflush) - она уже должна быть в сессии
+        MediaService._change_ref_count(blob, 1)
+        return media
+    
+    @staticmethod
+    def _sync_retries(product_ids, downloaded, failed):
+        """
+        Обновить очередь повторного скачивания товаров (без фиксации)
+        
+        Скачанные файлы и файлы с постоянными ошибками удаляются из очереди,
+        для временных ошибок увеличивается счетчик попыток и откладывается следующая попытка.
+        
+        Returns:
+            int: Сколько файлов удалено из очереди после исчерпания попыток
+        """
+        retries = {
+            (retry.product_id, retry.attribute_id, retry.url): retry
+            for retry in MediaDownloadRetry.query.filter(MediaDownloadRetry.product_id.in_(product_ids))
+        }
+        
+        for media in downloaded:
+            retry = retries.pop((media.product_id, media.attribute_id, media.original_url), None)
+            if retry is not None:
+                db.session.delete(retry)
+        
+        now = datetime.utcnow()
+        dropped = 0
+        for result in failed:
+            key = (result['product_id'], result['attribute_id'], result['url'])
+            retry = retries.get(key)
+            if not result['transient']:
+                if retry is not None:
+                    db.session.delete(retry)
+                    del retries[key]
                 continue
             
-            url = pav.value.strip()
-            media_type = MediaService._detect_media_type(url)
+            if retry is None:
+                retry = MediaDownloadRetry(
+                    product_id=result['product_id'],
+                    attribute_id=result['attribute_id'],
+                    url=result['url'],
+                    media_type=result['media_type'],
+                    sort_order=result['sort_order'],
+                    attempts=0
+                )
+                db.session.add(retry)
+                retries[key] = retry
             
-            if media_type == MediaType.THREE_D_MODEL:
-                stats['models_found'] += 1
-                
-                # Проверить, не скачан ли уже этот файл
-                existing = ProductMedia.query.filter_by(
-                    product_id=product.id,
-                    attribute_id=pav.attribute_id,
-                    original_url=url
-                ).first()
-                
-                if existing:
-                    continue
-                
-                if auto_download:
-                    media = MediaService.download_and_save_media(
-                        product,
-                        pav.attribute.code,
-                        url,
-                        sort_order=stats['models_found']
-                    )
-                    if media:
-                        stats['models_downloaded'] += 1
-                    else:
-                        stats['errors'].append(f"Не удалось скачать 3D модель: {url}")
+            retry.attempts += 1
+            retry.last_error = result['error'][:500]
+            if retry.attempts >= Config.MEDIA_RETRY_MAX_ATTEMPTS:
+                if retry in db.session.new:
+                    db.session.expunge(retry)
+                else:
+                    db.session.delete(retry)
+                del retries[key]
+                dropped += 1
+            else:
+                retry.next_attempt_at = now + timedelta(
+                    seconds=Config.MEDIA_RETRY_BASE_DELAY * 2 ** (retry.attempts - 1)
+                )
         
-        return stats
+        return dropped
+    
+    @staticmethod
+    def _analyze_downloaded(downloaded, raise_errors=False):
+        """Анализ скачанных изображений в пуле процессов"""
+        images = [
+            media for media in downloaded
+            if media.media_type == MediaType.IMAGE and media.analyzed_at is None
+        ]
+        if not images:
+            return
+        
+        from app.services.image_analysis_service import ImageAnalysisService
+        try:
+            ImageAnalysisService.analyze_media(images)
+        except Exception as e:
+            if raise_errors:
+                raise
+            from flask import current_app
+            current_app.logger.error(f"Ошибка анализа изображений: {str(e)}", exc_info=True)
+    
+    @staticmethod
+    def _schedule_derivatives(downloaded):
+        """Создать уменьшенные копии скачанных изображений в фоне"""
+        if not Config.IMAGE_DERIVATIVES_ON_DOWNLOAD:
+            return
+        
+        media_ids = [media.id for media in downloaded if media.media_type == MediaType.IMAGE]
+        if media_ids:
+            from app.services.image_derivative_service import ImageDerivativeService
+            ImageDerivativeService.start_generation(media_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _purge_released_media(session):
+    """Удалить файлы, освобожденные зафиксированной транзакцией"""
+    released = session.info.pop(RELEASED_MEDIA_KEY, None)
+    if not released or not (released['blobs'] or released['files']):
+        return
+    try:
+        MediaService.purge_released(session.get_bind(), released)
+    except Exception as e:
+        # Транзакция уже зафиксирована; оставшиеся файлы удалит сборка мусора
+        if has_app_context():
+            current_app.logger.error(f"Ошибка удаления освобожденных медиа-файлов: {str(e)}", exc_info=True)
+
 
+@event.listens_for(Session, 'after_transaction_end')
+def _forget_released_media(session, transaction):
+    """После отката освобождение отменяется (записи остались)"""
+    if transaction.parent is None:
+        session.info.pop(RELEASED_MEDIA_KEY, None)
@@ -0,0 +1,400 @@
+"""
+Учет объема медиа-файлов по поставщикам и квоты
+
+Счетчики MediaUsage (файлы и байты по поставщику, подкатегории и типу медиа)
+обновляются в той же транзакции, что и записи ProductMedia: обработчик
+before_flush собирает добавленные, измененные и удаленные записи и применяет
+разницу одним UPDATE на группу. При смене подкатегории или файла импорта
+(а значит, и поставщика) товара его медиа переносятся в новую группу.
+Массовые операции в обход ORM (query.delete()) счетчики не обновляют -
+для сверки есть MediaUsageService.rebuild().
+
+Поставщик товара определяется так же, как при верификации: по запросу данных
+файла импорта, иначе - по подкатегории.
+"""
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import delete, event, func, insert, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+from app import db
+from app.models.product import Product
+from app.models.product_media import ProductMedia, MediaUsage, MediaType
+
+
+class MediaUsageService:
+    """Сервис учета объема медиа-файлов"""
+    
+    GROUP_COLUMNS = {
+        'supplier': MediaUsage.supplier_id,
+        'subcategory': MediaUsage.subcategory_id,
+        'media_type': MediaUsage.media_type,
+    }
+    
+    @staticmethod
+    def usage(group_by=('supplier',), supplier_id=None, subcategory_id=None, media_type=None):
+        """
+        Объем медиа-файлов с группировкой
+        
+        Args:
+            group_by: Поля группировки: supplier, subcategory, media_type
+            supplier_id, subcategory_id, media_type: Фильтры
+        
+        Returns:
+            list: dict с полями группировки, file_count и total_bytes
+        """
+        columns = [MediaUsageService.GROUP_COLUMNS[name] for name in group_by]
+        query = db.session.query(
+            *columns,
+            func.coalesce(func.sum(MediaUsage.file_count), 0),
+            func.coalesce(func.sum(MediaUsage.total_bytes), 0)
+        )
+        if supplier_id is not None:
+            query = query.filter(MediaUsage.supplier_id == supplier_id)
+        if subcategory_id is not None:
+            query = query.filter(MediaUsage.subcategory_id == subcategory_id)
+        if media_type is not None:
+            query = query.filter(MediaUsage.media_type == media_type)
+        if columns:
+            query = query.group_by(*columns).order_by(*columns)
+        
+        result = []
+        for row in query.all():
+            item = {}
+            for name, value in zip(group_by, row):
+                item[f'{name}_id' if name != 'media_type' else name] = value.value if isinstance(value, MediaType) else value
+            item['file_count'] = int(row[-2])
+            item['total_bytes'] = int(row[-1])
+            result.append(item)
+        return result
+    
+    @staticmethod
+    def supplier_usage(supplier_ids):
+        """
+        Объем медиа-файлов поставщиков
+        
+        Returns:
+            dict: {supplier_id: (file_count, total_bytes)}
+        """
+        rows = db.session.query(
+            MediaUsage.supplier_id,
+            func.sum(MediaUsage.file_count),
+            func.sum(MediaUsage.total_bytes)
+        ).filter(MediaUsage.supplier_id.in_(list(supplier_ids))).group_by(MediaUsage.supplier_id).all()
+        return {supplier_id: (int(files or 0), int(size or 0)) for supplier_id, files, size in rows}
+    
+    @staticmethod
+    def check_quota(tasks):
+        """
+        Отобрать задания на скачивание, не превышающие квоты поставщиков
+        
+        Квота на количество файлов учитывает и задания текущего пакета.
+        Размер файла до скачивания неизвестен, поэтому по квоте на объем
+        скачивание останавливается, когда объем уже достиг квоты.
+        
+        Returns:
+            tuple: (допустимые задания, отклоненные задания с error и transient=False)
+        """
+        from app.models.supplier import Supplier
+        
+        if not tasks:
+            return tasks, []
+        
+        scopes = MediaUsageService.product_scopes({task['product_id'] for task in tasks})
+        supplier_ids = {scope[0] for scope in scopes.values() if scope[0] is not None}
+        quotas = {
+            supplier.id: supplier
+            for supplier in Supplier.query.filter(
+                Supplier.id.in_(supplier_ids),
+                or_(Supplier.media_quota_bytes.isnot(None), Supplier.media_quota_files.isnot(None))
+            )
+        } if supplier_ids else {}
+        if not quotas:
+            return tasks, []
+        
+        used = MediaUsageService.supplier_usage(quotas)
+        planned = defaultdict(int)
+        allowed = []
+        rejected = []
+        for task in tasks:
+            supplier_id = scopes.get(task['product_id'], (None, None))[0]
+            supplier = quotas.get(supplier_id)
+            if supplier is None:
+                allowed.append(task)
+                continue
+            
+            files, size = used.get(supplier_id, (0, 0))
+            if supplier.media_quota_bytes is not None and size >= supplier.media_quota_bytes:
+                error = f'превышена квота поставщика на объем медиа-файлов ({supplier.media_quota_bytes} байт)'
+            elif supplier.media_quota_files is not None and files + planned[supplier_id] >= supplier.media_quota_files:
+                error = f'превышена квота поставщика на количество медиа-файлов ({supplier.media_quota_files})'
+            else:
+                planned[supplier_id] += 1
+                allowed.append(task)
+                continue
+            rejected.append(dict(task, error=error, transient=False))
+        
+        return allowed, rejected
+    
+    @staticmethod
+    def product_scopes(product_ids, session=None):
+        """
+        Поставщик и подкатегория товаров
+        
+        Returns:
+            dict: {product_id: (supplier_id или None, subcategory_id)}
+        """
+        from app.models.data_request import DataRequest
+        from app.models.import_history import ImportHistory
+        
+        session = session or db.session
+        product_ids = [product_id for product_id in product_ids if product_id is not None]
+        if not product_ids:
+            return {}
+        
+        rows = session.execute(
+            select(Product.id, Product.subcategory_id, DataRequest.supplier_id)
+            .outerjoin(ImportHistory, Product.import_history_id == ImportHistory.id)
+            .outerjoin(DataRequest, ImportHistory.data_request_id == DataRequest.id)
+            .where(Product.id.in_(product_ids))
+        ).all()
+        
+        fallback = MediaUsageService._subcategory_suppliers(
+            {subcategory_id for _, subcategory_id, supplier_id in rows if supplier_id is None}, session
+        )
+        return {
+            product_id: (supplier_id if supplier_id is not None else fallback.get(subcategory_id), subcategory_id)
+            for product_id, subcategory_id, supplier_id in rows
+        }
+    
+    @staticmethod
+    def rebuild():
+        """
+        Пересчитать счетчики по записям ProductMedia (одним запросом INSERT ... SELECT)
+        
+        Returns:
+            int: Количество строк счетчиков
+        """
+        from app.models.data_request import DataRequest
+        from app.models.import_history import ImportHistory
+        from app.models.subcategory import supplier_subcategories
+        
+        # Поставщик подкатегории (с наименьшим ID) - если у файла импорта нет запроса данных
+        fallback = select(func.min(supplier_subcategories.c.supplier_id)).where(
+            supplier_subcategories.c.subcategory_id == Product.subcategory_id
+        ).scalar_subquery()
+        media = select(
+            func.coalesce(DataRequest.supplier_id, fallback).label('supplier_id'),
+            Product.subcategory_id.label('subcategory_id'),
+            ProductMedia.media_type.label('media_type'),
+            ProductMedia.id.label('media_id'),
+            func.coalesce(ProductMedia.file_size, 0).label('file_size')
+        ).join(Product, ProductMedia.product_id == Product.id).outerjoin(
+            ImportHistory, Product.import_history_id == ImportHistory.id
+        ).outerjoin(
+            DataRequest, ImportHistory.data_request_id == DataRequest.id
+        ).subquery()
+        totals = select(
+            media.c.supplier_id,
+            media.c.subcategory_id,
+            media.c.media_type,
+            func.count(media.c.media_id),
+            func.sum(media.c.file_size),
+            literal(datetime.utcnow(), MediaUsage.updated_at.type)
+        ).group_by(media.c.supplier_id, media.c.subcategory_id, media.c.media_type)
+        
+        # Строки счетчиков в сессии устаревают: удаляются из нее до пересчета
+        for usage in [obj for obj in db.session.identity_map.values() if isinstance(obj, MediaUsage)]:
+            db.session.expunge(usage)
+        table = MediaUsage.__table__
+        db.session.execute(delete(table))
+        db.session.execute(insert(table).from_select(
+            ['supplier_id', 'subcategory_id', 'media_type', 'file_count', 'total_bytes', 'updated_at'], totals
+        ))
+        db.session.commit()
+        return db.session.query(func.count(MediaUsage.id)).scalar()
+    
+    @staticmethod
+    def scopes_for(values, session=None):
+        """
+        Поставщик и подкатегория по новым значениям полей товаров (до их сохранения)
+        
+        Args:
+            values: {product_id: (subcategory_id, import_history_id)}
+        
+        Returns:
+            dict: {product_id: (supplier_id или None, subcategory_id)}
+        """
+        from app.models.data_request import DataRequest
+        from app.models.import_history import ImportHistory
+        
+        session = session or db.session
+        import_ids = {import_id for _, import_id in values.values() if import_id is not None}
+        import_suppliers = dict(session.execute(
+            select(ImportHistory.id, DataRequest.supplier_id)
+            .join(DataRequest, ImportHistory.data_request_id == DataRequest.id)
+            .where(ImportHistory.id.in_(list(import_ids)))
+        ).all()) if import_ids else {}
+        
+        fallback = MediaUsageService._subcategory_suppliers(
+            {subcategory_id for subcategory_id, import_id in values.values()
+             if import_suppliers.get(import_id) is None}, session
+        )
+        result = {}
+        for product_id, (subcategory_id, import_id) in values.items():
+            supplier_id = import_suppliers.get(import_id)
+            result[product_id] = (supplier_id if supplier_id is not None else fallback.get(subcategory_id), subcategory_id)
+        return result
+    
+    @staticmethod
+    def _subcategory_suppliers(subcategory_ids, session=None):
+        """Поставщик подкатегории (с наименьшим ID, если их несколько)"""
+        from app.models.subcategory import supplier_subcategories
+        
+        if not subcategory_ids:
+            return {}
+        session = session or db.session
+        table = supplier_subcategories.c
+        return dict(session.execute(
+            select(table.subcategory_id, func.min(table.supplier_id))
+            .where(table.subcategory_id.in_(list(subcategory_ids)))
+            .group_by(table.subcategory_id)
+        ).all())
+    
+    @staticmethod
+    def _apply(session, deltas):
+        """Применить изменения счетчиков {(supplier_id, subcategory_id, media_type): [файлы, байты]}"""
+        table = MediaUsage.__table__
+        connection = session.connection()
+        now = datetime.utcnow()
+        for (supplier_id, subcategory_id, media_type), (files, size) in deltas.items():
+            if not files and not size:
+                continue
+            supplier_condition = table.c.supplier_id.is_(None) if supplier_id is None else table.c.supplier_id == supplier_id
+            statement = update(table).where(
+                supplier_condition,
+                table.c.subcategory_id == subcategory_id,
+                table.c.media_type == media_type
+            ).values(
+                file_count=table.c.file_count + files,
+                total_bytes=table.c.total_bytes + size,
+                updated_at=now
+            )
+            if connection.execute(statement).rowcount:
+                continue
+            try:
+                with connection.begin_nested():
+                    connection.execute(insert(table).values(
+                        supplier_id=supplier_id, subcategory_id=subcategory_id, media_type=media_type,
+                        file_count=files, total_bytes=size, updated_at=now
+                    ))
+            except IntegrityError:
+                # Строку одновременно создал другой процесс
+                connection.execute(statement)
+
+
+def _changed_product_scopes(session):
+    """
+    Товары, у которых в сессии изменились подкатегория или файл импорта
+    
+    Returns:
+        dict: {product_id: (subcategory_id, import_history_id)} - новые значения
+    """
+    changed = {}
+    for product in session.dirty:
+        if not isinstance(product, Product) or product.id is None:
+            continue
+        if not any(get_history(product, key).has_changes()
+                   for key in ('subcategory_id', 'import_history_id', 'subcategory', 'import_file')):
+            continue
+        # Связь, назначенная объектом, попадает во внешний ключ только при сохранении
+        subcategory_id = product.subcategory_id
+        if get_history(product, 'subcategory').has_changes() and product.subcategory is not None:
+            subcategory_id = product.subcategory.id
+        import_history_id = product.import_history_id
+        if get_history(product, 'import_file').has_changes():
+            import_history_id = product.import_file.id if product.import_file is not None else None
+        changed[product.id] = (subcategory_id, import_history_id)
+    return changed
+
+
+def _media_scope_key(media, product_id):
+    """Товар записи медиа (для новой записи с product вместо product_id)"""
+    if product_id is None and media.product is not None:
+        return media.product.id
+    return product_id
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_media_usage(session, flush_context, instances):
+    """Изменить счетчики MediaUsage при добавлении, изменении и удалении ProductMedia"""
+    changes = []  # (product_id, media_type, файлы, байты)
+    for media in session.new:
+        if isinstance(media, ProductMedia):
+            changes.append((_media_scope_key(media, media.product_id), media.media_type, 1, media.file_size or 0))
+    
+    for media in session.deleted:
+        if isinstance(media, ProductMedia):
+            product_id = get_history(media, 'product_id').non_added()
+            media_type = get_history(media, 'media_type').non_added()
+            file_size = get_history(media, 'file_size').non_added()
+            changes.append((
+                product_id[0] if product_id else media.product_id,
+                media_type[0] if media_type else media.media_type,
+                -1,
+                -((file_size[0] if file_size else media.file_size) or 0)
+            ))
+    
+    for media in session.dirty:
+        if not isinstance(media, ProductMedia):
+            continue
+        histories = [get_history(media, key) for key in ('product_id', 'media_type', 'file_size')]
+        if not any(history.has_changes() for history in histories):
+            continue
+        old = [history.deleted[0] if history.deleted else history.unchanged[0] if history.unchanged else None
+               for history in histories]
+        changes.append((old[0], old[1], -1, -(old[2] or 0)))
+        changes.append((media.product_id, media.media_type, 1, media.file_size or 0))
+    
+    changes = [change for change in changes if change[0] is not None and change[1] is not None]
+    moved = _changed_product_scopes(session)
+    if not changes and not moved:
+        return
+    
+    with session.no_autoflush:
+        scopes = MediaUsageService.product_scopes({change[0] for change in changes} | set(moved), session)
+        deltas = defaultdict(lambda: [0, 0])
+        
+        # Смена подкатегории или поставщика товара: сохраненные медиа переносятся в новую группу,
+        # изменения медиа в этой же сессии учитываются уже в новой группе
+        new_scopes = MediaUsageService.scopes_for(moved, session) if moved else {}
+        new_scopes = {
+            product_id: scope for product_id, scope in new_scopes.items()
+            if scope[1] is not None and scope != scopes.get(product_id)
+        }
+        if new_scopes:
+            rows = session.execute(
+                select(
+                    ProductMedia.product_id,
+                    ProductMedia.media_type,
+                    func.count(ProductMedia.id),
+                    func.coalesce(func.sum(ProductMedia.file_size), 0)
+                ).where(ProductMedia.product_id.in_(list(new_scopes)))
+                .group_by(ProductMedia.product_id, ProductMedia.media_type)
+            ).all()
+            for product_id, media_type, files, size in rows:
+                old_scope, new_scope = scopes[product_id], new_scopes[product_id]
+                deltas[(old_scope[0], old_scope[1], media_type)][0] -= files
+                deltas[(old_scope[0], old_scope[1], media_type)][1] -= int(size)
+                deltas[(new_scope[0], new_scope[1], media_type)][0] += files
+                deltas[(new_scope[0], new_scope[1], media_type)][1] += int(size)
+            scopes.update(new_scopes)
+        
+        for product_id, media_type, files, size in changes:
+            scope = scopes.get(product_id)
+            if scope is None:
+                continue
+            deltas[(scope[0], scope[1], media_type)][0] += files
+            deltas[(scope[0], scope[1], media_type)][1] += size
+        MediaUsageService._apply(session, deltas)
@@ -0,0 +1,455 @@
+"""
+Колоночный расчет оценок полноты и качества для всей подкатегории
+
+Значения атрибутов товаров подкатегории загружаются одним запросом и разворачиваются
+в матрицу товар x атрибут. Маски заполненности, типа, правил и уникальности
+считаются по столбцам (атрибутам) векторными операциями pandas, а не по каждому
+товару и значению. Семантика совпадает с VerificationService._check_completeness
+и VerificationService._check_quality.
+
+Общая оценка и статус товара считаются здесь же по целым весам проверок и порогам
+из конфигурации. Пересчет "что если" с другими весами и порогами выполняется
+запросами по сохраненным оценкам проверок последних верификаций, без повторных проверок.
+"""
+from datetime import datetime
+import math
+import numpy as np
+import pandas as pd
+from sqlalchemy import case, func, insert, literal, select, update
+from app import db
+from app.models.attribute import Attribute, AttributeType
+from app.models.product import Product, ProductAttributeValue, ProductStatus
+from app.models.subcategory import Subcategory
+from app.models.verification import ProductVerification
+from app.models.workflow import ProductStatusHistory
+from app.utils.attribute_validators import validator_registry, BOOLEAN_VALUES
+from config import Config
+
+
+# Статусы, которые назначает верификация, в порядке убывания оценки
+SCORE_STATUSES = (ProductStatus.APPROVED, ProductStatus.TO_REVIEW, ProductStatus.REJECTED)
+
+
+def _map_unique(series, func):
+    """Применить функцию к каждому уникальному значению столбца (одна проверка на значение)"""
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    results = np.array([func(value) for value in uniques], dtype=bool)
+    return pd.Series(results[codes], index=series.index)
+
+
+def _to_float(value):
+    """float() как в AttributeValidator: NaN для нечисловых значений"""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+class ScoringService:
+    """Сервис расчета оценок верификации"""
+    
+    @staticmethod
+    def overall_score(completeness_score, quality_score, media_score, weights=None):
+        """
+        Общая оценка - взвешенная сумма оценок проверок
+        
+        Считается в целых числах, чтобы совпадать с пересчетом в SQL.
+        
+        Args:
+            weights: {'completeness', 'quality', 'media'} - целые веса (по умолчанию Config.VERIFICATION_WEIGHTS)
+        
+        Returns:
+            int: Оценка 0-100
+        """
+        weights = ScoringService._normalize_weights(weights)
+        total = (
+            completeness_score * weights['completeness'] +
+            quality_score * weights['quality'] +
+            media_score * weights['media']
+        )
+        return total // sum(weights.values())
+    
+    @staticmethod
+    def status_for_score(score, thresholds=None):
+        """
+        Статус товара по общей оценке
+        
+        Args:
+            thresholds: {'approve', 'review'} - пороги оценки (по умолчанию из конфигурации)
+        
+        Returns:
+            ProductStatus: APPROVED, TO_REVIEW или REJECTED
+        """
+        thresholds = ScoringService._normalize_thresholds(thresholds)
+        if score >= thresholds['approve']:
+            return ProductStatus.APPROVED
+        if score >= thresholds['review']:
+            return ProductStatus.TO_REVIEW
+        return ProductStatus.REJECTED
+    
+    @staticmethod
+    def rescore(weights=None, thresholds=None, subcategory_id=None, apply=False, user=None):
+        """
+        Пересчитать общие оценки и статусы по сохраненным оценкам проверок
+        
+        Используется последняя верификация каждого товара; проверки не выполняются заново.
+        Статусы меняются только у товаров в статусах, которые назначает оценка
+        (SCORE_STATUSES): черновики, товары в работе и экспортированные не затрагиваются.
+        
+        Args:
+            weights: Целые веса проверок (по умолчанию Config.VERIFICATION_WEIGHTS)
+            thresholds: Пороги статусов {'approve', 'review'} (по умолчанию из конфигурации)
+            subcategory_id: Ограничить товарами подкатегории
+            apply: False - только распределение (предпросмотр), True - обновить
+                   общие оценки последних верификаций и статусы товаров
+            user: Пользователь для истории статусов
+        
+        Returns:
+            dict: weights, thresholds, total, distribution (новое распределение статусов),
+                  current_distribution, changes ([{from, to, count}]), changed_count,
+                  avg_overall_score, applied
+        """
+        weights = ScoringService._normalize_weights(weights)
+        thresholds = ScoringService._normalize_thresholds(thresholds)
+        
+        latest, scored = ScoringService._scored_query(weights, subcategory_id)
+        new_status = case(
+            (scored.c.overall_score >= thresholds['approve'], ProductStatus.APPROVED.name),
+            (scored.c.overall_score >= thresholds['review'], ProductStatus.TO_REVIEW.name),
+            else_=ProductStatus.REJECTED.name
+        )
+        rows = db.session.execute(
+            select(
+                new_status, Product.status, func.count(), func.sum(scored.c.overall_score)
+            ).join(
+                Product, Product.id == scored.c.product_id
+            ).where(
+                Product.status.in_(SCORE_STATUSES)
+            ).group_by(new_status, Product.status)
+        ).all()
+        
+        result = {
+            'weights': weights,
+            'thresholds': thresholds,
+            'total': 0,
+            'distribution': {status.value: 0 for status in SCORE_STATUSES},
+            'current_distribution': {},
+            'changes': [],
+            'changed_count': 0,
+            'avg_overall_score': None,
+            'applied': False,
+        }
+        score_sum = 0
+        for status_name, current_status, count, overall_sum in rows:
+            status = ProductStatus[status_name]
+            result['total'] += count
+            result['distribution'][status.value] += count
+            result['current_distribution'][current_status.value] = (
+                result['current_distribution'].get(current_status.value, 0) + count
+            )
+            if status != current_status:
+                result['changes'].append({'from': current_status.value, 'to': status.value, 'count': count})
+                result['changed_count'] += count
+            score_sum += overall_sum or 0
+        if result['total']:
+            result['avg_overall_score'] = round(float(score_sum) / result['total'], 2)
+        
+        if apply:
+            ScoringService._apply_rescore(weights, thresholds, latest, scored, user)
+            result['applied'] = True
+        
+        return result
+    
+    @staticmethod
+    def _apply_rescore(weights, thresholds, latest, scored, user=None):
+        """Обновить общие оценки последних верификаций и статусы товаров (по одному запросу на статус)"""
+        now = datetime.utcnow()
+        comment = (
+            'Пересчет оценки верификации (веса {completeness}/{quality}/{media}, '.format(**weights) +
+            'пороги {approve}/{review})'.format(**thresholds)
+        )
+        old_status_value = case(*[(Product.status == status, status.value) for status in ProductStatus])
+        conditions = {
+            ProductStatus.APPROVED: scored.c.overall_score >= thresholds['approve'],
+            ProductStatus.TO_REVIEW: (scored.c.overall_score >= thresholds['review']) &
+                                     (scored.c.overall_score < thresholds['approve']),
+            ProductStatus.REJECTED: scored.c.overall_score < thresholds['review'],
+        }
+        
+        try:
+            for status, condition in conditions.items():
+                changed = (
+                    Product.id.in_(select(scored.c.product_id).where(condition)),
+                    Product.status.in_(SCORE_STATUSES),
+                    Product.status != status
+                )
+                
+                # История статусов до обновления (старый статус берется из товара)
+                db.session.execute(insert(ProductStatusHistory).from_select(
+                    ['product_id', 'old_status', 'new_status', 'changed_by_id', 'changed_at', 'comment'],
+                    select(
+                        Product.id,
+                        old_status_value,
+                        literal(status.value),
+                        literal(user.id if user else None, db.Integer),
+                        literal(now, db.DateTime),
+                        literal(comment)
+                    ).where(*changed)
+                ))
+                db.session.execute(
+                    update(Product).where(*changed).values(status=status, updated_at=now),
+                    execution_options={'synchronize_session': False}
+                )
+            
+            db.session.execute(
+                update(ProductVerification).where(
+                    ProductVerification.id.in_(select(latest.c.verification_id))
+                ).values(overall_score=ScoringService._overall_expression(ProductVerification, weights)),
+                execution_options={'synchronize_session': False}
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        # Загруженные в сессию товары и верификации перечитываются из БД
+        db.session.expire_all()
+    
+    @staticmethod
+    def _scored_query(weights, subcategory_id=None):
+        """
+        Подзапросы последних верификаций и их общих оценок с заданными весами
+        
+        Returns:
+            tuple: (latest: verification_id; scored: product_id, overall_score)
+        """
+        criteria = []
+        if subcategory_id is not None:
+            criteria.append(ProductVerification.product_id.in_(
+                select(Product.id).where(Product.subcategory_id == subcategory_id)
+            ))
+        latest = ProductVerification.latest_subquery(*criteria)
+        
+        scored = select(
+            ProductVerification.product_id,
+            ScoringService._overall_expression(ProductVerification, weights).label('overall_score')
+        ).join(
+            latest, ProductVerification.id == latest.c.verification_id
+        ).subquery()
+        
+        return latest, scored
+    
+    @staticmethod
+    def _overall_expression(verification, weights):
+        """SQL-выражение общей оценки (целочисленное деление, как в overall_score)"""
+        return (
+            verification.completeness_score * weights['completeness'] +
+            verification.quality_score * weights['quality'] +
+            verification.media_score * weights['media']
+        ) // sum(weights.values())
+    
+    @staticmethod
+    def _normalize_weights(weights=None):
+        """Проверить веса проверок: целые неотрицательные числа с положительной суммой"""
+        weights = {**Config.VERIFICATION_WEIGHTS, **(weights or {})}
+        normalized = {}
+        for key in ('completeness', 'quality', 'media'):
+            value = weights[key]
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                raise ValueError(f'Вес проверки {key} должен быть целым неотрицательным числом')
+            normalized[key] = value
+        if not sum(normalized.values()):
+            raise ValueError('Сумма весов проверок должна быть больше нуля')
+        return normalized
+    
+    @staticmethod
+    def _normalize_thresholds(thresholds=None):
+        """Проверить пороги статусов; дробный порог округляется вверх (оценка целая)"""
+        thresholds = {
+            'approve': Config.VERIFICATION_APPROVE_SCORE,
+            'review': Config.VERIFICATION_REVIEW_SCORE,
+            **(thresholds or {})
+        }
+        try:
+            normalized = {key: math.ceil(float(thresholds[key])) for key in ('approve', 'review')}
+        except (TypeError, ValueError):
+            raise ValueError('Пороги статусов должны быть числами')
+        if normalized['review'] > normalized['approve']:
+            raise ValueError('Порог "На проверке" не может быть выше порога "Утвержден"')
+        return normalized
+    
+    @staticmethod
+    def score_subcategory(subcategory_id):
+        """
+        Рассчитать оценки полноты и качества для всех товаров подкатегории
+        
+        Args:
+            subcategory_id: ID подкатегории
+        
+        Returns:
+            pandas.DataFrame: Индекс - ID товара; столбцы completeness_score, quality_score,
+                              filled_required, required_count, valid_attrs, total_attrs
+        """
+        subcategory = db.session.get(Subcategory, subcategory_id)
+        if subcategory is None:
+            raise ValueError(f'Подкатегория {subcategory_id} не найдена')
+        
+        product_ids = pd.Index(
+            [product_id for (product_id,) in db.session.query(Product.id).filter(
+                Product.subcategory_id == subcategory_id
+            ).order_by(Product.id)],
+            name='product_id'
+        )
+        values, hashes = ScoringService._load_matrix(subcategory_id)
+        values = values.reindex(product_ids)
+        hashes = hashes.reindex(product_ids)
+        
+        present = values.notna()
+        filled = pd.DataFrame({
+            attribute_id: present[attribute_id] & (values[attribute_id].str.strip().str.len() > 0)
+            for attribute_id in values.columns
+        }, index=values.index, columns=values.columns, dtype=bool)
+        
+        # Полнота: заполненные обязательные атрибуты подкатегории
+        required_ids = [attribute_id for attribute_id, _ in validator_registry.get_schema(subcategory).required]
+        required_count = len(required_ids)
+        filled_required = filled.reindex(columns=required_ids, fill_value=False).sum(axis=1)
+        if required_count:
+            completeness = ((filled_required / required_count) * 100).astype(int)
+        else:
+            completeness = pd.Series(100, index=product_ids)
+        
+        # Качество: валидные непустые значения среди всех значений товара
+        valid = ScoringService._valid_mask(values, hashes, filled)
+        total_attrs = present.sum(axis=1)
+        valid_attrs = valid.sum(axis=1)
+        quality = ((valid_attrs / total_attrs.where(total_attrs > 0)) * 100).fillna(100).astype(int)
+        
+        return pd.DataFrame({
+            'completeness_score': completeness.astype(int),
+            'quality_score': quality,
+            'filled_required': filled_required.astype(int),
+            'required_count': required_count,
+            'valid_attrs': valid_attrs.astype(int),
+            'total_attrs': total_attrs.astype(int),
+        }, index=product_ids)
+    
+    @staticmethod
+    def _load_matrix(subcategory_id):
+        """
+        Загрузить значения атрибутов подкатегории матрицей товар x атрибут
+        
+        Returns:
+            tuple: (DataFrame значений, DataFrame хэшей значений); отсутствующее значение - NaN
+        """
+        rows = db.session.query(
+            ProductAttributeValue.product_id,
+            ProductAttributeValue.attribute_id,
+            ProductAttributeValue.value,
+            ProductAttributeValue.value_hash
+        ).join(
+            Product, Product.id == ProductAttributeValue.product_id
+        ).filter(
+            Product.subcategory_id == subcategory_id
+        ).all()
+        
+        # object, а не строковый тип pandas: проверки шаблонов должны использовать модуль re
+        pavs = pd.DataFrame.from_records(
+            rows, columns=['product_id', 'attribute_id', 'value', 'value_hash']
+        ).astype({'value': object, 'value_hash': object})
+        
+        values = pavs.pivot(index='product_id', columns='attribute_id', values='value')
+        hashes = pavs.pivot(index='product_id', columns='attribute_id', values='value_hash')
+        return values.astype(object), hashes.astype(object)
+    
+    @staticmethod
+    def _valid_mask(values, hashes, filled):
+        """Маска валидных значений: тип, правила валидации и уникальность по каждому атрибуту"""
+        from app.services.duplicate_service import DuplicateService
+        
+        attributes = {
+            attribute.id: attribute
+            for attribute in Attribute.query.filter(Attribute.id.in_([int(column) for column in values.columns]))
+        }
+        
+        # Хэши значений, встречающихся у двух и более товаров: {attribute_id: {value_hash}}
+        unique_ids = [attribute_id for attribute_id, attribute in attributes.items() if attribute.is_unique]
+        duplicate_hashes = {}
+        if unique_ids:
+            for (attribute_id, value_hash), product_ids in DuplicateService.build_index(unique_ids).groups.items():
+                if len(set(product_ids)) > 1:
+                    duplicate_hashes.setdefault(attribute_id, set()).add(value_hash)
+        
+        valid = pd.DataFrame(False, index=values.index, columns=values.columns)
+        for attribute_id in values.columns:
+            attribute = attributes.get(attribute_id)
+            column_filled = filled[attribute_id]
+            if attribute is None or not column_filled.any():
+                continue
+            
+            column = values.loc[column_filled, attribute_id]
+            validator = validator_registry.get_validator(attribute)
+            
+            ok = ScoringService._type_mask(validator, column)
+            if validator.rules:
+                ok &= ScoringService._rules_mask(validator, column)
+            
+            if attribute_id in duplicate_hashes:
+                column_hashes = hashes.loc[column_filled, attribute_id]
+                missing = column_hashes.isna()
+                if missing.any():
+                    column_hashes = column_hashes.copy()
+                    column_hashes[missing] = column[missing].map(ProductAttributeValue.hash_value)
+                ok &= ~column_hashes.isin(duplicate_hashes[attribute_id])
+            
+            valid.loc[column_filled, attribute_id] = ok
+        
+        return valid
+    
+    @staticmethod
+    def _type_mask(validator, column):
+        """Маска соответствия значений типу атрибута (AttributeValidator.check_type)"""
+        if validator.type == AttributeType.NUMBER:
+            # to_numeric разбирает подмножество того, что принимает float(); остальное - через float()
+            numeric = pd.to_numeric(column, errors='coerce').notna()
+            if not numeric.all():
+                numeric[~numeric] = _map_unique(column[~numeric], validator.check_type)
+            return numeric
+        if validator.type == AttributeType.BOOLEAN:
+            return column.str.lower().isin(BOOLEAN_VALUES)
+        if validator.type == AttributeType.SELECT:
+            return column.isin(validator.select_values)
+        if validator.type == AttributeType.URL:
+            return column.str.startswith(('http://', 'https://')).astype(bool)
+        if validator.type == AttributeType.DATE:
+            return _map_unique(column, validator.check_type)
+        return pd.Series(True, index=column.index)
+    
+    @staticmethod
+    def _rules_mask(validator, column):
+        """Маска соответствия значений правилам валидации (AttributeValidator.check_rules)"""
+        ok = pd.Series(True, index=column.index)
+        
+        if validator.type == AttributeType.NUMBER and (validator.min is not None or validator.max is not None):
+            numbers = pd.to_numeric(column, errors='coerce')
+            unparsed = numbers.isna()
+            if unparsed.any():
+                # Нечисловые значения не проходят правила; float('nan') проходит, как и в check_rules
+                numbers[unparsed] = column[unparsed].map(_to_float)
+                ok[unparsed] = _map_unique(column[unparsed], validator.check_type)
+            if validator.min is not None:
+                ok &= ~(numbers < validator.min)
+            if validator.max is not None:
+                ok &= ~(numbers > validator.max)
+        
+        if validator.pattern is not None:
+            ok &= column.str.match(validator.pattern.pattern, flags=validator.pattern.flags).astype(bool)
+        
+        if validator.min_length is not None or validator.max_length is not None:
+            lengths = column.str.len()
+            if validator.min_length is not None:
+                ok &= lengths >= validator.min_length
+            if validator.max_length is not None:
+                ok &= lengths <= validator.max_length
+        
+        return ok
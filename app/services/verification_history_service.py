@@ -0,0 +1,146 @@
+"""
+Хранение истории верификаций
+
+У каждого товара остаются последние N верификаций с проблемами; более старые
+сворачиваются в строку сводки (период, количество, оценки, число проблем) и удаляются.
+Очистка выполняется пакетами товаров запросами INSERT ... SELECT и DELETE
+с фиксацией после каждого пакета, в фоновом потоке или после задания верификации.
+"""
+import threading
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, select
+from app import db
+from app.models.verification import ProductVerification, VerificationIssue, VerificationSummary
+from config import Config
+
+
+class VerificationHistoryService:
+    """Сервис хранения истории верификаций"""
+    
+    @staticmethod
+    def purge(keep=None, product_ids=None, batch_size=None):
+        """
+        Свернуть в сводки и удалить верификации сверх последних keep у каждого товара
+        
+        Args:
+            keep: Сколько последних верификаций оставить (по умолчанию Config.VERIFICATION_HISTORY_KEEP)
+            product_ids: Ограничить товарами (None - все товары)
+            batch_size: Товаров в пакете (по умолчанию Config.VERIFICATION_PURGE_BATCH_SIZE)
+        
+        Returns:
+            dict: products (товаров с удаленной историей), verifications, issues (удалено записей)
+        """
+        keep = Config.VERIFICATION_HISTORY_KEEP if keep is None else keep
+        if keep < 1:
+            raise ValueError('Необходимо хранить хотя бы одну последнюю верификацию')
+        batch_size = batch_size or Config.VERIFICATION_PURGE_BATCH_SIZE
+        
+        result = {'products': 0, 'verifications': 0, 'issues': 0}
+        if product_ids is not None and not product_ids:
+            return result
+        
+        # Товары, у которых верификаций больше, чем нужно хранить
+        candidates = select(ProductVerification.product_id).group_by(
+            ProductVerification.product_id
+        ).having(func.count(ProductVerification.id) > keep)
+        if product_ids is not None:
+            candidates = candidates.where(ProductVerification.product_id.in_(product_ids))
+        
+        last_product_id = 0
+        while True:
+            batch = db.session.execute(
+                candidates.where(ProductVerification.product_id > last_product_id).order_by(
+                    ProductVerification.product_id
+                ).limit(batch_size)
+            ).scalars().all()
+            if not batch:
+                break
+            last_product_id = batch[-1]
+            
+            try:
+                verifications, issues = VerificationHistoryService._purge_batch(batch, keep)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            
+            result['products'] += len(batch)
+            result['verifications'] += verifications
+            result['issues'] += issues
+        
+        return result
+    
+    @staticmethod
+    def start_purge(keep=None, product_ids=None):
+        """
+        Запустить очистку истории в фоновом потоке
+        
+        Returns:
+            threading.Thread: Поток очистки
+        """
+        app = current_app._get_current_object()
+        
+        def run():
+            with app.app_context():
+                try:
+                    result = VerificationHistoryService.purge(keep, product_ids)
+                    app.logger.info(f"Очистка истории верификаций: {result}")
+                except Exception as e:
+                    app.logger.error(f"Ошибка очистки истории верификаций: {str(e)}", exc_info=True)
+        
+        thread = threading.Thread(target=run, name='verification-history-purge', daemon=True)
+        thread.start()
+        return thread
+    
+    @staticmethod
+    def _purge_batch(product_ids, keep):
+        """
+        Свернуть и удалить старые верификации пакета товаров
+        
+        Returns:
+            tuple: (удалено верификаций, удалено проблем)
+        """
+        # Номер верификации товара от последней к первой
+        ranked = select(
+            ProductVerification.id,
+            ProductVerification.product_id,
+            ProductVerification.verified_at,
+            ProductVerification.overall_score,
+            ProductVerification.issues_count,
+            func.row_number().over(
+                partition_by=ProductVerification.product_id,
+                order_by=ProductVerification.newest_first()
+            ).label('position')
+        ).where(ProductVerification.product_id.in_(product_ids)).subquery()
+        old = select(ranked).where(ranked.c.position > keep).subquery()
+        old_ids = select(old.c.id)
+        
+        db.session.execute(insert(VerificationSummary).from_select(
+            [
+                'product_id', 'period_start', 'period_end', 'verifications_count', 'min_overall_score',
+                'max_overall_score', 'avg_overall_score', 'issues_count', 'created_at'
+            ],
+            select(
+                old.c.product_id,
+                func.min(old.c.verified_at),
+                func.max(old.c.verified_at),
+                func.count(old.c.id),
+                func.min(old.c.overall_score),
+                func.max(old.c.overall_score),
+                func.avg(old.c.overall_score),
+                func.coalesce(func.sum(old.c.issues_count), 0),
+                literal(datetime.utcnow(), db.DateTime)
+            ).group_by(old.c.product_id)
+        ))
+        
+        issues = db.session.execute(
+            delete(VerificationIssue).where(VerificationIssue.verification_id.in_(old_ids)),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        verifications = db.session.execute(
+            delete(ProductVerification).where(ProductVerification.id.in_(old_ids)),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        
+        return verifications, issues
@@ -0,0 +1,326 @@
+"""
+Массовая верификация товаров заданиями в пуле процессов
+
+Набор товаров (файл импорта или подкатегория) разбивается на части, которые
+верифицируются в отдельных процессах. Каждый процесс создает собственное
+приложение, т.е. собственный пул соединений с БД, сессию и состояние HTTP.
+Прогресс и отметка о ходе выполнения (heartbeat_at) записываются в VerificationJob
+после каждой части. Индекс дубликатов строится один раз на задание, статистика
+выборочной проверки медиа ведется по заданию целиком: каждая часть получает
+накопленные счетчики, ее прирост добавляется к общим (в работе одновременно не
+больше частей, чем процессов). Задание выполняется в фоновом потоке веб-процесса, поэтому
+при перезапуске процесса оно прерывается: задания без отметки дольше
+Config.VERIFICATION_JOB_STALE_SECONDS помечаются как failed при запросе прогресса
+и при создании новых заданий.
+"""
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from app import db
+from app.models.product import Product
+from app.models.verification import VerificationJob, VerificationJobStatus
+from config import Config
+
+
+# Приложение процесса-обработчика и индекс дубликатов задания (создаются в _init_worker)
+_worker_app = None
+_worker_duplicates = None
+
+
+def _init_worker(config_path, duplicates=None):
+    """
+    Инициализация процесса-обработчика: собственное приложение и соединения с БД
+    
+    Args:
+        config_path: Путь импорта класса конфигурации родительского приложения
+        duplicates: Индекс дубликатов задания (DuplicateIndex)
+    """
+    global _worker_app, _worker_duplicates
+    from werkzeug.utils import import_string
+    from app import create_app
+    from app.services.image_analysis_service import ImageAnalysisService
+    _worker_app = create_app(import_string(config_path))
+    _worker_duplicates = duplicates
+    # Анализ изображений при скачивании не запускает вложенный пул на каждый обработчик
+    ImageAnalysisService.limit_workers(_worker_app.config['IMAGE_ANALYSIS_JOB_WORKERS'])
+
+
+def verify_chunk(product_ids, user_id=None, force=False, sampling=None, sample_stats=None, duplicates=None):
+    """
+    Верифицировать часть товаров задания (выполняется в процессе-обработчике)
+    
+    Args:
+        sample_stats: Накопленная статистика выборочной проверки задания (MediaSampler.export_stats)
+        duplicates: Индекс дубликатов задания (None - переданный в _init_worker)
+    
+    Returns:
+        dict: verified, unchanged, errors (список сообщений), failed (ни один товар части
+              не верифицирован - ошибка не в данных товаров, а в окружении),
+              sample_stats (прирост статистики выборочной проверки за часть)
+    """
+    if duplicates is None:
+        duplicates = _worker_duplicates
+    if _worker_app is None:
+        return _verify_products(product_ids, user_id, force, sampling, sample_stats, duplicates)
+    with _worker_app.app_context():
+        return _verify_products(product_ids, user_id, force, sampling, sample_stats, duplicates)
+
+
+def _verify_products(product_ids, user_id, force, sampling, sample_stats=None, duplicates=None):
+    """Верифицировать товары в текущем контексте приложения"""
+    from app.models.user import User
+    from app.services.media_sampler import MediaSampler
+    from app.services.verification_service import VerificationService
+    
+    user = db.session.get(User, user_id) if user_id else None
+    sampler = MediaSampler.from_config(enabled=sampling)
+    seed = None
+    if sampler and sample_stats:
+        sampler.merge_stats(sample_stats)
+        seed = sampler.export_stats()
+    result = {'verified': 0, 'unchanged': 0, 'errors': []}
+    
+    products = Product.query.filter(Product.id.in_(product_ids)).order_by(Product.id).all()
+    for product in products:
+        try:
+            verification = VerificationService.verify_product(
+                product, user, sampler=sampler, force=force, duplicates=duplicates
+            )
+            result['verified'] += 1
+            if verification.unchanged:
+                result['unchanged'] += 1
+        except Exception as e:
+            db.session.rollback()
+            result['errors'].append(f"Товар {product.sku}: {str(e)}")
+    
+    result['failed'] = bool(products) and not result['verified']
+    result['sample_stats'] = sampler.export_stats(since=seed) if sampler else {}
+    return result
+
+
+class VerificationJobService:
+    """Сервис заданий массовой верификации"""
+    
+    @staticmethod
+    def create_job(user=None, import_history_id=None, subcategory_id=None, force=False, sampling=None):
+        """
+        Создать задание верификации товаров файла импорта или подкатегории
+        
+        Returns:
+            VerificationJob: Созданное задание (еще не запущено)
+        """
+        if not import_history_id and not subcategory_id:
+            raise ValueError('Необходимо указать файл импорта или подкатегорию')
+        
+        VerificationJobService.fail_stale_jobs()
+        
+        job = VerificationJob(
+            import_history_id=import_history_id,
+            subcategory_id=subcategory_id,
+            force=force,
+            sampling=sampling,
+            total_count=VerificationJobService._product_query(import_history_id, subcategory_id).count(),
+            created_by_id=user.id if user else None
+        )
+        db.session.add(job)
+        db.session.commit()
+        return job
+    
+    @staticmethod
+    def start_job(job):
+        """
+        Запустить задание в фоновом потоке (запрос возвращает ID задания сразу)
+        
+        Returns:
+            threading.Thread: Поток, управляющий заданием
+        """
+        app = current_app._get_current_object()
+        job_id = job.id
+        
+        def run():
+            with app.app_context():
+                VerificationJobService.run_job(job_id)
+        
+        thread = threading.Thread(target=run, name=f'verification-job-{job_id}', daemon=True)
+        thread.start()
+        return thread
+    
+    @staticmethod
+    def run_job(job_id, workers=None):
+        """
+        Выполнить задание: разбить товары на части и верифицировать их в пуле процессов
+        
+        Args:
+            job_id: ID задания
+            workers: Количество процессов (по умолчанию Config.VERIFICATION_WORKERS;
+                     1 - выполнение в текущем процессе)
+        
+        Returns:
+            VerificationJob: Задание с итоговым статусом
+        """
+        job = db.session.get(VerificationJob, job_id)
+        job.status = VerificationJobStatus.RUNNING
+        job.started_at = job.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+        
+        try:
+            product_ids = [
+                product_id for (product_id,) in VerificationJobService._product_query(
+                    job.import_history_id, job.subcategory_id
+                ).with_entities(Product.id).order_by(Product.id).all()
+            ]
+            chunk_size = Config.VERIFICATION_CHUNK_SIZE
+            chunks = [product_ids[i:i + chunk_size] for i in range(0, len(product_ids), chunk_size)]
+            
+            job.total_count = len(product_ids)
+            job.chunks_total = len(chunks)
+            db.session.commit()
+            
+            # Хэши значений для поиска дубликатов (записи, созданные в обход ORM) и индекс
+            # дубликатов - один проход GROUP BY на задание
+            from app.services.duplicate_service import DuplicateService
+            DuplicateService.ensure_hashes()
+            duplicates = DuplicateService.build_index()
+            
+            # Скачанные изображения анализируются заранее одним проходом (свой пул процессов)
+            from app.services.image_analysis_service import ImageAnalysisService
+            try:
+                ImageAnalysisService.analyze_pending(product_ids)
+            except Exception as e:
+                current_app.logger.warning(f"Ошибка анализа изображений: {str(e)}")
+            
+            workers = workers or Config.VERIFICATION_WORKERS or os.cpu_count() or 1
+            workers = min(workers, len(chunks)) or 1
+            args = (job.created_by_id, job.force, job.sampling)
+            
+            # Статистика выборочной проверки медиа по всему заданию
+            from app.services.media_sampler import MediaSampler
+            sampler = MediaSampler.from_config(enabled=job.sampling)
+            
+            def record(result):
+                if sampler:
+                    sampler.merge_stats(result.get('sample_stats') or {})
+                VerificationJobService._record_chunk(job, result)
+            
+            def stats():
+                return sampler.export_stats() if sampler else None
+            
+            if workers == 1:
+                for chunk in chunks:
+                    record(verify_chunk(chunk, *args, sample_stats=stats(), duplicates=duplicates))
+            else:
+                # spawn: процессы не наследуют потоки и соединения веб-процесса
+                with ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(current_app.config['CONFIG_CLASS_PATH'], duplicates)
+                ) as executor:
+                    # Следующая часть отправляется после завершения предыдущей -
+                    # с учетом накопленной статистики выборки
+                    pending = iter(chunks)
+                    futures = {
+                        executor.submit(verify_chunk, chunk, *args, sample_stats=stats())
+                        for chunk in itertools.islice(pending, workers)
+                    }
+                    try:
+                        while futures:
+                            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                record(future.result())
+                                chunk = next(pending, None)
+                                if chunk is not None:
+                                    futures.add(executor.submit(verify_chunk, chunk, *args, sample_stats=stats()))
+                    except Exception:
+                        # Оставшиеся части не запускаются
+                        for future in futures:
+                            future.cancel()
+                        raise
+            
+            job.status = VerificationJobStatus.COMPLETED
+            
+            # Старые верификации товаров задания сворачиваются в сводки
+            from app.services.verification_history_service import VerificationHistoryService
+            try:
+                VerificationHistoryService.purge(product_ids=product_ids)
+            except Exception as e:
+                current_app.logger.warning(f"Ошибка очистки истории верификаций: {str(e)}")
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Ошибка задания верификации {job_id}: {str(e)}", exc_info=True)
+            job.status = VerificationJobStatus.FAILED
+            job.error_message = str(e)
+        
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return job
+    
+    @staticmethod
+    def fail_stale_jobs(job_id=None):
+        """
+        Пометить как failed задания, выполнение которых прервано (перезапуск процесса)
+        
+        Задание прервано, если оно в статусе pending или running и не отмечалось
+        дольше Config.VERIFICATION_JOB_STALE_SECONDS.
+        
+        Args:
+            job_id: Проверить только это задание (None - все задания)
+        
+        Returns:
+            int: Количество помеченных заданий
+        """
+        now = datetime.utcnow()
+        deadline = now - timedelta(seconds=Config.VERIFICATION_JOB_STALE_SECONDS)
+        query = VerificationJob.query.filter(
+            VerificationJob.status.in_([VerificationJobStatus.PENDING, VerificationJobStatus.RUNNING]),
+            func.coalesce(VerificationJob.heartbeat_at, VerificationJob.created_at) < deadline
+        )
+        if job_id is not None:
+            query = query.filter(VerificationJob.id == job_id)
+        
+        count = query.update({
+            VerificationJob.status: VerificationJobStatus.FAILED,
+            VerificationJob.error_message: 'Задание прервано: нет отметки о выполнении (процесс перезапущен)',
+            VerificationJob.finished_at: now,
+        }, synchronize_session='fetch')
+        db.session.commit()
+        return count
+    
+    @staticmethod
+    def _record_chunk(job, result):
+        """
+        Записать результат части задания
+        
+        Raises:
+            RuntimeError: Ни один товар части не верифицирован (задание завершается ошибкой)
+        """
+        job.chunks_done += 1
+        job.processed_count += result['verified'] + len(result['errors'])
+        job.unchanged_count += result['unchanged']
+        job.errors_count += len(result['errors'])
+        
+        if result['errors']:
+            errors = list(job.errors or [])
+            errors.extend(result['errors'][:max(0, Config.VERIFICATION_JOB_MAX_ERRORS - len(errors))])
+            job.errors = errors
+        
+        job.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+        
+        if result.get('failed'):
+            raise RuntimeError(f"Ни один товар части задания не верифицирован: {result['errors'][0]}")
+    
+    @staticmethod
+    def _product_query(import_history_id=None, subcategory_id=None):
+        """Запрос товаров задания"""
+        query = Product.query
+        if import_history_id:
+            query = query.filter(Product.import_history_id == import_history_id)
+        if subcategory_id:
+            query = query.filter(Product.subcategory_id == subcategory_id)
+        return query
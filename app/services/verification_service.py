@@ -3,26 +3,83 @@
 """
 from app import db
 from app.models.product import Product, ProductStatus
-from app.models.verification import ProductVerification, VerificationIssue, IssueType
+from app.models.verification import ProductVerification, VerificationIssue, IssueType, render_issue_message
 from app.models.subcategory_attribute import SubcategoryAttribute
 from app.models.attribute import AttributeType
+from app.utils.host_guard import host_guard, HostUnavailableError
+from app.utils.attribute_validators import validator_registry
+from app.services.scoring_service import ScoringService
 from datetime import datetime
+import hashlib
+import json
 import requests
 from PIL import Image
 import io
-import re
 
 class VerificationService:
     """Сервис для верификации товаров"""
     
+    # Допустимые форматы изображений
+    ALLOWED_IMAGE_FORMATS = ['JPEG', 'JPG', 'PNG', 'WEBP']
+    
+    # Соответствие MIME типов форматам PIL
+    MIME_TO_FORMAT = {
+        'image/jpeg': 'JPEG',
+        'image/jpg': 'JPEG',
+        'image/png': 'PNG',
+        'image/webp': 'WEBP',
+        'image/gif': 'GIF',
+        'image/bmp': 'BMP',
+        'image/svg+xml': 'SVG',
+    }
+    
+    # Типы проблем, которые дает каждая проверка (для переиспользования результатов)
+    COMPLETENESS_ISSUE_TYPES = {IssueType.MISSING_REQUIRED}
+    QUALITY_ISSUE_TYPES = {IssueType.INVALID_TYPE, IssueType.INVALID_VALUE, IssueType.INVALID_FORMAT, IssueType.DUPLICATE}
+    
     @staticmethod
-    def verify_product(product, user=None):
+    def verify_product(product, user=None, sampler=None, force=False, duplicates=None):
         """
         Выполнить полную верификацию товара
         
+        Args:
+            product: Объект Product
+            user: Пользователь, запустивший верификацию
+            sampler: MediaSampler для выборочной проверки удаленных медиа
+                     (при массовой верификации; None - проверять все)
+            force: Пересчитать все проверки, не сравнивая отпечатки входных данных
+            duplicates: DuplicateIndex - предвычисленные группы дубликатов
+                        (при массовой верификации; None - запрос по индексу хэша)
+        
+        Если входные данные (значения атрибутов, обязательные атрибуты подкатегории,
+        правила валидации, медиа-файлы, веса и пороги оценки) не изменились с последней
+        верификации, возвращается последняя верификация с признаком unchanged. Если
+        изменилась только часть данных, пересчитываются только затронутые проверки.
+        
+        Сначала сравнивается отпечаток данных самого товара; дубликаты в каталоге,
+        наличие файлов в хранилище и похожие изображения проверяются, только если
+        он совпал с прошлой верификацией.
+        
         Returns:
             ProductVerification: объект с результатами верификации
         """
+        fingerprints = VerificationService.compute_fingerprints(product)
+        
+        previous = None
+        external = None
+        if not force:
+            previous = product.verifications.order_by(*ProductVerification.newest_first()).first()
+            if previous and previous.input_fingerprint == fingerprints['overall']:
+                external = VerificationService.compute_external_fingerprints(product, fingerprints, duplicates)
+                if external == (previous.check_fingerprints or {}).get('external'):
+                    previous.unchanged = True
+                    return previous
+        previous_checks = (previous.check_fingerprints or {}) if previous else {}
+        previous_external = previous_checks.get('external') or {}
+        if external is None:
+            # Нужны для переиспользования проверок и сохраняются для следующей верификации
+            external = VerificationService.compute_external_fingerprints(product, fingerprints, duplicates)
+        
         verification = ProductVerification(
             product_id=product.id,
             verified_by_id=user.id if user else None,
@@ -30,35 +87,74 @@ class VerificationService:
         )
         
         # Проверка полноты данных
-        completeness_score, completeness_issues = VerificationService._check_completeness(product)
+        if fingerprints['completeness'] == previous_checks.get('completeness'):
+            completeness_score = previous.completeness_score
+            completeness_issues = VerificationService._reuse_issues(
+                previous, VerificationService.COMPLETENESS_ISSUE_TYPES
+            )
+        else:
+            completeness_score, completeness_issues = VerificationService._check_completeness(product)
         verification.completeness_score = completeness_score
         
-        # Проверка качества данных
-        quality_score, quality_issues = VerificationService._check_quality(product)
+        # Проверка качества данных (результаты атрибутов с прежним отпечатком переиспользуются;
+        # уникальные атрибуты - только если не изменились и найденные дубликаты)
+        previous_quality = previous_checks.get('quality') or {}
+        duplicates_unchanged = external['quality'] == previous_external.get('quality')
+        reusable_attribute_ids = {
+            int(attribute_id) for attribute_id, fingerprint in fingerprints['quality'].items()
+            if previous_quality.get(attribute_id) == fingerprint
+            and (duplicates_unchanged or int(attribute_id) not in fingerprints['unique'])
+        }
+        reuse = None
+        if reusable_attribute_ids:
+            reuse = {attribute_id: [] for attribute_id in reusable_attribute_ids}
+            for issue in VerificationService._reuse_issues(previous, VerificationService.QUALITY_ISSUE_TYPES):
+                if issue['attribute_id'] in reuse:
+                    reuse[issue['attribute_id']].append(issue)
+        quality_score, quality_issues = VerificationService._check_quality(product, reuse, duplicates)
         verification.quality_score = quality_score
         
         # Проверка медиа-контента
-        media_score, media_issues = VerificationService._check_media(product)
+        if fingerprints['media'] == previous_checks.get('media') and external['media'] == previous_external.get('media'):
+            media_score = previous.media_score
+            media_issues = VerificationService._reuse_issues(
+                previous,
+                set(IssueType) - VerificationService.COMPLETENESS_ISSUE_TYPES - VerificationService.QUALITY_ISSUE_TYPES
+            )
+        else:
+            media_score, media_issues = VerificationService._check_media(product, sampler)
+            # Результат с пропущенными или выборочными проверками не переиспользуется
+            if any(issue.get('transient') for issue in media_issues):
+                fingerprints['media'] = None
         verification.media_score = media_score
         
-        # Расчет общей оценки (взвешенная сумма)
-        verification.overall_score = int(
-            completeness_score * 0.4 + 
-            quality_score * 0.4 + 
-            media_score * 0.2
-        )
+        # Отпечатки входных данных для следующей верификации
+        verification.check_fingerprints = {
+            'completeness': fingerprints['completeness'],
+            'quality': fingerprints['quality'],
+            'media': fingerprints['media'],
+            'external': external,
+        }
+        verification.input_fingerprint = fingerprints['overall'] if fingerprints['media'] else None
+        
+        # Расчет общей оценки (взвешенная сумма, веса из конфигурации)
+        verification.overall_score = ScoringService.overall_score(completeness_score, quality_score, media_score)
         
         db.session.add(verification)
         db.session.flush()  # Получить ID для verification
         
         # Сохранить все проблемы
         all_issues = completeness_issues + quality_issues + media_issues
+        verification.issues_count = len(all_issues)
         for issue_data in all_issues:
+            # Хранятся код и параметры; готовый текст - только для записей без кода
             issue = VerificationIssue(
                 verification_id=verification.id,
                 issue_type=issue_data['type'],
                 attribute_id=issue_data.get('attribute_id'),
-                message=issue_data['message'],
+                code=issue_data.get('code'),
+                params=issue_data.get('params') or None,
+                message=None if issue_data.get('code') else issue_data['message'],
                 severity=issue_data.get('severity', 'warning')
             )
             db.session.add(issue)
@@ -66,7 +162,7 @@ class VerificationService:
         db.session.commit()
         
         # Автоматический переход статуса на основе оценки
-        VerificationService._update_status_based_on_score(product, verification.overall_score)
+        VerificationService._update_status_based_on_score(product, verification.overall_score, user)
         
         return verification
     
@@ -78,8 +174,8 @@ class VerificationService:
         Returns:
             tuple: (score 0-100, list of issues)
         """
-        # Получить обязательные атрибуты для подкатегории
-        required_attrs = product.subcategory.get_required_attributes()
+        # Получить обязательные атрибуты для подкатегории (из скомпилированной схемы)
+        required_attrs = validator_registry.get_schema(product.subcategory).required
         
         if not required_attrs:
             return 100, []  # Нет обязательных атрибутов - все заполнено
@@ -87,36 +183,41 @@ class VerificationService:
         total_required = len(required_attrs)
         filled_count = 0
         issues = []
+        values = {pav.attribute_id: pav.value for pav in product.attribute_values.all()}
         
-        for subcat_attr in required_attrs:
-            attribute = subcat_attr.attribute
-            pav = product.attribute_values.filter_by(attribute_id=attribute.id).first()
+        for attribute_id, attribute_name in required_attrs:
+            value = values.get(attribute_id)
             
-            if pav and pav.value and pav.value.strip():
+            if value and value.strip():
                 filled_count += 1
             else:
-                issues.append({
-                    'type': IssueType.MISSING_REQUIRED,
-                    'attribute_id': attribute.id,
-                    'message': f'Отсутствует обязательное поле: {attribute.name}',
-                    'severity': 'error'
-                })
+                issues.append(VerificationService._issue(
+                    IssueType.MISSING_REQUIRED, 'missing_required', 'error',
+                    attribute_id=attribute_id, attribute_name=attribute_name
+                ))
         
         score = int((filled_count / total_required) * 100) if total_required > 0 else 100
         
         return score, issues
     
     @staticmethod
-    def _check_quality(product):
+    def _check_quality(product, reuse=None, duplicates=None):
         """
         Проверить качество данных
         
+        Args:
+            product: Объект Product
+            reuse: {attribute_id: [issues]} - атрибуты, входные данные которых не изменились
+                   с прошлой верификации, и их прежние проблемы (пустой список - значение валидно)
+            duplicates: DuplicateIndex для проверки уникальности
+        
         Returns:
             tuple: (score 0-100, list of issues)
         """
         issues = []
         total_attrs = 0
         valid_attrs = 0
+        reuse = reuse or {}
         
         # Проверить все атрибуты товара
         for pav in product.attribute_values.all():
@@ -127,37 +228,39 @@ class VerificationService:
             if not value or not value.strip():
                 continue  # Пустые значения уже проверены в полноте
             
+            # Прежний результат для атрибута с неизменным отпечатком
+            if pav.attribute_id in reuse:
+                if reuse[pav.attribute_id]:
+                    issues.extend(reuse[pav.attribute_id])
+                else:
+                    valid_attrs += 1
+                continue
+            
             # Проверка типа данных
             if not VerificationService._validate_attribute_type(attribute, value):
-                issues.append({
-                    'type': IssueType.INVALID_TYPE,
-                    'attribute_id': attribute.id,
-                    'message': f'Неверный тип данных для атрибута {attribute.name}',
-                    'severity': 'error'
-                })
+                issues.append(VerificationService._issue(
+                    IssueType.INVALID_TYPE, 'invalid_type', 'error',
+                    attribute_id=attribute.id, attribute_name=attribute.name
+                ))
                 continue
             
             # Проверка правил валидации
             if attribute.validation_rules:
                 if not VerificationService._validate_rules(attribute, value):
-                    issues.append({
-                        'type': IssueType.INVALID_VALUE,
-                        'attribute_id': attribute.id,
-                        'message': f'Значение не соответствует правилам валидации для {attribute.name}',
-                        'severity': 'warning'
-                    })
+                    issues.append(VerificationService._issue(
+                        IssueType.INVALID_VALUE, 'invalid_rules', 'warning',
+                        attribute_id=attribute.id, attribute_name=attribute.name
+                    ))
                     continue
             
             # Проверка уникальности (для атрибутов с флагом is_unique)
             if attribute.is_unique:
-                duplicate = VerificationService._check_uniqueness(attribute, value, product)
+                duplicate = VerificationService._check_uniqueness(attribute, value, product, duplicates)
                 if duplicate:
-                    issues.append({
-                        'type': IssueType.DUPLICATE,
-                        'attribute_id': attribute.id,
-                        'message': f'Дубликат значения для уникального атрибута {attribute.name}: {value}',
-                        'severity': 'error'
-                    })
+                    issues.append(VerificationService._issue(
+                        IssueType.DUPLICATE, 'duplicate', 'error', {'value': value},
+                        attribute_id=attribute.id, attribute_name=attribute.name
+                    ))
                     continue
             
             valid_attrs += 1
@@ -167,10 +270,15 @@ class VerificationService:
         return score, issues
     
     @staticmethod
-    def _check_media(product):
+    def _check_media(product, sampler=None):
         """
         Проверить медиа-контент (фото и 3D модели)
         
+        Args:
+            product: Объект Product
+            sampler: MediaSampler - удаленные изображения проверяются выборочно
+                     по парам (поставщик, хост)
+        
         Returns:
             tuple: (score 0-100, list of issues)
         """
@@ -185,81 +293,145 @@ class VerificationService:
         url_attrs = [pav for pav in product.attribute_values.all() 
                     if pav.attribute.type == AttributeType.URL]
         
+        # Уже скачанные медиа-файлы: проверяются локально, без обращения к сети
+        local_media = VerificationService._get_local_media(product)
+        
+        # Похожие изображения других товаров (по перцептивному хэшу скачанных файлов)
+        similar = {}
+        if any(media.phash for media in local_media.values()):
+            from app.services.image_similarity_service import ImageSimilarityService
+            similar = ImageSimilarityService.similar_for_product(product.id)
+        similar_images = 0
+        
         # Проверка количества изображений
         if not image_attrs:
-            issues.append({
-                'type': IssueType.MEDIA_COUNT_LOW,
-                'message': 'Отсутствуют изображения товара',
-                'severity': 'warning'
-            })
+            issues.append(VerificationService._issue(IssueType.MEDIA_COUNT_LOW, 'no_images', 'warning'))
             score = 50  # Штраф за отсутствие изображений
         elif len(image_attrs) < 3:
-            issues.append({
-                'type': IssueType.MEDIA_COUNT_LOW,
-                'message': f'Мало изображений товара: {len(image_attrs)} (рекомендуется минимум 3)',
-                'severity': 'warning'
-            })
+            issues.append(VerificationService._issue(
+                IssueType.MEDIA_COUNT_LOW, 'few_images', 'warning', {'count': len(image_attrs), 'min_count': 3}
+            ))
             score = max(60, score - (3 - len(image_attrs)) * 10)  # Штраф за недостаточное количество
         
         # Проверить каждое изображение
         valid_images = 0
+        supplier_id = VerificationService._get_supplier_id(product) if sampler else None
+        sampled_ok = {}  # (поставщик, хост) -> количество изображений, принятых по выборке
         for pav in image_attrs:
             image_url = pav.value.strip()
             
             if not image_url:
                 continue
             
-            # Проверка доступности URL
-            if not VerificationService._check_image_url(image_url):
-                issues.append({
-                    'type': IssueType.IMAGE_NOT_ACCESSIBLE,
-                    'attribute_id': pav.attribute.id,
-                    'message': f'Изображение недоступно: {image_url}',
-                    'severity': 'error'
-                })
+            media = local_media.get((pav.attribute_id, image_url))
+            probe = None
+            
+            # Выборочная проверка: удаленное изображение может быть принято по статистике хоста
+            sample_key = None
+            if media is None and sampler is not None:
+                sample_key = (supplier_id, host_guard.get_host(image_url))
+                if not sampler.should_check(sample_key):
+                    sampler.mark_skipped(sample_key)
+                    sampled_ok[sample_key] = sampled_ok.get(sample_key, 0) + 1
+                    valid_images += 1
+                    continue
+            
+            try:
+                # Проверка доступности URL
+                image_accessible = VerificationService._check_image_url(image_url, media)
+                
+                # Параметры удаленного изображения определяются один раз по заголовку файла
+                if image_accessible and media is None:
+                    probe = VerificationService._probe_remote_image(image_url) or {}
+            except HostUnavailableError as e:
+                # Хост отключен или перегружен - проверка пропущена без ожидания таймаута
+                issues.append(VerificationService._issue(
+                    IssueType.IMAGE_NOT_ACCESSIBLE, 'image_check_skipped', 'warning',
+                    {'reason': e.reason, 'url': image_url}, attribute_id=pav.attribute.id, transient=True
+                ))
+                continue
+            
+            if not image_accessible:
+                if sample_key:
+                    sampler.record(sample_key, accessible=False)
+                issues.append(VerificationService._issue(
+                    IssueType.IMAGE_NOT_ACCESSIBLE, 'image_not_accessible', 'error',
+                    {'url': image_url}, attribute_id=pav.attribute.id
+                ))
                 continue
             
+            # Результаты анализа скачанного файла (целостность, пустое изображение, соотношение сторон)
+            if media is not None:
+                analysis_issue = VerificationService._check_image_analysis(media, image_url)
+                if analysis_issue:
+                    analysis_issue['attribute_id'] = pav.attribute.id
+                    issues.append(analysis_issue)
+                    continue
+                
+                # То же фото у других товаров - проблема качества данных, но изображение пригодно
+                similar_issue = VerificationService._check_image_similar(media, image_url, similar)
+                if similar_issue:
+                    similar_issue['attribute_id'] = pav.attribute.id
+                    issues.append(similar_issue)
+                    similar_images += 1
+            
             # Проверка разрешения
-            resolution_ok, width, height = VerificationService._check_image_resolution(image_url)
+            resolution_ok, width, height = VerificationService._check_image_resolution(image_url, media, probe)
+            if sample_key:
+                sampler.record(sample_key, accessible=True, resolution_ok=resolution_ok)
             if not resolution_ok:
-                issues.append({
-                    'type': IssueType.IMAGE_LOW_RESOLUTION,
-                    'attribute_id': pav.attribute.id,
-                    'message': f'Низкое разрешение изображения ({width}x{height}): {image_url}',
-                    'severity': 'warning'
-                })
+                issues.append(VerificationService._issue(
+                    IssueType.IMAGE_LOW_RESOLUTION, 'image_low_resolution', 'warning',
+                    {'width': width, 'height': height, 'url': image_url}, attribute_id=pav.attribute.id
+                ))
                 # Не считаем невалидным, но снижаем оценку
                 continue
             
             # Проверка формата
-            format_ok, image_format = VerificationService._check_image_format(image_url)
+            format_ok, image_format = VerificationService._check_image_format(image_url, media, probe)
             if not format_ok:
-                issues.append({
-                    'type': IssueType.IMAGE_INVALID_FORMAT,
-                    'attribute_id': pav.attribute.id,
-                    'message': f'Неподдерживаемый формат изображения ({image_format}): {image_url}',
-                    'severity': 'warning'
-                })
+                issues.append(VerificationService._issue(
+                    IssueType.IMAGE_INVALID_FORMAT, 'image_invalid_format', 'warning',
+                    {'format': image_format, 'url': image_url}, attribute_id=pav.attribute.id
+                ))
                 continue
             
             # Проверка размера файла
-            size_ok, file_size = VerificationService._check_image_size(image_url)
+            size_ok, file_size = VerificationService._check_image_size(image_url, media, probe)
             if not size_ok:
-                issues.append({
-                    'type': IssueType.IMAGE_INVALID_FORMAT,
-                    'attribute_id': pav.attribute.id,
-                    'message': f'Слишком большой размер файла ({file_size / 1024 / 1024:.1f}MB): {image_url}',
-                    'severity': 'warning'
-                })
+                issues.append(VerificationService._issue(
+                    IssueType.IMAGE_INVALID_FORMAT, 'image_too_large', 'warning',
+                    {'size_mb': round(file_size / 1024 / 1024, 1), 'url': image_url}, attribute_id=pav.attribute.id
+                ))
                 continue
             
             valid_images += 1
         
+        # Изображения, принятые без проверки по результатам выборки
+        for (sample_supplier_id, host), count in sampled_ok.items():
+            summary = sampler.summary((sample_supplier_id, host))
+            issues.append(VerificationService._issue(
+                IssueType.MEDIA_SAMPLED, 'media_sampled', 'info',
+                {
+                    'count': count,
+                    'host': host,
+                    'checked': summary['checked'],
+                    'failures': summary['failures'],
+                    'accessible_lower_bound': round(summary['accessible_lower_bound'], 4),
+                    'resolution_lower_bound': round(summary['resolution_lower_bound'], 4),
+                },
+                transient=True
+            ))
+        
         # Пересчитать оценку на основе валидных изображений
         if len(image_attrs) > 0:
             image_score = int((valid_images / len(image_attrs)) * 100)
             score = min(score, image_score)
         
+        # Штраф за изображения, повторяющие фото других товаров
+        if similar_images:
+            score = max(0, score - 10)
+        
         # Проверка 3D моделей (в URL атрибутах)
         model_attrs = [pav for pav in url_attrs 
                       if VerificationService._is_3d_model_url(pav.value)]
@@ -268,17 +440,25 @@ class VerificationService:
             valid_models = 0
             for pav in model_attrs:
                 model_url = pav.value.strip()
+                media = local_media.get((pav.attribute_id, model_url))
                 
                 # Проверка доступности 3D модели
-                if VerificationService._check_3d_model_url(model_url):
+                try:
+                    model_accessible = VerificationService._check_3d_model_url(model_url, media)
+                except HostUnavailableError as e:
+                    issues.append(VerificationService._issue(
+                        IssueType.IMAGE_NOT_ACCESSIBLE, 'model_check_skipped', 'warning',
+                        {'reason': e.reason, 'url': model_url}, attribute_id=pav.attribute.id, transient=True
+                    ))
+                    continue
+                
+                if model_accessible:
                     valid_models += 1
                 else:
-                    issues.append({
-                        'type': IssueType.IMAGE_NOT_ACCESSIBLE,
-                        'attribute_id': pav.attribute.id,
-                        'message': f'3D модель недоступна: {model_url}',
-                        'severity': 'warning'
-                    })
+                    issues.append(VerificationService._issue(
+                        IssueType.IMAGE_NOT_ACCESSIBLE, 'model_not_accessible', 'warning',
+                        {'url': model_url}, attribute_id=pav.attribute.id
+                    ))
             
             # Если есть 3D модели, но они недоступны - снижаем оценку
             if len(model_attrs) > 0 and valid_models == 0:
@@ -291,149 +471,517 @@ class VerificationService:
     @staticmethod
     def _validate_attribute_type(attribute, value):
         """Проверить соответствие типа данных"""
-        try:
-            if attribute.type == AttributeType.NUMBER:
-                float(value)
-            elif attribute.type == AttributeType.BOOLEAN:
-                value.lower() in ['true', 'false', '1', '0', 'yes', 'no', 'да', 'нет']
-            elif attribute.type == AttributeType.DATE:
-                from datetime import datetime
-                # Попробовать разные форматы даты
-                formats = ['%Y-%m-%d', '%d.%m.%Y', '%Y/%m/%d', '%d-%m-%Y']
-                parsed = False
-                for fmt in formats:
-                    try:
-                        datetime.strptime(value, fmt)
-                        parsed = True
-                        break
-                    except:
-                        continue
-                if not parsed:
-                    datetime.fromisoformat(value)
-            elif attribute.type == AttributeType.SELECT:
-                # Проверить, что значение есть в списке допустимых
-                allowed_values = [av.value for av in attribute.values.all()]
-                return value in allowed_values
-            elif attribute.type == AttributeType.URL:
-                # Базовая проверка URL
-                return value.startswith(('http://', 'https://'))
-        except (ValueError, TypeError, AttributeError):
-            return False
-        
-        return True
+        return validator_registry.get_validator(attribute).check_type(value)
     
     @staticmethod
     def _validate_rules(attribute, value):
         """Проверить правила валидации"""
-        rules = attribute.validation_rules or {}
+        return validator_registry.get_validator(attribute).check_rules(value)
+    
+    @staticmethod
+    def _check_uniqueness(attribute, value, current_product, duplicates=None):
+        """
+        Проверить уникальность значения атрибута
         
-        if attribute.type == AttributeType.NUMBER:
-            try:
-                num_value = float(value)
-                if 'min' in rules and num_value < rules['min']:
-                    return False
-                if 'max' in rules and num_value > rules['max']:
-                    return False
-            except (ValueError, TypeError):
-                return False
-        
-        if 'pattern' in rules:
-            try:
-                if not re.match(rules['pattern'], value):
-                    return False
-            except:
-                pass
+        Args:
+            duplicates: DuplicateIndex - предвычисленные группы дубликатов
+                        (None - точечный запрос по индексу хэша значения)
         
-        if 'min_length' in rules:
-            if len(value) < rules['min_length']:
-                return False
+        Returns:
+            Product or None: Найденный дубликат или None
+        """
+        from app.services.duplicate_service import DuplicateService
         
-        if 'max_length' in rules:
-            if len(value) > rules['max_length']:
-                return False
+        # Найти другие товары с таким же значением этого атрибута
+        if duplicates is not None:
+            duplicate_id = duplicates.find_duplicate(attribute.id, value, current_product.id)
+        else:
+            duplicate_id = DuplicateService.find_duplicate(attribute.id, value, current_product.id)
         
-        return True
+        return db.session.get(Product, duplicate_id) if duplicate_id else None
     
     @staticmethod
-    def _check_uniqueness(attribute, value, current_product):
+    def compute_fingerprints(product):
         """
-        Проверить уникальность значения атрибута
+        Вычислить отпечатки данных самого товара (без запросов к каталогу и хранилищу)
+        
+        Args:
+            product: Объект Product
         
         Returns:
-            Product or None: Найденный дубликат или None
+            dict: completeness, quality ({attribute_id: отпечаток}), media, overall
+                  и входные данные внешних отпечатков: unique ({attribute_id: значение}),
+                  files ([(media_id, file_path)]), phash (есть ли перцептивные хэши)
         """
+        from app.models.attribute import Attribute
         from app.models.product import ProductAttributeValue
+        from app.models.product_media import ProductMedia
+        from config import Config
         
-        # Найти другие товары с таким же значением этого атрибута
-        duplicate_pav = ProductAttributeValue.query.filter(
-            ProductAttributeValue.attribute_id == attribute.id,
-            ProductAttributeValue.value == value,
-            ProductAttributeValue.product_id != current_product.id
-        ).first()
+        pavs = ProductAttributeValue.query.filter_by(product_id=product.id).join(
+            Attribute, ProductAttributeValue.attribute_id == Attribute.id
+        ).add_entity(Attribute).all()
+        values = {pav.attribute_id: pav.value for pav, _ in pavs}
+        
+        # Полнота: набор обязательных атрибутов подкатегории и их заполненность
+        required_ids = sorted(
+            validator_registry.get_schema(product.subcategory).required_ids
+        ) if product.subcategory else []
+        completeness = VerificationService._hash([
+            product.subcategory_id,
+            [(attribute_id, bool(values.get(attribute_id) and values[attribute_id].strip()))
+             for attribute_id in required_ids]
+        ])
+        
+        # Качество: значение, тип и правила валидации каждого атрибута
+        quality = {}
+        unique = {}
+        for pav, attribute in pavs:
+            value = pav.value
+            inputs = [value, attribute.type.value, attribute.validation_rules, attribute.is_unique]
+            if value and value.strip():
+                if attribute.type == AttributeType.SELECT:
+                    inputs.append(sorted(validator_registry.get_validator(attribute).select_values))
+                if attribute.is_unique:
+                    unique[attribute.id] = value
+            quality[str(attribute.id)] = VerificationService._hash(inputs)
+        
+        # Медиа: URL изображений и 3D моделей, записи скачанных файлов и пороги проверки
+        media_urls = sorted(
+            (pav.attribute_id, attribute.type.value, pav.value) for pav, attribute in pavs
+            if attribute.type in (AttributeType.IMAGE, AttributeType.URL)
+        )
+        media_rows = ProductMedia.query.filter_by(product_id=product.id).order_by(ProductMedia.id).all()
+        media = VerificationService._hash([
+            media_urls,
+            [(m.id, m.attribute_id, m.original_url, m.file_path, m.file_size, m.mime_type, m.width, m.height,
+              m.analyzed_at, m.is_valid, m.is_blank, m.aspect_ratio, m.phash)
+             for m in media_rows],
+            [Config.MIN_IMAGE_RESOLUTION, Config.MAX_IMAGE_SIZE, Config.IMAGE_MAX_ASPECT_RATIO,
+             Config.IMAGE_SIMILAR_MAX_DISTANCE, VerificationService.ALLOWED_IMAGE_FORMATS]
+        ])
+        
+        # Веса и пороги оценки: от них зависят общая оценка и статус
+        scoring = VerificationService._hash([
+            ScoringService._normalize_weights(), ScoringService._normalize_thresholds()
+        ])
+        
+        return {
+            'completeness': completeness,
+            'quality': quality,
+            'media': media,
+            'overall': VerificationService._hash([completeness, sorted(quality.items()), media, scoring]),
+            'unique': unique,
+            'files': [(m.id, m.file_path) for m in media_rows if m.file_path],
+            'phash': any(m.phash for m in media_rows),
+        }
+    
+    @staticmethod
+    def compute_external_fingerprints(product, fingerprints, duplicates=None):
+        """
+        Вычислить отпечатки данных вне товара: дубликаты уникальных значений в каталоге,
+        наличие скачанных файлов в хранилище и похожие изображения других товаров
+        
+        Args:
+            product: Объект Product
+            fingerprints: Результат compute_fingerprints
+            duplicates: DuplicateIndex (None - один запрос по индексу хэша)
+        
+        Returns:
+            dict: quality, media
+        """
+        from app.services.duplicate_service import DuplicateService
+        from app.services.image_similarity_service import ImageSimilarityService
+        from app.services.media_service import MediaService
+        
+        unique = sorted(fingerprints['unique'].items())
+        finder = duplicates if duplicates is not None else DuplicateService
+        found = finder.find_duplicates(unique, product.id) if unique else {}
         
-        return duplicate_pav.product if duplicate_pav else None
+        files = [(media_id, MediaService.media_exists(file_path)) for media_id, file_path in fingerprints['files']]
+        similar = []
+        if fingerprints['phash']:
+            similar = sorted(
+                (media_id, sorted(matches))
+                for media_id, matches in ImageSimilarityService.similar_for_product(product.id).items()
+            )
+        
+        return {
+            'quality': VerificationService._hash(sorted(found.items())),
+            'media': VerificationService._hash([files, similar]),
+        }
+    
+    @staticmethod
+    def _hash(data):
+        """Отпечаток данных (SHA-1 от канонического JSON)"""
+        payload = json.dumps(data, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def _reuse_issues(verification, issue_types):
+        """Получить проблемы заданных типов из прежней верификации в виде словарей для сохранения"""
+        return [
+            {
+                'type': issue.issue_type,
+                'code': issue.code,
+                'params': issue.params,
+                'attribute_id': issue.attribute_id,
+                'message': issue.message,
+                'severity': issue.severity
+            }
+            for issue in verification.issues_with_attributes(VerificationIssue.issue_type.in_(issue_types))
+        ]
     
     @staticmethod
-    def _check_image_url(url):
-        """Проверить доступность изображения по URL"""
+    def _issue(issue_type, code, severity, params=None, attribute_id=None, attribute_name=None, transient=False):
+        """
+        Описание проблемы: код и параметры сообщения (сохраняются в БД) и готовый текст
+        
+        Args:
+            issue_type: IssueType
+            code: Код шаблона сообщения (ISSUE_MESSAGES)
+            severity: error, warning или info
+            params: Параметры шаблона
+            transient: Проверка пропущена или выборочна (результат не переиспользуется)
+        """
+        issue = {
+            'type': issue_type,
+            'code': code,
+            'params': params or {},
+            'attribute_id': attribute_id,
+            'message': render_issue_message(code, params, attribute_name),
+            'severity': severity,
+        }
+        if transient:
+            issue['transient'] = True
+        return issue
+    
+    @staticmethod
+    def _get_supplier_id(product):
+        """Получить ID поставщика товара (через запрос данных файла импорта или подкатегорию)"""
+        import_file = product.import_file
+        if import_file and import_file.data_request:
+            return import_file.data_request.supplier_id
+        supplier = product.subcategory.suppliers.first() if product.subcategory else None
+        return supplier.id if supplier else None
+    
+    @staticmethod
+    def _get_local_media(product):
+        """
+        Получить скачанные медиа-файлы товара, файлы которых есть в хранилище
+        
+        Returns:
+            dict: {(attribute_id, original_url): ProductMedia}
+        """
+        from app.models.product_media import ProductMedia
+        from app.services.media_service import MediaService
+        
+        local_media = {}
+        for media in ProductMedia.query.filter_by(product_id=product.id).all():
+            if not media.original_url or not media.file_path:
+                continue
+            if MediaService.media_exists(media.file_path):
+                local_media[(media.attribute_id, media.original_url.strip())] = media
+        return local_media
+    
+    @staticmethod
+    def _read_local_image(media):
+        """
+        Прочитать размеры и формат локального изображения (только заголовок файла)
+        
+        Returns:
+            tuple: (width, height, format) или (0, 0, None) при ошибке
+        """
+        from app.services.media_service import MediaService
+        try:
+            with Image.open(MediaService.get_media_path(media.file_path)) as img:
+                width, height = img.size
+                return width, height, img.format
+        except Exception:
+            return 0, 0, None
+    
+    @staticmethod
+    def _check_image_analysis(media, url):
+        """
+        Проверить результаты анализа локального изображения (ImageAnalysisService)
+        
+        Returns:
+            dict: Проблема или None (в т.ч. если изображение еще не анализировалось)
+        """
+        from config import Config
+        
+        if media.analyzed_at is None:
+            return None
+        
+        if not media.is_valid:
+            return VerificationService._issue(
+                IssueType.IMAGE_CORRUPTED, 'image_corrupted', 'error',
+                {'error': media.analysis_error or 'ошибка декодирования', 'url': url}
+            )
+        
+        if media.is_blank:
+            return VerificationService._issue(IssueType.IMAGE_BLANK, 'image_blank', 'warning', {'url': url})
+        
+        ratio = media.aspect_ratio
+        if ratio and max(ratio, 1 / ratio) > Config.IMAGE_MAX_ASPECT_RATIO:
+            return VerificationService._issue(
+                IssueType.IMAGE_BAD_ASPECT_RATIO, 'image_bad_aspect_ratio', 'warning',
+                {'width': media.width, 'height': media.height, 'url': url}
+            )
+        
+        return None
+    
+    @staticmethod
+    def _check_image_similar(media, url, similar):
+        """
+        Проверить, не используется ли похожее изображение у других товаров
+        
+        Args:
+            similar: Результат ImageSimilarityService.similar_for_product
+        
+        Returns:
+            dict: Проблема или None
+        """
+        matches = similar.get(media.id)
+        if not matches:
+            return None
+        
+        product_ids = sorted({product_id for _, product_id, _ in matches})
+        skus = [sku for (sku,) in db.session.query(Product.sku).filter(
+            Product.id.in_(product_ids[:5])
+        ).order_by(Product.sku)]
+        return VerificationService._issue(
+            IssueType.IMAGE_SIMILAR, 'image_similar', 'warning',
+            {
+                'count': len(product_ids),
+                'skus': ', '.join(skus) + (', ...' if len(product_ids) > len(skus) else ''),
+                'distance': min(distance for _, _, distance in matches),
+                'url': url,
+            }
+        )
+    
+    @staticmethod
+    def _check_image_url(url, media=None):
+        """Проверить доступность изображения по URL (или наличие локальной копии)"""
+        if media is not None:
+            return True
         try:
-            response = requests.head(url, timeout=5, allow_redirects=True)
+            with host_guard.slot(url) as guarded:
+                response = guarded.observe(requests.head(url, timeout=5, allow_redirects=True))
             return response.status_code == 200
+        except HostUnavailableError:
+            raise
         except:
             return False
     
     @staticmethod
-    def _check_image_resolution(url):
+    def _check_image_resolution(url, media=None, probe=None):
         """Проверить разрешение изображения"""
         from config import Config
-        try:
-            response = requests.get(url, timeout=10, stream=True)
-            if response.status_code != 200:
-                return False, 0, 0
-            
-            img = Image.open(io.BytesIO(response.content))
-            width, height = img.size
-            min_width, min_height = Config.MIN_IMAGE_RESOLUTION
-            
+        min_width, min_height = Config.MIN_IMAGE_RESOLUTION
+        
+        if media is not None:
+            width, height = media.width, media.height
+            if not width or not height:
+                width, height, _ = VerificationService._read_local_image(media)
             return width >= min_width and height >= min_height, width, height
-        except:
+        
+        if probe is None:
+            probe = VerificationService._probe_remote_image(url)
+        if not probe:
             return False, 0, 0
+        
+        width, height = probe['width'], probe['height']
+        return width >= min_width and height >= min_height, width, height
     
     @staticmethod
-    def _check_image_format(url):
+    def _check_image_format(url, media=None, probe=None):
         """Проверить формат изображения"""
-        ALLOWED_FORMATS = ['JPEG', 'JPG', 'PNG', 'WEBP']
-        try:
-            response = requests.get(url, timeout=10, stream=True)
-            if response.status_code != 200:
-                return False, 'unknown'
-            
-            img = Image.open(io.BytesIO(response.content))
-            format_name = img.format
+        ALLOWED_FORMATS = VerificationService.ALLOWED_IMAGE_FORMATS
+        
+        if media is not None:
+            format_name = VerificationService.MIME_TO_FORMAT.get((media.mime_type or '').lower())
+            if not format_name:
+                _, _, format_name = VerificationService._read_local_image(media)
             return format_name in ALLOWED_FORMATS, format_name or 'unknown'
-        except:
+        
+        if probe is None:
+            probe = VerificationService._probe_remote_image(url)
+        if not probe:
             return False, 'unknown'
+        
+        format_name = probe['format']
+        return format_name in ALLOWED_FORMATS, format_name or 'unknown'
     
     @staticmethod
-    def _check_image_size(url):
+    def _check_image_size(url, media=None, probe=None):
         """Проверить размер файла изображения"""
         from config import Config
-        try:
-            response = requests.get(url, timeout=10, stream=True)
-            if response.status_code != 200:
-                return False, 0
-            
-            content_length = response.headers.get('content-length')
-            if content_length:
-                file_size = int(content_length)
-                return file_size <= Config.MAX_IMAGE_SIZE, file_size
-            
-            # Если нет заголовка, проверим размер контента
-            content = response.content
-            file_size = len(content)
+        
+        if media is not None:
+            file_size = media.file_size
+            if file_size is None:
+                from app.utils.media_storage import get_storage
+                file_size = get_storage().stat(media.file_path).size
             return file_size <= Config.MAX_IMAGE_SIZE, file_size
-        except:
+        
+        if probe is None:
+            probe = VerificationService._probe_remote_image(url)
+        if not probe:
             return False, 0
+        
+        file_size = probe['file_size']
+        if file_size is None:
+            # Сервер не сообщил размер - досчитать поток (без хранения в памяти)
+            file_size = VerificationService._measure_remote_size(url, Config.MAX_IMAGE_SIZE)
+            if file_size is None:
+                return False, 0
+        return file_size <= Config.MAX_IMAGE_SIZE, file_size
+    
+    @staticmethod
+    def _probe_remote_image(url):
+        """
+        Определить размеры, формат и размер файла изображения по URL,
+        скачав только начало файла (HTTP Range)
+        
+        Заголовок изображения подается в PIL по частям, пока не станут
+        известны размеры. Полное скачивание выполняется, только если
+        заголовок не удалось разобрать.
+        
+        Returns:
+            dict: {'width', 'height', 'format', 'file_size'} или None при ошибке
+        """
+        from config import Config
+        from PIL import ImageFile
+        
+        probe_bytes = Config.IMAGE_PROBE_BYTES
+        try:
+            with host_guard.slot(url) as guarded:
+                response = guarded.observe(requests.get(
+                    url,
+                    timeout=10,
+                    stream=True,
+                    headers={'Range': f'bytes=0-{probe_bytes - 1}'}
+                ))
+                if response.status_code not in (200, 206):
+                    response.close()
+                    return None
+                
+                file_size = VerificationService._get_remote_file_size(response)
+                parser = ImageFile.Parser()
+                received = 0
+                try:
+                    for chunk in response.iter_content(chunk_size=8192):
+                        received += len(chunk)
+                        try:
+                            parser.feed(chunk)
+                        except Exception:
+                            break
+                        if parser.image is not None or received >= probe_bytes:
+                            break
+                finally:
+                    response.close()
+                
+                if parser.image is not None:
+                    width, height = parser.image.size
+                    return {
+                        'width': width,
+                        'height': height,
+                        'format': parser.image.format,
+                        'file_size': file_size,
+                    }
+        except HostUnavailableError:
+            raise
+        except Exception:
+            return None
+        
+        # Заголовок не распознан - скачать файл целиком
+        return VerificationService._fetch_full_image(url)
+    
+    @staticmethod
+    def _fetch_full_image(url):
+        """
+        Скачать изображение целиком (не больше MAX_IMAGE_SIZE) и прочитать его параметры
+        
+        Returns:
+            dict: {'width', 'height', 'format', 'file_size'} или None при ошибке
+        """
+        from config import Config
+        try:
+            with host_guard.slot(url) as guarded:
+                response = guarded.observe(requests.get(url, timeout=10, stream=True))
+                if response.status_code != 200:
+                    response.close()
+                    return None
+                
+                buffer = io.BytesIO()
+                try:
+                    for chunk in response.iter_content(chunk_size=8192):
+                        buffer.write(chunk)
+                        if buffer.tell() > Config.MAX_IMAGE_SIZE:
+                            break
+                finally:
+                    response.close()
+                
+                file_size = buffer.tell()
+                buffer.seek(0)
+                with Image.open(buffer) as img:
+                    width, height = img.size
+                    return {
+                        'width': width,
+                        'height': height,
+                        'format': img.format,
+                        'file_size': file_size,
+                    }
+        except HostUnavailableError:
+            raise
+        except Exception:
+            return None
+    
+    @staticmethod
+    def _get_remote_file_size(response):
+        """Получить полный размер файла из заголовков Content-Range/Content-Length"""
+        content_range = response.headers.get('Content-Range', '')
+        if '/' in content_range:
+            total = content_range.rsplit('/', 1)[1].strip()
+            if total.isdigit():
+                return int(total)
+        
+        if response.status_code == 200:
+            content_length = response.headers.get('Content-Length', '')
+            if content_length.isdigit():
+                return int(content_length)
+        
+        return None
+    
+    @staticmethod
+    def _measure_remote_size(url, limit):
+        """
+        Посчитать размер файла по URL потоково, остановившись после превышения limit
+        
+        Returns:
+            int: Размер в байтах (limit + 1, если файл больше limit) или None при ошибке
+        """
+        try:
+            with host_guard.slot(url) as guarded:
+                response = guarded.observe(requests.get(url, timeout=10, stream=True))
+                if response.status_code != 200:
+                    response.close()
+                    return None
+                
+                size = 0
+                try:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        size += len(chunk)
+                        if size > limit:
+                            return limit + 1
+                finally:
+                    response.close()
+                return size
+        except HostUnavailableError:
+            raise
+        except Exception:
+            return None
     
     @staticmethod
     def _is_3d_model_url(url):
@@ -455,28 +1003,35 @@ class VerificationService:
         return False
     
     @staticmethod
-    def _check_3d_model_url(url):
-        """Проверить доступность 3D модели по URL"""
+    def _check_3d_model_url(url, media=None):
+        """Проверить доступность 3D модели по URL (или наличие локальной копии)"""
+        if media is not None:
+            return True
         try:
-            response = requests.head(url, timeout=10, allow_redirects=True)
+            with host_guard.slot(url) as guarded:
+                response = guarded.observe(requests.head(url, timeout=10, allow_redirects=True))
             return response.status_code == 200
+        except HostUnavailableError:
+            raise
         except:
             return False
     
     @staticmethod
-    def _update_status_based_on_score(product, score):
-        """Обновить статус товара на основе оценки верификации"""
+    def _update_status_based_on_score(product, score, user=None):
+        """
+        Обновить статус товара на основе оценки верификации
+        
+        Args:
+            user: Пользователь для истории статусов (по умолчанию - текущий пользователь запроса;
+                  в фоновых заданиях запроса нет)
+        """
         from app.models.workflow import ProductStatusHistory
         from flask_login import current_user
         
         old_status = product.status
+        changed_by = user if user is not None else current_user
         
-        if score >= 80:
-            new_status = ProductStatus.APPROVED
-        elif score >= 50:
-            new_status = ProductStatus.TO_REVIEW
-        else:
-            new_status = ProductStatus.REJECTED
+        new_status = ScoringService.status_for_score(score)
         
         if old_status != new_status:
             product.status = new_status
@@ -486,7 +1041,7 @@ class VerificationService:
                 product_id=product.id,
                 old_status=old_status.value,
                 new_status=new_status.value,
-                changed_by_id=current_user.id if current_user.is_authenticated else None,
+                changed_by_id=changed_by.id if getattr(changed_by, 'is_authenticated', False) else None,
                 comment=f'Автоматический переход на основе верификации (оценка: {score}%)'
             )
             db.session.add(history)
@@ -4,6 +4,7 @@
 from app import db
 from app.models.import_history import ImportHistory, ImportFileStatus
 from app.models.product import Product
+from app.utils.pagination import CursorError, paginate
 from flask import current_app
 from sqlalchemy import func, or_
 
@@ -35,7 +36,7 @@ class CatalogService:
             }
     
     @staticmethod
-    def get_imports(filters=None, page=1, per_page=20):
+    def get_imports(filters=None, page=1, per_page=20, cursor=None, total='exact'):
         """
         Получить импорты в каталоге с фильтрацией и пагинацией
         
@@ -48,6 +49,8 @@ class CatalogService:
                 - search: поисковый запрос
             page: номер страницы
             per_page: количество на странице
+            cursor: курсор следующей страницы (вместо номера страницы, '' - первая)
+            total: подсчет общего количества ('exact', 'cached', 'estimate', 'none')
         
         Returns:
             dict: {
@@ -55,8 +58,13 @@ class CatalogService:
                 'total': общее количество,
                 'page': текущая страница,
                 'per_page': количество на странице,
-                'pages': всего страниц
+                'pages': всего страниц,
+                'next_cursor': курсор следующей страницы,
+                'has_more': есть ли следующая страница
             }
+        
+        Raises:
+            CursorError: некорректный курсор
         """
         try:
             filters = filters or {}
@@ -84,20 +92,13 @@ class CatalogService:
                     )
                 )
             
-            # Пагинация
-            pagination = query.order_by(ImportHistory.imported_at.desc()).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
+            # Пагинация по (ключ сортировки, id): с курсором - без OFFSET
+            return paginate(
+                query, (ImportHistory.imported_at, ImportHistory.id),
+                page=page, per_page=per_page, cursor=cursor, total=total
             )
-            
-            return {
-                'items': pagination.items,
-                'total': pagination.total,
-                'page': page,
-                'per_page': per_page,
-                'pages': pagination.pages,
-            }
+        except CursorError:
+            raise
         except Exception as e:
             current_app.logger.error(f"Ошибка при получении импортов в каталоге: {str(e)}", exc_info=True)
             return {
@@ -106,5 +107,7 @@ class CatalogService:
                 'page': page,
                 'per_page': per_page,
                 'pages': 0,
+                'next_cursor': None,
+                'has_more': False,
             }
 
@@ -4,6 +4,7 @@
 from app import db
 from app.models.import_history import ImportHistory, ImportFileStatus
 from app.models.product import Product
+from app.utils.pagination import CursorError, paginate
 from flask import current_app
 from sqlalchemy import func, or_
 
@@ -33,7 +34,7 @@ class ExportService:
             }
     
     @staticmethod
-    def get_exports(filters=None, page=1, per_page=20):
+    def get_exports(filters=None, page=1, per_page=20, cursor=None, total='exact'):
         """
         Получить экспорты с фильтрацией и пагинацией
         
@@ -46,6 +47,8 @@ class ExportService:
                 - search: поисковый запрос
             page: номер страницы
             per_page: количество на странице
+            cursor: курсор следующей страницы (вместо номера страницы, '' - первая)
+            total: подсчет общего количества ('exact', 'cached', 'estimate', 'none')
         
         Returns:
             dict: {
@@ -53,8 +56,13 @@ class ExportService:
                 'total': общее количество,
                 'page': текущая страница,
                 'per_page': количество на странице,
-                'pages': всего страниц
+                'pages': всего страниц,
+                'next_cursor': курсор следующей страницы,
+                'has_more': есть ли следующая страница
             }
+        
+        Raises:
+            CursorError: некорректный курсор
         """
         try:
             filters = filters or {}
@@ -89,20 +97,13 @@ class ExportService:
                     )
                 )
             
-            # Пагинация
-            pagination = query.order_by(ImportHistory.exported_at.desc()).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
+            # Пагинация по (ключ сортировки, id): с курсором - без OFFSET
+            return paginate(
+                query, (ImportHistory.exported_at, ImportHistory.id),
+                page=page, per_page=per_page, cursor=cursor, total=total
             )
-            
-            return {
-                'items': pagination.items,
-                'total': pagination.total,
-                'page': page,
-                'per_page': per_page,
-                'pages': pagination.pages,
-            }
+        except CursorError:
+            raise
         except Exception as e:
             current_app.logger.error(f"Ошибка при получении экспортов: {str(e)}", exc_info=True)
             return {
@@ -111,5 +112,7 @@ class ExportService:
                 'page': page,
                 'per_page': per_page,
                 'pages': 0,
+                'next_cursor': None,
+                'has_more': False,
             }
 
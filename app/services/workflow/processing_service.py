@@ -3,6 +3,7 @@
 """
 from app import db
 from app.models.import_history import ImportHistory, ImportFileStatus
+from app.utils.pagination import CursorError, paginate
 from flask import current_app
 from sqlalchemy import func, or_
 
@@ -34,7 +35,7 @@ class ProcessingService:
             }
     
     @staticmethod
-    def get_files(filters=None, page=1, per_page=20):
+    def get_files(filters=None, page=1, per_page=20, cursor=None, total='exact'):
         """
         Получить файлы в обработке с фильтрацией и пагинацией
         
@@ -45,6 +46,8 @@ class ProcessingService:
                 - search: поисковый запрос
             page: номер страницы
             per_page: количество на странице
+            cursor: курсор следующей страницы (вместо номера страницы, '' - первая)
+            total: подсчет общего количества ('exact', 'cached', 'estimate', 'none')
         
         Returns:
             dict: {
@@ -52,8 +55,13 @@ class ProcessingService:
                 'total': общее количество,
                 'page': текущая страница,
                 'per_page': количество на странице,
-                'pages': всего страниц
+                'pages': всего страниц,
+                'next_cursor': курсор следующей страницы,
+                'has_more': есть ли следующая страница
             }
+        
+        Raises:
+            CursorError: некорректный курсор
         """
         try:
             filters = filters or {}
@@ -81,20 +89,13 @@ class ProcessingService:
                     )
                 )
             
-            # Пагинация
-            pagination = query.order_by(ImportHistory.imported_at.desc()).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
+            # Пагинация по (ключ сортировки, id): с курсором - без OFFSET
+            return paginate(
+                query, (ImportHistory.imported_at, ImportHistory.id),
+                page=page, per_page=per_page, cursor=cursor, total=total
             )
-            
-            return {
-                'items': pagination.items,
-                'total': pagination.total,
-                'page': page,
-                'per_page': per_page,
-                'pages': pagination.pages,
-            }
+        except CursorError:
+            raise
         except Exception as e:
             current_app.logger.error(f"Ошибка при получении файлов в обработке: {str(e)}", exc_info=True)
             return {
@@ -103,5 +104,7 @@ class ProcessingService:
                 'page': page,
                 'per_page': per_page,
                 'pages': 0,
+                'next_cursor': None,
+                'has_more': False,
             }
 
@@ -0,0 +1,230 @@
+"""
+Скомпилированные валидаторы атрибутов и схемы подкатегорий
+
+Каждый атрибут компилируется один раз в валидатор (предкомпилированный шаблон,
+границы min/max, множество значений SELECT, выбранный парсер даты), а подкатегория -
+в схему (обязательные атрибуты и валидаторы по ID атрибута). Используется
+импортом и верификацией вместо разбора правил на каждое значение.
+
+Кэш сбрасывается при изменении Attribute, AttributeValue, Subcategory и SubcategoryAttribute
+в текущем процессе; для изменений из других процессов действует время жизни кэша.
+"""
+import re
+import threading
+import time
+from datetime import datetime
+from itertools import chain
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.models.attribute import Attribute, AttributeType, AttributeValue
+from app.models.subcategory import Subcategory
+from app.models.subcategory_attribute import SubcategoryAttribute
+from config import Config
+
+
+# Форматы дат, принимаемые без явного формата в правилах атрибута
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%Y/%m/%d', '%d-%m-%Y')
+
+# Допустимые значения логического типа
+BOOLEAN_VALUES = frozenset(['true', 'false', '1', '0', 'yes', 'no', 'да', 'нет'])
+
+
+def _make_date_parser(date_format=None):
+    """Выбрать парсер даты: формат из правил атрибута или стандартный набор форматов и ISO 8601"""
+    if date_format:
+        return lambda value: datetime.strptime(value, date_format)
+    
+    def parse(value):
+        for fmt in DATE_FORMATS:
+            try:
+                return datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+        return datetime.fromisoformat(value)
+    
+    return parse
+
+
+class AttributeValidator:
+    """Скомпилированный валидатор значений одного атрибута"""
+    
+    def __init__(self, attribute):
+        """
+        Args:
+            attribute: Объект Attribute (используется только при компиляции)
+        """
+        rules = attribute.validation_rules or {}
+        
+        self.attribute_id = attribute.id
+        self.name = attribute.name
+        self.type = attribute.type
+        self.is_unique = attribute.is_unique
+        self.rules = rules
+        
+        self.min = rules.get('min')
+        self.max = rules.get('max')
+        self.min_length = rules.get('min_length')
+        self.max_length = rules.get('max_length')
+        
+        # Некорректный шаблон игнорируется, как и при проверке без компиляции
+        self.pattern = None
+        if rules.get('pattern'):
+            try:
+                self.pattern = re.compile(rules['pattern'])
+            except (re.error, TypeError):
+                self.pattern = None
+        
+        self.select_values = frozenset(
+            av.value for av in attribute.values.all()
+        ) if attribute.type == AttributeType.SELECT else frozenset()
+        
+        self.parse_date = _make_date_parser(rules.get('format')) if attribute.type == AttributeType.DATE else None
+        
+        self._check_type = {
+            AttributeType.NUMBER: self._check_number,
+            AttributeType.BOOLEAN: self._check_boolean,
+            AttributeType.DATE: self._check_date,
+            AttributeType.SELECT: self._check_select,
+            AttributeType.URL: self._check_url,
+        }.get(attribute.type)
+    
+    def check_type(self, value):
+        """Проверить соответствие значения типу атрибута"""
+        if self._check_type is None:
+            return True
+        try:
+            return self._check_type(value)
+        except (ValueError, TypeError, AttributeError):
+            return False
+    
+    def check_rules(self, value):
+        """Проверить значение по правилам валидации атрибута"""
+        if self.type == AttributeType.NUMBER and (self.min is not None or self.max is not None):
+            try:
+                num_value = float(value)
+            except (ValueError, TypeError):
+                return False
+            if self.min is not None and num_value < self.min:
+                return False
+            if self.max is not None and num_value > self.max:
+                return False
+        
+        if self.pattern is not None and not self.pattern.match(value):
+            return False
+        
+        if self.min_length is not None and len(value) < self.min_length:
+            return False
+        
+        if self.max_length is not None and len(value) > self.max_length:
+            return False
+        
+        return True
+    
+    def _check_number(self, value):
+        float(value)
+        return True
+    
+    def _check_boolean(self, value):
+        return value.lower() in BOOLEAN_VALUES
+    
+    def _check_date(self, value):
+        self.parse_date(value)
+        return True
+    
+    def _check_select(self, value):
+        return value in self.select_values
+    
+    def _check_url(self, value):
+        return value.startswith(('http://', 'https://'))
+
+
+class SubcategorySchema:
+    """Скомпилированная схема подкатегории: обязательные атрибуты и валидаторы"""
+    
+    def __init__(self, subcategory_id, required, validators):
+        """
+        Args:
+            subcategory_id: ID подкатегории
+            required: Кортеж (attribute_id, название) обязательных атрибутов
+            validators: {attribute_id: AttributeValidator} для всех атрибутов подкатегории
+        """
+        self.subcategory_id = subcategory_id
+        self.required = required
+        self.required_ids = frozenset(attribute_id for attribute_id, _ in required)
+        self.validators = validators
+
+
+class ValidatorRegistry:
+    """Кэш скомпилированных валидаторов атрибутов и схем подкатегорий"""
+    
+    def __init__(self, ttl=None):
+        """
+        Args:
+            ttl: Время жизни кэша в секундах (None или 0 - без ограничения)
+        """
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._validators = {}  # attribute_id -> (AttributeValidator, время компиляции)
+        self._schemas = {}  # subcategory_id -> (SubcategorySchema, время компиляции)
+    
+    def get_validator(self, attribute):
+        """Получить скомпилированный валидатор атрибута"""
+        validator = self._get_cached(self._validators, attribute.id)
+        if validator is None:
+            validator = AttributeValidator(attribute)
+            with self._lock:
+                self._validators[attribute.id] = (validator, time.monotonic())
+        return validator
+    
+    def get_schema(self, subcategory):
+        """Получить скомпилированную схему подкатегории"""
+        schema = self._get_cached(self._schemas, subcategory.id)
+        if schema is None:
+            subcat_attrs = SubcategoryAttribute.query.filter_by(subcategory_id=subcategory.id).order_by(
+                SubcategoryAttribute.sort_order
+            ).all()
+            schema = SubcategorySchema(
+                subcategory.id,
+                tuple(
+                    (subcat_attr.attribute_id, subcat_attr.attribute.name)
+                    for subcat_attr in subcat_attrs if subcat_attr.is_required
+                ),
+                {
+                    subcat_attr.attribute_id: self.get_validator(subcat_attr.attribute)
+                    for subcat_attr in subcat_attrs
+                }
+            )
+            with self._lock:
+                self._schemas[subcategory.id] = (schema, time.monotonic())
+        return schema
+    
+    def clear(self):
+        """Сбросить все скомпилированные валидаторы и схемы"""
+        with self._lock:
+            self._validators.clear()
+            self._schemas.clear()
+    
+    def _get_cached(self, cache, key):
+        """Получить объект из кэша с учетом времени жизни"""
+        with self._lock:
+            entry = cache.get(key)
+            if entry is None:
+                return None
+            value, compiled_at = entry
+            if self.ttl and time.monotonic() - compiled_at > self.ttl:
+                del cache[key]
+                return None
+            return value
+
+
+# Общий реестр для процесса
+validator_registry = ValidatorRegistry(ttl=Config.VALIDATOR_CACHE_TTL)
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_on_flush(session, flush_context):
+    """Сбросить реестр при изменении атрибутов, их значений, подкатегорий или их состава"""
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (Attribute, AttributeValue, Subcategory, SubcategoryAttribute)):
+            validator_registry.clear()
+            return
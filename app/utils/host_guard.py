@@ -0,0 +1,229 @@
+"""
+Защита внешних хостов медиа-файлов: circuit breaker и лимит одновременных запросов
+
+Состояние общее для верификации и скачивания медиа в рамках процесса:
+после нескольких ошибок подряд (сетевые ошибки, таймауты, ответы 5xx и 429)
+хост отключается на время охлаждения, и оставшиеся URL на нем сразу пропускаются
+вместо ожидания таймаутов. После охлаждения к хосту пропускается один пробный
+запрос: успех снова открывает хост, ошибка отключает его на новый срок.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import requests
+from config import Config
+
+
+class HostUnavailableError(Exception):
+    """Запрос к хосту пропущен: хост временно отключен или перегружен"""
+    
+    def __init__(self, host, reason):
+        self.host = host
+        self.reason = reason
+        super().__init__(reason)
+
+
+def is_host_error_status(status_code):
+    """Ответ говорит о проблеме на стороне хоста (ошибка сервера или лимит запросов)"""
+    return status_code == 429 or status_code >= 500
+
+
+class GuardedRequest:
+    """Запрос внутри HostGuard.slot(): учитывает код ответа хоста"""
+    
+    def __init__(self):
+        self.failed = False
+    
+    def observe(self, response):
+        """
+        Учесть ответ хоста (ответы 5xx и 429 считаются ошибками хоста)
+        
+        Returns:
+            Ответ без изменений
+        """
+        if is_host_error_status(response.status_code):
+            self.failed = True
+        return response
+
+
+class HostGuard:
+    """Состояние внешних хостов (счетчики ошибок, отключение, лимит запросов)"""
+    
+    def __init__(self, failure_threshold=5, cooldown_seconds=300, max_concurrency=4, acquire_timeout=30):
+        """
+        Args:
+            failure_threshold: Количество ошибок подряд, после которого хост отключается
+            cooldown_seconds: Время отключения хоста в секундах
+            max_concurrency: Максимум одновременных запросов к одному хосту
+            acquire_timeout: Сколько секунд ждать свободный слот для запроса
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.max_concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        
+        self._lock = threading.Lock()
+        self._failures = {}  # host -> количество ошибок подряд
+        self._opened_at = {}  # host -> время отключения (time.monotonic)
+        self._probing = set()  # Хосты, к которым выполняется пробный запрос после охлаждения
+        self._semaphores = {}  # host -> BoundedSemaphore
+    
+    @staticmethod
+    def get_host(url):
+        """Получить имя хоста из URL"""
+        try:
+            return (urlparse(url).hostname or '').lower()
+        except ValueError:
+            return ''
+    
+    def check(self, url):
+        """
+        Проверить, можно ли обращаться к хосту URL
+        
+        Raises:
+            HostUnavailableError: Хост отключен после серии ошибок
+        """
+        with self._lock:
+            self._check_locked(self.get_host(url), claim_probe=False)
+    
+    def _check_locked(self, host, claim_probe):
+        """
+        Проверить состояние хоста (вызывается под self._lock)
+        
+        Args:
+            claim_probe: Занять пробный запрос, если время охлаждения истекло
+        
+        Returns:
+            bool: Запрос - пробный
+        """
+        opened_at = self._opened_at.get(host)
+        if opened_at is None:
+            return False
+        remaining = self.cooldown_seconds - (time.monotonic() - opened_at)
+        failures = self._failures.get(host, 0)
+        
+        if remaining > 0:
+            raise HostUnavailableError(
+                host,
+                f'хост {host} отключен после {failures} ошибок подряд, повторная попытка через {int(remaining) + 1} с'
+            )
+        # Время охлаждения истекло - пропускается только один пробный запрос
+        if host in self._probing:
+            raise HostUnavailableError(
+                host,
+                f'хост {host} отключен после {failures} ошибок подряд, выполняется пробный запрос'
+            )
+        if claim_probe:
+            self._probing.add(host)
+        return claim_probe
+    
+    @contextmanager
+    def slot(self, url):
+        """
+        Выполнить запрос к хосту URL с учетом circuit breaker и лимита одновременных запросов
+        
+        Сетевые ошибки, таймауты и ответы 5xx/429 (HTTPError или переданные
+        в GuardedRequest.observe) внутри блока считаются ошибками хоста.
+        
+        Yields:
+            GuardedRequest: для передачи ответа хоста
+        
+        Raises:
+            HostUnavailableError: Хост отключен или все слоты заняты
+        """
+        host = self.get_host(url)
+        with self._lock:
+            probe = self._check_locked(host, claim_probe=True)
+        semaphore = self._get_semaphore(host)
+        
+        try:
+            if not semaphore.acquire(timeout=self.acquire_timeout):
+                raise HostUnavailableError(
+                    host,
+                    f'превышен лимит одновременных запросов к хосту {host} ({self.max_concurrency})'
+                )
+            guarded = GuardedRequest()
+            try:
+                yield guarded
+            except (requests.ConnectionError, requests.Timeout):
+                self.record_failure(url)
+                raise
+            except requests.HTTPError as e:
+                if guarded.failed or (e.response is not None and is_host_error_status(e.response.status_code)):
+                    self.record_failure(url)
+                raise
+            except Exception:
+                if guarded.failed:
+                    self.record_failure(url)
+                raise
+            else:
+                if guarded.failed:
+                    self.record_failure(url)
+                else:
+                    self.record_success(url)
+            finally:
+                semaphore.release()
+        finally:
+            if probe:
+                with self._lock:
+                    self._probing.discard(host)
+    
+    def record_failure(self, url):
+        """Зафиксировать ошибку запроса к хосту"""
+        host = self.get_host(url)
+        with self._lock:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if failures >= self.failure_threshold:
+                self._opened_at[host] = time.monotonic()
+    
+    def record_success(self, url):
+        """Зафиксировать успешный запрос к хосту (сбрасывает счетчик ошибок)"""
+        host = self.get_host(url)
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+    
+    def get_state(self):
+        """
+        Получить состояние хостов с ошибками
+        
+        Returns:
+            dict: {host: {'failures': int, 'open': bool}}
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                host: {
+                    'failures': failures,
+                    'open': host in self._opened_at and now - self._opened_at[host] < self.cooldown_seconds,
+                }
+                for host, failures in self._failures.items()
+            }
+    
+    def reset(self):
+        """Сбросить состояние всех хостов"""
+        with self._lock:
+            self._failures.clear()
+            self._opened_at.clear()
+            self._probing.clear()
+            self._semaphores.clear()
+    
+    def _get_semaphore(self, host):
+        """Получить семафор хоста (создается при первом обращении)"""
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.max_concurrency)
+                self._semaphores[host] = semaphore
+            return semaphore
+
+
+# Общее состояние хостов для процесса
+host_guard = HostGuard(
+    failure_threshold=Config.HOST_FAILURE_THRESHOLD,
+    cooldown_seconds=Config.HOST_COOLDOWN_SECONDS,
+    max_concurrency=Config.HOST_MAX_CONCURRENCY,
+    acquire_timeout=Config.HOST_ACQUIRE_TIMEOUT
+)
@@ -0,0 +1,86 @@
+"""
+Перцептивный хэш изображений (pHash) и поиск похожих по расстоянию Хэмминга
+
+pHash - 64 бита: знаки низкочастотных коэффициентов DCT уменьшенного
+полутонового изображения относительно медианы. Одно и то же фото в другом
+разрешении, формате или с другим сжатием дает хэш на малом расстоянии Хэмминга.
+
+Для поиска без перебора всех хэшей используется индекс из нескольких частей
+(multi-index hashing): хэш делится на PHASH_BANDS частей по 16 бит, каждая
+хранится в отдельном индексированном столбце. Если расстояние между хэшами
+не больше r, то хотя бы одна часть отличается не больше чем на r // PHASH_BANDS
+бит (принцип Дирихле), поэтому кандидаты находятся точными запросами по индексам
+частей с небольшим числом соседних значений, а расстояние проверяется только у них.
+"""
+from itertools import combinations
+import numpy as np
+from PIL import Image
+
+
+PHASH_BITS = 64
+PHASH_BANDS = 4
+BAND_BITS = PHASH_BITS // PHASH_BANDS
+
+# Размер уменьшенного изображения для DCT и размер блока низких частот
+DCT_SIZE = 32
+LOW_FREQ_SIZE = 8
+
+
+def _dct_matrix(size):
+    """Матрица одномерного DCT-II"""
+    k = np.arange(size).reshape(-1, 1)
+    n = np.arange(size).reshape(1, -1)
+    return np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+def phash(img):
+    """
+    Перцептивный хэш изображения
+    
+    Args:
+        img: Изображение PIL (загруженное)
+    
+    Returns:
+        str: 16 шестнадцатеричных символов
+    """
+    gray = img.convert('L').resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:LOW_FREQ_SIZE, :LOW_FREQ_SIZE].flatten()
+    # Постоянная составляющая (яркость) в сравнение с медианой не входит
+    bits = low > np.median(low[1:])
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f'{value:016x}'
+
+
+def hamming(a, b):
+    """Расстояние Хэмминга между хэшами (шестнадцатеричные строки)"""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def hash_bands(value):
+    """
+    Части хэша для индекса
+    
+    Returns:
+        list: PHASH_BANDS целых чисел (старшая часть первой)
+    """
+    number = int(value, 16)
+    mask = (1 << BAND_BITS) - 1
+    return [(number >> (BAND_BITS * (PHASH_BANDS - 1 - i))) & mask for i in range(PHASH_BANDS)]
+
+
+def band_neighbours(band, radius):
+    """Значения части хэша на расстоянии не больше radius бит (включая саму часть)"""
+    values = [band]
+    for distance in range(1, radius + 1):
+        for positions in combinations(range(BAND_BITS), distance):
+            value = band
+            for position in positions:
+                value ^= 1 << position
+            values.append(value)
+    return values
@@ -0,0 +1,124 @@
+"""
+Отдача медиа-файлов: передача отправки фронт-прокси, ETag, кэширование, Range
+
+В режиме Config.MEDIA_SENDFILE_MODE = 'nginx' (X-Accel-Redirect) или 'sendfile'
+(X-Sendfile) приложение только проверяет доступ и возвращает заголовок, а файл
+(включая Range-запросы для докачки) отдает прокси - воркер не занят на время передачи.
+Без прокси файл отдается через send_file с условными запросами (304) и Range (206).
+
+Файлы хранилища с адресацией по содержимому (<sha256>.<ext> и их уменьшенные копии
+<sha256>_<размер>.<ext>) не меняются, поэтому получают ETag по хэшу и
+Cache-Control: immutable. Остальные файлы кэшируются с обязательной перепроверкой.
+
+При объектном хранилище (Config.MEDIA_STORAGE = 's3') приложение проверяет доступ
+и перенаправляет клиента на временную подписанную ссылку хранилища.
+"""
+import re
+from pathlib import Path
+from urllib.parse import quote
+from flask import abort, current_app, redirect, request, send_file
+from app.utils.media_storage import get_storage
+from config import Config
+
+
+# Имя файла хранилища: sha256 и необязательный размер уменьшенной копии
+CONTENT_ADDRESSED_NAME = re.compile(r'^(?P<sha256>[0-9a-f]{64})(?:_(?P<size>\d+))?$')
+
+
+def content_etag(path):
+    """
+    ETag файла хранилища по хэшу содержимого
+    
+    Returns:
+        str: ETag или None, если имя файла не содержит хэш
+    """
+    match = CONTENT_ADDRESSED_NAME.match(Path(path).stem)
+    if not match:
+        return None
+    if match.group('size'):
+        return f"{match.group('sha256')}-{match.group('size')}{Path(path).suffix}"
+    return f"{match.group('sha256')}{Path(path).suffix}"
+
+
+def send_media(path, mimetype=None, etag=None):
+    """
+    Ответ с медиа-файлом
+    
+    Args:
+        path: Абсолютный путь к файлу (внутри Config.MEDIA_FOLDER)
+        mimetype: MIME тип (по умолчанию по расширению)
+        etag: ETag (по умолчанию по хэшу содержимого из имени файла)
+    
+    Returns:
+        Response
+    """
+    path = Path(path)
+    etag = etag or content_etag(path)
+    immutable = etag is not None
+    mode = Config.MEDIA_SENDFILE_MODE
+    
+    relative = None
+    if mode == 'nginx':
+        try:
+            relative = path.resolve().relative_to(Path(Config.MEDIA_FOLDER).resolve())
+        except ValueError:
+            # Файл вне каталога медиа (старые записи с абсолютным путем) прокси не отдаст
+            current_app.logger.warning(f"Медиа-файл вне {Config.MEDIA_FOLDER} отдается приложением: {path}")
+            mode = None
+    
+    if mode in ('nginx', 'sendfile'):
+        response = current_app.response_class(mimetype=mimetype)
+        if mimetype is None:
+            # Тип определит прокси по расширению файла
+            del response.headers['Content-Type']
+        if etag:
+            response.set_etag(etag)
+            if request.if_none_match.contains(etag):
+                response.status_code = 304
+                _set_cache_headers(response, immutable)
+                return response
+        if mode == 'nginx':
+            response.headers['X-Accel-Redirect'] = Config.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative.as_posix())
+        else:
+            response.headers['X-Sendfile'] = str(path.resolve())
+        _set_cache_headers(response, immutable)
+        return response
+    
+    # Отдача приложением: If-None-Match/If-Modified-Since -> 304, Range -> 206
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=etag if etag else True)
+    _set_cache_headers(response, immutable)
+    return response
+
+
+def send_stored_media(file_path, mimetype=None):
+    """
+    Ответ с файлом хранилища медиа-файлов по ключу (ProductMedia.file_path)
+    
+    Объектное хранилище - перенаправление на подписанную ссылку (кэшируется браузером
+    на половину срока ее действия), локальное - send_media().
+    """
+    storage = get_storage()
+    url = storage.url(file_path, mimetype=mimetype)
+    if url is not None:
+        response = redirect(url)
+        response.cache_control.private = True
+        response.cache_control.max_age = Config.MEDIA_S3_URL_EXPIRES // 2
+        return response
+    
+    path = storage.local_path(file_path)
+    if not path.is_file():
+        abort(404)
+    return send_media(path, mimetype=mimetype)
+
+
+def _set_cache_headers(response, immutable):
+    """Заголовки кэширования (медиа доступны только авторизованным пользователям)"""
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if immutable:
+        response.cache_control.max_age = Config.MEDIA_CACHE_SECONDS
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    else:
+        response.cache_control.max_age = 0
+        response.cache_control.no_cache = True
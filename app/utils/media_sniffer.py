@@ -0,0 +1,164 @@
+"""
+Определение формата медиа-файла по содержимому
+
+Тип файла определяется по сигнатуре первых байт, а не по URL: ссылка
+со словом "model" может вести на JPEG, а ссылка на .jpg - на HTML-страницу
+с ошибкой. Для GLB читаются заголовок и JSON-блок, без загрузки геометрии.
+"""
+import io
+import json
+import struct
+from PIL import ImageFile
+from app.models.product_media import MediaType
+
+
+# Сколько первых байт нужно для определения формата
+SNIFF_BYTES = 4096
+
+# Текстовые форматы 3D моделей без надежной сигнатуры (принимаются по расширению URL)
+TEXT_MODEL_EXTENSIONS = {'.obj', '.stl', '.3ds'}
+
+MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.bmp': 'image/bmp',
+    '.svg': 'image/svg+xml',
+    '.glb': 'model/gltf-binary',
+    '.gltf': 'model/gltf+json',
+    '.fbx': 'application/octet-stream',
+    '.ply': 'application/octet-stream',
+    '.dae': 'model/vnd.collada+xml',
+    '.obj': 'model/obj',
+    '.stl': 'model/stl',
+    '.3ds': 'application/octet-stream',
+}
+
+
+class MediaFormatError(ValueError):
+    """Содержимое файла не является поддерживаемым медиа-файлом"""
+
+
+def sniff_media(head, url_ext=''):
+    """
+    Определить тип и формат медиа-файла по первым байтам
+    
+    Args:
+        head: Первые байты файла (не меньше SNIFF_BYTES, если файл больше)
+        url_ext: Расширение файла в URL (для текстовых форматов 3D моделей)
+    
+    Returns:
+        tuple: (MediaType, расширение, MIME тип)
+    
+    Raises:
+        MediaFormatError: Формат не распознан или получена HTML-страница
+    """
+    text = head.lstrip(b'\xef\xbb\xbf \t\r\n')
+    lower = text[:2048].lower()
+    
+    if head.startswith(b'\xff\xd8\xff'):
+        ext = '.jpg'
+    elif head.startswith(b'\x89PNG\r\n\x1a\n'):
+        ext = '.png'
+    elif head[:6] in (b'GIF87a', b'GIF89a'):
+        ext = '.gif'
+    elif head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        ext = '.webp'
+    elif head[:2] == b'BM' and len(head) >= 26:
+        ext = '.bmp'
+    elif head[:4] == b'glTF':
+        ext = '.glb'
+    elif head.startswith(b'Kaydara FBX Binary'):
+        ext = '.fbx'
+    elif head.startswith((b'ply\n', b'ply\r\n')):
+        ext = '.ply'
+    elif lower.startswith((b'<!doctype html', b'<html')):
+        raise MediaFormatError('получена HTML-страница вместо медиа-файла')
+    elif lower.startswith(b'<svg') or (lower.startswith(b'<?xml') and b'<svg' in lower):
+        ext = '.svg'
+    elif lower.startswith(b'<?xml') and b'<collada' in lower:
+        ext = '.dae'
+    elif text.startswith(b'{') and b'"asset"' in head:
+        ext = '.gltf'
+    elif url_ext in TEXT_MODEL_EXTENSIONS:
+        ext = url_ext
+    else:
+        raise MediaFormatError('формат файла не распознан')
+    
+    media_type = MediaType.IMAGE if MIME_TYPES[ext].startswith('image/') else MediaType.THREE_D_MODEL
+    return media_type, ext, MIME_TYPES[ext]
+
+
+def image_size_from_header(head):
+    """
+    Размеры изображения по заголовку (без декодирования)
+    
+    Returns:
+        tuple: (ширина, высота) или None, если заголовок не помещается в head
+    """
+    parser = ImageFile.Parser()
+    try:
+        parser.feed(head)
+    except Exception:
+        return None
+    return parser.image.size if parser.image else None
+
+
+def glb_declared_length(head):
+    """Размер файла из заголовка GLB (None, если заголовок неполный)"""
+    if len(head) < 12 or head[:4] != b'glTF':
+        return None
+    return struct.unpack_from('<I', head, 8)[0]
+
+
+def parse_glb_stats(path, max_json_bytes=4 * 1024 * 1024):
+    """
+    Основные параметры GLB-модели по заголовку и JSON-блоку
+    
+    Бинарный блок с геометрией не читается.
+    
+    Args:
+        path: Путь к файлу
+        max_json_bytes: Максимальный размер JSON-блока
+    
+    Returns:
+        dict: version, meshes, nodes, materials, textures, animations, vertices
+    
+    Raises:
+        MediaFormatError: Поврежденный заголовок GLB
+    """
+    with open(path, 'rb') as f:
+        header = f.read(20)
+        if len(header) < 20 or header[:4] != b'glTF':
+            raise MediaFormatError('поврежденный заголовок GLB')
+        version, length = struct.unpack_from('<II', header, 4)
+        json_length, chunk_type = struct.unpack_from('<II', header, 12)
+        if chunk_type != 0x4E4F534A:  # 'JSON'
+            raise MediaFormatError('в GLB нет JSON-блока')
+        if json_length > max_json_bytes:
+            raise MediaFormatError(f'JSON-блок GLB слишком большой ({json_length} байт)')
+        try:
+            document = json.load(io.TextIOWrapper(io.BytesIO(f.read(json_length)), encoding='utf-8'))
+        except ValueError as e:
+            raise MediaFormatError(f'поврежденный JSON-блок GLB: {e}')
+    
+    accessors = document.get('accessors') or []
+    vertices = 0
+    for mesh in document.get('meshes') or []:
+        for primitive in mesh.get('primitives') or []:
+            index = (primitive.get('attributes') or {}).get('POSITION')
+            if isinstance(index, int) and 0 <= index < len(accessors):
+                vertices += accessors[index].get('count') or 0
+    
+    return {
+        'version': version,
+        'length': length,
+        'generator': (document.get('asset') or {}).get('generator'),
+        'meshes': len(document.get('meshes') or []),
+        'nodes': len(document.get('nodes') or []),
+        'materials': len(document.get('materials') or []),
+        'textures': len(document.get('textures') or []),
+        'animations': len(document.get('animations') or []),
+        'vertices': vertices,
+    }
@@ -0,0 +1,402 @@
+"""
+Хранилище медиа-файлов: локальная файловая система или объектное хранилище
+
+Ключ файла - путь ProductMedia.file_path / MediaBlob.file_path (относительно
+корня проекта, например media/images/ab/cd/<sha256>.jpg), поэтому записи БД
+одинаковы для обоих вариантов и переносятся между ними копированием файлов.
+
+Config.MEDIA_STORAGE выбирает вариант:
+- 'local' - файлы в папке проекта (один сервер или общая сетевая папка);
+- 's3' - S3-совместимое объектное хранилище (AWS S3, MinIO, Ceph) через boto3,
+  несколько серверов приложения работают с общими файлами. Файлы отдаются
+  клиенту напрямую из хранилища по временной подписанной ссылке, а для обработки
+  (анализ, уменьшенные копии, проверка) скачиваются в локальный кэш. Файлы
+  с адресацией по содержимому не меняются, поэтому кэш не устаревает. Объем кэша
+  ограничен Config.MEDIA_CACHE_MAX_BYTES: при превышении удаляются файлы, которые
+  дольше всех не читались (время изменения файла кэша обновляется при каждом чтении).
+"""
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from pathlib import Path, PurePosixPath
+from config import Config
+
+
+# Файл хранилища: ключ, размер в байтах, время изменения (timestamp)
+StoredFile = namedtuple('StoredFile', ['key', 'size', 'mtime'])
+
+# Коды ошибки S3 "объект не найден"
+NOT_FOUND_CODES = {'404', 'NoSuchKey', 'NotFound'}
+
+# Файлы кэша, прочитанные недавно, не вытесняются (их путь мог только что получить вызывающий код)
+CACHE_KEEP_RECENT_SECONDS = 60
+
+# После вытеснения кэш занимает не больше этой доли предела (чтобы не чистить его на каждом скачивании)
+CACHE_LOW_WATERMARK = 0.9
+
+
+class MediaStorage(ABC):
+    """Базовый класс хранилища медиа-файлов (реализация обязана определить все абстрактные методы)"""
+    
+    @abstractmethod
+    def stat(self, key):
+        """Размер и время изменения файла (None - файла нет)"""
+        raise NotImplementedError
+    
+    def exists(self, key):
+        """Есть ли файл в хранилище"""
+        return self.stat(key) is not None
+    
+    @abstractmethod
+    def open(self, key):
+        """
+        Открыть файл для потокового чтения
+        
+        Returns:
+            Файловый объект с методами read(size) и close()
+        
+        Raises:
+            FileNotFoundError: Файла нет
+        """
+        raise NotImplementedError
+    
+    @abstractmethod
+    def put_file(self, key, path):
+        """Перенести локальный файл в хранилище (исходный файл перестает существовать по path)"""
+        raise NotImplementedError
+    
+    def touch(self, key):
+        """Обновить время изменения файла (сборка мусора отсчитывает срок хранения заново)"""
+    
+    @abstractmethod
+    def delete(self, key):
+        """Удалить файл (отсутствующий файл - не ошибка)"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def url(self, key, mimetype=None, expires=None):
+        """Прямая ссылка на файл для клиента (None - файл отдает приложение)"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def local_path(self, key):
+        """
+        Локальный путь для чтения файла (для объектного хранилища - копия в кэше)
+        
+        Возвращаемый путь может не существовать, если файла нет в хранилище.
+        """
+        raise NotImplementedError
+    
+    @abstractmethod
+    def iter_files(self, prefix):
+        """
+        Потоковый обход файлов с ключами, начинающимися с prefix
+        
+        Папки временных файлов (.tmp) пропускаются.
+        
+        Yields:
+            StoredFile
+        """
+        raise NotImplementedError
+    
+    @abstractmethod
+    def normalize(self, key):
+        """Ключ в виде для сравнения"""
+        raise NotImplementedError
+    
+    def trim_cache(self):
+        """
+        Сократить локальный кэш до предельного объема
+        
+        Returns:
+            dict: files, bytes - удаленные из кэша файлы и их объем
+        """
+        return {'files': 0, 'bytes': 0}
+
+
+class LocalStorage(MediaStorage):
+    """Файлы в локальной файловой системе (ключ - путь относительно корня проекта)"""
+    
+    def __init__(self, root=None):
+        self._root = Path(root) if root is not None else None
+    
+    @property
+    def root(self):
+        """Корень хранилища (по умолчанию Config.basedir)"""
+        return self._root if self._root is not None else Path(Config.basedir)
+    
+    def key_for(self, path):
+        """Ключ файла по абсолютному пути (вне корня - сам путь)"""
+        try:
+            return str(Path(path).relative_to(self.root))
+        except ValueError:
+            return str(path)
+    
+    def local_path(self, key):
+        path = Path(key)
+        return path if path.is_absolute() else self.root / path
+    
+    def url(self, key, mimetype=None, expires=None):
+        return None
+    
+    def stat(self, key):
+        try:
+            stat = os.stat(self.local_path(key))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return StoredFile(key, stat.st_size, stat.st_mtime)
+    
+    def open(self, key):
+        return open(self.local_path(key), 'rb')
+    
+    def put_file(self, key, path):
+        target = self.local_path(key)
+        if Path(path) == target:
+            return
+        os.makedirs(target.parent, exist_ok=True)
+        os.replace(path, target)
+    
+    def touch(self, key):
+        try:
+            os.utime(self.local_path(key))
+        except FileNotFoundError:
+            pass
+    
+    def delete(self, key):
+        self.local_path(key).unlink(missing_ok=True)
+    
+    def iter_files(self, prefix):
+        folder = self.local_path(prefix)
+        if not folder.is_dir():
+            return
+        stack = [folder]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name != '.tmp':
+                                stack.append(Path(entry.path))
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            yield StoredFile(self.key_for(entry.path), stat.st_size, stat.st_mtime)
+            except FileNotFoundError:
+                continue
+    
+    def normalize(self, key):
+        return os.path.normcase(os.path.abspath(str(self.local_path(key))))
+
+
+class ObjectStorage(MediaStorage):
+    """
+    S3-совместимое объектное хранилище
+    
+    client - клиент с интерфейсом boto3 S3 (head_object, get_object, upload_file,
+    delete_object, generate_presigned_url, get_paginator('list_objects_v2')).
+    """
+    
+    def __init__(self, client, bucket, prefix='', cache_folder=None):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.cache_folder = Path(cache_folder or Config.MEDIA_CACHE_FOLDER)
+        self._cache_bytes = None  # Оценка объема кэша (None - еще не подсчитан)
+        self._cache_lock = threading.Lock()
+    
+    def normalize(self, key):
+        return PurePosixPath(str(key).replace('\\', '/')).as_posix().lstrip('/')
+    
+    def _object_key(self, key):
+        return self.prefix + self.normalize(key)
+    
+    def local_path(self, key):
+        path = self.cache_folder / self.normalize(key)
+        try:
+            # Время изменения - время последнего чтения (порядок вытеснения)
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+        
+        # Скачать во временный файл рядом и атомарно перенести (параллельные чтения безопасны)
+        os.makedirs(path.parent, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as target, self.open(key) as source:
+                shutil.copyfileobj(source, target, Config.MEDIA_BUNDLE_CHUNK_SIZE)
+            os.replace(tmp_name, path)
+        except FileNotFoundError:
+            Path(tmp_name).unlink(missing_ok=True)
+            return path
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        
+        self._add_cached(path.stat().st_size)
+        return path
+    
+    def trim_cache(self):
+        """
+        Удалить из кэша файлы, которые дольше всех не читались, пока объем
+        не станет меньше CACHE_LOW_WATERMARK от Config.MEDIA_CACHE_MAX_BYTES
+        """
+        limit = Config.MEDIA_CACHE_MAX_BYTES
+        removed = {'files': 0, 'bytes': 0}
+        with self._cache_lock:
+            files = []
+            total = 0
+            for root, _, names in os.walk(self.cache_folder):
+                for name in names:
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+                    total += stat.st_size
+            
+            if limit and total > limit:
+                target = limit * CACHE_LOW_WATERMARK
+                recent = time.time() - CACHE_KEEP_RECENT_SECONDS
+                for mtime, size, file_path in sorted(files):
+                    if total <= target or mtime >= recent:
+                        break
+                    try:
+                        os.unlink(file_path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    removed['files'] += 1
+                    removed['bytes'] += size
+            self._cache_bytes = total
+        return removed
+    
+    def _add_cached(self, size):
+        """Учесть скачанный в кэш файл; при превышении предела - вытеснить старые файлы"""
+        with self._cache_lock:
+            if self._cache_bytes is not None:
+                self._cache_bytes += size
+            over_limit = self._cache_bytes is None or self._cache_bytes > Config.MEDIA_CACHE_MAX_BYTES
+        # Оценка объема не учитывает файлы других процессов - она уточняется при каждом вытеснении
+        if Config.MEDIA_CACHE_MAX_BYTES and over_limit:
+            self.trim_cache()
+    
+    def stat(self, key):
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if _is_not_found(e):
+                return None
+            raise
+        return StoredFile(key, response['ContentLength'], response['LastModified'].timestamp())
+    
+    def open(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if _is_not_found(e):
+                raise FileNotFoundError(key)
+            raise
+        return _BodyReader(response['Body'])
+    
+    def put_file(self, key, path):
+        content_type = mimetypes.guess_type(str(key))[0] or 'application/octet-stream'
+        self.client.upload_file(
+            str(path), self.bucket, self._object_key(key), ExtraArgs={'ContentType': content_type}
+        )
+        # Загруженные файлы в кэше не остаются: кэш - только для читаемых файлов
+        Path(path).unlink(missing_ok=True)
+    
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        (self.cache_folder / self.normalize(key)).unlink(missing_ok=True)
+    
+    def url(self, key, mimetype=None, expires=None):
+        params = {'Bucket': self.bucket, 'Key': self._object_key(key)}
+        if mimetype:
+            params['ResponseContentType'] = mimetype
+        return self.client.generate_presigned_url(
+            'get_object', Params=params, ExpiresIn=expires or Config.MEDIA_S3_URL_EXPIRES
+        )
+    
+    def iter_files(self, prefix):
+        paginator = self.client.get_paginator('list_objects_v2')
+        object_prefix = self._object_key(prefix).rstrip('/') + '/'
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=object_prefix):
+            for item in page.get('Contents') or []:
+                key = item['Key'][len(self.prefix):]
+                if '.tmp' in PurePosixPath(key).parts:
+                    continue
+                yield StoredFile(key, item['Size'], item['LastModified'].timestamp())
+
+
+class _BodyReader:
+    """Тело ответа get_object как файловый объект с контекстным менеджером"""
+    
+    def __init__(self, body):
+        self._body = body
+    
+    def read(self, size=-1):
+        return self._body.read() if size is None or size < 0 else self._body.read(size)
+    
+    def close(self):
+        self._body.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _is_not_found(error):
+    """Ошибка клиента S3 означает отсутствие объекта"""
+    response = getattr(error, 'response', None) or {}
+    return str(response.get('Error', {}).get('Code')) in NOT_FOUND_CODES
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Хранилище медиа-файлов процесса (по Config.MEDIA_STORAGE)"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = _create_storage()
+    return _storage
+
+
+def set_storage(storage):
+    """Заменить хранилище процесса (None - создать заново по настройкам)"""
+    global _storage
+    with _storage_lock:
+        _storage = storage
+
+
+def _create_storage():
+    """Создать хранилище по настройкам"""
+    backend = (Config.MEDIA_STORAGE or 'local').lower()
+    if backend == 'local':
+        return LocalStorage()
+    if backend != 's3':
+        raise ValueError(f'Неизвестное хранилище медиа-файлов: {Config.MEDIA_STORAGE}')
+    
+    try:
+        import boto3
+    except ImportError:
+        raise RuntimeError('Для MEDIA_STORAGE=s3 требуется пакет boto3 (pip install boto3)')
+    
+    client = boto3.client(
+        's3',
+        endpoint_url=Config.MEDIA_S3_ENDPOINT_URL or None,
+        region_name=Config.MEDIA_S3_REGION or None,
+    )
+    return ObjectStorage(client, Config.MEDIA_S3_BUCKET, Config.MEDIA_S3_PREFIX)
@@ -0,0 +1,292 @@
+"""
+Постраничный вывод списков: курсорная пагинация и кэш общего количества
+
+Пагинация по номеру страницы (OFFSET) на каждой странице выполняет COUNT(*)
+и пропускает все предыдущие строки, поэтому дальние страницы большого списка
+медленные. Курсорная (keyset) пагинация продолжает список с последней
+показанной строки условием (ключ сортировки, id) < (значения курсора) по
+составному индексу - любая страница стоит столько же, сколько первая.
+
+Курсор - непрозрачная строка (base64 от JSON со значениями ключа сортировки
+и id последней строки страницы), клиент передает его обратно без изменений.
+
+Общее количество:
+- 'exact' - COUNT(*) на каждой странице;
+- 'cached' - COUNT(*), результат кэшируется на Config.PAGINATION_COUNT_CACHE_TTL секунд;
+- 'estimate' - оценка планировщика PostgreSQL (EXPLAIN), в других СУБД - как 'cached';
+- 'none' - не считать.
+"""
+import base64
+import json
+import math
+import threading
+import time
+from datetime import date, datetime
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from app import db
+from config import Config
+
+
+TOTAL_MODES = ('exact', 'cached', 'estimate', 'none')
+
+
+class CursorError(ValueError):
+    """Некорректный курсор пагинации"""
+
+
+def encode_cursor(order, values):
+    """
+    Курсор по значениям ключа сортировки
+    
+    Args:
+        order: Столбцы сортировки (ключ сортировки, id)
+        values: Значения столбцов последней строки страницы
+    """
+    payload = {'k': [column.key for column in order], 'v': [_encode_value(value) for value in values]}
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(order, cursor):
+    """
+    Значения ключа сортировки из курсора
+    
+    Raises:
+        CursorError: Курсор поврежден или получен для другой сортировки
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw.decode('utf-8'))
+        keys, values = payload['k'], [_decode_value(value) for value in payload['v']]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise CursorError('Некорректный курсор пагинации')
+    if keys != [column.key for column in order] or len(values) != len(order):
+        raise CursorError('Курсор получен для другой сортировки списка')
+    return values
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+        raise ValueError(value)
+    return value
+
+
+def request_args(args, per_page=None, max_per_page=None):
+    """
+    Параметры пагинации из запроса: page, per_page, cursor, total
+    
+    Без курсора общее количество считается точно, с курсором - оценивается
+    (каждая страница бесконечной прокрутки не должна выполнять COUNT(*)).
+    """
+    cursor = args.get('cursor')
+    per_page = args.get('per_page', per_page or Config.ITEMS_PER_PAGE, type=int)
+    if max_per_page:
+        per_page = min(per_page, max_per_page)
+    total = args.get('total')
+    if total not in TOTAL_MODES:
+        total = 'exact' if cursor is None else 'estimate'
+    return {
+        'page': args.get('page', 1, type=int),
+        'per_page': max(per_page, 1),
+        'cursor': cursor,
+        'total': total,
+    }
+
+
+def paginate(query, order, page=1, per_page=None, cursor=None, total='exact'):
+    """
+    Страница списка по номеру или по курсору
+    
+    Сортировка - по убыванию (ключ сортировки, id); строки с пустым ключом - в конце.
+    
+    Args:
+        query: Запрос без сортировки
+        order: Столбцы сортировки (ключ сортировки, id)
+        page: Номер страницы (если курсор не передан)
+        per_page: Строк на странице (по умолчанию Config.ITEMS_PER_PAGE)
+        cursor: Курсор из next_cursor предыдущей страницы ('' - первая страница в режиме курсора)
+        total: Подсчет общего количества: 'exact', 'cached', 'estimate' или 'none'
+    
+    Returns:
+        dict: items, total, page (None в режиме курсора), per_page, pages, next_cursor, has_more
+    
+    Raises:
+        CursorError: Некорректный курсор
+    """
+    per_page = per_page or Config.ITEMS_PER_PAGE
+    sort_column, id_column = order
+    nullable = getattr(sort_column.expression, 'nullable', True)
+    
+    ordered = query.order_by(
+        sort_column.desc().nulls_last() if nullable else sort_column.desc(),
+        id_column.desc()
+    )
+    if cursor:
+        sort_value, id_value = decode_cursor(order, cursor)
+        ordered = ordered.filter(_after_condition(sort_column, id_column, sort_value, id_value, nullable))
+        page = None
+    elif cursor is not None:
+        page = None
+    else:
+        page = max(page or 1, 1)
+        ordered = ordered.offset((page - 1) * per_page)
+    
+    # Лишняя строка показывает, есть ли следующая страница (без COUNT)
+    rows = ordered.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    next_cursor = None
+    if has_more:
+        last = items[-1]
+        next_cursor = encode_cursor(order, [getattr(last, sort_column.key), getattr(last, id_column.key)])
+    
+    count = count_total(query, total)
+    return {
+        'items': items,
+        'total': count,
+        'page': page,
+        'per_page': per_page,
+        'pages': math.ceil(count / per_page) if count is not None else None,
+        'next_cursor': next_cursor,
+        'has_more': has_more,
+    }
+
+
+class PageNavigation:
+    """
+    Навигация по страницам для шаблонов (интерфейс Pagination из Flask-SQLAlchemy)
+    
+    Переход на следующую страницу - по курсору, на произвольную - по номеру.
+    """
+    
+    def __init__(self, result, page):
+        self.items = result['items']
+        self.total = result['total']
+        self.per_page = result['per_page']
+        self.page = result['page'] or page or 1
+        self.next_cursor = result['next_cursor']
+        self.has_next = result['has_more']
+        # Кэшированное количество может отставать от списка
+        self.pages = max(result['pages'] or 0, self.page + 1 if self.has_next else self.page)
+        self.has_prev = self.page > 1
+        self.prev_num = self.page - 1 if self.has_prev else None
+        self.next_num = self.page + 1 if self.has_next else None
+    
+    def iter_pages(self, left_edge=2, left_current=2, right_current=4, right_edge=2):
+        """Номера страниц для ссылок (None - пропуск)"""
+        pages_end = self.pages + 1
+        if pages_end == 1:
+            return
+        left_end = min(1 + left_edge, pages_end)
+        yield from range(1, left_end)
+        if left_end == pages_end:
+            return
+        mid_start = max(left_end, self.page - left_current)
+        mid_end = min(self.page + right_current + 1, pages_end)
+        if mid_start > left_end:
+            yield None
+        yield from range(mid_start, mid_end)
+        if mid_end == pages_end:
+            return
+        right_start = max(mid_end, pages_end - right_edge)
+        if right_start > mid_end:
+            yield None
+        yield from range(right_start, pages_end)
+
+
+def _after_condition(sort_column, id_column, sort_value, id_value, nullable):
+    """Строки после курсора при сортировке по убыванию (пустой ключ - в конце)"""
+    if sort_value is None:
+        return and_(sort_column.is_(None), id_column < id_value)
+    # Сравнение кортежей использует составной индекс (ключ сортировки, id)
+    condition = tuple_(sort_column, id_column) < tuple_(sort_value, id_value)
+    return or_(condition, sort_column.is_(None)) if nullable else condition
+
+
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+
+def count_total(query, mode='exact'):
+    """
+    Общее количество строк запроса
+    
+    Args:
+        mode: 'exact', 'cached' (с кэшированием), 'estimate' (оценка планировщика) или 'none'
+    
+    Returns:
+        int или None (mode='none')
+    """
+    if mode not in TOTAL_MODES:
+        raise ValueError(f'Неизвестный режим подсчета: {mode}')
+    if mode == 'none':
+        return None
+    
+    query = query.order_by(None)
+    if mode == 'estimate' and db.session.get_bind().dialect.name == 'postgresql':
+        return _estimate_count(query)
+    
+    ttl = Config.PAGINATION_COUNT_CACHE_TTL
+    if mode == 'exact' or not ttl:
+        return query.count()
+    
+    key = _query_key(query)
+    now = time.monotonic()
+    with _count_cache_lock:
+        cached = _count_cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    
+    count = query.count()
+    with _count_cache_lock:
+        if len(_count_cache) >= Config.PAGINATION_COUNT_CACHE_SIZE:
+            _count_cache.clear()
+        _count_cache[key] = (now + ttl, count)
+    return count
+
+
+def clear_count_cache():
+    """Сбросить кэш общего количества"""
+    with _count_cache_lock:
+        _count_cache.clear()
+
+
+def _query_key(query):
+    """Ключ кэша: текст SQL и параметры"""
+    compiled = query.statement.compile(dialect=db.session.get_bind().dialect)
+    return str(compiled), repr(sorted(compiled.params.items()))
+
+
+class _Explain(Executable, ClauseElement):
+    """EXPLAIN запроса (план в JSON)"""
+    inherit_cache = False
+    
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(_Explain, 'postgresql')
+def _compile_explain(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) ' + compiler.process(element.statement, **kw)
+
+
+def _estimate_count(query):
+    """Оценка количества строк планировщиком PostgreSQL (без выполнения запроса)"""
+    plan = db.session.connection().execute(_Explain(query.statement)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
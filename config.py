@@ -8,6 +8,8 @@ basedir = Path(__file__).parent.absolute()
 
 class Config:
     """Базовая конфигурация"""
+    basedir = basedir  # Корень проекта (относительно него хранятся пути медиа-файлов)
+    
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     
     # База данных
@@ -22,16 +24,99 @@ class Config:
     
     # Настройки медиа-файлов
     MEDIA_FOLDER = basedir / 'media'  # Папка для хранения медиа-файлов
-    IMAGES_FOLDER = MEDIA_FOLDER / 'images'  # Папка для изображений
-    MODELS_FOLDER = MEDIA_FOLDER / 'models'  # Папка для 3D моделей
+    IMAGES_FOLDER = MEDIA_FOLDER / 'images'  # Папка для изображений (ab/cd/<sha256>.<ext>)
+    MODELS_FOLDER = MEDIA_FOLDER / 'models'  # Папка для 3D моделей (ab/cd/<sha256>.<ext>)
     MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB max image size
     MAX_MODEL_SIZE = 50 * 1024 * 1024  # 50MB max 3D model size
     
+    # Хранилище медиа-файлов (app.utils.media_storage)
+    MEDIA_STORAGE = os.environ.get('MEDIA_STORAGE', 'local')  # 'local' - папка проекта, 's3' - S3-совместимое хранилище (нужен boto3)
+    MEDIA_S3_BUCKET = os.environ.get('MEDIA_S3_BUCKET', '')  # Бакет для медиа-файлов
+    MEDIA_S3_PREFIX = os.environ.get('MEDIA_S3_PREFIX', '')  # Префикс ключей в бакете
+    MEDIA_S3_ENDPOINT_URL = os.environ.get('MEDIA_S3_ENDPOINT_URL', '')  # Адрес S3-совместимого сервера (MinIO и т.п.), пусто - AWS
+    MEDIA_S3_REGION = os.environ.get('MEDIA_S3_REGION', '')  # Регион бакета
+    MEDIA_S3_URL_EXPIRES = int(os.environ.get('MEDIA_S3_URL_EXPIRES', '300'))  # Срок действия подписанной ссылки на файл, секунд
+    MEDIA_CACHE_FOLDER = Path(os.environ.get('MEDIA_CACHE_FOLDER', str(basedir / 'media' / '.cache')))  # Локальный кэш файлов объектного хранилища
+    MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))  # Предельный объем кэша; давно не читанные файлы удаляются первыми
+    
+    # Отдача медиа-файлов
+    MEDIA_SENDFILE_MODE = os.environ.get('MEDIA_SENDFILE_MODE', '')  # '' - приложением, 'nginx' - X-Accel-Redirect, 'sendfile' - X-Sendfile
+    MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')  # internal location nginx, указывающий на MEDIA_FOLDER
+    MEDIA_CACHE_SECONDS = 365 * 24 * 3600  # Время кэширования файлов с адресацией по содержимому
+    MEDIA_BUNDLE_CHUNK_SIZE = 1024 * 1024  # Блок чтения файла при выгрузке ZIP-архивом
+    MEDIA_BUNDLE_BATCH_SIZE = 500  # Записей медиа (товаров) на запрос при выгрузке архивом
+    
     # Настройки верификации
     MIN_IMAGE_RESOLUTION = (800, 600)  # Минимальное разрешение изображений
+    IMAGE_PROBE_BYTES = 64 * 1024  # Сколько байт скачивать для чтения заголовка изображения
+    VERIFICATION_WEIGHTS = {'completeness': 40, 'quality': 40, 'media': 20}  # Целые веса проверок в общей оценке
+    VERIFICATION_APPROVE_SCORE = 80  # Общая оценка для статуса "Утвержден"
+    VERIFICATION_REVIEW_SCORE = 50  # Общая оценка для статуса "На проверке" (ниже - "Отклонен")
+    
+    # Ограничение обращений к внешним хостам медиа (верификация и скачивание)
+    HOST_FAILURE_THRESHOLD = int(os.environ.get('HOST_FAILURE_THRESHOLD', '5'))  # Ошибок подряд до отключения хоста
+    HOST_COOLDOWN_SECONDS = int(os.environ.get('HOST_COOLDOWN_SECONDS', '300'))  # Время отключения хоста
+    HOST_MAX_CONCURRENCY = int(os.environ.get('HOST_MAX_CONCURRENCY', '4'))  # Одновременных запросов к одному хосту
+    HOST_ACQUIRE_TIMEOUT = 30  # Ожидание свободного слота для запроса, секунд
+    
+    # Массовое скачивание медиа-файлов (импорт): пул потоков, keep-alive сессии, повторы
+    MEDIA_DOWNLOAD_WORKERS = int(os.environ.get('MEDIA_DOWNLOAD_WORKERS', '8'))  # Одновременных скачиваний
+    MEDIA_DOWNLOAD_TIMEOUT = (5, 30)  # Таймауты подключения и чтения, секунд
+    MEDIA_DOWNLOAD_RETRIES = 3  # Повторов при временной ошибке (сеть, HTTP 429/5xx)
+    MEDIA_DOWNLOAD_BACKOFF = 0.5  # Задержка перед первым повтором, удваивается с каждой попыткой
+    MEDIA_DOWNLOAD_CHUNK_SIZE = 64 * 1024  # Размер блока записи файла
+    MEDIA_DOWNLOAD_BATCH_SIZE = 100  # Товаров на одну фиксацию записей ProductMedia
+    MEDIA_RETRY_MAX_ATTEMPTS = 5  # Попыток из очереди повторного скачивания до отказа
+    MEDIA_RETRY_BASE_DELAY = 60  # Задержка до повтора из очереди, секунд (удваивается с каждой попыткой)
+    MEDIA_URL_REUSE_SECONDS = int(os.environ.get('MEDIA_URL_REUSE_SECONDS', str(7 * 24 * 3600)))  # URL, скачанный недавно, не скачивается повторно (0 - всегда скачивать)
+    MEDIA_REFRESH_INTERVAL = int(os.environ.get('MEDIA_REFRESH_INTERVAL', str(7 * 24 * 3600)))  # Перепроверка URL скачанных файлов не чаще, секунд
+    MEDIA_REFRESH_BATCH_SIZE = 200  # Записей ProductMedia на одну фиксацию при перепроверке
+    MEDIA_GC_GRACE_SECONDS = int(os.environ.get('MEDIA_GC_GRACE_SECONDS', str(24 * 3600)))  # Неиспользуемые файлы моложе этого срока не удаляются, секунд
+    MEDIA_GC_BATCH_SIZE = 1000  # Файлов на один запрос к БД при сборке мусора
+    
+    # Выборочная проверка медиа при массовой верификации (по парам поставщик/хост)
+    MEDIA_SAMPLING_ENABLED = os.environ.get('MEDIA_SAMPLING_ENABLED', 'false').lower() == 'true'
+    MEDIA_SAMPLE_MIN = 30  # Первые N изображений пары проверяются всегда
+    MEDIA_SAMPLE_RATE = 0.05  # Доля проверяемых изображений после минимальной выборки
+    MEDIA_SAMPLE_MAX_FAILURE_RATE = 0.05  # Доля ошибок, после которой включается полная проверка
+    
+    # Скомпилированные валидаторы атрибутов (сбрасываются при изменении атрибутов в текущем процессе)
+    VALIDATOR_CACHE_TTL = int(os.environ.get('VALIDATOR_CACHE_TTL', '60'))  # Время жизни для изменений из других процессов, секунд
+    
+    # Анализ скачанных изображений в пуле процессов (целостность, соотношение сторон, "пустые" изображения)
+    IMAGE_ANALYSIS_WORKERS = int(os.environ.get('IMAGE_ANALYSIS_WORKERS', '0')) or None  # 0 - по числу ядер
+    IMAGE_ANALYSIS_JOB_WORKERS = int(os.environ.get('IMAGE_ANALYSIS_JOB_WORKERS', '1'))  # В процессах заданий верификации (1 - без собственного пула)
+    IMAGE_ANALYSIS_BATCH_SIZE = 200  # Изображений в одном пакете
+    IMAGE_ANALYSIS_MIN_POOL_BATCH = 8  # Пакеты меньшего размера анализируются в текущем процессе (запуск пула и передача данных дороже)
+    IMAGE_BLANK_STDDEV = 3.0  # Изображение "пустое", если отклонение яркости ниже порога
+    IMAGE_MAX_ASPECT_RATIO = 4.0  # Максимальное соотношение длинной и короткой стороны
+    IMAGE_SIMILAR_MAX_DISTANCE = int(os.environ.get('IMAGE_SIMILAR_MAX_DISTANCE', '6'))  # Похожие изображения: расстояние Хэмминга перцептивных хэшей, бит из 64
+    IMAGE_SIMILAR_BATCH_SIZE = 1000  # Кандидатов на одну выборку при поиске похожих изображений
+    
+    # Уменьшенные копии изображений для страниц (создаются в пуле процессов анализа)
+    IMAGE_DERIVATIVE_SIZES = (160, 480, 1200)  # Размеры по длинной стороне, px
+    IMAGE_DERIVATIVE_FORMAT = os.environ.get('IMAGE_DERIVATIVE_FORMAT', 'webp')  # webp или jpeg
+    IMAGE_DERIVATIVE_QUALITY = 80  # Качество сжатия копий
+    IMAGE_DERIVATIVES_ON_DOWNLOAD = os.environ.get('IMAGE_DERIVATIVES_ON_DOWNLOAD', 'true').lower() == 'true'  # Создавать копии в фоне сразу после скачивания
+    IMAGE_DERIVATIVE_THREADS = int(os.environ.get('IMAGE_DERIVATIVE_THREADS', '1'))  # Фоновых потоков генерации копий (задания сверх лимита ждут в очереди)
+    
+    # Массовая верификация в пуле процессов
+    VERIFICATION_WORKERS = int(os.environ.get('VERIFICATION_WORKERS', '0')) or None  # 0 - по числу ядер
+    VERIFICATION_CHUNK_SIZE = 200  # Товаров в одной части задания
+    VERIFICATION_JOB_MAX_ERRORS = 100  # Сколько сообщений об ошибках хранить в задании
+    VERIFICATION_JOB_STALE_SECONDS = int(os.environ.get('VERIFICATION_JOB_STALE_SECONDS', '3600'))  # Задание без отметки о ходе выполнения дольше этого считается прерванным
+    
+    # Хранение истории верификаций (старые верификации сворачиваются в сводки)
+    VERIFICATION_HISTORY_KEEP = int(os.environ.get('VERIFICATION_HISTORY_KEEP', '5'))  # Последних верификаций на товар
+    VERIFICATION_PURGE_BATCH_SIZE = 500  # Товаров в одном пакете очистки
+    
+    # Поиск дубликатов уникальных атрибутов
+    DUPLICATE_HASH_BATCH_SIZE = 1000  # Записей в пакете при заполнении хэшей значений
     
     # Pagination
     ITEMS_PER_PAGE = 50
+    PAGINATION_COUNT_CACHE_TTL = int(os.environ.get('PAGINATION_COUNT_CACHE_TTL', '30'))  # Секунд кэширования общего количества (0 - без кэша)
+    PAGINATION_COUNT_CACHE_SIZE = 1000  # Запросов в кэше общего количества
     
     # Логирование
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
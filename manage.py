@@ -119,6 +119,80 @@ def clear_suppliers():
     
     click.echo(f'✅ Удалено поставщиков: {count}')
 
+@cli.command()
+@click.option('--limit', type=int, default=None, help='Максимум файлов за запуск')
+def retry_media(limit):
+    """Повторить скачивание медиа-файлов из очереди (после временных ошибок)"""
+    from app.services.media_service import MediaService
+    
+    result = MediaService.retry_failed_downloads(limit=limit)
+    if result['processed'] == 0:
+        click.echo('ℹ️  Нет файлов для повторного скачивания')
+        return
+    
+    click.echo(f"✅ Скачано: {result['downloaded']} из {result['processed']}")
+    if result['failed']:
+        click.echo(f"⚠️  Не удалось скачать: {result['failed']} (удалено из очереди: {result['dropped']})")
+
+@cli.command()
+@click.option('--limit', type=int, default=None, help='Максимум файлов за запуск')
+def refresh_media(limit):
+    """Перепроверить URL скачанных медиа-файлов и обновить изменившиеся (условные запросы)"""
+    from app.services.media_service import MediaService
+    
+    result = MediaService.refresh_media(limit=limit)
+    if result['checked'] == 0:
+        click.echo('ℹ️  Нет файлов для перепроверки')
+        return
+    
+    click.echo(f"✅ Проверено: {result['checked']}, обновлено: {result['updated']}, без изменений: {result['unchanged']}")
+    if result['failed']:
+        click.echo(f"⚠️  Не удалось проверить: {result['failed']}")
+
+@cli.command()
+@click.option('--dry-run', is_flag=True, help='Только показать, сколько места освободится')
+@click.option('--grace', type=int, default=None, help='Не удалять файлы моложе N секунд')
+@click.option('--prune-stale', is_flag=True, help='Сначала удалить медиа, URL которых больше нет в атрибутах товаров')
+def gc_media(dry_run, grace, prune_stale):
+    """Удалить из хранилища медиа-файлы, на которые не ссылается ни один товар"""
+    from app.services.media_gc_service import MediaGCService
+    
+    if prune_stale:
+        pruned = MediaGCService.prune_stale_media(dry_run=dry_run)
+        click.echo(f"ℹ️  Устаревших записей медиа: {pruned}")
+    
+    result = MediaGCService.collect(grace_seconds=grace, dry_run=dry_run)
+    action = 'Будет удалено' if dry_run else 'Удалено'
+    click.echo(f"ℹ️  Проверено файлов: {result['scanned']}, неиспользуемых: {result['orphaned']} "
+               f"(моложе срока хранения: {result['kept_recent']})")
+    click.echo(f"✅ {action} файлов: {result['deleted']}, освобождено: {result['reclaimed_bytes'] / 1024 / 1024:.1f} MB")
+    if result['cache_freed_bytes']:
+        click.echo(f"ℹ️  Очищено в локальном кэше: {result['cache_freed_bytes'] / 1024 / 1024:.1f} MB")
+    if result['errors']:
+        click.echo(f"⚠️  Ошибок удаления: {result['errors']}")
+
+@cli.command()
+@click.option('--rebuild', is_flag=True, help='Пересчитать счетчики по записям медиа-файлов')
+def media_usage(rebuild):
+    """Показать объем медиа-файлов по поставщикам"""
+    from app.services.media_usage_service import MediaUsageService
+    
+    if rebuild:
+        rows = MediaUsageService.rebuild()
+        click.echo(f"✅ Счетчики пересчитаны: {rows} групп")
+    
+    for item in MediaUsageService.usage(group_by=['supplier']):
+        supplier = item['supplier_id'] if item['supplier_id'] is not None else 'не определен'
+        click.echo(f"  Поставщик {supplier}: файлов {item['file_count']}, {item['total_bytes'] / 1024 / 1024:.1f} MB")
+
+@cli.command()
+def analyze_images():
+    """Проанализировать скачанные изображения и вычислить перцептивные хэши (для поиска похожих)"""
+    from app.services.image_analysis_service import ImageAnalysisService
+    
+    count = ImageAnalysisService.analyze_pending()
+    click.echo(f"✅ Проанализировано изображений: {count}")
+
 if __name__ == '__main__':
     cli()
 
@@ -0,0 +1,41 @@
+"""Image derivatives (thumbnails, WebP)
+
+Revision ID: 1c7e9a3b5f42
+Revises: 8e1b4d7a2c60
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1c7e9a3b5f42'
+down_revision = '8e1b4d7a2c60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('media_derivatives',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('media_id', sa.Integer(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('format', sa.String(length=10), nullable=False),
+    sa.Column('file_path', sa.String(length=500), nullable=False),
+    sa.Column('width', sa.Integer(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('file_size', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['media_id'], ['product_media.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('media_id', 'size', 'format', name='uq_media_derivative')
+    )
+    with op.batch_alter_table('media_derivatives', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_media_derivatives_media_id'), ['media_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('media_derivatives', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_media_derivatives_media_id'))
+    op.drop_table('media_derivatives')
@@ -0,0 +1,51 @@
+"""Add value hash index to ProductAttributeValue
+
+Revision ID: 2f7c9a4d8e15
+Revises: 9d2b6e4f1a03
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+import hashlib
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f7c9a4d8e15'
+down_revision = '9d2b6e4f1a03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product_attribute_values', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('value_hash', sa.String(length=40), nullable=True))
+        batch_op.create_index('ix_pav_attribute_value_hash', ['attribute_id', 'value_hash'], unique=False)
+    
+    # Заполнить хэши существующих значений пакетами
+    bind = op.get_bind()
+    pav = sa.table('product_attribute_values', sa.column('id', sa.Integer), sa.column('value', sa.Text),
+                   sa.column('value_hash', sa.String))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(pav.c.id, pav.c.value).where(pav.c.id > last_id).order_by(pav.c.id).limit(1000)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = [
+            {'pav_id': row[0], 'hash': hashlib.sha1(row[1].strip().encode('utf-8')).hexdigest()}
+            for row in rows if row[1] and row[1].strip()
+        ]
+        if updates:
+            bind.execute(
+                pav.update().where(pav.c.id == sa.bindparam('pav_id')).values(value_hash=sa.bindparam('hash')),
+                updates
+            )
+
+
+def downgrade():
+    with op.batch_alter_table('product_attribute_values', schema=None) as batch_op:
+        batch_op.drop_index('ix_pav_attribute_value_hash')
+        batch_op.drop_column('value_hash')
@@ -0,0 +1,28 @@
+"""Add MEDIA_SAMPLED verification issue type
+
+Revision ID: 3b9d2f6a1c47
+Revises: eac4bdf6cb0d
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d2f6a1c47'
+down_revision = 'eac4bdf6cb0d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # В SQLite enum хранится как VARCHAR - изменение нужно только для PostgreSQL
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.execute("ALTER TYPE issuetype ADD VALUE IF NOT EXISTS 'MEDIA_SAMPLED'")
+
+
+def downgrade():
+    # PostgreSQL не поддерживает удаление значений enum
+    pass
@@ -0,0 +1,82 @@
+"""Media usage counters and supplier media quotas
+
+Revision ID: 3e6a9d1c7b85
+Revises: 7b4e1f9d3a58
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3e6a9d1c7b85'
+down_revision = '7b4e1f9d3a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Тип mediatype уже создан вместе с таблицей product_media
+    media_type = postgresql.ENUM('IMAGE', 'THREE_D_MODEL', name='mediatype', create_type=False)
+    
+    op.create_table('media_usage',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('supplier_id', sa.Integer(), nullable=True),
+    sa.Column('subcategory_id', sa.Integer(), nullable=False),
+    sa.Column('media_type', media_type, nullable=False),
+    sa.Column('file_count', sa.Integer(), nullable=False),
+    sa.Column('total_bytes', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['subcategory_id'], ['subcategories.id'], ),
+    sa.ForeignKeyConstraint(['supplier_id'], ['suppliers.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('supplier_id', 'subcategory_id', 'media_type', name='uq_media_usage_scope')
+    )
+    with op.batch_alter_table('media_usage', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_media_usage_supplier_id'), ['supplier_id'], unique=False)
+    
+    # NULL в уникальном ограничении не совпадает с NULL - строки без поставщика ограничены отдельно
+    op.create_index(
+        'uq_media_usage_scope_no_supplier', 'media_usage', ['subcategory_id', 'media_type'], unique=True,
+        postgresql_where=sa.text('supplier_id IS NULL'),
+        sqlite_where=sa.text('supplier_id IS NULL')
+    )
+    
+    with op.batch_alter_table('suppliers', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('media_quota_bytes', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('media_quota_files', sa.Integer(), nullable=True))
+    
+    # Начальные значения счетчиков по уже скачанным файлам
+    op.execute("""
+        INSERT INTO media_usage (supplier_id, subcategory_id, media_type, file_count, total_bytes, updated_at)
+        SELECT scope.supplier_id, scope.subcategory_id, scope.media_type,
+               COUNT(*), COALESCE(SUM(scope.file_size), 0), CURRENT_TIMESTAMP
+        FROM (
+            SELECT COALESCE(
+                       dr.supplier_id,
+                       (SELECT MIN(ss.supplier_id) FROM supplier_subcategories ss
+                        WHERE ss.subcategory_id = p.subcategory_id)
+                   ) AS supplier_id,
+                   p.subcategory_id AS subcategory_id,
+                   pm.media_type AS media_type,
+                   pm.file_size AS file_size
+            FROM product_media pm
+            JOIN products p ON p.id = pm.product_id
+            LEFT JOIN import_history ih ON ih.id = p.import_history_id
+            LEFT JOIN data_requests dr ON dr.id = ih.data_request_id
+        ) scope
+        GROUP BY scope.supplier_id, scope.subcategory_id, scope.media_type
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('suppliers', schema=None) as batch_op:
+        batch_op.drop_column('media_quota_files')
+        batch_op.drop_column('media_quota_bytes')
+    
+    op.drop_index('uq_media_usage_scope_no_supplier', table_name='media_usage')
+    with op.batch_alter_table('media_usage', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_media_usage_supplier_id'))
+    op.drop_table('media_usage')
@@ -0,0 +1,66 @@
+"""Compact verification issues and verification history summaries
+
+Revision ID: 4b1e7d3a9c26
+Revises: 2f7c9a4d8e15
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1e7d3a9c26'
+down_revision = '2f7c9a4d8e15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('verification_issues', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('code', sa.String(length=40), nullable=True))
+        batch_op.add_column(sa.Column('params', sa.JSON(), nullable=True))
+        batch_op.alter_column('message', existing_type=sa.Text(), nullable=True)
+    
+    with op.batch_alter_table('product_verifications', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('issues_count', sa.Integer(), nullable=False, server_default='0'))
+    
+    # Количество проблем существующих верификаций
+    op.execute(
+        'UPDATE product_verifications SET issues_count = ('
+        'SELECT COUNT(*) FROM verification_issues '
+        'WHERE verification_issues.verification_id = product_verifications.id)'
+    )
+    
+    op.create_table('verification_summaries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('period_start', sa.DateTime(), nullable=False),
+    sa.Column('period_end', sa.DateTime(), nullable=False),
+    sa.Column('verifications_count', sa.Integer(), nullable=False),
+    sa.Column('min_overall_score', sa.Integer(), nullable=True),
+    sa.Column('max_overall_score', sa.Integer(), nullable=True),
+    sa.Column('avg_overall_score', sa.Float(), nullable=True),
+    sa.Column('issues_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('verification_summaries', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_verification_summaries_product_id'), ['product_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('verification_summaries', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_verification_summaries_product_id'))
+    op.drop_table('verification_summaries')
+    
+    with op.batch_alter_table('product_verifications', schema=None) as batch_op:
+        batch_op.drop_column('issues_count')
+    
+    # Сообщения записей с кодом формируются приложением - в старой схеме текст обязателен
+    op.execute("UPDATE verification_issues SET message = code WHERE message IS NULL")
+    with op.batch_alter_table('verification_issues', schema=None) as batch_op:
+        batch_op.alter_column('message', existing_type=sa.Text(), nullable=False)
+        batch_op.drop_column('params')
+        batch_op.drop_column('code')
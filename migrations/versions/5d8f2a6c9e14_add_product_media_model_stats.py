@@ -0,0 +1,26 @@
+"""Model stats parsed from GLB headers
+
+Revision ID: 5d8f2a6c9e14
+Revises: 1c7e9a3b5f42
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8f2a6c9e14'
+down_revision = '1c7e9a3b5f42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product_media', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('model_stats', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('product_media', schema=None) as batch_op:
+        batch_op.drop_column('model_stats')
@@ -0,0 +1,28 @@
+"""Add input fingerprints to ProductVerification
+
+Revision ID: 5e8a3c1f7b92
+Revises: 7c4e1a9b2d58
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8a3c1f7b92'
+down_revision = '7c4e1a9b2d58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product_verifications', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('input_fingerprint', sa.String(length=40), nullable=True))
+        batch_op.add_column(sa.Column('check_fingerprints', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('product_verifications', schema=None) as batch_op:
+        batch_op.drop_column('check_fingerprints')
+        batch_op.drop_column('input_fingerprint')
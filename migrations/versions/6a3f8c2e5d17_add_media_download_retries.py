@@ -0,0 +1,47 @@
+"""Queue of media downloads to retry after transient errors
+
+Revision ID: 6a3f8c2e5d17
+Revises: 4b1e7d3a9c26
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '6a3f8c2e5d17'
+down_revision = '4b1e7d3a9c26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Тип mediatype уже создан вместе с таблицей product_media
+    media_type = postgresql.ENUM('IMAGE', 'THREE_D_MODEL', name='mediatype', create_type=False)
+    
+    op.create_table('media_download_retries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('attribute_id', sa.Integer(), nullable=True),
+    sa.Column('url', sa.String(length=500), nullable=False),
+    sa.Column('media_type', media_type, nullable=False),
+    sa.Column('sort_order', sa.Integer(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.String(length=500), nullable=True),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['attribute_id'], ['attributes.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('product_id', 'attribute_id', 'url', name='uq_media_download_retry')
+    )
+    with op.batch_alter_table('media_download_retries', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_media_download_retries_next_attempt_at'), ['next_attempt_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('media_download_retries', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_media_download_retries_next_attempt_at'))
+    op.drop_table('media_download_retries')
@@ -0,0 +1,32 @@
+"""Stored ETag/Last-Modified for conditional media refresh
+
+Revision ID: 7b4e1f9d3a58
+Revises: 5d8f2a6c9e14
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b4e1f9d3a58'
+down_revision = '5d8f2a6c9e14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product_media', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('etag', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('last_modified', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('checked_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_product_media_checked_at'), ['checked_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product_media', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_media_checked_at'))
+        batch_op.drop_column('checked_at')
+        batch_op.drop_column('last_modified')
+        batch_op.drop_column('etag')
@@ -0,0 +1,40 @@
+"""Add image analysis results to ProductMedia
+
+Revision ID: 7c4e1a9b2d58
+Revises: 3b9d2f6a1c47
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4e1a9b2d58'
+down_revision = '3b9d2f6a1c47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product_media', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('is_valid', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('is_blank', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('aspect_ratio', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('analysis_error', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('analyzed_at', sa.DateTime(), nullable=True))
+    
+    # В SQLite enum хранится как VARCHAR - изменение нужно только для PostgreSQL
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for value in ('IMAGE_CORRUPTED', 'IMAGE_BLANK', 'IMAGE_BAD_ASPECT_RATIO'):
+                op.execute(f"ALTER TYPE issuetype ADD VALUE IF NOT EXISTS '{value}'")
+
+
+def downgrade():
+    with op.batch_alter_table('product_media', schema=None) as batch_op:
+        batch_op.drop_column('analyzed_at')
+        batch_op.drop_column('analysis_error')
+        batch_op.drop_column('aspect_ratio')
+        batch_op.drop_column('is_blank')
+        batch_op.drop_column('is_valid')
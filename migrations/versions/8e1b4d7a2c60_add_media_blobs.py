@@ -0,0 +1,55 @@
+"""Content-addressed media storage (media_blobs)
+
+Revision ID: 8e1b4d7a2c60
+Revises: 6a3f8c2e5d17
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8e1b4d7a2c60'
+down_revision = '6a3f8c2e5d17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Тип mediatype уже создан вместе с таблицей product_media
+    media_type = postgresql.ENUM('IMAGE', 'THREE_D_MODEL', name='mediatype', create_type=False)
+    
+    op.create_table('media_blobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('media_type', media_type, nullable=False),
+    sa.Column('file_path', sa.String(length=500), nullable=False),
+    sa.Column('file_size', sa.Integer(), nullable=True),
+    sa.Column('mime_type', sa.String(length=100), nullable=True),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('media_blobs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_media_blobs_sha256'), ['sha256'], unique=True)
+    
+    # Существующие записи остаются без blob и продолжают использовать свой file_path
+    with op.batch_alter_table('product_media', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('blob_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_product_media_blob_id', 'media_blobs', ['blob_id'], ['id'])
+        batch_op.create_index(batch_op.f('ix_product_media_blob_id'), ['blob_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_product_media_original_url'), ['original_url'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product_media', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_media_original_url'))
+        batch_op.drop_index(batch_op.f('ix_product_media_blob_id'))
+        batch_op.drop_constraint('fk_product_media_blob_id', type_='foreignkey')
+        batch_op.drop_column('blob_id')
+    
+    with op.batch_alter_table('media_blobs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_media_blobs_sha256'))
+    op.drop_table('media_blobs')
@@ -0,0 +1,37 @@
+"""Perceptual hash of product images for near-duplicate search
+
+Revision ID: 9a5c2e7f4b18
+Revises: 3e6a9d1c7b85
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a5c2e7f4b18'
+down_revision = '3e6a9d1c7b85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product_media', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('phash', sa.String(length=16), nullable=True))
+        for band in range(4):
+            batch_op.add_column(sa.Column(f'phash_b{band}', sa.Integer(), nullable=True))
+            batch_op.create_index(batch_op.f(f'ix_product_media_phash_b{band}'), [f'phash_b{band}'], unique=False)
+    
+    # В SQLite enum хранится как VARCHAR - изменение нужно только для PostgreSQL
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.execute("ALTER TYPE issuetype ADD VALUE IF NOT EXISTS 'IMAGE_SIMILAR'")
+
+
+def downgrade():
+    with op.batch_alter_table('product_media', schema=None) as batch_op:
+        for band in reversed(range(4)):
+            batch_op.drop_index(batch_op.f(f'ix_product_media_phash_b{band}'))
+            batch_op.drop_column(f'phash_b{band}')
+        batch_op.drop_column('phash')
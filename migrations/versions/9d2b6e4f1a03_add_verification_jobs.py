@@ -0,0 +1,48 @@
+"""Add verification jobs
+
+Revision ID: 9d2b6e4f1a03
+Revises: 5e8a3c1f7b92
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2b6e4f1a03'
+down_revision = '5e8a3c1f7b92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('verification_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('import_history_id', sa.Integer(), nullable=True),
+    sa.Column('subcategory_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.Enum('PENDING', 'RUNNING', 'COMPLETED', 'FAILED', name='verificationjobstatus'), nullable=False),
+    sa.Column('force', sa.Boolean(), nullable=False),
+    sa.Column('sampling', sa.Boolean(), nullable=True),
+    sa.Column('total_count', sa.Integer(), nullable=False),
+    sa.Column('processed_count', sa.Integer(), nullable=False),
+    sa.Column('unchanged_count', sa.Integer(), nullable=False),
+    sa.Column('errors_count', sa.Integer(), nullable=False),
+    sa.Column('chunks_total', sa.Integer(), nullable=False),
+    sa.Column('chunks_done', sa.Integer(), nullable=False),
+    sa.Column('errors', sa.JSON(), nullable=True),
+    sa.Column('error_message', sa.Text(), nullable=True),
+    sa.Column('created_by_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['created_by_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['import_history_id'], ['import_history.id'], ),
+    sa.ForeignKeyConstraint(['subcategory_id'], ['subcategories.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('verification_jobs')
+    sa.Enum(name='verificationjobstatus').drop(op.get_bind(), checkfirst=True)
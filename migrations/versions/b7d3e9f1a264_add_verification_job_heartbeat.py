@@ -0,0 +1,26 @@
+"""Heartbeat of verification jobs (detecting jobs of restarted workers)
+
+Revision ID: b7d3e9f1a264
+Revises: c4f1a8e2d657
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3e9f1a264'
+down_revision = 'c4f1a8e2d657'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('verification_jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('verification_jobs', schema=None) as batch_op:
+        batch_op.drop_column('heartbeat_at')
@@ -0,0 +1,42 @@
+"""Composite indexes for keyset pagination of products and workflow lists
+
+Revision ID: c4f1a8e2d657
+Revises: 9a5c2e7f4b18
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f1a8e2d657'
+down_revision = '9a5c2e7f4b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.create_index('ix_products_created_at_id', ['created_at', 'id'], unique=False)
+        batch_op.create_index('ix_products_subcategory_created_at_id', ['subcategory_id', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_products_status_created_at_id', ['status', 'created_at', 'id'], unique=False)
+    
+    with op.batch_alter_table('import_history', schema=None) as batch_op:
+        batch_op.create_index('ix_import_history_status_imported_at_id', ['file_status', 'imported_at', 'id'], unique=False)
+        # Порядок индекса совпадает с сортировкой списка экспортов (пустые даты - в конце)
+        batch_op.create_index(
+            'ix_import_history_status_exported_at_id', ['file_status', 'exported_at', 'id'], unique=False,
+            postgresql_ops={'exported_at': 'DESC NULLS LAST', 'id': 'DESC'}
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('import_history', schema=None) as batch_op:
+        batch_op.drop_index('ix_import_history_status_exported_at_id')
+        batch_op.drop_index('ix_import_history_status_imported_at_id')
+    
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index('ix_products_status_created_at_id')
+        batch_op.drop_index('ix_products_subcategory_created_at_id')
+        batch_op.drop_index('ix_products_created_at_id')
@@ -186,3 +186,2312 @@ class TestVerificationService:
         assert product2.id is not None
         assert product1.sku != product2.sku  # SKU должны быть разными
 
+
+
+class TestVerificationLocalMedia:
+    """Тесты локальной проверки скачанных медиа-файлов"""
+    
+    def _create_product_with_image(self, db_session, tmp_path, size=(1024, 768)):
+        """Создать товар с изображением, уже скачанным в ProductMedia"""
+        from PIL import Image
+        from app.models.product import ProductAttributeValue
+        from app.models.product_media import ProductMedia, MediaType
+        
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        attribute = Attribute(code='photo', name='Фото', type=AttributeType.IMAGE)
+        db_session.session.add_all([subcategory, attribute])
+        db_session.session.commit()
+        
+        product = Product(name='Товар', sku='SKU123', subcategory_id=subcategory.id)
+        db_session.session.add(product)
+        db_session.session.commit()
+        
+        url = 'http://cdn.example.com/photo.jpg'
+        db_session.session.add(ProductAttributeValue(product_id=product.id, attribute_id=attribute.id, value=url))
+        
+        file_path = tmp_path / 'photo.jpg'
+        Image.new('RGB', size).save(file_path, 'JPEG')
+        db_session.session.add(ProductMedia(
+            product_id=product.id,
+            attribute_id=attribute.id,
+            media_type=MediaType.IMAGE,
+            original_url=url,
+            file_path=str(file_path),
+            file_name='photo.jpg',
+            file_size=file_path.stat().st_size,
+            mime_type='image/jpeg',
+            width=size[0],
+            height=size[1]
+        ))
+        db_session.session.commit()
+        return product
+    
+    def test_check_media_uses_local_file(self, db_session, tmp_path, monkeypatch):
+        """Скачанное изображение проверяется без обращения к сети"""
+        import requests
+        
+        def no_network(*args, **kwargs):
+            raise AssertionError('Сетевой запрос не ожидался')
+        
+        monkeypatch.setattr(requests, 'get', no_network)
+        monkeypatch.setattr(requests, 'head', no_network)
+        
+        product = self._create_product_with_image(db_session, tmp_path)
+        score, issues = VerificationService._check_media(product)
+        
+        issue_types = [issue['type'].value for issue in issues]
+        assert 'image_not_accessible' not in issue_types
+        assert 'image_low_resolution' not in issue_types
+    
+    def test_check_media_local_low_resolution(self, db_session, tmp_path, monkeypatch):
+        """Разрешение берется из сохраненных метаданных ProductMedia"""
+        import requests
+        monkeypatch.setattr(requests, 'head', lambda *args, **kwargs: None)
+        
+        product = self._create_product_with_image(db_session, tmp_path, size=(200, 100))
+        score, issues = VerificationService._check_media(product)
+        
+        low_res = [issue for issue in issues if issue['type'].value == 'image_low_resolution']
+        assert len(low_res) == 1
+        assert '200x100' in low_res[0]['message']
+    
+    def test_check_media_reports_corrupted_image(self, db_session, tmp_path, monkeypatch):
+        """Поврежденный файл по результатам анализа дает ошибку верификации"""
+        from app.services.image_analysis_service import ImageAnalysisService
+        from config import Config
+        monkeypatch.setattr(Config, 'IMAGE_ANALYSIS_MIN_POOL_BATCH', 100)
+        
+        product = self._create_product_with_image(db_session, tmp_path)
+        media = product.media_files[0]
+        data = (tmp_path / 'photo.jpg').read_bytes()
+        (tmp_path / 'photo.jpg').write_bytes(data[:len(data) // 2])
+        
+        assert ImageAnalysisService.analyze_media([media]) == 1
+        assert media.is_valid is False
+        
+        score, issues = VerificationService._check_media(product)
+        issue_types = [issue['type'].value for issue in issues]
+        assert 'image_corrupted' in issue_types
+
+
+class TestRemoteImageProbe:
+    """Тесты чтения параметров удаленного изображения по заголовку"""
+    
+    class FakeResponse:
+        """Потоковый ответ requests с отслеживанием прочитанных байт"""
+        
+        def __init__(self, content, status_code=206, headers=None):
+            self.content_bytes = content
+            self.status_code = status_code
+            self.headers = headers or {}
+            self.bytes_read = 0
+        
+        def iter_content(self, chunk_size=8192):
+            for start in range(0, len(self.content_bytes), chunk_size):
+                chunk = self.content_bytes[start:start + chunk_size]
+                self.bytes_read += len(chunk)
+                yield chunk
+        
+        def close(self):
+            pass
+    
+    def _make_png(self, size):
+        """Сгенерировать PNG с шумом, чтобы файл был заметно больше заголовка"""
+        import io
+        import os
+        from PIL import Image
+        image = Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        return buffer.getvalue()
+    
+    def test_probe_reads_only_header(self, monkeypatch):
+        """Размеры берутся из первых байт, размер файла - из Content-Range"""
+        import requests
+        content = self._make_png((1200, 900))
+        response = self.FakeResponse(content, headers={'Content-Range': f'bytes 0-65535/{len(content)}'})
+        requested = {}
+        
+        def fake_get(url, **kwargs):
+            requested.update(kwargs.get('headers') or {})
+            return response
+        
+        monkeypatch.setattr(requests, 'get', fake_get)
+        probe = VerificationService._probe_remote_image('http://cdn.example.com/big.png')
+        
+        assert requested['Range'].startswith('bytes=0-')
+        assert probe['width'] == 1200
+        assert probe['height'] == 900
+        assert probe['format'] == 'PNG'
+        assert probe['file_size'] == len(content)
+        assert response.bytes_read < len(content)
+    
+    def test_probe_falls_back_to_full_fetch(self, monkeypatch):
+        """Если заголовок не распознан, изображение скачивается целиком"""
+        import requests
+        content = self._make_png((10, 10))
+        responses = [
+            self.FakeResponse(b'not an image header', headers={'Content-Range': 'bytes 0-18/19'}),
+            self.FakeResponse(content, status_code=200),
+        ]
+        monkeypatch.setattr(requests, 'get', lambda url, **kwargs: responses.pop(0))
+        
+        probe = VerificationService._probe_remote_image('http://cdn.example.com/odd')
+        
+        assert probe['width'] == 10
+        assert probe['file_size'] == len(content)
+
+
+class TestHostGuard:
+    """Тесты circuit breaker для внешних хостов"""
+    
+    def test_breaker_opens_after_failures(self):
+        """После серии ошибок хост отключается, другие хосты доступны"""
+        from app.utils.host_guard import HostGuard, HostUnavailableError
+        guard = HostGuard(failure_threshold=2, cooldown_seconds=60)
+        
+        for _ in range(2):
+            guard.record_failure('http://down.example.com/a.jpg')
+        
+        with pytest.raises(HostUnavailableError) as exc_info:
+            guard.check('http://down.example.com/b.jpg')
+        assert 'down.example.com' in exc_info.value.reason
+        
+        guard.check('http://up.example.com/a.jpg')
+        assert guard.get_state()['down.example.com']['open'] is True
+    
+    def test_breaker_counts_network_errors(self):
+        """Сетевые ошибки внутри slot() учитываются, успех сбрасывает счетчик"""
+        import requests
+        from app.utils.host_guard import HostGuard
+        guard = HostGuard(failure_threshold=3, cooldown_seconds=60)
+        
+        with pytest.raises(requests.ConnectionError):
+            with guard.slot('http://flaky.example.com/a.jpg'):
+                raise requests.ConnectionError()
+        assert guard.get_state()['flaky.example.com']['failures'] == 1
+        
+        with guard.slot('http://flaky.example.com/a.jpg'):
+            pass
+        assert 'flaky.example.com' not in guard.get_state()
+    
+    def test_breaker_counts_server_errors(self):
+        """Ответы 5xx и 429 считаются ошибками хоста, 404 - нет"""
+        import requests
+        from types import SimpleNamespace
+        from app.utils.host_guard import HostGuard
+        guard = HostGuard(failure_threshold=5, cooldown_seconds=60)
+        url = 'http://overloaded.example.com/a.jpg'
+        
+        for status_code in (503, 429):
+            with guard.slot(url) as guarded:
+                guarded.observe(SimpleNamespace(status_code=status_code))
+        with pytest.raises(requests.HTTPError):
+            with guard.slot(url):
+                raise requests.HTTPError(response=SimpleNamespace(status_code=502))
+        assert guard.get_state()['overloaded.example.com']['failures'] == 3
+        
+        with guard.slot(url) as guarded:
+            guarded.observe(SimpleNamespace(status_code=404))
+        assert 'overloaded.example.com' not in guard.get_state()
+    
+    def test_single_probe_after_cooldown(self, monkeypatch):
+        """После охлаждения пропускается один пробный запрос; его ошибка снова отключает хост"""
+        import requests
+        import app.utils.host_guard as host_guard_module
+        from app.utils.host_guard import HostGuard, HostUnavailableError
+        now = [1000.0]
+        monkeypatch.setattr(host_guard_module.time, 'monotonic', lambda: now[0])
+        guard = HostGuard(failure_threshold=2, cooldown_seconds=60)
+        url = 'http://down.example.com/a.jpg'
+        for _ in range(2):
+            guard.record_failure(url)
+        
+        now[0] += 61
+        with pytest.raises(requests.ConnectionError):
+            with guard.slot(url):
+                with pytest.raises(HostUnavailableError) as exc_info:
+                    with guard.slot(url):
+                        pass
+                assert 'пробный' in exc_info.value.reason
+                raise requests.ConnectionError()
+        
+        with pytest.raises(HostUnavailableError):
+            guard.check(url)
+        
+        now[0] += 61
+        with guard.slot(url):
+            pass
+        assert 'down.example.com' not in guard.get_state()
+    
+    def test_concurrency_limit(self):
+        """Если все слоты хоста заняты, запрос пропускается с понятной причиной"""
+        from app.utils.host_guard import HostGuard, HostUnavailableError
+        guard = HostGuard(max_concurrency=1, acquire_timeout=0.01)
+        
+        with guard.slot('http://busy.example.com/a.jpg'):
+            with pytest.raises(HostUnavailableError) as exc_info:
+                with guard.slot('http://busy.example.com/b.jpg'):
+                    pass
+        assert 'лимит' in exc_info.value.reason
+
+
+class TestMediaSampler:
+    """Тесты выборочной проверки медиа"""
+    
+    def test_min_sample_always_checked(self):
+        """Первые min_sample URL пары проверяются всегда, затем - по доле выборки"""
+        import random
+        from app.services.media_sampler import MediaSampler
+        sampler = MediaSampler(sample_rate=0.0, min_sample=3, rng=random.Random(1))
+        key = (1, 'cdn.example.com')
+        
+        for _ in range(3):
+            assert sampler.should_check(key) is True
+            sampler.record(key, accessible=True)
+        assert sampler.should_check(key) is False
+    
+    def test_escalation_on_failures(self):
+        """При превышении доли ошибок пара переводится на полную проверку"""
+        from app.services.media_sampler import MediaSampler
+        sampler = MediaSampler(sample_rate=0.0, min_sample=4, max_failure_rate=0.2)
+        key = (1, 'cdn.example.com')
+        
+        sampler.record(key, accessible=True)
+        sampler.record(key, accessible=True)
+        sampler.record(key, accessible=False)
+        sampler.record(key, accessible=True, resolution_ok=False)
+        
+        summary = sampler.summary(key)
+        assert summary['escalated'] is True
+        assert summary['failures'] == 2
+        assert sampler.should_check(key) is True
+    
+    def test_wilson_lower_bound(self):
+        """Нижняя граница доли успехов меньше наблюдаемой и растет с размером выборки"""
+        from app.services.media_sampler import MediaSampler
+        sampler = MediaSampler()
+        
+        assert sampler._wilson_lower_bound(0, 0) == 0.0
+        small = sampler._wilson_lower_bound(30, 30)
+        large = sampler._wilson_lower_bound(300, 300)
+        assert 0.85 < small < 1.0
+        assert small < large < 1.0
+    
+    def test_from_config_disabled(self):
+        """Без включения в конфигурации выборка не создается"""
+        from app.services.media_sampler import MediaSampler
+        assert MediaSampler.from_config(enabled=False) is None
+        assert isinstance(MediaSampler.from_config(enabled=True), MediaSampler)
+    
+    def test_stats_merged_across_chunks(self):
+        """Части задания продолжают общую статистику: min_sample не набирается заново, ошибки суммируются"""
+        from app.services.media_sampler import MediaSampler
+        key = (1, 'cdn.example.com')
+        job = MediaSampler(sample_rate=0.0, min_sample=4, max_failure_rate=0.3)
+        
+        first = MediaSampler(sample_rate=0.0, min_sample=4, max_failure_rate=0.3)
+        for accessible in (True, True, True, False):
+            first.record(key, accessible=accessible)
+        job.merge_stats(first.export_stats())
+        
+        second = MediaSampler(sample_rate=0.0, min_sample=4, max_failure_rate=0.3)
+        second.merge_stats(job.export_stats())
+        seed = second.export_stats()
+        assert second.should_check(key) is False
+        second.record(key, accessible=False)
+        
+        delta = second.export_stats(since=seed)
+        assert delta[key][:2] == (1, 1)
+        job.merge_stats(delta)
+        summary = job.summary(key)
+        assert summary['checked'] == 5
+        assert summary['failures'] == 2
+        assert summary['escalated'] is True
+
+
+class TestImageAnalysis:
+    """Тесты анализа изображений"""
+    
+    def _save_noise(self, path, size=(320, 240)):
+        """Сохранить изображение со случайным шумом"""
+        import random
+        from PIL import Image
+        rng = random.Random(0)
+        img = Image.new('L', size)
+        img.putdata([rng.randrange(256) for _ in range(size[0] * size[1])])
+        img.convert('RGB').save(path, 'PNG')
+    
+    def test_analyze_valid_image(self, tmp_path):
+        """Обычное изображение: валидно, не пустое, соотношение сторон вычислено"""
+        from app.services.image_analysis_service import analyze_image_file
+        path = tmp_path / 'noise.png'
+        self._save_noise(path)
+        
+        result = analyze_image_file(str(path))
+        assert result['is_valid'] is True
+        assert result['is_blank'] is False
+        assert (result['width'], result['height']) == (320, 240)
+        assert result['aspect_ratio'] == pytest.approx(4 / 3, rel=1e-3)
+    
+    def test_analyze_blank_image(self, tmp_path):
+        """Однотонное изображение определяется как пустое"""
+        from PIL import Image
+        from app.services.image_analysis_service import analyze_image_file
+        path = tmp_path / 'white.jpg'
+        Image.new('RGB', (800, 600), 'white').save(path, 'JPEG')
+        
+        result = analyze_image_file(str(path))
+        assert result['is_valid'] is True
+        assert result['is_blank'] is True
+    
+    def test_analyze_files_in_process_pool(self, tmp_path, monkeypatch):
+        """Пакет файлов анализируется в пуле процессов с сохранением порядка"""
+        from app.services.image_analysis_service import ImageAnalysisService
+        from config import Config
+        monkeypatch.setattr(Config, 'IMAGE_ANALYSIS_MIN_POOL_BATCH', 1)
+        monkeypatch.setattr(Config, 'IMAGE_ANALYSIS_WORKERS', 2)
+        
+        good = tmp_path / 'good.png'
+        self._save_noise(good)
+        broken = tmp_path / 'broken.png'
+        broken.write_bytes(b'not an image')
+        
+        try:
+            results = ImageAnalysisService.analyze_files([good, broken])
+        finally:
+            ImageAnalysisService.shutdown()
+        
+        assert [result['is_valid'] for result in results] == [True, False]
+        assert results[1]['error']
+        assert ImageAnalysisService._executor is None
+    
+    def test_pool_limited_in_job_worker(self, tmp_path, monkeypatch):
+        """В процессе задания верификации с ограничением 1 анализ выполняется без пула"""
+        from app.services.image_analysis_service import ImageAnalysisService
+        from config import Config
+        monkeypatch.setattr(Config, 'IMAGE_ANALYSIS_MIN_POOL_BATCH', 1)
+        monkeypatch.setattr(ImageAnalysisService, '_workers_limit', None)
+        
+        path = tmp_path / 'good.png'
+        self._save_noise(path)
+        ImageAnalysisService.limit_workers(1)
+        
+        results = ImageAnalysisService.analyze_files([path, path])
+        assert [result['is_valid'] for result in results] == [True, True]
+        assert ImageAnalysisService._executor is None
+
+
+class TestImageSimilarity:
+    """Тесты поиска похожих изображений по перцептивному хэшу"""
+    
+    def _save_photo(self, path, seed, size=(640, 480), quality=90):
+        """Сохранить JPEG с крупными цветными блоками (детали, переживающие масштабирование)"""
+        import random
+        from PIL import Image, ImageDraw
+        rng = random.Random(seed)
+        img = Image.new('RGB', (64, 48))
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            x, y = rng.randrange(56), rng.randrange(40)
+            draw.rectangle([x, y, x + rng.randrange(4, 24), y + rng.randrange(4, 24)],
+                           fill=tuple(rng.randrange(256) for _ in range(3)))
+        img.resize(size, Image.BILINEAR).save(path, 'JPEG', quality=quality)
+    
+    def test_phash_distance_and_index_bands(self, tmp_path):
+        """Одно фото в другом разрешении и сжатии - малое расстояние, другое фото - большое"""
+        from PIL import Image
+        from app.utils.image_hash import phash, hamming, hash_bands, band_neighbours
+        self._save_photo(tmp_path / 'a.jpg', seed=1)
+        self._save_photo(tmp_path / 'a_small.jpg', seed=1, size=(200, 150), quality=60)
+        self._save_photo(tmp_path / 'b.jpg', seed=2)
+        
+        hashes = {}
+        for name in ('a', 'a_small', 'b'):
+            with Image.open(tmp_path / f'{name}.jpg') as img:
+                hashes[name] = phash(img)
+        assert len(hashes['a']) == 16
+        assert hamming(hashes['a'], hashes['a_small']) <= 4
+        assert hamming(hashes['a'], hashes['b']) > 12
+        
+        bands = hash_bands(hashes['a'])
+        assert ''.join(f'{band:04x}' for band in bands) == hashes['a']
+        assert len(band_neighbours(bands[0], 1)) == 17
+        assert len(set(band_neighbours(bands[0], 2))) == 1 + 16 + 120
+    
+    def test_similar_images_flagged_and_queried(self, db_session, logged_in_client, tmp_path, monkeypatch):
+        """Фото другого товара в другом разрешении дает проблему верификации и находится запросом"""
+        from app.models.product import ProductAttributeValue
+        from app.models.product_media import ProductMedia, MediaType
+        from app.services.image_analysis_service import ImageAnalysisService
+        from app.services.image_similarity_service import ImageSimilarityService
+        from config import Config
+        monkeypatch.setattr(Config, 'IMAGE_ANALYSIS_MIN_POOL_BATCH', 100)
+        
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        attribute = Attribute(code='photo', name='Фото', type=AttributeType.IMAGE)
+        db_session.session.add_all([subcategory, attribute])
+        db_session.session.commit()
+        
+        media_list = []
+        for sku, seed, size in (('SKU-A', 1, (1024, 768)), ('SKU-B', 1, (800, 600)), ('SKU-C', 2, (1024, 768))):
+            product = Product(name=sku, sku=sku, subcategory_id=subcategory.id)
+            db_session.session.add(product)
+            db_session.session.commit()
+            url = f'http://cdn.example.com/{sku}.jpg'
+            path = tmp_path / f'{sku}.jpg'
+            self._save_photo(path, seed, size)
+            db_session.session.add(ProductAttributeValue(product_id=product.id, attribute_id=attribute.id, value=url))
+            media = ProductMedia(
+                product_id=product.id, attribute_id=attribute.id, media_type=MediaType.IMAGE, original_url=url,
+                file_path=str(path), file_name=path.name, file_size=path.stat().st_size, mime_type='image/jpeg'
+            )
+            db_session.session.add(media)
+            media_list.append(media)
+        db_session.session.commit()
+        
+        assert ImageAnalysisService.analyze_pending() == 3
+        assert all(media.phash and media.phash_b0 is not None for media in media_list)
+        a, b, c = media_list
+        
+        similar = ImageSimilarityService.similar_for_product(a.product_id)
+        assert [match[:2] for match in similar[a.id]] == [(b.id, b.product_id)]
+        assert ImageSimilarityService.similar_for_product(c.product_id) == {}
+        
+        score, issues = VerificationService._check_media(a.product)
+        similar_issues = [issue for issue in issues if issue['type'].value == 'image_similar']
+        assert len(similar_issues) == 1
+        assert 'SKU-B' in similar_issues[0]['message']
+        _, issues = VerificationService._check_media(c.product)
+        assert 'image_similar' not in [issue['type'].value for issue in issues]
+        
+        response = logged_in_client.get(f'/api/media/{a.id}/similar')
+        assert response.status_code == 200
+        assert [(item['sku'], item['media_id']) for item in response.get_json()['similar']] == [('SKU-B', b.id)]
+        assert logged_in_client.get(f'/api/media/{a.id}/similar?max_distance=99').status_code == 400
+
+
+class TestProductSerialization:
+    """Тесты сериализации списка товаров"""
+    
+    def test_page_serialized_with_fixed_queries(self, db_session, auth_user):
+        """Связанные данные страницы загружаются постоянным числом запросов, результат как у to_dict"""
+        from sqlalchemy import event
+        from app.api.serializers import ProductSerializer
+        from app.models.product import ProductAttributeValue
+        from app.models.verification import ProductVerification
+        from app.models.workflow import ProductStatusHistory
+        
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategories = [Subcategory(code=f'01_{i}', name=f'Подкатегория {i}', category_id=category.id) for i in (1, 2)]
+        suppliers = [Supplier(code=f'S{i}', name=f'Поставщик {i}') for i in (1, 2)]
+        attributes = [Attribute(code=code, name=code, type=AttributeType.TEXT) for code in ('color', 'size')]
+        db_session.session.add_all(subcategories + suppliers + attributes)
+        db_session.session.commit()
+        subcategories[0].suppliers.append(suppliers[1])
+        subcategories[0].suppliers.append(suppliers[0])
+        
+        for i in range(6):
+            product = Product(name=f'Товар {i}', sku=f'SKU{i}', subcategory_id=subcategories[i % 2].id)
+            db_session.session.add(product)
+            db_session.session.commit()
+            for attribute in attributes:
+                db_session.session.add(ProductAttributeValue(product_id=product.id, attribute_id=attribute.id, value=f'{attribute.code}-{i}'))
+            for score in (10, 20 + i):
+                db_session.session.add(ProductVerification(product_id=product.id, completeness_score=score, quality_score=score,
+                                                           media_score=score, overall_score=score))
+            db_session.session.add(ProductStatusHistory(product_id=product.id, old_status='draft', new_status='verified',
+                                                        changed_by_id=auth_user.id))
+            db_session.session.commit()
+        
+        options = dict(include_attributes=True, include_verification=True, include_history=True)
+        expected = [ProductSerializer.serialize(product, **options) for product in Product.query.order_by(Product.id)]
+        db_session.session.expire_all()
+        products = Product.query.order_by(Product.id).all()
+        
+        statements = []
+        engine = db_session.engine
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            items = ProductSerializer.serialize_many(products, **options)
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+        
+        assert items == expected
+        assert len(statements) <= 5
+        assert items[0]['supplier_name'] == 'Поставщик 1'
+        assert items[1]['supplier_name'] is None
+        assert items[0]['category_name'] == 'Категория'
+        assert items[3]['attributes'] == {'color': 'color-3', 'size': 'size-3'}
+        assert items[3]['verification']['overall_score'] == 23
+        assert items[3]['status_history'][0]['changed_by'] == auth_user.username
+    
+    def test_issues_serialized_without_query_per_attribute(self, db_session):
+        """Атрибуты проблем верификации загружаются одним запросом для всех проблем"""
+        from sqlalchemy import event
+        from app.models.verification import ProductVerification, VerificationIssue, IssueType
+        
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        attributes = [Attribute(code=f'attr{i}', name=f'Атрибут {i}', type=AttributeType.TEXT) for i in range(5)]
+        db_session.session.add_all([subcategory] + attributes)
+        db_session.session.commit()
+        product = Product(name='Товар', sku='SKU1', subcategory_id=subcategory.id)
+        db_session.session.add(product)
+        db_session.session.commit()
+        verification = ProductVerification(product_id=product.id, completeness_score=0, quality_score=0,
+                                           media_score=0, overall_score=0)
+        db_session.session.add(verification)
+        db_session.session.commit()
+        db_session.session.add_all(
+            VerificationIssue(verification_id=verification.id, issue_type=IssueType.MISSING_REQUIRED,
+                              code='missing_required', attribute_id=attribute.id, severity='error')
+            for attribute in attributes
+        )
+        db_session.session.commit()
+        db_session.session.expire_all()
+        verification = db_session.session.get(ProductVerification, verification.id)
+        
+        statements = []
+        engine = db_session.engine
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            data = verification.to_dict(include_issues=True)
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+        
+        assert len(statements) == 2
+        assert [issue['message'] for issue in data['issues']] == [
+            f'Отсутствует обязательное поле: Атрибут {i}' for i in range(5)
+        ]
+
+
+class TestKeysetPagination:
+    """Тесты курсорной пагинации"""
+    
+    def test_cursor_pages_cover_list_once(self, db_session, client):
+        """Страницы по курсору идут в порядке (created_at, id) без пропусков и повторов"""
+        from datetime import datetime, timedelta
+        from app.utils.pagination import CursorError, paginate
+        
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        db_session.session.add(subcategory)
+        db_session.session.commit()
+        
+        # Одинаковое время создания у нескольких товаров - порядок определяет id
+        start = datetime(2026, 1, 1)
+        for i in range(8):
+            db_session.session.add(Product(name=f'Товар {i}', sku=f'SKU{i}', subcategory_id=subcategory.id,
+                                           created_at=start + timedelta(minutes=i // 3)))
+        db_session.session.commit()
+        expected = [product.id for product in Product.query.order_by(Product.created_at.desc(), Product.id.desc())]
+        
+        order = (Product.created_at, Product.id)
+        seen = []
+        result = paginate(Product.query, order, per_page=3, cursor='', total='none')
+        while True:
+            seen.extend(product.id for product in result['items'])
+            assert result['page'] is None and result['total'] is None
+            if not result['has_more']:
+                break
+            result = paginate(Product.query, order, per_page=3, cursor=result['next_cursor'], total='none')
+        assert seen == expected
+        
+        second = paginate(Product.query, order, page=2, per_page=3)
+        assert [product.id for product in second['items']] == expected[3:6]
+        assert second['total'] == 8 and second['pages'] == 3
+        
+        with pytest.raises(CursorError):
+            paginate(Product.query, order, cursor='not-a-cursor')
+        with pytest.raises(CursorError):
+            paginate(Product.query, (Product.updated_at, Product.id), cursor=second['next_cursor'])
+        
+        response = client.get('/api/products?per_page=5&cursor=')
+        assert response.status_code == 200
+        data = response.get_json()
+        assert [item['id'] for item in data['items']] == expected[:5]
+        response = client.get(f"/api/products?per_page=5&cursor={data['next_cursor']}")
+        assert [item['id'] for item in response.get_json()['items']] == expected[5:]
+        assert response.get_json()['has_more'] is False
+        assert client.get('/api/products?cursor=broken').status_code == 400
+    
+    def test_export_list_with_empty_dates_and_cached_total(self, db_session, auth_user, monkeypatch):
+        """Экспорты без даты - в конце списка, кэшированное количество обновляется после сброса"""
+        from datetime import datetime, timedelta
+        from app.models.import_history import ImportHistory, ImportFileStatus
+        from app.services.workflow import ExportService
+        from app.utils.pagination import clear_count_cache, count_total
+        from config import Config
+        monkeypatch.setattr(Config, 'PAGINATION_COUNT_CACHE_TTL', 60)
+        
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        db_session.session.add(subcategory)
+        db_session.session.commit()
+        
+        start = datetime(2026, 1, 1)
+        for i in range(5):
+            db_session.session.add(ImportHistory(
+                filename=f'file{i}.xlsx', subcategory_id=subcategory.id, imported_by_id=auth_user.id,
+                file_status=ImportFileStatus.EXPORTED, exported_at=start + timedelta(days=i) if i % 2 else None
+            ))
+        db_session.session.commit()
+        
+        seen = []
+        cursor = ''
+        while cursor is not None:
+            result = ExportService.get_exports(per_page=2, cursor=cursor, total='none')
+            seen.extend(result['items'])
+            cursor = result['next_cursor']
+        assert [item.filename for item in seen] == ['file3.xlsx', 'file1.xlsx', 'file4.xlsx', 'file2.xlsx', 'file0.xlsx']
+        
+        clear_count_cache()
+        query = ImportHistory.query.filter_by(file_status=ImportFileStatus.EXPORTED)
+        assert count_total(query, 'cached') == 5
+        db_session.session.add(ImportHistory(filename='new.xlsx', subcategory_id=subcategory.id, imported_by_id=auth_user.id,
+                                             file_status=ImportFileStatus.EXPORTED))
+        db_session.session.commit()
+        assert count_total(query, 'cached') == 5
+        assert count_total(query, 'exact') == 6
+        clear_count_cache()
+        assert count_total(query, 'estimate') == 6
+
+
+class TestIncrementalVerification:
+    """Тесты инкрементальной верификации по отпечаткам входных данных"""
+    
+    def _create_product(self, db_session):
+        """Создать товар с текстовым и числовым атрибутами"""
+        from app.models.product import ProductAttributeValue
+        
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        color = Attribute(code='color', name='Цвет', type=AttributeType.TEXT)
+        weight = Attribute(code='weight', name='Вес', type=AttributeType.NUMBER)
+        db_session.session.add_all([subcategory, color, weight])
+        db_session.session.commit()
+        
+        product = Product(name='Товар', sku='SKU123', subcategory_id=subcategory.id)
+        db_session.session.add(product)
+        db_session.session.commit()
+        db_session.session.add_all([
+            ProductAttributeValue(product_id=product.id, attribute_id=color.id, value='красный'),
+            ProductAttributeValue(product_id=product.id, attribute_id=weight.id, value='abc'),
+        ])
+        db_session.session.commit()
+        return product, weight
+    
+    def test_unchanged_product_is_skipped(self, db_session, monkeypatch):
+        """Повторная верификация без изменений не пересчитывает проверки и не создает записей"""
+        monkeypatch.setattr(VerificationService, '_update_status_based_on_score', lambda *args: None)
+        product, _ = self._create_product(db_session)
+        
+        first = VerificationService.verify_product(product)
+        assert first.input_fingerprint
+        
+        def fail(*args, **kwargs):
+            raise AssertionError('Проверка не должна пересчитываться')
+        
+        monkeypatch.setattr(VerificationService, '_check_media', fail)
+        monkeypatch.setattr(VerificationService, '_check_completeness', fail)
+        
+        second = VerificationService.verify_product(product)
+        assert second.id == first.id
+        assert second.unchanged is True
+        assert product.verifications.count() == 1
+    
+    def test_changed_attribute_recomputes_only_affected_checks(self, db_session, monkeypatch):
+        """Изменение значения атрибута пересчитывает качество, медиа берется из прошлой верификации"""
+        monkeypatch.setattr(VerificationService, '_update_status_based_on_score', lambda *args: None)
+        product, weight = self._create_product(db_session)
+        
+        first = VerificationService.verify_product(product)
+        assert first.quality_score == 50
+        assert any(issue.issue_type.value == 'invalid_type' for issue in first.issues)
+        
+        def fail(*args, **kwargs):
+            raise AssertionError('Медиа не должны проверяться повторно')
+        
+        monkeypatch.setattr(VerificationService, '_check_media', fail)
+        
+        pav = product.attribute_values.filter_by(attribute_id=weight.id).first()
+        pav.value = '1.5'
+        db_session.session.commit()
+        
+        second = VerificationService.verify_product(product)
+        assert second.id != first.id
+        assert second.quality_score == 100
+        assert second.media_score == first.media_score
+        assert [i.message for i in second.issues if i.issue_type.value == 'media_count_low'] == \
+            [i.message for i in first.issues if i.issue_type.value == 'media_count_low']
+    
+    def test_force_recomputes(self, db_session, monkeypatch):
+        """force=True создает новую верификацию даже без изменений"""
+        monkeypatch.setattr(VerificationService, '_update_status_based_on_score', lambda *args: None)
+        product, _ = self._create_product(db_session)
+        
+        first = VerificationService.verify_product(product)
+        second = VerificationService.verify_product(product, force=True)
+        assert second.id != first.id
+        assert second.unchanged is False
+    
+    def test_scoring_config_change_recomputes(self, db_session, monkeypatch):
+        """Изменение весов оценки не дает вернуть прежнюю верификацию"""
+        from config import Config
+        monkeypatch.setattr(VerificationService, '_update_status_based_on_score', lambda *args: None)
+        product, _ = self._create_product(db_session)
+        
+        first = VerificationService.verify_product(product)
+        monkeypatch.setattr(Config, 'VERIFICATION_WEIGHTS', {'completeness': 1, 'quality': 0, 'media': 0})
+        second = VerificationService.verify_product(product)
+        assert second.id != first.id
+        assert second.overall_score == second.completeness_score
+    
+    def test_external_inputs_checked_only_after_local_match(self, db_session, monkeypatch):
+        """Дубликаты в каталоге проверяются после совпадения отпечатка товара и сбрасывают быстрый путь"""
+        from app.models.product import ProductAttributeValue
+        from app.services.duplicate_service import DuplicateService
+        monkeypatch.setattr(VerificationService, '_update_status_based_on_score', lambda *args: None)
+        product, weight = self._create_product(db_session)
+        article = Attribute(code='article', name='Артикул', type=AttributeType.TEXT, is_unique=True)
+        db_session.session.add(article)
+        db_session.session.commit()
+        db_session.session.add(ProductAttributeValue(product_id=product.id, attribute_id=article.id, value='A-1'))
+        db_session.session.commit()
+        
+        first = VerificationService.verify_product(product)
+        assert not any(issue.issue_type.value == 'duplicate' for issue in first.issues)
+        
+        calls = []
+        original = DuplicateService.find_duplicates
+        monkeypatch.setattr(DuplicateService, 'find_duplicates',
+                            lambda *args: calls.append(args) or original(*args))
+        assert VerificationService.verify_product(product).unchanged is True
+        assert len(calls) == 1
+        
+        other = Product(name='Другой', sku='SKU456', subcategory_id=product.subcategory_id)
+        db_session.session.add(other)
+        db_session.session.commit()
+        db_session.session.add(ProductAttributeValue(product_id=other.id, attribute_id=article.id, value='A-1'))
+        db_session.session.commit()
+        
+        second = VerificationService.verify_product(product)
+        assert second.id != first.id
+        assert any(issue.issue_type.value == 'duplicate' for issue in second.issues)
+
+
+class TestValidatorRegistry:
+    """Тесты скомпилированных валидаторов атрибутов"""
+    
+    def test_rules_and_types(self, db_session):
+        """Валидатор проверяет тип и правила с предкомпилированным шаблоном"""
+        from app.utils.attribute_validators import validator_registry
+        attribute = Attribute(
+            code='article', name='Артикул', type=AttributeType.TEXT,
+            validation_rules={'pattern': r'^[A-Z]{3}\d+$', 'max_length': 6}
+        )
+        date_attr = Attribute(
+            code='release', name='Дата выпуска', type=AttributeType.DATE,
+            validation_rules={'format': '%d/%m/%Y'}
+        )
+        flag = Attribute(code='in_stock', name='В наличии', type=AttributeType.BOOLEAN)
+        db_session.session.add_all([attribute, date_attr, flag])
+        db_session.session.commit()
+        
+        validator = validator_registry.get_validator(attribute)
+        assert validator.pattern is not None
+        assert validator.check_rules('ABC12') is True
+        assert validator.check_rules('abc12') is False
+        assert validator.check_rules('ABC1234') is False
+        
+        assert validator_registry.get_validator(date_attr).check_type('05/03/2024') is True
+        assert validator_registry.get_validator(date_attr).check_type('2024-03-05') is False
+        assert validator_registry.get_validator(flag).check_type('да') is True
+        assert validator_registry.get_validator(flag).check_type('может быть') is False
+    
+    def test_select_values_invalidated_on_change(self, db_session):
+        """Добавление значения SELECT сбрасывает скомпилированный валидатор"""
+        from app.models.attribute import AttributeValue
+        from app.utils.attribute_validators import validator_registry
+        attribute = Attribute(code='color', name='Цвет', type=AttributeType.SELECT)
+        db_session.session.add(attribute)
+        db_session.session.commit()
+        db_session.session.add(AttributeValue(attribute_id=attribute.id, value='красный'))
+        db_session.session.commit()
+        
+        assert validator_registry.get_validator(attribute).check_type('синий') is False
+        
+        db_session.session.add(AttributeValue(attribute_id=attribute.id, value='синий'))
+        db_session.session.commit()
+        
+        assert validator_registry.get_validator(attribute).check_type('синий') is True
+    
+    def test_subcategory_schema(self, db_session):
+        """Схема подкатегории содержит обязательные атрибуты и валидаторы всех атрибутов"""
+        from app.models.subcategory_attribute import SubcategoryAttribute
+        from app.utils.attribute_validators import validator_registry
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        weight = Attribute(code='weight', name='Вес', type=AttributeType.NUMBER)
+        color = Attribute(code='color', name='Цвет', type=AttributeType.TEXT)
+        db_session.session.add_all([subcategory, weight, color])
+        db_session.session.commit()
+        db_session.session.add_all([
+            SubcategoryAttribute(subcategory_id=subcategory.id, attribute_id=weight.id, is_required=True),
+            SubcategoryAttribute(subcategory_id=subcategory.id, attribute_id=color.id, is_required=False),
+        ])
+        db_session.session.commit()
+        
+        schema = validator_registry.get_schema(subcategory)
+        assert schema.required == ((weight.id, 'Вес'),)
+        assert set(schema.validators) == {weight.id, color.id}
+        assert validator_registry.get_schema(subcategory) is schema
+    
+    def test_import_keeps_values_of_wrong_type(self, db_session):
+        """Импорт сохраняет значения, не прошедшие проверку типа, и сообщает о них"""
+        from app.models.product import ProductAttributeValue
+        from app.models.subcategory_attribute import SubcategoryAttribute
+        from app.models.verification import IssueType
+        from app.services.import_service import ImportService
+        from app.services.verification_service import VerificationService
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        released = Attribute(code='released', name='Дата выпуска', type=AttributeType.DATE)
+        expires = Attribute(code='expires', name='Годен до', type=AttributeType.DATE)
+        site = Attribute(code='site', name='Сайт', type=AttributeType.URL)
+        db_session.session.add_all([subcategory, released, expires, site])
+        db_session.session.commit()
+        reference = {}
+        for attribute in (released, expires, site):
+            reference[attribute.code] = SubcategoryAttribute(subcategory_id=subcategory.id, attribute_id=attribute.id)
+            db_session.session.add(reference[attribute.code])
+        db_session.session.commit()
+        
+        warnings = []
+        product = ImportService._create_product_from_row(
+            {'SKU': 'SKU1', 'released': '12/31/2023', 'expires': '31 Dec 2023', 'site': 'example.com'},
+            subcategory, {'SKU': 'sku', 'released': 'released', 'expires': 'expires', 'site': 'site'},
+            reference, None, warnings=warnings
+        )
+        db_session.session.commit()
+        
+        values = {pav.attribute_id: pav.value for pav in ProductAttributeValue.query.filter_by(product_id=product.id)}
+        assert values == {released.id: '12/31/2023', expires.id: '31 Dec 2023', site.id: 'example.com'}
+        assert len(warnings) == 3
+        
+        verification = VerificationService.verify_product(product)
+        invalid = {issue.attribute_id for issue in verification.issues if issue.issue_type == IssueType.INVALID_TYPE}
+        assert invalid == {released.id, expires.id, site.id}
+
+
+class TestVerificationJob:
+    """Тесты заданий массовой верификации"""
+    
+    def test_run_job_in_chunks(self, db_session, monkeypatch):
+        """Задание обрабатывает товары подкатегории по частям и записывает прогресс"""
+        from app.models.verification import VerificationJobStatus
+        from app.services.verification_job_service import VerificationJobService
+        from config import Config
+        monkeypatch.setattr(Config, 'VERIFICATION_CHUNK_SIZE', 2)
+        
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        db_session.session.add(subcategory)
+        db_session.session.commit()
+        for i in range(5):
+            db_session.session.add(Product(name=f'Товар {i}', sku=f'SKU{i}', subcategory_id=subcategory.id))
+        db_session.session.commit()
+        
+        job = VerificationJobService.create_job(subcategory_id=subcategory.id)
+        assert job.total_count == 5
+        
+        job = VerificationJobService.run_job(job.id, workers=1)
+        assert job.status == VerificationJobStatus.COMPLETED
+        assert job.chunks_total == 3
+        assert job.chunks_done == 3
+        assert job.processed_count == 5
+        assert job.errors_count == 0
+        
+        # Повторный запуск без изменений - все товары пропускаются
+        job = VerificationJobService.run_job(VerificationJobService.create_job(subcategory_id=subcategory.id).id, workers=1)
+        assert job.unchanged_count == 5
+        assert job.to_dict()['progress'] == 100
+    
+    def test_duplicate_index_built_once_per_job(self, db_session, monkeypatch):
+        """Индекс дубликатов строится один раз на задание, а не на каждую часть"""
+        from app.services.duplicate_service import DuplicateService
+        from app.services.verification_job_service import VerificationJobService
+        from config import Config
+        monkeypatch.setattr(Config, 'VERIFICATION_CHUNK_SIZE', 1)
+        
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        db_session.session.add(subcategory)
+        db_session.session.commit()
+        for i in range(3):
+            db_session.session.add(Product(name=f'Товар {i}', sku=f'SKU{i}', subcategory_id=subcategory.id))
+        db_session.session.commit()
+        
+        calls = []
+        build_index = DuplicateService.build_index
+        monkeypatch.setattr(DuplicateService, 'build_index',
+                            staticmethod(lambda *args: calls.append(args) or build_index(*args)))
+        
+        job = VerificationJobService.run_job(VerificationJobService.create_job(subcategory_id=subcategory.id).id, workers=1)
+        assert job.chunks_done == 3
+        assert len(calls) == 1
+    
+    def test_worker_uses_parent_config(self, monkeypatch):
+        """Процесс-обработчик создает приложение с конфигурацией родительского приложения"""
+        from app import create_app
+        from app.services import verification_job_service
+        from app.services.image_analysis_service import ImageAnalysisService
+        from config import TestingConfig
+        
+        app = create_app(TestingConfig)
+        assert app.config['CONFIG_CLASS_PATH'] == 'config.TestingConfig'
+        
+        monkeypatch.setattr(verification_job_service, '_worker_app', None)
+        monkeypatch.setattr(verification_job_service, '_worker_duplicates', None)
+        monkeypatch.setattr(ImageAnalysisService, '_workers_limit', None)
+        verification_job_service._init_worker(app.config['CONFIG_CLASS_PATH'], 'index')
+        assert verification_job_service._worker_app.config['TESTING'] is True
+        assert verification_job_service._worker_duplicates == 'index'
+        assert ImageAnalysisService._workers_limit == TestingConfig.IMAGE_ANALYSIS_JOB_WORKERS
+    
+    def test_create_job_requires_scope(self, db_session):
+        """Задание без файла импорта и подкатегории не создается"""
+        from app.services.verification_job_service import VerificationJobService
+        with pytest.raises(ValueError):
+            VerificationJobService.create_job()
+    
+    def test_failed_chunk_fails_job(self, db_session, monkeypatch):
+        """Если ни один товар части не верифицирован, задание завершается ошибкой"""
+        from app.models.verification import VerificationJobStatus
+        from app.services.verification_job_service import VerificationJobService
+        from app.services.verification_service import VerificationService
+        
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        db_session.session.add(subcategory)
+        db_session.session.commit()
+        db_session.session.add(Product(name='Товар', sku='SKU1', subcategory_id=subcategory.id))
+        db_session.session.commit()
+        
+        def broken(*args, **kwargs):
+            raise RuntimeError('нет соединения с БД')
+        
+        monkeypatch.setattr(VerificationService, 'verify_product', broken)
+        job = VerificationJobService.run_job(VerificationJobService.create_job(subcategory_id=subcategory.id).id, workers=1)
+        assert job.status == VerificationJobStatus.FAILED
+        assert 'нет соединения с БД' in job.error_message
+    
+    def test_stale_job_marked_failed_when_polled(self, db_session, logged_in_client):
+        """Задание прерванного процесса помечается как failed при запросе прогресса"""
+        from datetime import datetime, timedelta
+        from config import Config
+        from app.models.verification import VerificationJob, VerificationJobStatus
+        
+        stale_at = datetime.utcnow() - timedelta(seconds=Config.VERIFICATION_JOB_STALE_SECONDS + 60)
+        stale = VerificationJob(status=VerificationJobStatus.RUNNING,
+                                started_at=stale_at, heartbeat_at=stale_at)
+        running = VerificationJob(status=VerificationJobStatus.RUNNING,
+                                  started_at=stale_at, heartbeat_at=datetime.utcnow())
+        db_session.session.add_all([stale, running])
+        db_session.session.commit()
+        
+        assert logged_in_client.get(f'/api/verification-jobs/{stale.id}').get_json()['status'] == 'failed'
+        assert logged_in_client.get(f'/api/verification-jobs/{running.id}').get_json()['status'] == 'running'
+
+
+class TestDuplicateService:
+    """Тесты поиска дубликатов уникальных атрибутов"""
+    
+    def _create_products(self, db_session, values):
+        """Создать товары со значениями уникального атрибута"""
+        from app.models.product import ProductAttributeValue
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        attribute = Attribute(code='ean', name='EAN', type=AttributeType.TEXT, is_unique=True)
+        db_session.session.add_all([subcategory, attribute])
+        db_session.session.commit()
+        
+        products = []
+        for i, value in enumerate(values):
+            product = Product(name=f'Товар {i}', sku=f'SKU{i}', subcategory_id=subcategory.id)
+            db_session.session.add(product)
+            db_session.session.commit()
+            db_session.session.add(ProductAttributeValue(product_id=product.id, attribute_id=attribute.id, value=value))
+            products.append(product)
+        db_session.session.commit()
+        return products, attribute
+    
+    def test_value_hash_maintained(self, db_session):
+        """Хэш значения пересчитывается при изменении, пробелы по краям не учитываются"""
+        from app.models.product import ProductAttributeValue
+        products, attribute = self._create_products(db_session, ['4600000000001'])
+        pav = ProductAttributeValue.query.filter_by(product_id=products[0].id).first()
+        assert pav.value_hash == ProductAttributeValue.hash_value(' 4600000000001 ')
+        
+        pav.value = '4600000000002'
+        db_session.session.commit()
+        assert pav.value_hash == ProductAttributeValue.hash_value('4600000000002')
+    
+    def test_clusters_and_index(self, db_session):
+        """Группы дубликатов находятся одним проходом и используются верификацией"""
+        from app.services.duplicate_service import DuplicateService
+        products, attribute = self._create_products(db_session, ['111', '222', '111', '333', '111 '])
+        
+        clusters = DuplicateService.get_clusters()
+        assert len(clusters) == 1
+        assert clusters[0]['value'] == '111'
+        assert [p['id'] for p in clusters[0]['products']] == [products[0].id, products[2].id, products[4].id]
+        
+        index = DuplicateService.build_index()
+        assert index.find_duplicate(attribute.id, '111', products[0].id) == products[2].id
+        assert index.find_duplicate(attribute.id, '222', products[1].id) is None
+        
+        duplicate = VerificationService._check_uniqueness(attribute, '111', products[2], index)
+        assert duplicate.id == products[0].id
+        assert VerificationService._check_uniqueness(attribute, '333', products[3]) is None
+    
+    def test_ensure_hashes_backfills(self, db_session):
+        """Записи без хэша (созданные в обход ORM) заполняются пакетами"""
+        from app.models.product import ProductAttributeValue
+        from app.services.duplicate_service import DuplicateService
+        products, attribute = self._create_products(db_session, ['111', '111'])
+        db_session.session.query(ProductAttributeValue).update({'value_hash': None})
+        db_session.session.commit()
+        assert DuplicateService.get_clusters() == []
+        
+        assert DuplicateService.ensure_hashes(batch_size=1) == 2
+        assert len(DuplicateService.get_clusters()) == 1
+
+
+class TestScoringService:
+    """Тесты колоночного расчета оценок подкатегории"""
+    
+    def test_matches_per_product_checks(self, db_session):
+        """Оценки по матрице совпадают с _check_completeness и _check_quality"""
+        from app.models.attribute import AttributeValue
+        from app.models.product import ProductAttributeValue
+        from app.models.subcategory_attribute import SubcategoryAttribute
+        from app.services.scoring_service import ScoringService
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        weight = Attribute(code='weight', name='Вес', type=AttributeType.NUMBER, validation_rules={'min': 0, 'max': 100})
+        color = Attribute(code='color', name='Цвет', type=AttributeType.SELECT)
+        ean = Attribute(code='ean', name='EAN', type=AttributeType.TEXT, is_unique=True,
+                        validation_rules={'pattern': r'^\d+$'})
+        release = Attribute(code='release', name='Дата выпуска', type=AttributeType.DATE)
+        flag = Attribute(code='in_stock', name='В наличии', type=AttributeType.BOOLEAN)
+        site = Attribute(code='site', name='Сайт', type=AttributeType.URL)
+        db_session.session.add_all([subcategory, weight, color, ean, release, flag, site])
+        db_session.session.commit()
+        db_session.session.add_all([
+            AttributeValue(attribute_id=color.id, value='красный'),
+            SubcategoryAttribute(subcategory_id=subcategory.id, attribute_id=weight.id, is_required=True),
+            SubcategoryAttribute(subcategory_id=subcategory.id, attribute_id=color.id, is_required=True),
+            SubcategoryAttribute(subcategory_id=subcategory.id, attribute_id=ean.id, is_required=False),
+        ])
+        db_session.session.commit()
+        
+        rows = [
+            {weight: '12.5', color: 'красный', ean: '111', release: '2024-03-05', flag: 'да', site: 'https://a.ru'},
+            {weight: '1_000', color: 'синий', ean: '111 ', release: '31.02.2024', flag: 'может быть'},
+            {weight: 'abc', color: '  ', ean: 'X1', site: 'ftp://a.ru'},
+            {weight: 'nan', ean: '222', release: '2024/03/05'},
+            {},
+        ]
+        products = []
+        for i, values in enumerate(rows):
+            product = Product(name=f'Товар {i}', sku=f'SKU{i}', subcategory_id=subcategory.id)
+            db_session.session.add(product)
+            db_session.session.commit()
+            for attribute, value in values.items():
+                db_session.session.add(ProductAttributeValue(product_id=product.id, attribute_id=attribute.id, value=value))
+            products.append(product)
+        db_session.session.commit()
+        
+        scores = ScoringService.score_subcategory(subcategory.id)
+        assert list(scores.index) == [product.id for product in products]
+        for product in products:
+            assert scores.loc[product.id, 'completeness_score'] == VerificationService._check_completeness(product)[0]
+            assert scores.loc[product.id, 'quality_score'] == VerificationService._check_quality(product)[0]
+        
+        assert scores.loc[products[0].id, 'quality_score'] == 83  # Дубликат EAN
+        assert scores.loc[products[4].id, 'completeness_score'] == 0
+        assert scores.loc[products[4].id, 'quality_score'] == 100
+    
+    def test_overall_score_and_status(self):
+        """Общая оценка считается в целых числах, статус - по порогам"""
+        from app.services.scoring_service import ScoringService
+        assert ScoringService.overall_score(100, 100, 100) == 100
+        assert ScoringService.overall_score(90, 80, 50) == 78
+        assert ScoringService.overall_score(90, 80, 50, weights={'media': 0}) == 85
+        assert ScoringService.status_for_score(80) == ProductStatus.APPROVED
+        assert ScoringService.status_for_score(79) == ProductStatus.TO_REVIEW
+        assert ScoringService.status_for_score(49) == ProductStatus.REJECTED
+        with pytest.raises(ValueError):
+            ScoringService.overall_score(1, 1, 1, weights={'completeness': 0, 'quality': 0, 'media': 0})
+    
+    def test_rescore_preview_and_apply(self, db_session):
+        """Пересчет по сохраненным оценкам: предпросмотр не меняет данные, применение обновляет статусы"""
+        from app.models.verification import ProductVerification
+        from app.models.workflow import ProductStatusHistory
+        from app.services.scoring_service import ScoringService
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        db_session.session.add(subcategory)
+        db_session.session.commit()
+        
+        # (полнота, качество, медиа) последней верификации
+        scores = [(100, 100, 100), (90, 80, 50), (40, 40, 20)]
+        products = []
+        for i, (completeness, quality, media) in enumerate(scores):
+            product = Product(name=f'Товар {i}', sku=f'SKU{i}', subcategory_id=subcategory.id)
+            db_session.session.add(product)
+            db_session.session.commit()
+            db_session.session.add(ProductVerification(product_id=product.id, completeness_score=0,
+                                                       quality_score=0, media_score=0, overall_score=0))
+            db_session.session.commit()
+            overall = ScoringService.overall_score(completeness, quality, media)
+            db_session.session.add(ProductVerification(
+                product_id=product.id, completeness_score=completeness, quality_score=quality,
+                media_score=media, overall_score=overall
+            ))
+            product.status = ScoringService.status_for_score(overall)
+            products.append(product)
+        db_session.session.commit()
+        
+        # Последняя верификация - по времени, а не по наибольшему id
+        from datetime import datetime
+        db_session.session.add(ProductVerification(product_id=products[0].id, completeness_score=0, quality_score=0,
+                                                   media_score=0, overall_score=0, verified_at=datetime(2000, 1, 1)))
+        # Статус экспортированного товара пересчет не меняет
+        exported = Product(name='Экспортирован', sku='SKU-EXP', subcategory_id=subcategory.id, status=ProductStatus.EXPORTED)
+        db_session.session.add(exported)
+        db_session.session.commit()
+        db_session.session.add(ProductVerification(product_id=exported.id, completeness_score=50, quality_score=50,
+                                                   media_score=50, overall_score=50))
+        db_session.session.commit()
+        
+        # Текущие веса и пороги - без изменений
+        result = ScoringService.rescore()
+        assert result['total'] == 3
+        assert result['distribution'] == {'approved': 1, 'to_review': 1, 'rejected': 1}
+        assert result['changed_count'] == 0
+        
+        # Без учета медиа: второй товар утверждается (оценка 85)
+        result = ScoringService.rescore(weights={'media': 0}, subcategory_id=subcategory.id)
+        assert result['distribution'] == {'approved': 2, 'to_review': 0, 'rejected': 1}
+        assert result['changes'] == [{'from': 'to_review', 'to': 'approved', 'count': 1}]
+        assert products[1].status == ProductStatus.TO_REVIEW
+        
+        result = ScoringService.rescore(weights={'media': 0}, thresholds={'review': 40}, apply=True)
+        assert result['applied'] is True
+        assert result['changed_count'] == 2
+        assert [p.status for p in products] == [ProductStatus.APPROVED, ProductStatus.APPROVED, ProductStatus.TO_REVIEW]
+        assert products[1].verifications.order_by(ProductVerification.id.desc()).first().overall_score == 85
+        history = ProductStatusHistory.query.filter_by(product_id=products[2].id).all()
+        assert [(h.old_status, h.new_status) for h in history] == [('rejected', 'to_review')]
+        assert exported.status == ProductStatus.EXPORTED
+        assert ProductStatusHistory.query.filter_by(product_id=exported.id).count() == 0
+        
+        with pytest.raises(ValueError):
+            ScoringService.rescore(thresholds={'approve': 40, 'review': 60})
+
+
+class TestVerificationHistory:
+    """Тесты компактного хранения проблем и очистки истории верификаций"""
+    
+    def _create_product(self, db_session):
+        """Создать товар без изображений (каждая верификация дает проблему MEDIA_COUNT_LOW)"""
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        db_session.session.add(subcategory)
+        db_session.session.commit()
+        product = Product(name='Товар', sku='SKU1', subcategory_id=subcategory.id)
+        db_session.session.add(product)
+        db_session.session.commit()
+        return product
+    
+    def test_issue_stored_as_code_and_params(self, db_session):
+        """Проблема хранится кодом и параметрами, текст формируется при чтении"""
+        from app.models.verification import VerificationIssue
+        product = self._create_product(db_session)
+        verification = VerificationService.verify_product(product, force=True)
+        
+        issue = verification.issues.first()
+        assert issue.code == 'no_images'
+        assert issue.stored_message is None
+        assert issue.message == 'Отсутствуют изображения товара'
+        assert verification.to_dict()['issues_count'] == 1
+        
+        # Записи в старом формате читаются как есть
+        legacy = VerificationIssue(verification_id=verification.id, issue_type=issue.issue_type, message='Текст')
+        db_session.session.add(legacy)
+        db_session.session.commit()
+        assert legacy.message == 'Текст'
+    
+    def test_purge_keeps_latest_and_summarizes(self, db_session):
+        """Очистка оставляет последние N верификаций, остальные сворачиваются в сводку"""
+        from app.models.verification import ProductVerification, VerificationIssue, VerificationSummary
+        from app.services.verification_history_service import VerificationHistoryService
+        product = self._create_product(db_session)
+        verifications = [VerificationService.verify_product(product, force=True) for _ in range(5)]
+        latest_ids = [v.id for v in verifications[-2:]]
+        first_score = verifications[0].overall_score
+        
+        result = VerificationHistoryService.purge(keep=2, batch_size=1)
+        assert result == {'products': 1, 'verifications': 3, 'issues': 3}
+        
+        assert sorted(v.id for v in ProductVerification.query.all()) == latest_ids
+        assert VerificationIssue.query.count() == 2
+        summary = VerificationSummary.query.one()
+        assert summary.product_id == product.id
+        assert summary.verifications_count == 3
+        assert summary.issues_count == 3
+        assert summary.max_overall_score == first_score
+        
+        # Повторная очистка ничего не удаляет
+        assert VerificationHistoryService.purge(keep=2)['verifications'] == 0
+
+
+class TestMediaDownloader:
+    """Тесты параллельного скачивания медиа-файлов с повторами"""
+    
+    class FakeResponse:
+        """Ответ requests для потокового скачивания"""
+        
+        def __init__(self, content=b'', status_code=200):
+            self.content_bytes = content
+            self.status_code = status_code
+            self.headers = {'Content-Type': 'image/png', 'Content-Length': str(len(content))}
+        
+        def __enter__(self):
+            return self
+        
+        def __exit__(self, *args):
+            pass
+        
+        def raise_for_status(self):
+            import requests
+            if self.status_code >= 400:
+                raise requests.HTTPError(f'HTTP {self.status_code}')
+        
+        def iter_content(self, chunk_size=8192):
+            for start in range(0, len(self.content_bytes), chunk_size):
+                yield self.content_bytes[start:start + chunk_size]
+    
+    @pytest.fixture
+    def media_config(self, tmp_path, monkeypatch):
+        """Папки медиа во временной директории, повторы без задержки"""
+        from config import Config
+        from app.utils.host_guard import host_guard
+        monkeypatch.setattr(Config, 'IMAGES_FOLDER', tmp_path / 'images')
+        monkeypatch.setattr(Config, 'MODELS_FOLDER', tmp_path / 'models')
+        monkeypatch.setattr(Config, 'MEDIA_DOWNLOAD_BACKOFF', 0)
+        monkeypatch.setattr(Config, 'IMAGE_ANALYSIS_MIN_POOL_BATCH', 100)
+        monkeypatch.setattr(Config, 'IMAGE_DERIVATIVES_ON_DOWNLOAD', False)
+        host_guard.reset()
+        yield tmp_path
+        host_guard.reset()
+    
+    def _png(self):
+        import io
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new('RGB', (10, 10), 'red').save(buffer, 'PNG')
+        return buffer.getvalue()
+    
+    def _create_products(self, db_session, count):
+        """Создать товары с двумя изображениями каждый"""
+        from app.models.product import ProductAttributeValue
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        photo = Attribute(code='photo', name='Фото', type=AttributeType.IMAGE)
+        photo2 = Attribute(code='photo2', name='Фото 2', type=AttributeType.IMAGE)
+        db_session.session.add_all([subcategory, photo, photo2])
+        db_session.session.commit()
+        
+        products = []
+        for i in range(count):
+            product = Product(name=f'Товар {i}', sku=f'SKU{i}', subcategory_id=subcategory.id)
+            db_session.session.add(product)
+            db_session.session.flush()
+            for attribute in (photo, photo2):
+                db_session.session.add(ProductAttributeValue(
+                    product_id=product.id,
+                    attribute_id=attribute.id,
+                    value=f'http://cdn.example.com/{product.sku}_{attribute.code}.png'
+                ))
+            products.append(product)
+        db_session.session.commit()
+        return products
+    
+    def test_bulk_download_retries_transient_errors(self, db_session, media_config, monkeypatch):
+        """Файлы товаров скачиваются пакетом, HTTP 503 повторяется"""
+        import threading
+        import requests
+        from app.models.product_media import ProductMedia, MediaDownloadRetry
+        from app.services.media_service import MediaService
+        content = self._png()
+        calls = {}
+        lock = threading.Lock()
+        
+        def fake_get(session, url, **kwargs):
+            with lock:
+                calls[url] = calls.get(url, 0) + 1
+                first = calls[url] == 1
+            return self.FakeResponse(status_code=503) if first else self.FakeResponse(content)
+        
+        monkeypatch.setattr(requests.Session, 'get', fake_get)
+        products = self._create_products(db_session, 3)
+        
+        stats = MediaService.process_products_media(products)
+        
+        assert all(s['images_found'] == 2 and s['images_downloaded'] == 2 and not s['errors'] for s in stats.values())
+        assert set(calls.values()) == {2}
+        assert ProductMedia.query.count() == 6
+        assert MediaDownloadRetry.query.count() == 0
+        media = ProductMedia.query.filter_by(product_id=products[0].id).order_by(ProductMedia.sort_order).all()
+        assert [m.sort_order for m in media] == [1, 2]
+        assert all(MediaService.get_media_path(m.file_path).read_bytes() == content for m in media)
+        
+        # Повторная обработка не скачивает уже сохраненные файлы
+        calls.clear()
+        MediaService.process_products_media(products)
+        assert calls == {}
+    
+    def test_failed_download_goes_to_retry_queue(self, db_session, media_config, monkeypatch):
+        """Не скачанный из-за сетевой ошибки файл скачивается повторно из очереди"""
+        from datetime import datetime, timedelta
+        import requests
+        from app.models.product_media import ProductMedia, MediaDownloadRetry
+        from app.services.media_service import MediaService
+        from app.utils.host_guard import host_guard
+        content = self._png()
+        
+        def offline(session, url, **kwargs):
+            raise requests.ConnectionError('connection refused')
+        
+        monkeypatch.setattr(requests.Session, 'get', offline)
+        product = self._create_products(db_session, 1)[0]
+        
+        stats = MediaService.process_product_media(product)
+        assert stats['images_downloaded'] == 0
+        assert len(stats['errors']) == 2
+        retries = MediaDownloadRetry.query.all()
+        assert len(retries) == 2
+        assert all(r.attempts == 1 and r.next_attempt_at > datetime.utcnow() for r in retries)
+        assert not (media_config / 'images').exists()
+        
+        # Время повтора не наступило
+        assert MediaService.retry_failed_downloads()['processed'] == 0
+        
+        # Хост снова доступен
+        host_guard.reset()
+        for retry in retries:
+            retry.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+        db_session.session.commit()
+        monkeypatch.setattr(requests.Session, 'get', lambda session, url, **kwargs: self.FakeResponse(content))
+        
+        result = MediaService.retry_failed_downloads()
+        assert result == {'processed': 2, 'downloaded': 2, 'failed': 0, 'dropped': 0}
+        assert MediaDownloadRetry.query.count() == 0
+        assert ProductMedia.query.filter_by(product_id=product.id).count() == 2
+    
+    def test_shared_url_stored_once(self, db_session, media_config, monkeypatch):
+        """Общий URL вариантов скачивается один раз и хранится одним blob по хэшу"""
+        import hashlib
+        import requests
+        from app.models.product import ProductAttributeValue
+        from app.models.product_media import ProductMedia, MediaBlob
+        from app.services.media_service import MediaService
+        content = self._png()
+        sha256 = hashlib.sha256(content).hexdigest()
+        calls = []
+        
+        def fake_get(session, url, **kwargs):
+            calls.append(url)
+            return self.FakeResponse(content)
+        
+        monkeypatch.setattr(requests.Session, 'get', fake_get)
+        products = self._create_products(db_session, 4)
+        for product in products:
+            ProductAttributeValue.query.filter_by(product_id=product.id).update(
+                {'value': 'http://cdn.example.com/shared.png'}
+            )
+        db_session.session.commit()
+        
+        MediaService.process_products_media(products[:3])
+        assert calls == ['http://cdn.example.com/shared.png']
+        blob = MediaBlob.query.one()
+        assert blob.sha256 == sha256
+        assert blob.ref_count == 6
+        assert blob.file_path.endswith(f'{sha256[:2]}/{sha256[2:4]}/{sha256}.png')
+        assert MediaService.get_media_path(blob.file_path).read_bytes() == content
+        assert all(m.file_name == 'shared.png' and m.analyzed_at for m in ProductMedia.query.all())
+        
+        # Недавно скачанный URL не скачивается повторно, результаты анализа копируются
+        stats = MediaService.process_product_media(products[3])
+        assert stats['images_downloaded'] == 2
+        assert len(calls) == 1
+        assert blob.ref_count == 8
+        
+        # При откате файл и счетчик ссылок остаются
+        blob_path = MediaService.get_media_path(blob.file_path)
+        for media in ProductMedia.query.all():
+            MediaService.release_media(media)
+        db_session.session.rollback()
+        assert blob_path.exists() and MediaBlob.query.one().ref_count == 8
+        
+        # Файл удаляется после фиксации удаления последней ссылки
+        for media in ProductMedia.query.all():
+            MediaService.release_media(media)
+        assert blob_path.exists()
+        db_session.session.commit()
+        assert MediaBlob.query.count() == 0
+        assert not blob_path.exists()
+    
+    def _glb(self, vertices=24):
+        """Минимальный GLB: заголовок, JSON-блок и бинарный блок"""
+        import json
+        import struct
+        document = json.dumps({
+            'asset': {'version': '2.0', 'generator': 'test'},
+            'meshes': [{'primitives': [{'attributes': {'POSITION': 0}}]}],
+            'nodes': [{'mesh': 0}],
+            'materials': [{}],
+            'accessors': [{'count': vertices}],
+        }).encode()
+        document += b' ' * (-len(document) % 4)
+        binary = b'\0' * 64
+        length = 12 + 8 + len(document) + 8 + len(binary)
+        return (
+            struct.pack('<4sII', b'glTF', 2, length)
+            + struct.pack('<I4s', len(document), b'JSON') + document
+            + struct.pack('<I4s', len(binary), b'BIN\0') + binary
+        )
+    
+    def test_size_limit_enforced_while_streaming(self, db_session, media_config, monkeypatch):
+        """Без Content-Length скачивание прерывается при превышении лимита, файл не сохраняется"""
+        import requests
+        from config import Config
+        from app.models.product_media import ProductMedia, MediaDownloadRetry
+        from app.services.media_service import MediaService
+        content = self._png() + b'\0' * 4096
+        responses = []
+        
+        def fake_get(session, url, **kwargs):
+            response = self.FakeResponse(content)
+            response.headers = {}
+            responses.append(response)
+            return response
+        
+        monkeypatch.setattr(Config, 'MAX_IMAGE_SIZE', len(content) - 1)
+        monkeypatch.setattr(Config, 'MEDIA_DOWNLOAD_CHUNK_SIZE', 1024)
+        monkeypatch.setattr(requests.Session, 'get', fake_get)
+        product = self._create_products(db_session, 1)[0]
+        
+        stats = MediaService.process_product_media(product)
+        
+        assert stats['images_downloaded'] == 0
+        assert len(stats['errors']) == 2
+        assert ProductMedia.query.count() == 0
+        # Ошибка постоянная - повтор не планируется
+        assert MediaDownloadRetry.query.count() == 0
+        files = [path for path in (media_config / 'images').rglob('*') if path.is_file()]
+        assert files == []
+    
+    def test_type_detected_by_content(self, db_session, media_config, monkeypatch):
+        """Тип определяется по сигнатуре: HTML отклоняется, GLB по ссылке на изображение - 3D модель"""
+        import requests
+        from app.models.product_media import ProductMedia, MediaType
+        from app.services.media_service import MediaService
+        glb = self._glb(vertices=36)
+        
+        def fake_get(session, url, **kwargs):
+            if 'photo2' in url:
+                return self.FakeResponse(b'<!DOCTYPE html><html><body>Not found</body></html>')
+            return self.FakeResponse(glb)
+        
+        monkeypatch.setattr(requests.Session, 'get', fake_get)
+        product = self._create_products(db_session, 1)[0]
+        
+        stats = MediaService.process_product_media(product)
+        
+        assert stats['models_downloaded'] == 1
+        assert len(stats['errors']) == 1
+        media = ProductMedia.query.one()
+        assert media.media_type == MediaType.THREE_D_MODEL
+        assert media.model_format == '.glb'
+        assert media.mime_type == 'model/gltf-binary'
+        assert media.file_name == 'SKU0_photo.glb'
+        assert media.model_stats['version'] == 2
+        assert media.model_stats['meshes'] == 1
+        assert media.model_stats['vertices'] == 36
+        assert MediaService.get_media_path(media.file_path).parent.parent.parent == media_config / 'models'
+        assert not (media_config / 'images').exists() or not any(
+            path.is_file() for path in (media_config / 'images').rglob('*')
+        )
+    
+    def test_truncated_glb_rejected(self, tmp_path, monkeypatch):
+        """GLB, размер которого не совпадает с заголовком, не сохраняется"""
+        import requests
+        from config import Config
+        from app.services.media_downloader import MediaDownloader
+        response = self.FakeResponse(self._glb()[:-16])
+        response.headers = {}
+        monkeypatch.setattr(Config, 'MODELS_FOLDER', tmp_path)
+        monkeypatch.setattr(requests.Session, 'get', lambda session, url, **kwargs: response)
+        
+        with MediaDownloader(workers=1, retries=0) as downloader:
+            result = downloader.fetch({
+                'product_id': 1, 'sku': 'SKU', 'attribute_id': 1, 'attribute_code': 'model',
+                'url': 'http://cdn.example.com/model.glb', 'media_type': None, 'sort_order': 1,
+            })
+        
+        assert 'не совпадает с заголовком' in result['error']
+        assert result['transient'] is False
+        assert [path for path in tmp_path.rglob('*') if path.is_file()] == []
+    
+    def test_refresh_downloads_only_changed_media(self, db_session, media_config, monkeypatch):
+        """Перепроверка: 304 не скачивает файл, изменившийся файл заменяет blob и копии"""
+        import io
+        from datetime import datetime, timedelta
+        import requests
+        from PIL import Image
+        from app.models.product_media import ProductMedia, MediaBlob, MediaDerivative
+        from app.services.media_service import MediaService
+        versions = {'"v1"': self._png()}
+        buffer = io.BytesIO()
+        Image.new('RGB', (20, 10), 'blue').save(buffer, 'PNG')
+        current = {'etag': '"v1"'}
+        requests_log = []
+        
+        def fake_get(session, url, headers=None, **kwargs):
+            requests_log.append((url, dict(headers or {})))
+            if (headers or {}).get('If-None-Match') == current['etag']:
+                response = self.FakeResponse(status_code=304)
+            else:
+                response = self.FakeResponse(versions[current['etag']])
+            response.headers['ETag'] = current['etag']
+            return response
+        
+        monkeypatch.setattr(requests.Session, 'get', fake_get)
+        product = self._create_products(db_session, 1)[0]
+        MediaService.process_product_media(product)
+        assert all(m.etag == '"v1"' and m.checked_at for m in ProductMedia.query.all())
+        old_blob = MediaBlob.query.one()
+        old_blob_id, old_blob_path = old_blob.id, old_blob.file_path
+        
+        # Время перепроверки не наступило
+        requests_log.clear()
+        assert MediaService.refresh_media()['checked'] == 0
+        assert requests_log == []
+        
+        def make_due():
+            ProductMedia.query.update({'checked_at': datetime.utcnow() - timedelta(days=30)})
+            db_session.session.commit()
+        
+        make_due()
+        result = MediaService.refresh_media()
+        assert result == {'checked': 2, 'unchanged': 2, 'updated': 0, 'failed': 0}
+        assert all(headers.get('If-None-Match') == '"v1"' for _, headers in requests_log)
+        
+        # Поставщик заменил файл по тому же URL
+        media = ProductMedia.query.order_by(ProductMedia.id).first()
+        db_session.session.add(MediaDerivative(
+            media_id=media.id, size=160, format='webp', file_path='old_160.webp'
+        ))
+        db_session.session.commit()
+        versions['"v2"'] = buffer.getvalue()
+        current['etag'] = '"v2"'
+        make_due()
+        
+        result = MediaService.refresh_media(limit=1)
+        assert result == {'checked': 1, 'unchanged': 0, 'updated': 1, 'failed': 0}
+        db_session.session.refresh(media)
+        assert media.etag == '"v2"'
+        assert media.blob.sha256 != old_blob.sha256
+        assert (media.width, media.height) == (20, 10)
+        assert MediaService.get_media_path(media.file_path).read_bytes() == versions['"v2"']
+        assert MediaDerivative.query.filter_by(media_id=media.id).count() == 0
+        
+        result = MediaService.refresh_media()
+        assert result['updated'] == 1
+        # Старое содержимое больше не используется и удалено
+        assert MediaBlob.query.filter_by(id=old_blob_id).count() == 0
+        assert not MediaService.get_media_path(old_blob_path).exists()
+        assert MediaBlob.query.one().ref_count == 2
+    
+    def test_garbage_collection(self, db_session, media_config, monkeypatch):
+        """Неиспользуемые файлы старше срока хранения удаляются, используемые остаются"""
+        import io
+        import os
+        import time
+        import requests
+        from PIL import Image
+        from app.models.product import ProductAttributeValue
+        from app.models.product_media import ProductMedia, MediaBlob, MediaType
+        from app.services.media_gc_service import MediaGCService
+        from app.services.media_service import MediaService
+        
+        def fake_get(session, url, **kwargs):
+            buffer = io.BytesIO()
+            Image.new('RGB', (10, 10), (sum(url.encode()) % 256, 0, 0)).save(buffer, 'PNG')
+            return self.FakeResponse(buffer.getvalue())
+        
+        monkeypatch.setattr(requests.Session, 'get', fake_get)
+        products = self._create_products(db_session, 2)
+        MediaService.process_products_media(products)
+        assert MediaBlob.query.count() == 4
+        
+        # Удаление товара освобождает его файлы
+        removed = [MediaService.get_media_path(m.file_path) for m in ProductMedia.query.filter_by(product_id=products[0].id)]
+        MediaService.release_products_media([products[0].id])
+        db_session.session.delete(products[0])
+        db_session.session.commit()
+        assert MediaBlob.query.count() == 2
+        assert not any(path.exists() for path in removed)
+        
+        # Мусор прошлых версий: файл без blob, blob без ссылок, временный файл, свежий файл
+        images = media_config / 'images'
+        def write(relative, size):
+            path = images / relative
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b'x' * size)
+            return path
+        stray = write('aa/aa/' + 'a' * 64 + '.png', 100)
+        stray_thumb = write('aa/aa/' + 'a' * 64 + '_160.webp', 10)
+        stale_blob_file = write('bb/bb/' + 'b' * 64 + '.png', 200)
+        db_session.session.add(MediaBlob(
+            sha256='b' * 64, media_type=MediaType.IMAGE, ref_count=3,
+            file_path=MediaService._to_stored_path(stale_blob_file)
+        ))
+        legacy = write('legacy_photo.jpg', 50)
+        db_session.session.add(ProductMedia(
+            product_id=products[1].id, media_type=MediaType.IMAGE, file_path=MediaService._to_stored_path(legacy),
+            file_name='legacy_photo.jpg'
+        ))
+        db_session.session.commit()
+        tmp_file = write('.tmp/tmpabc', 30)
+        old = time.time() - 7 * 24 * 3600
+        for path in images.rglob('*'):
+            if path.is_file():
+                os.utime(path, (old, old))
+        recent = write('cc/cc/' + 'c' * 64 + '.png', 40)
+        
+        preview = MediaGCService.collect(grace_seconds=3600, dry_run=True)
+        assert preview['deleted'] == 4
+        assert stray.exists() and MediaBlob.query.count() == 3
+        
+        result = MediaGCService.collect(grace_seconds=3600)
+        assert result['scanned'] == 8
+        assert result['orphaned'] == 5
+        assert result['kept_recent'] == 1
+        assert result['deleted'] == 4
+        assert result['blobs_deleted'] == 1
+        assert result['reclaimed_bytes'] == 100 + 10 + 200 + 30
+        assert not any(path.exists() for path in (stray, stray_thumb, stale_blob_file, tmp_file))
+        assert not (images / 'aa').exists()
+        assert recent.exists() and legacy.exists()
+        assert MediaBlob.query.count() == 2
+        assert all(MediaService.get_media_path(blob.file_path).exists() for blob in MediaBlob.query.all())
+        
+        # После повторного импорта с другой ссылкой старая запись медиа устаревает
+        ProductAttributeValue.query.filter_by(product_id=products[1].id, attribute_id=ProductMedia.query.filter(
+            ProductMedia.product_id == products[1].id, ProductMedia.attribute_id.isnot(None)
+        ).first().attribute_id).update({'value': 'http://cdn.example.com/new.png'})
+        db_session.session.commit()
+        assert MediaGCService.prune_stale_media() == 1
+        assert ProductMedia.query.filter_by(product_id=products[1].id).count() == 2
+        assert MediaBlob.query.count() == 1
+    
+    def test_usage_counters_and_quota(self, db_session, media_config, monkeypatch, logged_in_client):
+        """Счетчики объема обновляются при добавлении и удалении медиа, квота ограничивает скачивание"""
+        import io
+        import requests
+        from PIL import Image
+        from app.models.product_media import ProductMedia, MediaUsage, MediaType
+        from app.models.supplier import Supplier
+        from app.services.media_service import MediaService
+        from app.services.media_usage_service import MediaUsageService
+        
+        def fake_get(session, url, **kwargs):
+            buffer = io.BytesIO()
+            Image.new('RGB', (10, 10), (sum(url.encode()) % 256, 0, 0)).save(buffer, 'PNG')
+            return self.FakeResponse(buffer.getvalue())
+        
+        monkeypatch.setattr(requests.Session, 'get', fake_get)
+        products = self._create_products(db_session, 3)
+        supplier = Supplier(code='SUP', name='Поставщик')
+        db_session.session.add(supplier)
+        products[0].subcategory.suppliers.append(supplier)
+        db_session.session.commit()
+        
+        MediaService.process_products_media(products[:2])
+        total = sum(media.file_size for media in ProductMedia.query.all())
+        usage = MediaUsage.query.one()
+        assert (usage.supplier_id, usage.subcategory_id, usage.media_type) == (supplier.id, products[0].subcategory_id, MediaType.IMAGE)
+        assert (usage.file_count, usage.total_bytes) == (4, total)
+        
+        # Квота на количество файлов: из двух файлов третьего товара скачивается один
+        supplier.media_quota_files = 5
+        db_session.session.commit()
+        stats = MediaService.process_product_media(products[2])
+        assert stats['images_downloaded'] == 1
+        assert 'квота' in stats['errors'][0]
+        assert MediaUsageService.supplier_usage([supplier.id])[supplier.id][0] == 5
+        
+        # Удаление уменьшает счетчики; пересчет дает тот же результат
+        MediaService.release_products_media([products[0].id])
+        db_session.session.commit()
+        expected = sum(media.file_size for media in ProductMedia.query.all())
+        assert MediaUsageService.usage(group_by=['supplier']) == [
+            {'supplier_id': supplier.id, 'file_count': 3, 'total_bytes': expected}
+        ]
+        MediaUsageService.rebuild()
+        assert MediaUsageService.supplier_usage([supplier.id]) == {supplier.id: (3, expected)}
+        
+        response = logged_in_client.get(f'/api/suppliers/{supplier.id}/media-usage')
+        assert response.status_code == 200
+        data = response.get_json()
+        assert (data['file_count'], data['total_bytes'], data['quota_files']) == (3, expected, 5)
+        assert data['by_media_type'] == [{'media_type': 'image', 'file_count': 3, 'total_bytes': expected}]
+        response = logged_in_client.get('/api/media/usage?group_by=supplier,media_type')
+        assert response.get_json() == [
+            {'supplier_id': supplier.id, 'media_type': 'image', 'file_count': 3, 'total_bytes': expected}
+        ]
+        assert logged_in_client.get('/api/media/usage?group_by=host').status_code == 400
+    
+    def test_usage_follows_product_scope(self, db_session, media_config, monkeypatch):
+        """Смена подкатегории товара переносит его медиа в счетчики новой подкатегории и поставщика"""
+        import io
+        import warnings
+        import requests
+        from PIL import Image
+        from sqlalchemy.exc import SAWarning
+        from app.models.supplier import Supplier
+        from app.services.media_service import MediaService
+        from app.services.media_usage_service import MediaUsageService
+        
+        def fake_get(session, url, **kwargs):
+            buffer = io.BytesIO()
+            Image.new('RGB', (10, 10), (sum(url.encode()) % 256, 0, 0)).save(buffer, 'PNG')
+            return self.FakeResponse(buffer.getvalue())
+        
+        monkeypatch.setattr(requests.Session, 'get', fake_get)
+        product = self._create_products(db_session, 1)[0]
+        first = Supplier(code='SUP1', name='Поставщик 1')
+        second = Supplier(code='SUP2', name='Поставщик 2')
+        other = Subcategory(code='01_2', name='Другая подкатегория', category_id=product.subcategory.category_id)
+        db_session.session.add_all([first, second, other])
+        product.subcategory.suppliers.append(first)
+        other.suppliers.append(second)
+        db_session.session.commit()
+        
+        MediaService.process_product_media(product)
+        usage = MediaUsageService.supplier_usage([first.id, second.id])
+        assert usage[first.id][0] == 2 and second.id not in usage
+        
+        product.subcategory = other
+        db_session.session.commit()
+        moved = MediaUsageService.usage(group_by=['supplier', 'subcategory'])
+        assert [(row['supplier_id'], row['subcategory_id'], row['file_count']) for row in moved if row['file_count']] == [
+            (second.id, other.id, 2)
+        ]
+        
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', SAWarning)
+            MediaUsageService.rebuild()
+        assert MediaUsageService.usage(group_by=['supplier', 'subcategory']) == [
+            row for row in moved if row['file_count']
+        ]
+    
+    def test_usage_unique_without_supplier(self, db_session):
+        """Счетчик без поставщика существует в одном экземпляре на подкатегорию и тип медиа"""
+        from sqlalchemy.exc import IntegrityError
+        from app.models.product_media import MediaUsage, MediaType
+        from app.services.media_usage_service import MediaUsageService
+        product = self._create_products(db_session, 1)[0]
+        scope = (None, product.subcategory_id, MediaType.IMAGE)
+        
+        MediaUsageService._apply(db_session.session, {scope: [1, 100]})
+        MediaUsageService._apply(db_session.session, {scope: [2, 50]})
+        db_session.session.commit()
+        usage = MediaUsage.query.one()
+        assert (usage.supplier_id, usage.file_count, usage.total_bytes) == (None, 3, 150)
+        
+        db_session.session.add(MediaUsage(subcategory_id=product.subcategory_id, media_type=MediaType.IMAGE))
+        with pytest.raises(IntegrityError):
+            db_session.session.commit()
+        db_session.session.rollback()
+
+
+class TestImageDerivatives:
+    """Тесты уменьшенных копий изображений"""
+    
+    def _create_media(self, db_session, tmp_path, count=1):
+        """Создать товары, ссылающиеся на один файл изображения 1600x800"""
+        from PIL import Image
+        from app.models.product_media import ProductMedia, MediaType
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        db_session.session.add(subcategory)
+        db_session.session.commit()
+        
+        file_path = tmp_path / f"{'ab' * 32}.jpg"
+        Image.new('RGB', (1600, 800), 'blue').save(file_path, 'JPEG')
+        media_list = []
+        for i in range(count):
+            product = Product(name=f'Товар {i}', sku=f'SKU{i}', subcategory_id=subcategory.id)
+            db_session.session.add(product)
+            db_session.session.flush()
+            media = ProductMedia(
+                product_id=product.id,
+                media_type=MediaType.IMAGE,
+                file_path=str(file_path),
+                file_name='photo.jpg'
+            )
+            db_session.session.add(media)
+            media_list.append(media)
+        db_session.session.commit()
+        return media_list
+    
+    def test_generate_sizes_once_per_file(self, db_session, tmp_path, monkeypatch):
+        """Копии всех размеров создаются один раз для общего файла"""
+        import app.services.image_derivative_service as derivative_module
+        from config import Config
+        from app.models.product_media import MediaDerivative
+        from app.services.image_derivative_service import ImageDerivativeService
+        monkeypatch.setattr(Config, 'IMAGE_ANALYSIS_MIN_POOL_BATCH', 100)
+        monkeypatch.setattr(Config, 'IMAGE_DERIVATIVE_FORMAT', 'webp')
+        calls = []
+        original = derivative_module.make_derivatives
+        
+        def counting(path, sizes, fmt, quality):
+            calls.append(sizes)
+            return original(path, sizes, fmt, quality)
+        
+        monkeypatch.setattr(derivative_module, 'make_derivatives', counting)
+        media_list = self._create_media(db_session, tmp_path, count=2)
+        
+        assert ImageDerivativeService.generate(media_list) == 2 * len(Config.IMAGE_DERIVATIVE_SIZES)
+        assert calls == [sorted(Config.IMAGE_DERIVATIVE_SIZES)]
+        
+        small = MediaDerivative.query.filter_by(media_id=media_list[1].id, size=160).one()
+        assert (small.width, small.height) == (160, 80)
+        assert small.file_path.endswith(f"{'ab' * 32}_160.webp")
+        assert MediaDerivative.query.filter_by(size=1200).first().width == 1200
+        
+        # Повторный вызов ничего не создает
+        assert ImageDerivativeService.generate(media_list) == 0
+    
+    def test_missing_size_created_on_request(self, db_session, logged_in_client, tmp_path, monkeypatch):
+        """Отсутствующая копия создается при первом запросе (без пула процессов) и кэшируется браузером"""
+        from config import Config
+        from app.models.product_media import MediaDerivative
+        from app.services.image_analysis_service import ImageAnalysisService
+        monkeypatch.setattr(Config, 'IMAGE_DERIVATIVE_FORMAT', 'jpeg')
+        monkeypatch.setattr(Config, 'IMAGE_ANALYSIS_MIN_POOL_BATCH', 1)
+        
+        def no_pool():
+            raise AssertionError('Копия по запросу не должна запускать пул процессов')
+        
+        monkeypatch.setattr(ImageAnalysisService, '_get_executor', staticmethod(no_pool))
+        media = self._create_media(db_session, tmp_path)[0]
+        
+        response = logged_in_client.get(f'/media/{media.id}/thumb/480')
+        assert response.status_code == 200
+        assert response.mimetype == 'image/jpeg'
+        assert response.cache_control.max_age == Config.MEDIA_CACHE_SECONDS
+        assert response.cache_control.private
+        assert MediaDerivative.query.filter_by(media_id=media.id).count() == 1
+        
+        assert logged_in_client.get(f'/media/{media.id}/thumb/333').status_code == 404
+
+
+class TestMediaServing:
+    """Тесты отдачи медиа-файлов (ETag, Range, X-Accel-Redirect)"""
+    
+    @pytest.fixture
+    def stored_model(self, tmp_path, monkeypatch):
+        """3D модель в хранилище с адресацией по содержимому"""
+        import hashlib
+        from config import Config
+        monkeypatch.setattr(Config, 'basedir', tmp_path)
+        monkeypatch.setattr(Config, 'MEDIA_FOLDER', tmp_path / 'media')
+        
+        content = bytes(range(256)) * 40
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = tmp_path / 'media' / 'models' / sha256[:2] / sha256[2:4] / f'{sha256}.glb'
+        path.parent.mkdir(parents=True)
+        path.write_bytes(content)
+        return path, content, sha256
+    
+    def test_app_serving_validators_and_range(self, logged_in_client, stored_model):
+        """Приложение отдает файл с ETag по хэшу, 304 и частичными ответами"""
+        path, content, sha256 = stored_model
+        url = '/media/' + path.relative_to(path.parents[4]).as_posix()
+        
+        response = logged_in_client.get(url)
+        assert response.status_code == 200
+        assert response.data == content
+        assert response.get_etag() == (f'{sha256}.glb', False)
+        assert response.cache_control.immutable
+        assert response.cache_control.private
+        
+        response = logged_in_client.get(url, headers={'If-None-Match': f'"{sha256}.glb"'})
+        assert response.status_code == 304
+        
+        response = logged_in_client.get(url, headers={'Range': 'bytes=100-199'})
+        assert response.status_code == 206
+        assert response.data == content[100:200]
+    
+    def test_nginx_mode_offloads_transfer(self, logged_in_client, stored_model, monkeypatch):
+        """В режиме nginx приложение возвращает только X-Accel-Redirect"""
+        from config import Config
+        monkeypatch.setattr(Config, 'MEDIA_SENDFILE_MODE', 'nginx')
+        path, content, sha256 = stored_model
+        url = '/media/' + path.relative_to(path.parents[4]).as_posix()
+        
+        response = logged_in_client.get(url)
+        assert response.status_code == 200
+        assert response.data == b''
+        assert response.headers['X-Accel-Redirect'] == f'/protected-media/models/{sha256[:2]}/{sha256[2:4]}/{sha256}.glb'
+        assert response.get_etag() == (f'{sha256}.glb', False)
+        
+        response = logged_in_client.get(url, headers={'If-None-Match': f'"{sha256}.glb"'})
+        assert response.status_code == 304
+        assert 'X-Accel-Redirect' not in response.headers
+    
+    def test_nginx_mode_file_outside_media_folder(self, app, tmp_path, monkeypatch):
+        """Файл вне каталога медиа в режиме nginx отдается приложением, а не ошибкой 500"""
+        from config import Config
+        from app.utils.media_response import send_media
+        monkeypatch.setattr(Config, 'MEDIA_SENDFILE_MODE', 'nginx')
+        monkeypatch.setattr(Config, 'MEDIA_FOLDER', tmp_path / 'media')
+        legacy = tmp_path / 'uploads' / 'photo.jpg'
+        legacy.parent.mkdir()
+        legacy.write_bytes(b'legacy')
+        
+        with app.test_request_context('/media/legacy'):
+            response = send_media(legacy)
+            response.direct_passthrough = False
+            assert response.status_code == 200
+            assert 'X-Accel-Redirect' not in response.headers
+            assert response.get_data() == b'legacy'
+
+
+class TestMediaBundle:
+    """Тесты потоковой выгрузки медиа-файлов ZIP-архивом"""
+    
+    def test_iter_zip_streams_valid_archive(self, tmp_path, monkeypatch):
+        """Архив отдается частями, сжатые форматы записываются без сжатия"""
+        import io
+        import os
+        import zipfile
+        from config import Config
+        from app.services.media_bundle_service import MediaBundleService
+        monkeypatch.setattr(Config, 'MEDIA_BUNDLE_CHUNK_SIZE', 1024)
+        
+        photo = tmp_path / 'photo.jpg'
+        photo.write_bytes(os.urandom(10000))
+        model = tmp_path / 'model.obj'
+        model.write_bytes(b'v 0 0 0\n' * 2000)
+        entries = [('A/images/01_photo.jpg', str(photo)), ('A/models/01_model.obj', str(model)),
+                   ('A/images/02_missing.jpg', str(tmp_path / 'missing.jpg'))]
+        
+        chunks = list(MediaBundleService.iter_zip(iter(entries)))
+        assert len(chunks) > 10
+        assert max(len(chunk) for chunk in chunks) < 8 * 1024
+        
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            assert archive.testzip() is None
+            assert archive.namelist() == ['A/images/01_photo.jpg', 'A/models/01_model.obj']
+            assert archive.getinfo('A/images/01_photo.jpg').compress_type == zipfile.ZIP_STORED
+            assert archive.getinfo('A/models/01_model.obj').compress_type == zipfile.ZIP_DEFLATED
+            assert archive.read('A/models/01_model.obj') == model.read_bytes()
+    
+    def test_product_bundle_endpoint(self, db_session, logged_in_client, tmp_path):
+        """Архив товара содержит его медиа-файлы по папкам"""
+        import io
+        import zipfile
+        from app.models.product_media import ProductMedia, MediaType
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        db_session.session.add(subcategory)
+        db_session.session.commit()
+        product = Product(name='Товар', sku='SKU1', subcategory_id=subcategory.id)
+        db_session.session.add(product)
+        db_session.session.commit()
+        
+        for name, media_type in (('photo.png', MediaType.IMAGE), ('photo.png', MediaType.IMAGE), ('chair.glb', MediaType.THREE_D_MODEL)):
+            path = tmp_path / f'{len(list(tmp_path.iterdir()))}_{name}'
+            path.write_bytes(name.encode() * 10)
+            db_session.session.add(ProductMedia(
+                product_id=product.id, media_type=media_type, file_path=str(path), file_name=name, sort_order=1
+            ))
+        db_session.session.commit()
+        
+        response = logged_in_client.get(f'/products/{product.id}/media.zip')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/zip'
+        assert response.is_streamed
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            names = archive.namelist()
+        assert names[0] == 'SKU1/images/01_photo.png'
+        assert names[1].startswith('SKU1/images/01_photo_')
+        assert names[2] == 'SKU1/models/01_chair.glb'
+    
+    def test_entry_names_cannot_escape_archive(self, db_session, tmp_path):
+        """Артикул и имя файла поставщика не дают путей вне каталога архива"""
+        from app.models.product_media import ProductMedia, MediaType
+        from app.services.media_bundle_service import MediaBundleService
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        db_session.session.add(subcategory)
+        db_session.session.commit()
+        products = [Product(name=f'Товар {i}', sku=sku, subcategory_id=subcategory.id)
+                    for i, sku in enumerate(('../../etc', '..', 'C:\\evil'))]
+        db_session.session.add_all(products)
+        db_session.session.commit()
+        for product, file_name in zip(products, ('../../passwd', 'a\\..\\b.png', '/abs.png')):
+            db_session.session.add(ProductMedia(
+                product_id=product.id, media_type=MediaType.IMAGE, file_path=str(tmp_path / 'x.png'),
+                file_name=file_name, sort_order=1
+            ))
+        db_session.session.commit()
+        
+        names = [name for name, _ in MediaBundleService.iter_media_entries(product_ids=[p.id for p in products])]
+        assert names == [
+            '.._.._etc/images/01_.._.._passwd',
+            f'product_{products[1].id}/images/01_a_.._b.png',
+            'C__evil/images/01__abs.png',
+        ]
+        assert not any(part in ('..', '.') or ':' in part for name in names for part in name.split('/'))
+
+
+class TestMediaStorage:
+    """Тесты объектного хранилища медиа-файлов (S3-совместимый клиент в памяти)"""
+    
+    class FakeS3Client:
+        """Клиент S3 в памяти: объекты {ключ: (данные, время изменения)}"""
+        
+        class NotFound(Exception):
+            response = {'Error': {'Code': '404'}}
+        
+        def __init__(self):
+            self.objects = {}
+            self.uploads = 0
+        
+        def _get(self, Bucket, Key):
+            if (Bucket, Key) not in self.objects:
+                raise self.NotFound(Key)
+            return self.objects[(Bucket, Key)]
+        
+        def head_object(self, Bucket, Key):
+            data, modified = self._get(Bucket, Key)
+            return {'ContentLength': len(data), 'LastModified': modified}
+        
+        def get_object(self, Bucket, Key):
+            import io
+            return {'Body': io.BytesIO(self._get(Bucket, Key)[0])}
+        
+        def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+            from datetime import datetime, timezone
+            with open(Filename, 'rb') as f:
+                self.objects[(Bucket, Key)] = (f.read(), datetime.now(timezone.utc))
+            self.uploads += 1
+        
+        def delete_object(self, Bucket, Key):
+            self.objects.pop((Bucket, Key), None)
+        
+        def generate_presigned_url(self, operation, Params, ExpiresIn):
+            return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+        
+        def get_paginator(self, operation):
+            client = self
+            
+            class Paginator:
+                def paginate(self, Bucket, Prefix):
+                    yield {'Contents': [
+                        {'Key': key, 'Size': len(data), 'LastModified': modified}
+                        for (bucket, key), (data, modified) in sorted(client.objects.items())
+                        if bucket == Bucket and key.startswith(Prefix)
+                    ]}
+            
+            return Paginator()
+    
+    @pytest.fixture
+    def s3_storage(self, tmp_path, monkeypatch):
+        """Объектное хранилище с клиентом в памяти и папками во временной директории"""
+        from config import Config
+        from app.utils.media_storage import ObjectStorage, set_storage
+        monkeypatch.setattr(Config, 'IMAGES_FOLDER', tmp_path / 'images')
+        monkeypatch.setattr(Config, 'MODELS_FOLDER', tmp_path / 'models')
+        monkeypatch.setattr(Config, 'IMAGE_ANALYSIS_MIN_POOL_BATCH', 100)
+        monkeypatch.setattr(Config, 'IMAGE_DERIVATIVE_FORMAT', 'webp')
+        storage = ObjectStorage(self.FakeS3Client(), 'media', 'catalog', cache_folder=tmp_path / 'cache')
+        set_storage(storage)
+        yield storage
+        set_storage(None)
+    
+    def test_media_lifecycle_in_object_storage(self, db_session, logged_in_client, s3_storage, tmp_path):
+        """Файлы сохраняются, отдаются по подписанной ссылке, читаются другим сервером и удаляются в хранилище"""
+        import io
+        import zipfile
+        from datetime import datetime, timedelta, timezone
+        from PIL import Image
+        from config import Config
+        from app.models.product_media import ProductMedia, MediaBlob, MediaType
+        from app.services.media_bundle_service import MediaBundleService
+        from app.services.media_gc_service import MediaGCService
+        from app.services.media_service import MediaService
+        client = s3_storage.client
+        
+        buffer = io.BytesIO()
+        Image.new('RGB', (600, 400), 'blue').save(buffer, 'PNG')
+        png = buffer.getvalue()
+        
+        # Файл переносится в хранилище, повторное содержимое не загружается
+        sha256, path, size = MediaService._store_stream(Config.IMAGES_FOLDER, '.png', iter([png]))
+        key = MediaService._to_stored_path(path)
+        MediaService._store_stream(Config.IMAGES_FOLDER, '.png', iter([png]))
+        assert client.uploads == 1
+        assert ('media', 'catalog/' + key.lstrip('/')) in client.objects
+        assert not path.exists()
+        
+        category = ProductCategory(code='01', name='Категория')
+        db_session.session.add(category)
+        db_session.session.commit()
+        subcategory = Subcategory(code='01_1', name='Подкатегория', category_id=category.id)
+        db_session.session.add(subcategory)
+        db_session.session.commit()
+        product = Product(name='Товар', sku='SKU1', subcategory_id=subcategory.id)
+        blob = MediaBlob(sha256=sha256, media_type=MediaType.IMAGE, file_path=key, file_size=size, ref_count=1)
+        db_session.session.add_all([product, blob])
+        db_session.session.commit()
+        media = ProductMedia(
+            product_id=product.id, media_type=MediaType.IMAGE, blob_id=blob.id, file_path=key, file_name='photo.png'
+        )
+        db_session.session.add(media)
+        db_session.session.commit()
+        
+        # Загруженный файл в кэше не остается: файл скачивается из хранилища
+        assert not (tmp_path / 'cache').exists()
+        response = logged_in_client.get(f'/media/{media.id}/thumb/160')
+        assert response.status_code == 302
+        assert response.location.startswith('https://s3.test/media/catalog/')
+        assert response.location.split('?')[0].endswith(f'{sha256}_160.webp')
+        assert client.uploads == 2
+        
+        entries = iter([('SKU1/images/01_photo.png', key), ('SKU1/images/02_missing.png', key + '.missing')])
+        with zipfile.ZipFile(io.BytesIO(b''.join(MediaBundleService.iter_zip(entries)))) as archive:
+            assert archive.namelist() == ['SKU1/images/01_photo.png']
+            assert archive.read('SKU1/images/01_photo.png') == png
+        
+        # Сборка мусора обходит список объектов: удаляется только объект без ссылок
+        orphan = 'catalog/' + str(Config.IMAGES_FOLDER / 'ee' / 'ee' / ('e' * 64 + '.png')).lstrip('/')
+        client.objects[('media', orphan)] = (b'x' * 70, datetime.now(timezone.utc) - timedelta(days=7))
+        result = MediaGCService.collect(grace_seconds=3600)
+        assert result['deleted'] == 1 and result['reclaimed_bytes'] == 70
+        assert ('media', orphan) not in client.objects
+        assert len(client.objects) == 2
+        
+        # Освобождение последней ссылки удаляет оригинал и копии из хранилища и кэша
+        MediaService.release_media(media)
+        db_session.session.commit()
+        assert client.objects == {}
+        assert not MediaService.media_exists(key)
+        assert not any(path.is_file() for path in (tmp_path / 'cache').rglob('*'))
+    
+    def test_incomplete_backend_rejected(self):
+        """Хранилище без реализации всех методов не создается"""
+        from app.utils.media_storage import LocalStorage, MediaStorage
+        
+        class ReadOnlyStorage(MediaStorage):
+            def stat(self, key):
+                return None
+        
+        with pytest.raises(TypeError):
+            ReadOnlyStorage()
+        assert LocalStorage().url('media/images/a.png') is None
+    
+    def test_cache_bounded_with_lru_eviction(self, s3_storage, tmp_path, monkeypatch):
+        """Загруженные файлы не кэшируются, кэш читаемых файлов вытесняет давно не читанные"""
+        import os
+        import time
+        import app.utils.media_storage as storage_module
+        from config import Config
+        monkeypatch.setattr(Config, 'MEDIA_CACHE_MAX_BYTES', 250)
+        monkeypatch.setattr(storage_module, 'CACHE_KEEP_RECENT_SECONDS', 0)
+        
+        keys = []
+        for i in range(3):
+            source = tmp_path / f'upload{i}.bin'
+            source.write_bytes(bytes([i]) * 100)
+            keys.append(f'media/images/{i}.bin')
+            s3_storage.put_file(keys[-1], source)
+            assert not source.exists()
+        assert not any(path.is_file() for path in (tmp_path / 'cache').rglob('*'))
+        
+        first = s3_storage.local_path(keys[0])
+        second = s3_storage.local_path(keys[1])
+        old = time.time() - 100
+        os.utime(first, (old, old))
+        os.utime(second, (old + 10, old + 10))
+        s3_storage.local_path(keys[0])  # Чтение делает файл самым свежим
+        
+        third = s3_storage.local_path(keys[2])
+        assert first.exists() and third.exists()
+        assert not second.exists()
+        assert third.read_bytes() == bytes([2]) * 100